@@ -10,9 +10,9 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 import os
 
 import djp
-import sentry_sdk
 from django.core.asgi import get_asgi_application
-from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
+
+from django_plugins.preload import ASGI_PRELOAD, preload
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
@@ -29,6 +29,10 @@ def get_release():
 # Initialize Sentry if DSN is configured
 sentry_dsn = os.environ.get("SENTRY_DSN")
 if sentry_dsn:
+    # Only imported when enabled; sentry_sdk alone takes ~200ms to import
+    import sentry_sdk
+    from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
+
     sentry_sdk.init(
         dsn=sentry_dsn,
         environment=os.environ.get("SENTRY_ENVIRONMENT", "production"),
@@ -44,3 +48,7 @@ application = djp.asgi_wrapper(get_asgi_application())
 # Wrap with Sentry middleware for error capture
 if sentry_dsn:
     application = SentryAsgiMiddleware(application)
+
+# With gunicorn --preload this runs once in the master, before forking
+if ASGI_PRELOAD:
+    preload()
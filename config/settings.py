@@ -320,4 +320,16 @@ API_KEY_VALID_TTL = 7200  # 2 hours for valid keys
 API_KEY_INVALID_TTL = 300  # 5 minutes for invalid keys
 
 
+# Federated (cross-site) search
+FEDERATED_SEARCH_WORKERS = int(os.environ.get("FEDERATED_SEARCH_WORKERS", "16"))
+FEDERATED_SEARCH_SITE_BUDGET_MS = int(
+    os.environ.get("FEDERATED_SEARCH_SITE_BUDGET_MS", "500")
+)
+FEDERATED_SEARCH_TOTAL_BUDGET_MS = int(
+    os.environ.get("FEDERATED_SEARCH_TOTAL_BUDGET_MS", "10000")
+)
+# Shards written by the build_search_index command
+SEARCH_INDEX_DIR = os.environ.get("SEARCH_INDEX_DIR", "../search-index")
+
+
 djp.settings(globals())
@@ -19,9 +19,10 @@ import djp
 from django.contrib import admin
 from django.urls import include, path
 
-from config.views import health_check
+from config.views import health_check, metrics_view, slow_queries_view
 from pages.views import (
     disclaimer_view,
+    federated_search_view,
     feed_view,
     home_view,
     how_view,
@@ -42,8 +43,15 @@ urlpatterns = [
     path("map", map_view, name="map"),
     path("how.html", how_view),
     path("health/", health_check, name="health_check"),
+    path("metrics", metrics_view, name="metrics"),
     path(route="disclaimer.html", view=disclaimer_view),
     path("api/recent-deploys/", recent_deploys_view, name="recent_deploys"),
+    path("api/search/", federated_search_view, name="federated_search"),
+    path(
+        "admin/slow-queries/",
+        admin.site.admin_view(slow_queries_view),
+        name="slow_queries",
+    ),
     path("admin/", admin.site.urls),
     path("", include("social_django.urls", namespace="social")),
     path("", home_view, name="home"),
@@ -1,6 +1,46 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.contrib import admin
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import render
+
+from django_plugins.api_key_auth import is_internal_service_request
+from django_plugins.metrics import metrics, render_prometheus
+from django_plugins.slow_queries import slow_query_log, top_fingerprints
 
 
 def health_check(request):
     """Health check endpoint for load balancer."""
     return JsonResponse({"status": "ok"}, status=200)
+
+
+def metrics_view(request):
+    """Prometheus metrics merged across workers, for internal services only."""
+    headers = [
+        (name.encode(), value.encode()) for name, value in request.headers.items()
+    ]
+    if not (settings.DEBUG or is_internal_service_request(headers)):
+        raise Http404
+    return HttpResponse(
+        render_prometheus(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def slow_queries_view(request):
+    """Admin page ranking slow query fingerprints by total execution time."""
+    try:
+        days = max(1, int(request.GET.get("days", "7")))
+    except ValueError:
+        days = 7
+    subdomain = request.GET.get("subdomain") or None
+    # Include this worker's buffered queries; other workers flush on their own
+    slow_query_log.flush()
+    context = {
+        **admin.site.each_context(request),
+        "title": "Slow queries",
+        "days": days,
+        "subdomain": subdomain,
+        "threshold_ms": slow_query_log.threshold_ms,
+        "fingerprints": top_fingerprints(days=days, subdomain=subdomain),
+    }
+    return render(request, "admin/slow_queries.html", context)
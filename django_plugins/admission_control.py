@@ -0,0 +1,211 @@
+"""
+Load-shedding admission control for the subdomain router.
+
+When a worker is saturated, every request used to queue until gunicorn's
+30s timeout killed it, including people reading meeting pages. The router
+now classifies each request before any database work and sheds
+low-priority traffic early with a cheap 503 and Retry-After:
+
+| Class   | Requests                                          | Shed when              |
+|---------|---------------------------------------------------|------------------------|
+| human   | HTML pages, first-party AJAX, internal, research  | Never                  |
+| api_key | Requests carrying an already validated API key    | In flight >= max       |
+| low     | Anonymous JSON, denied bots, other automated UAs  | In flight >= shed, or  |
+|         |                                                   | recent latency >= shed |
+
+In-flight requests and latency are measured around the Datasette call, the
+part that holds SQL threads. Latency is an exponentially weighted average
+that decays towards zero while no requests complete, so shedding stops on
+its own once load drops.
+
+Admission decisions are counted in admission_admitted_total and
+admission_shed_total; the router reports in-flight requests and the
+thresholds as gauges.
+"""
+
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from django_plugins.api_key_auth import (
+    is_first_party_request,
+    is_internal_service_request,
+    is_json_endpoint,
+    is_research_tool_request,
+)
+from django_plugins.bot_policy import NO_MATCH, BotVerdict
+from django_plugins.metrics import metrics
+from django_plugins.well_known import AI_USER_AGENTS
+
+ADMISSION_SHED_IN_FLIGHT = int(os.getenv("ADMISSION_SHED_IN_FLIGHT", "24"))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "48"))
+ADMISSION_SHED_LATENCY_MS = int(os.getenv("ADMISSION_SHED_LATENCY_MS", "2000"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "10"))
+
+PRIORITY_HUMAN = "human"
+PRIORITY_API_KEY = "api_key"
+PRIORITY_LOW = "low"
+
+# Weight of each new latency sample, and how fast the average decays
+LATENCY_EWMA_ALPHA = 0.2
+LATENCY_HALF_LIFE_SECONDS = 10
+
+_automated_user_agent_re = re.compile(
+    "|".join(
+        [
+            r"bot\b|bot/|crawl|spider|scrap|slurp|headless",
+            r"^curl/|^wget/|python-requests|python-urllib|httpx|aiohttp",
+            r"go-http-client|okhttp|^java/|libwww|node-fetch|axios",
+            *(re.escape(agent.lower()) for agent in AI_USER_AGENTS),
+        ]
+    )
+)
+
+
+def _user_agent(headers: list) -> str:
+    for name, value in headers:
+        if name.lower() == b"user-agent":
+            return value.decode("utf-8", errors="ignore").lower()
+    return ""
+
+
+def is_automated_user_agent(headers: list) -> bool:
+    """Check for a missing User-Agent or one from a crawler or HTTP library."""
+    user_agent = _user_agent(headers)
+    return not user_agent or bool(_automated_user_agent_re.search(user_agent))
+
+
+def classify_request(
+    headers: list,
+    path: str,
+    subdomain: str,
+    bot_verdict: BotVerdict = NO_MATCH,
+    api_key_validated: bool = False,
+) -> str:
+    """
+    Assign a request its admission class without any I/O.
+
+    Only a key the caller has found valid in the API key cache earns the
+    api_key class; any other key is treated as anonymous, so made-up keys
+    can't jump the queue. Requests the bot policy denies are always low
+    priority.
+    """
+    if (
+        is_first_party_request(headers, subdomain)
+        or is_internal_service_request(headers)
+        or is_research_tool_request(headers)
+    ):
+        return PRIORITY_HUMAN
+    if api_key_validated:
+        return PRIORITY_API_KEY
+    if bot_verdict.denied or is_automated_user_agent(headers) or is_json_endpoint(path):
+        return PRIORITY_LOW
+    return PRIORITY_HUMAN
+
+
+def make_503_overloaded_response(retry_after: int) -> tuple:
+    """Create a 503 Service Unavailable JSON response with Retry-After."""
+    body = json.dumps(
+        {
+            "error": "overloaded",
+            "message": "The server is busy. Please retry later.",
+            "retry_after": retry_after,
+        }
+    ).encode("utf-8")
+
+    return body, [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"retry-after", str(retry_after).encode()),
+        (b"cache-control", b"no-store"),
+    ]
+
+
+class AdmissionController:
+    """Tracks in-flight requests and latency, and decides what to shed."""
+
+    def __init__(
+        self,
+        shed_in_flight: int = ADMISSION_SHED_IN_FLIGHT,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+        shed_latency_ms: int = ADMISSION_SHED_LATENCY_MS,
+        retry_after: int = ADMISSION_RETRY_AFTER,
+    ):
+        self.shed_in_flight = shed_in_flight
+        self.max_in_flight = max_in_flight
+        self.shed_latency_ms = shed_latency_ms
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._latency_ms = 0.0
+        self._latency_at = time.monotonic()
+        self.admitted = Counter()
+        self.shed = Counter()
+
+    def latency_ms(self, now: Optional[float] = None) -> float:
+        """Recent request latency, decayed by the time since it was measured."""
+        age = (now or time.monotonic()) - self._latency_at
+        return self._latency_ms * math.pow(0.5, age / LATENCY_HALF_LIFE_SECONDS)
+
+    def shed_reason(self, priority: str) -> Optional[str]:
+        """Why a request of this class should be shed right now, if it should."""
+        if priority == PRIORITY_HUMAN:
+            return None
+        if self.in_flight >= self.max_in_flight:
+            return "in_flight"
+        if priority == PRIORITY_LOW:
+            if self.in_flight >= self.shed_in_flight:
+                return "in_flight"
+            if self.latency_ms() >= self.shed_latency_ms:
+                return "latency"
+        return None
+
+    def admit(self, priority: str) -> Optional[str]:
+        """Count an admission decision; returns the shed reason, if shed."""
+        reason = self.shed_reason(priority)
+        if reason is None:
+            self.admitted[priority] += 1
+            metrics.inc("admission_admitted_total", priority=priority)
+        else:
+            self.shed[f"{priority}:{reason}"] += 1
+            metrics.inc("admission_shed_total", priority=priority, reason=reason)
+        return reason
+
+    @contextmanager
+    def track(self):
+        """Count a request as in flight and record its latency."""
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            now = time.monotonic()
+            sample = (now - start) * 1000
+            self._latency_ms = self.latency_ms(now) + LATENCY_EWMA_ALPHA * (
+                sample - self.latency_ms(now)
+            )
+            self._latency_at = now
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "latency_ms": round(self.latency_ms(), 1),
+            "shed_in_flight": self.shed_in_flight,
+            "max_in_flight": self.max_in_flight,
+            "shed_latency_ms": self.shed_latency_ms,
+            "retry_after": self.retry_after,
+            "admitted": dict(self.admitted),
+            "shed": dict(self.shed),
+        }
+
+
+# Per worker process; the router runs every request on one event loop
+admission_controller = AdmissionController()
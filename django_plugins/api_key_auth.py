@@ -8,12 +8,18 @@ Also includes rate limiting and research tool detection.
 import hashlib
 import json
 import logging
-from typing import Optional
+import os
+from typing import TYPE_CHECKING, Optional
 from urllib.parse import parse_qs, urlencode
 
-import redis.asyncio as redis
 from django.conf import settings
 
+from django_plugins.metrics import metrics
+from django_plugins.request_timing import timed
+
+if TYPE_CHECKING:
+    import redis.asyncio as redis
+
 logger = logging.getLogger(__name__)
 
 # Research tools that get full JSON access without API key
@@ -27,30 +33,43 @@ RATE_LIMIT_WINDOW_SECONDS = 60  # 1 minute window
 # Result size cap for unauthenticated requests
 MAX_RESULTS_UNAUTHENTICATED = 100
 
+# Access tiers the subdomain router assigns to JSON and ?sql= requests
+ACCESS_TIER_TRUSTED = "trusted"  # First-party, internal service or research tool
+ACCESS_TIER_API_KEY = "api_key"  # Valid API key
+ACCESS_TIER_ANONYMOUS = "anonymous"  # Everyone else
+
 # Redis connection (lazy initialization)
-_redis_client: Optional[redis.Redis] = None
+_redis_client: Optional["redis.Redis"] = None
 
 
-async def get_redis() -> redis.Redis:
+async def get_redis() -> "redis.Redis":
     """Get or create Redis connection."""
     global _redis_client
     if _redis_client is None:
+        # Imported on first use (~100ms); HTML-only workers never need it
+        import redis.asyncio as redis  # noqa: PLC0415
+
         _redis_client = redis.from_url(settings.REDIS_URL)
     return _redis_client
 
 
-def set_redis_client(client: redis.Redis) -> None:
+def set_redis_client(client: Optional["redis.Redis"]) -> None:
     """Set the Redis client (for testing)."""
     global _redis_client
     _redis_client = client
 
 
+# A client created before a fork shares its connections with the parent
+os.register_at_fork(after_in_child=lambda: set_redis_client(None))
+
+
 def _cache_key(api_key: str) -> str:
     """Generate cache key from API key (hashed for security)."""
     key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
     return f"apikey:{key_hash}"
 
 
+@timed("api_key")
 async def validate_api_key(api_key: str, subdomain: str) -> dict:
     """
     Validate an API key, using cache when available.
@@ -66,7 +85,9 @@ async def validate_api_key(api_key: str, subdomain: str) -> dict:
     cached = await redis_client.get(cache_key)
     if cached:
         logger.debug(f"API key cache hit for {cache_key}")
+        metrics.inc("api_key_cache_total", result="hit")
         return json.loads(cached)
+    metrics.inc("api_key_cache_total", result="miss")
 
     # Cache miss - validate against civic.observer
     logger.debug(f"API key cache miss for {cache_key}, calling civic.observer")
@@ -81,6 +102,18 @@ async def validate_api_key(api_key: str, subdomain: str) -> dict:
     return result
 
 
+async def is_validated_api_key(api_key: str) -> bool:
+    """
+    Check whether the cache holds a valid result for an API key.
+
+    Only reads the cache, never civic.observer, so it's cheap enough to
+    run before admission control; a key not validated recently is False.
+    """
+    redis_client = await get_redis()
+    cached = await redis_client.get(_cache_key(api_key))
+    return bool(cached) and json.loads(cached).get("valid", False)
+
+
 async def _call_civic_observer(api_key: str, subdomain: str) -> dict:
     """
     Call civic.observer to validate an API key.
@@ -255,6 +288,7 @@ def _rate_limit_key(ip_address: str) -> str:
     return f"ratelimit:{ip_address}"
 
 
+@timed("rate_limit")
 async def check_rate_limit(ip_address: str) -> bool:
     """
     Check if an IP address has exceeded the rate limit.
@@ -282,6 +316,7 @@ async def check_rate_limit(ip_address: str) -> bool:
     count = int(current)
     if count >= RATE_LIMIT_REQUESTS:
         logger.info(f"Rate limit exceeded for IP {ip_address}: {count} requests")
+        metrics.inc("rate_limit_hits_total")
         return True
 
     # Increment count
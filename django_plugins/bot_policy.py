@@ -0,0 +1,364 @@
+"""
+In-process bot classification compiled from botPolicy.yaml.
+
+Anubis reads botPolicy.yaml upstream, but traffic that gets past it (or
+reaches a worker directly) used to pay full routing cost before anything
+looked at who was asking. The router now loads the same rule file and
+classifies every request against it before any site lookup.
+
+Rules follow the Anubis format and are checked in order; the first rule
+whose conditions all match decides the action (ALLOW, DENY, CHALLENGE,
+WEIGH, ...):
+
+    bots:
+      - name: ai-scrapers
+        user_agent_regex: GPTBot|CCBot
+        action: DENY
+      - name: bad-network
+        remote_addresses: ["203.0.113.0/24"]
+        action: DENY
+      - import: ./more-rules.yaml
+
+For speed, runs of consecutive rules that only test the User-Agent are
+compiled into one alternation regex whose branches are tried in rule
+order (a pattern that can't be embedded, such as one starting with a
+global flag like ``(?i)``, is matched on its own), and runs of rules that
+only test remote addresses into a CIDR table keyed by prefix length.
+Rules combining conditions are checked one by one.
+
+``(data)/...`` imports refer to Anubis' bundled rule files. The AI crawler
+list and the "keep the internet working" paths are provided from this
+repo (the crawler list is shared with robots.txt); other bundled files are
+skipped and listed in ``BotPolicy.skipped``. CEL ``expression`` rules are
+skipped too.
+"""
+
+import ipaddress
+import logging
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import yaml
+
+from django_plugins.well_known import AI_USER_AGENTS
+
+logger = logging.getLogger(__name__)
+
+BOT_POLICY_PATH = os.getenv("BOT_POLICY_PATH", "botPolicy.yaml")
+
+ACTION_ALLOW = "ALLOW"
+ACTION_DENY = "DENY"
+ACTION_CHALLENGE = "CHALLENGE"
+
+# Bundled Anubis imports this repo can provide itself
+BUILTIN_IMPORTS = {
+    "(data)/bots/ai-robots-txt.yaml": [
+        {
+            "name": "ai-robots-txt",
+            "user_agent_regex": "|".join(re.escape(agent) for agent in AI_USER_AGENTS),
+            "action": ACTION_DENY,
+        }
+    ],
+    "(data)/common/keep-internet-working.yaml": [
+        {
+            "name": "well-known",
+            "path_regex": r"^/\.well-known/.*$",
+            "action": ACTION_ALLOW,
+        },
+        {
+            "name": "favicon",
+            "path_regex": r"^/favicon\.(?:ico|png)$",
+            "action": ACTION_ALLOW,
+        },
+        {"name": "robots-txt", "path_regex": r"^/robots\.txt$", "action": ACTION_ALLOW},
+    ],
+}
+
+
+class BotVerdict(NamedTuple):
+    action: Optional[str] = None
+    rule: Optional[str] = None
+
+    @property
+    def denied(self) -> bool:
+        return self.action == ACTION_DENY
+
+
+NO_MATCH = BotVerdict()
+
+Network = ipaddress.IPv4Network | ipaddress.IPv6Network
+
+
+class BotRule(NamedTuple):
+    name: str
+    action: str
+    user_agent: Optional[re.Pattern] = None
+    path: Optional[re.Pattern] = None
+    headers: tuple = ()
+    networks: tuple[Network, ...] = ()
+
+    @property
+    def kind(self) -> str:
+        """user_agent or networks if the rule only tests that, else single."""
+        conditions = [self.user_agent, self.path, self.headers, self.networks]
+        if sum(map(bool, conditions)) == 1:
+            if self.user_agent:
+                return "user_agent"
+            if self.networks:
+                return "networks"
+        return "single"
+
+    def matches(self, user_agent: str, path: str, headers: dict, ip) -> bool:
+        if self.user_agent and not self.user_agent.search(user_agent):
+            return False
+        if self.path and not self.path.search(path):
+            return False
+        for name, pattern in self.headers:
+            if name not in headers or not pattern.search(headers[name]):
+                return False
+        return not self.networks or (
+            ip is not None and any(ip in network for network in self.networks)
+        )
+
+
+class _UserAgentMatcher:
+    """Consecutive User-Agent-only rules as one ordered alternation."""
+
+    def __init__(self, rules: list[BotRule]):
+        self.rules = rules
+        self.regex = self.combine(rules)
+
+    @staticmethod
+    def combine(rules: list[BotRule]) -> re.Pattern:
+        """
+        Compile rules into one regex; raises re.error if they can't share one.
+
+        Every branch is anchored at the start, so the first branch (rule)
+        whose lookahead finds its pattern anywhere in the string wins.
+        Patterns with global flags like ``(?i)``, or group names clashing
+        with another rule's, don't survive being embedded.
+        """
+        return re.compile(
+            "^(?:"
+            + "|".join(
+                f"(?=[\\s\\S]*?(?:{rule.user_agent.pattern}))(?P<rule{i}>)"
+                for i, rule in enumerate(rules)
+            )
+            + ")"
+        )
+
+    def match(self, user_agent: str, path: str, headers: dict, ip) -> Optional[BotRule]:  # noqa: ARG002
+        match = self.regex.match(user_agent)
+        if match is None:
+            return None
+        return self.rules[int(match.lastgroup.removeprefix("rule"))]
+
+
+class _NetworkMatcher:
+    """Consecutive address-only rules as exact-match tables per prefix length."""
+
+    def __init__(self, rules: list[BotRule]):
+        self.rules = rules
+        # (version, prefix length) -> {network address int: first rule index}
+        self.tables: dict[tuple[int, int], dict[int, int]] = {}
+        for index, rule in enumerate(rules):
+            for network in rule.networks:
+                table = self.tables.setdefault((network.version, network.prefixlen), {})
+                table.setdefault(int(network.network_address), index)
+
+    def match(self, user_agent: str, path: str, headers: dict, ip) -> Optional[BotRule]:  # noqa: ARG002
+        if ip is None:
+            return None
+        address = int(ip)
+        best = None
+        for (version, prefixlen), table in self.tables.items():
+            if version != ip.version:
+                continue
+            shift = ip.max_prefixlen - prefixlen
+            index = table.get(address >> shift << shift)
+            if index is not None and (best is None or index < best):
+                best = index
+        return None if best is None else self.rules[best]
+
+
+class _SingleRuleMatcher:
+    def __init__(self, rule: BotRule):
+        self.rule = rule
+
+    def match(self, user_agent: str, path: str, headers: dict, ip) -> Optional[BotRule]:
+        return self.rule if self.rule.matches(user_agent, path, headers, ip) else None
+
+
+def _user_agent_matchers(rules: list[BotRule]) -> list:
+    """
+    Merge User-Agent rules into as few alternations as will compile.
+
+    A rule that can't be embedded in an alternation, even on its own, is
+    matched with its separately compiled pattern, keeping rule order.
+    """
+    matchers = []
+    run: list[BotRule] = []
+    for rule in rules:
+        try:
+            _UserAgentMatcher.combine([*run, rule])
+        except re.error:
+            pass
+        else:
+            run.append(rule)
+            continue
+        if run:
+            matchers.append(_UserAgentMatcher(run))
+            run = []
+        try:
+            _UserAgentMatcher.combine([rule])
+        except re.error:
+            matchers.append(_SingleRuleMatcher(rule))
+        else:
+            run = [rule]
+    if run:
+        matchers.append(_UserAgentMatcher(run))
+    return matchers
+
+
+class BotPolicy:
+    """A compiled, ordered set of bot rules."""
+
+    def __init__(self, rules: list[BotRule], skipped: tuple = ()):
+        self.rules = rules
+        self.skipped = skipped
+        self.matchers = []
+        run = []
+        for rule in rules:
+            # Batch consecutive rules of the same simple kind into one matcher
+            if run and (rule.kind != run[0].kind or rule.kind == "single"):
+                self.matchers.extend(self._compile_run(run))
+                run = []
+            run.append(rule)
+        if run:
+            self.matchers.extend(self._compile_run(run))
+
+    @staticmethod
+    def _compile_run(rules: list[BotRule]) -> list:
+        if rules[0].kind == "user_agent":
+            return _user_agent_matchers(rules)
+        if rules[0].kind == "networks":
+            return [_NetworkMatcher(rules)]
+        return [_SingleRuleMatcher(rules[0])]
+
+    def classify(self, headers: list, path: str, client_ip: str = "") -> BotVerdict:
+        """
+        Find the first rule matching a request.
+
+        Args:
+            headers: List of (name, value) tuples from ASGI scope
+            path: Request path
+            client_ip: Client address, e.g. from get_client_ip()
+
+        Returns:
+            The matching rule's action and name, or NO_MATCH
+        """
+        header_values = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in headers
+        }
+        user_agent = header_values.get("user-agent", "")
+        try:
+            ip = ipaddress.ip_address(client_ip) if client_ip else None
+        except ValueError:
+            ip = None
+        for matcher in self.matchers:
+            rule = matcher.match(user_agent, path, header_values, ip)
+            if rule is not None:
+                return BotVerdict(rule.action, rule.name)
+        return NO_MATCH
+
+
+def compile_rule(config: dict) -> BotRule:
+    """Compile one Anubis rule; raises ValueError for unsupported rules."""
+    if "expression" in config:
+        raise ValueError("CEL expressions are not supported")
+    try:
+        rule = BotRule(
+            name=config.get("name", "unnamed"),
+            action=str(config.get("action", ACTION_ALLOW)).upper(),
+            user_agent=(
+                re.compile(config["user_agent_regex"].strip())
+                if config.get("user_agent_regex")
+                else None
+            ),
+            path=(
+                re.compile(config["path_regex"].strip())
+                if config.get("path_regex")
+                else None
+            ),
+            headers=tuple(
+                (name.lower(), re.compile(pattern))
+                for name, pattern in (config.get("headers_regex") or {}).items()
+            ),
+            networks=tuple(
+                ipaddress.ip_network(address, strict=False)
+                for address in config.get("remote_addresses") or ()
+            ),
+        )
+    except (re.error, TypeError) as e:
+        raise ValueError(f"invalid regex: {e}") from e
+    if not (rule.user_agent or rule.path or rule.headers or rule.networks):
+        raise ValueError("rule has no conditions")
+    return rule
+
+
+def _expand_rules(configs: list, base_dir: Path, skipped: list) -> list[dict]:
+    """Inline imports, depth first, keeping rule order."""
+    expanded = []
+    for config in configs or ():
+        target = config.get("import")
+        if target is None:
+            expanded.append(config)
+        elif target in BUILTIN_IMPORTS:
+            expanded.extend(BUILTIN_IMPORTS[target])
+        elif target.startswith("(data)"):
+            skipped.append((target, "bundled Anubis rules are not available"))
+        else:
+            path = base_dir / target
+            try:
+                with open(path) as f:
+                    imported = yaml.safe_load(f)
+            except (OSError, yaml.YAMLError) as e:
+                skipped.append((target, str(e)))
+                continue
+            expanded.extend(_expand_rules(imported, path.parent, skipped))
+    return expanded
+
+
+def load_bot_policy(path: str) -> BotPolicy:
+    """
+    Load and compile a botPolicy.yaml file.
+
+    A missing file gives an empty policy that matches nothing. Rules that
+    can't be compiled are skipped, logged and listed in ``skipped``.
+    """
+    try:
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return BotPolicy([])
+
+    skipped = []
+    rules = []
+    for rule_config in _expand_rules(config.get("bots"), Path(path).parent, skipped):
+        try:
+            rules.append(compile_rule(rule_config))
+        except ValueError as e:
+            skipped.append((rule_config.get("name", "unnamed"), str(e)))
+    for name, reason in skipped:
+        logger.info("Skipped bot policy rule", extra={"rule": name, "reason": reason})
+    return BotPolicy(rules, tuple(skipped))
+
+
+@lru_cache(maxsize=1)
+def get_bot_policy() -> BotPolicy:
+    """The worker's bot policy, loaded from BOT_POLICY_PATH on first use."""
+    return load_bot_policy(BOT_POLICY_PATH)
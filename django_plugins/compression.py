@@ -0,0 +1,228 @@
+"""
+Streaming response compression for the subdomain router.
+
+Datasette sends its HTML pages (100 rows of OCR text) and JSON responses
+uncompressed. The router wraps the ASGI send of every site request with
+``compress_send()``, which negotiates an encoding from Accept-Encoding
+and compresses the body chunk by chunk, so streamed responses (CSV
+exports, ``_stream=on``) are never buffered:
+
+- zstd and brotli are used when the optional zstandard and brotli
+  packages are installed; gzip always is
+- a response sent in a single body message (most Datasette pages) gets
+  an exact Content-Length; a streamed one drops it and is sent chunked
+- responses that are already encoded, not text, smaller than
+  MIN_COMPRESS_SIZE, partial (206), or marked Cache-Control: no-transform
+  pass through untouched, as do HEAD requests
+- a strong ETag is weakened (W/"..."), since the compressed bytes differ
+  from the identity body it was computed for
+- Vary: Accept-Encoding is added to every response that could have been
+  compressed, whether or not this client accepted an encoding
+
+Static assets are served precompressed by static_assets and never reach
+this wrapper. Set COMPRESSION=false to disable it, e.g. when the edge
+already compresses.
+"""
+
+import os
+import time
+import zlib
+from typing import Optional
+
+from django_plugins.metrics import metrics
+from django_plugins.request_timing import current_timer
+from django_plugins.static_assets import (
+    COMPRESSIBLE_TYPES,
+    MIN_COMPRESS_SIZE,
+    choose_encoding,
+)
+
+try:
+    import brotli
+
+    _brotli_available = True
+except ImportError:
+    _brotli_available = False
+
+try:
+    import zstandard
+
+    _zstd_available = True
+except ImportError:
+    _zstd_available = False
+
+COMPRESSION = os.getenv("COMPRESSION", "true").lower() == "true"
+
+# Fast levels: responses are compressed on the event loop, per request
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+
+class _GzipEncoder:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+ENCODERS = {"gzip": _GzipEncoder}
+if _brotli_available:
+    ENCODERS["br"] = _BrotliEncoder
+if _zstd_available:
+    ENCODERS["zstd"] = _ZstdEncoder
+
+# Best first: brotli compresses text tightest, zstd fastest
+ENCODING_PREFERENCE = ("br", "zstd", "gzip")
+
+
+def _get_header(headers: list, name: bytes) -> Optional[bytes]:
+    for header_name, header_value in headers:
+        if header_name.lower() == name:
+            return header_value
+    return None
+
+
+def is_compressible(status: int, headers: list) -> bool:
+    """Whether a response could be compressed, whatever the client accepts."""
+    if status < 200 or status in (204, 206, 304):
+        return False
+    if _get_header(headers, b"content-encoding") is not None:
+        return False
+    content_type = (_get_header(headers, b"content-type") or b"").decode("latin-1")
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return False
+    cache_control = (_get_header(headers, b"cache-control") or b"").lower()
+    if b"no-transform" in cache_control:
+        return False
+    content_length = _get_header(headers, b"content-length")
+    return content_length is None or int(content_length) >= MIN_COMPRESS_SIZE
+
+
+def _response_headers(headers: list, encoding: str, length: Optional[int]) -> list:
+    """Headers for the compressed response, with Vary already added."""
+    new_headers = []
+    for name, value in headers:
+        lower = name.lower()
+        if lower == b"content-length":
+            continue
+        if lower == b"etag" and not value.startswith(b"W/"):
+            new_headers.append((name, b"W/" + value))
+            continue
+        new_headers.append((name, value))
+    new_headers.append((b"content-encoding", encoding.encode()))
+    if length is not None:
+        new_headers.append((b"content-length", str(length).encode()))
+    return new_headers
+
+
+def _add_vary(headers: list) -> list:
+    for index, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            if b"accept-encoding" in value.lower() or value.strip() == b"*":
+                return headers
+            headers = list(headers)
+            headers[index] = (name, value + b", Accept-Encoding")
+            return headers
+    return [*headers, (b"vary", b"Accept-Encoding")]
+
+
+def compress_send(send, request_headers: list, method: str = "GET"):
+    """Wrap an ASGI send to compress the response body as it streams."""
+    if not COMPRESSION or method == "HEAD":
+        return send
+    accept_encoding = _get_header(request_headers, b"accept-encoding")
+    encoding = choose_encoding(
+        accept_encoding.decode("latin-1") if accept_encoding else None,
+        ENCODERS,
+        ENCODING_PREFERENCE,
+    )
+
+    start_message = None
+    encoder = None
+    bytes_in = 0
+    bytes_out = 0
+
+    def timed(fn, *args) -> bytes:
+        started = time.perf_counter()
+        result = fn(*args)
+        timer = current_timer.get()
+        if timer is not None:
+            timer.add("compress", time.perf_counter() - started)
+        return result
+
+    async def wrapped(message):
+        nonlocal start_message, encoder, bytes_in, bytes_out
+        if message["type"] == "http.response.start":
+            headers = message.get("headers", [])
+            if not is_compressible(message["status"], headers):
+                await send(message)
+                return
+            # Held back until the first body chunk shows how big the body is
+            start_message = {**message, "headers": _add_vary(headers)}
+            return
+
+        if message["type"] != "http.response.body" or (
+            start_message is None and encoder is None
+        ):
+            await send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if encoder is None:
+            if encoding is None or (not more_body and len(body) < MIN_COMPRESS_SIZE):
+                await send(start_message)
+                start_message = None
+                await send(message)
+                return
+            encoder = ENCODERS[encoding]()
+
+        compressed = timed(encoder.compress, body)
+        if not more_body:
+            compressed += timed(encoder.finish)
+        if start_message is not None:
+            # A body sent in one message gets an exact Content-Length
+            length = None if more_body else len(compressed)
+            headers = _response_headers(start_message["headers"], encoding, length)
+            await send({**start_message, "headers": headers})
+            start_message = None
+
+        bytes_in += len(body)
+        bytes_out += len(compressed)
+        if not more_body:
+            metrics.inc("compression_bytes_in_total", bytes_in, encoding=encoding)
+            metrics.inc("compression_bytes_out_total", bytes_out, encoding=encoding)
+        await send({**message, "body": compressed})
+
+    return wrapped
@@ -1,12 +1,11 @@
 import json
 import logging
 import os
+from functools import lru_cache
 from urllib.parse import parse_qs
 
 import djp
-import sqlite_utils
-from jinja2 import Environment, FileSystemLoader
-from sqlite_utils.db import Database
+from jinja2 import Environment, FileSystemLoader, Template
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +31,15 @@ try:
 except ImportError:
     pass
 
+from django_plugins.admission_control import (
+    admission_controller,
+    classify_request,
+    make_503_overloaded_response,
+)
 from django_plugins.api_key_auth import (
+    ACCESS_TIER_ANONYMOUS,
+    ACCESS_TIER_API_KEY,
+    ACCESS_TIER_TRUSTED,
     cap_result_size,
     check_rate_limit,
     extract_api_key,
@@ -40,10 +47,68 @@ from django_plugins.api_key_auth import (
     is_internal_service_request,
     is_json_endpoint,
     is_research_tool_request,
+    is_validated_api_key,
     make_401_response,
     make_402_rate_limit_response,
     validate_api_key,
 )
+from django_plugins.bot_policy import get_bot_policy
+from django_plugins.compression import compress_send
+from django_plugins.export import (
+    ExportError,
+    export_limiter,
+    is_export_path,
+    parse_export_request,
+    resolve_table,
+    stream_export,
+)
+from django_plugins.metrics import metrics, record_request
+from django_plugins.preload import load_datasette_plugins
+from django_plugins.query_cache import (
+    ResponseRecorder,
+    database_version,
+    is_cacheable_request,
+    make_cache_key,
+    query_database_name,
+    query_result_cache,
+    replay_app,
+)
+from django_plugins.query_cost import assess_query, get_sql_query, tighten_time_limit
+from django_plugins.request_capture import request_capture
+from django_plugins.request_timing import (
+    SERVER_TIMING,
+    StageTimer,
+    current_timer,
+    instrument_send,
+    timed_stage,
+)
+from django_plugins.site_inspect import (
+    database_name,
+    inspect_data_path,
+    load_inspect_data,
+)
+from django_plugins.site_instances import SiteInstance, site_instances
+from django_plugins.site_registry import site_registry
+from django_plugins.slow_queries import slow_query_log
+from django_plugins.snapshots import (
+    SNAPSHOT_PREFIX,
+    is_snapshot_path,
+    load_snapshots,
+    parse_snapshot_path,
+    send_snapshot_file,
+    snapshot_dir,
+    snapshot_listing,
+    snapshot_response_headers,
+)
+from django_plugins.sql_executor import PRIORITY_NAMES, sql_executor
+from django_plugins.static_assets import get_static_response, is_static_path
+from django_plugins.warmup import (
+    WARMUP_SECONDS,
+    hot_subdomains,
+    prime_datasette,
+    warm_up,
+)
+from django_plugins.well_known import get_well_known_response, is_well_known_path
 
 
 @djp.hookimpl
@@ -53,7 +118,22 @@ def asgi_wrapper():
 
 def wrap(app):
     async def wrapper(scope, receive, send):
-        await datasette_by_subdomain_wrapper(scope, receive, send, app)
+        if scope["type"] == "lifespan":
+            await handle_lifespan(receive, send)
+            return
+
+        # The router makes a StageTimer current for site requests; record
+        # it in the shared metrics (and the request capture, if enabled)
+        # once the request is done
+        token = current_timer.set(None)
+        try:
+            await datasette_by_subdomain_wrapper(scope, receive, send, app)
+        finally:
+            timer = current_timer.get()
+            current_timer.reset(token)
+            if timer is not None:
+                record_request(timer)
+                request_capture.record(scope, timer)
 
     return wrapper
 
@@ -77,6 +157,25 @@ async def send_401_response(send):
     )
 
 
+async def send_503_response(send, retry_after: int):
+    """Send a 503 Service Unavailable response for shed requests."""
+    body, headers = make_503_overloaded_response(retry_after)
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 503,
+            "headers": headers,
+        }
+    )
+    await send(
+        {
+            "type": "http.response.body",
+            "body": body,
+        }
+    )
+
+
 async def send_redirect_to_home(send):
     """Send a 302 redirect to civic.band homepage."""
     await send(
@@ -127,10 +226,57 @@ async def send_404_response(send):
     )
 
 
+async def send_response(send, status: int, headers: list, body: bytes = b""):
+    """Send a complete response with a single body message."""
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers,
+        }
+    )
+    await send(
+        {
+            "type": "http.response.body",
+            "body": body,
+        }
+    )
+
+
+async def send_cached_query_response(scope, receive, send, response):
+    """
+    Send a cached ?sql= response.
+
+    The response is replayed through the civic_analytics wrapper, which
+    Datasette would otherwise have applied, so cached queries are still
+    tracked.
+    """
+    from plugins.civic_analytics import (  # noqa: PLC0415
+        asgi_wrapper as analytics_asgi_wrapper,
+    )
+
+    app = analytics_asgi_wrapper(None)(replay_app(response))
+    await app(scope, receive, send)
+
+
 async def send_402_response(send, error_type: str = "query_too_long"):
     """Send a 402 Payment Required response for bot-like queries or rate limiting."""
     if error_type == "rate_limit":
         body, headers = make_402_rate_limit_response()
+    elif error_type == "expensive_query":
+        response = {
+            "error": "expensive_query",
+            "message": (
+                "This query scans a large table without an index or full-text "
+                "search. Queries like this require an API key"
+            ),
+            "get_api_key": API_SIGNUP_URL,
+        }
+        body = json.dumps(response).encode()
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ]
     else:
         response = {
             "error": "query_too_long",
@@ -174,6 +320,13 @@ def is_query_too_long(query_string: bytes) -> bool:
     return False
 
 
+def wants_server_timing(headers: list) -> bool:
+    """Whether to send a Server-Timing header (see SERVER_TIMING)."""
+    if SERVER_TIMING == "all":
+        return True
+    return SERVER_TIMING == "internal" and is_internal_service_request(headers)
+
+
 def get_client_ip(scope: dict) -> str:
     """
     Extract client IP address from ASGI scope.
@@ -205,6 +358,230 @@ def get_client_ip(scope: dict) -> str:
     return "unknown"
 
 
+def get_site_databases(subdomain: str) -> list[str]:
+    """
+    Find the database files deployed for a site.
+
+    Always includes meetings.db, plus the finance databases when present.
+    If nothing exists on disk, meetings.db is returned anyway so Datasette
+    produces its usual 404.
+
+    Args:
+        subdomain: Site subdomain (e.g., "alameda.ca")
+
+    Returns:
+        List of database file paths
+    """
+    db_list = []
+    meetings_db = f"../sites/{subdomain}/meetings.db"
+    if os.path.exists(meetings_db):
+        db_list.append(meetings_db)
+
+    # Check for finance database
+    finance_db = f"../sites/{subdomain}/finance/election_finance.db"
+    if os.path.exists(finance_db):
+        db_list.append(finance_db)
+
+    # Check for items db
+    items_db = f"../sites/{subdomain}/finance/items.db"
+    if os.path.exists(items_db):
+        db_list.append(items_db)
+
+    # If no databases found, use meetings.db as fallback (will 404 if doesn't exist)
+    if not db_list:
+        db_list = [meetings_db]
+
+    return db_list
+
+
+def get_database_names(db_list: list[str]) -> tuple[str, ...]:
+    """Return the Datasette database names (file stems) for database paths."""
+    return tuple(database_name(path) for path in db_list)
+
+
+def site_version(subdomain: str, site: dict, db_list: list[str]) -> str:
+    """Changes whenever the site's Datasette instance needs rebuilding."""
+    try:
+        inspect_mtime = os.stat(inspect_data_path(subdomain)).st_mtime_ns
+    except OSError:
+        inspect_mtime = 0
+    return "|".join(
+        [
+            str(site["name"]),
+            str(site["state"]),
+            str(site["last_updated"]),
+            str(inspect_mtime),
+            database_version(db_list),
+        ]
+    )
+
+
+@lru_cache(maxsize=1)
+def get_metadata_template() -> Template:
+    """The compiled metadata.json template, shared by every site."""
+    jinja_env = Environment(
+        loader=FileSystemLoader("templates/config"),
+    )
+    return jinja_env.get_template("metadata.json")
+
+
+def build_site_instance(
+    subdomain: str, site: dict, db_list: list[str], version: str
+) -> SiteInstance:
+    """Build a site's Datasette instance from its metadata and inspect data."""
+    context_blob = {
+        "name": site["name"],
+        "state": site["state"],
+        "subdomain": site["subdomain"],
+        "last_updated": site["last_updated"],
+    }
+
+    with timed_stage("metadata"):
+        metadata = json.loads(get_metadata_template().render(context=context_blob))
+
+        # Databases covered by fresh deploy-time inspect data are opened
+        # immutable, so Datasette uses the recorded counts instead of
+        # running count(*); anything not yet inspected stays mutable
+        inspect_data = load_inspect_data(subdomain, db_list)
+    immutables = [path for path in db_list if database_name(path) in inspect_data]
+    files = [path for path in db_list if path not in immutables]
+
+    from datasette.app import Datasette  # noqa: PLC0415
+
+    with timed_stage("datasette_init"):
+        # Registered once per process instead of re-executed per instance
+        load_datasette_plugins()
+        datasette_instance = Datasette(
+            files,
+            immutables=immutables,
+            inspect_data=inspect_data or None,
+            config=metadata,
+            template_dir="templates/datasette",
+            static_mounts=[("-/static-plugins/corkboard", "plugins/static")],
+            settings={
+                "force_https_urls": True,
+                "default_page_size": 100,
+                "sql_time_limit_ms": 3000,
+                # Non-zero for threaded mode; sql_executor replaces the pool
+                "num_sql_threads": 5,
+                "default_facet_size": 10,
+                "facet_time_limit_ms": 100,
+                "allow_download": False,
+                "allow_csv_stream": False,
+                "truncate_cells_html": 0,
+            },
+        )
+        app = datasette_instance.app()
+        for database in datasette_instance.databases.values():
+            slow_query_log.instrument(database)
+
+    return SiteInstance(datasette_instance, app, version)
+
+
+def get_site_instance(subdomain: str, site: dict, db_list: list[str]) -> SiteInstance:
+    """The site's cached Datasette instance, built if missing or stale."""
+    version = site_version(subdomain, site, db_list)
+    return site_instances.get_or_build(
+        subdomain,
+        version,
+        lambda: build_site_instance(subdomain, site, db_list, version),
+    )
+
+
+async def warm_site(subdomain: str) -> None:
+    """Build a site's Datasette instance and fault its tables into cache."""
+    site = site_registry.get(subdomain)
+    if site is None:
+        raise LookupError(f"Unknown site: {subdomain}")
+    instance = get_site_instance(subdomain, site, get_site_databases(subdomain))
+    with sql_executor.serve(instance.datasette, subdomain):
+        await prime_datasette(instance.datasette)
+
+
+async def handle_export(scope, receive, send, subdomain, site, db_list):
+    """Stream a table export on the site's Datasette instance."""
+    try:
+        request = parse_export_request(scope["path"], scope.get("query_string", b""))
+    except ExportError as error:
+        await send_export_error(send, error)
+        return
+    if not export_limiter.try_acquire():
+        await send_503_response(send, admission_controller.retry_after)
+        return
+    try:
+        instance = get_site_instance(subdomain, site, db_list)
+        # Bulk reads queue behind page views, whoever asked for them
+        with (
+            sql_executor.serve(instance.datasette, subdomain, ACCESS_TIER_API_KEY),
+            timed_stage("export"),
+        ):
+            try:
+                keys = await resolve_table(instance.datasette, request)
+            except ExportError as error:
+                await send_export_error(send, error)
+                return
+            await stream_export(instance.datasette, request, keys, receive, send)
+    finally:
+        export_limiter.release()
+
+
+async def handle_snapshot(scope, send, subdomain):
+    """Serve a site's snapshot listing, or one snapshot file."""
+    path = scope["path"]
+    snapshots = load_snapshots(subdomain)
+    if path == SNAPSHOT_PREFIX:
+        body = snapshot_listing(snapshots)
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"cache-control", b"private, no-cache"),
+        ]
+        await send_response(send, 200, headers, body)
+        return
+
+    filename = parse_snapshot_path(path)
+    entry = snapshots.get(filename) if filename else None
+    if entry is None:
+        await send_export_error(
+            send, ExportError(404, f"No current snapshot at {path}")
+        )
+        return
+
+    status, headers, byte_range = snapshot_response_headers(
+        entry, subdomain, scope.get("headers", [])
+    )
+    if byte_range is None or scope.get("method", "GET") == "HEAD":
+        await send_response(send, status, headers)
+        return
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    sent = await send_snapshot_file(
+        os.path.join(snapshot_dir(subdomain), filename), byte_range, send
+    )
+    metrics.inc("snapshot_bytes_total", sent)
+
+
+async def send_export_error(send, error: ExportError):
+    body = json.dumps({"error": "export", "message": str(error)}).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    await send_response(send, error.status, headers, body)
+
+
+async def handle_lifespan(receive, send):
+    """Answer ASGI lifespan events, warming hot sites before startup completes."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if WARMUP_SECONDS > 0:
+                await warm_up(warm_site, hot_subdomains(), WARMUP_SECONDS)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
 async def datasette_by_subdomain_wrapper(scope, receive, send, app):
     if scope["type"] == "http":
         headers = scope["headers"]
@@ -222,19 +599,64 @@ async def datasette_by_subdomain_wrapper(scope, receive, send, app):
                 break
         subdomain: str = host.rstrip(".")
 
-        jinja_env = Environment(
-            loader=FileSystemLoader("templates/config"),
-        )
-
         # If no subdomain, fall back to Django app (main site)
         if not subdomain:
             await app(scope, receive, send)
             return
 
-        db: Database = sqlite_utils.Database("sites.db")
+        # Datasette and plugin static assets are the same for every site:
+        # serve them from the in-memory asset table before any site lookup
+        if is_static_path(scope.get("path", "")):
+            static_response = get_static_response(scope)
+            if static_response is not None:
+                await send_response(send, *static_response)
+                return
+
+        # Time each stage of the request. The timer is current for the rest
+        # of this request's task, so auth helpers and SQL threads record too
+        timer = StageTimer()
+        timer.subdomain = subdomain
+        current_timer.set(timer)
+        send = instrument_send(send, timer, wants_server_timing(headers))
+        # Compress text responses as they stream (see compression)
+        send = compress_send(send, headers, scope.get("method", "GET"))
+
+        # Bot policy (botPolicy.yaml rules) and admission control: when the
+        # worker is saturated, shed anonymous JSON and automated traffic
+        # before any database work. Only keys already in the validation
+        # cache count as API key traffic.
+        with timer.stage("admission"):
+            client_ip = get_client_ip(scope)
+            bot_verdict = get_bot_policy().classify(
+                headers, scope.get("path", ""), client_ip
+            )
+            api_key = extract_api_key(headers, scope.get("query_string", b""))
+            priority = classify_request(
+                headers,
+                scope.get("path", ""),
+                subdomain,
+                bot_verdict,
+                api_key_validated=bool(api_key) and await is_validated_api_key(api_key),
+            )
+            shed_reason = admission_controller.admit(priority)
+        timer.tier = priority
+        if shed_reason is not None:
+            logger.warning(
+                "Request shed",
+                extra={
+                    "subdomain": subdomain,
+                    "path": scope.get("path", ""),
+                    "priority": priority,
+                    "reason": shed_reason,
+                    "bot_rule": bot_verdict.rule,
+                },
+            )
+            await send_503_response(send, admission_controller.retry_after)
+            return
 
         try:
-            site = db["sites"].get(subdomain)
+            with timer.stage("site_lookup"):
+                site = site_registry.get(subdomain)
         except Exception:
             site = None
 
@@ -247,32 +669,42 @@ async def datasette_by_subdomain_wrapper(scope, receive, send, app):
             await send_redirect_to_home(send)
             return
 
+        path = scope.get("path", "")
+
+        # robots.txt / opensearch.xml: answer from the per-site cache without
+        # rendering metadata, checking auth or building a Datasette instance
+        if is_well_known_path(path):
+            db_list = get_site_databases(subdomain)
+            body, response_headers = get_well_known_response(
+                path, subdomain, site["name"], get_database_names(db_list)
+            )
+            await send_response(send, 200, response_headers, body)
+            return
+
         # Bot protection: block overly long text queries
         query_string = scope.get("query_string", b"")
         if is_query_too_long(query_string):
             await send_402_response(send)
             return
 
-        context_blob = {
-            "name": site["name"],
-            "state": site["state"],
-            "subdomain": site["subdomain"],
-            "last_updated": site["last_updated"],
-        }
-
-        # Tiered JSON access control:
+        # Tiered access control for JSON endpoints and custom ?sql= queries:
         # | Layer            | Condition                     | Action                    |
         # |------------------|-------------------------------|---------------------------|
         # | First-party      | Matching Referer              | Allow (full access)       |
         # | Internal service | Valid X-Service-Secret        | Allow (full access)       |
         # | Research tools   | UA contains Zotero/etc.       | Allow (full access)       |
-        # | Rate limit       | >15 req/min per IP            | 402                       |
+        # | Rate limit       | >15 JSON or denied-bot        | 402                       |
+        # |                  | req/min per IP                |                           |
         # | API key          | Valid key                     | Allow (unlimited results) |
-        # | No API key       | Unauthenticated               | Allow (cap _size at 100)  |
-        path = scope.get("path", "")
+        # | No API key       | Unauthenticated               | Allow (cap JSON _size at  |
+        # |                  |                               | 100, query cost guard)    |
         should_cap_results = False
+        access_tier = None
+        is_json = is_json_endpoint(path)
+        is_export = is_export_path(path) or is_snapshot_path(path)
+        sql = get_sql_query(query_string) if query_database_name(path) else None
 
-        if is_json_endpoint(path):
+        if is_json or is_export or sql or bot_verdict.denied:
             # Layers 1-3: Trusted sources get full access without rate limiting
             is_trusted_source = (
                 is_first_party_request(headers, subdomain)  # Layer 1: browser AJAX
@@ -280,10 +712,14 @@ async def datasette_by_subdomain_wrapper(scope, receive, send, app):
                 or is_research_tool_request(headers)  # Layer 3: Zotero, etc.
             )
 
-            if not is_trusted_source:
-                # Layer 4: Rate limiting for all other JSON requests
-                client_ip = get_client_ip(scope)
-                if await check_rate_limit(client_ip):
+            if is_trusted_source:
+                access_tier = ACCESS_TIER_TRUSTED
+            else:
+                # Layer 4: Rate limiting for all other JSON requests, and for
+                # every request from bots the bot policy denies
+                if (
+                    is_json or is_export or bot_verdict.denied
+                ) and await check_rate_limit(client_ip):
                     logger.warning(
                         "Rate limit exceeded",
                         extra={
@@ -305,75 +741,137 @@ async def datasette_by_subdomain_wrapper(scope, receive, send, app):
                         await send_401_response(send)
                         return
                     # Valid API key - full access, no capping
+                    access_tier = ACCESS_TIER_API_KEY
                 else:
-                    # Layer 6: No API key - allow but cap results
-                    should_cap_results = True
+                    # Layer 6: No API key - allow but cap JSON results
+                    access_tier = ACCESS_TIER_ANONYMOUS
+                    should_cap_results = is_json
 
         # Cap result size for unauthenticated requests
         if should_cap_results:
             scope = dict(scope)  # Make a mutable copy
             scope["query_string"] = cap_result_size(query_string)
 
-        metadata = json.loads(
-            jinja_env.get_template("metadata.json").render(context=context_blob)
-        )
-
         # Build list of databases - always include meetings.db, optionally include finance
-        db_list = []
-        meetings_db = f"../sites/{subdomain}/meetings.db"
-        if os.path.exists(meetings_db):
-            db_list.append(meetings_db)
-
-        # Check for finance database
-        finance_db = f"../sites/{subdomain}/finance/election_finance.db"
-        if os.path.exists(finance_db):
-            db_list.append(finance_db)
+        db_list = get_site_databases(subdomain)
+        if "election_finance" in get_database_names(db_list):
             logger.info(f"Found finance database for {subdomain}")
 
-        # Check for items db
-        items_db = f"../sites/{subdomain}/finance/items.db"
-        if os.path.exists(items_db):
-            db_list.append(items_db)
-
-        # If no databases found, use meetings.db as fallback (will 404 if doesn't exist)
-        if not db_list:
-            db_list = [meetings_db]
-
-        from datasette.app import Datasette  # noqa: PLC0415
-
-        datasette_instance = Datasette(
-            db_list,
-            config=metadata,
-            plugins_dir="plugins",
-            template_dir="templates/datasette",
-            static_mounts=[("-/static-plugins/corkboard", "plugins/static")],
-            settings={
-                "force_https_urls": True,
-                "default_page_size": 100,
-                "sql_time_limit_ms": 3000,
-                "num_sql_threads": 5,
-                "default_facet_size": 10,
-                "facet_time_limit_ms": 100,
-                "allow_download": False,
-                "allow_csv_stream": False,
-                "truncate_cells_html": 0,
-            },
-        )
+        # Whole-table exports and snapshots, for API keys and internal
+        # services only
+        if is_export:
+            is_internal = is_internal_service_request(headers)
+            if access_tier == ACCESS_TIER_TRUSTED and not is_internal:
+                # A first-party Referer or research tool doesn't grant
+                # exports on its own, but a key sent along with it does
+                api_key = extract_api_key(headers, query_string)
+                if api_key and (await validate_api_key(api_key, subdomain))["valid"]:
+                    access_tier = ACCESS_TIER_API_KEY
+            if access_tier != ACCESS_TIER_API_KEY and not is_internal:
+                await send_401_response(send)
+                return
+            if is_snapshot_path(path):
+                await handle_snapshot(scope, send, subdomain)
+            else:
+                await handle_export(scope, receive, send, subdomain, site, db_list)
+            logger.info(
+                "Request completed",
+                extra={
+                    "subdomain": subdomain,
+                    "path": path,
+                    "method": scope.get("method", "GET"),
+                    "export": True,
+                    "timings": timer.as_dict(),
+                },
+            )
+            return
 
-        ds = datasette_instance.app()
+        # Query cost guard: plan anonymous ?sql= queries before running them.
+        # Full scans of large tables are refused for JSON and get a short
+        # time limit for HTML, rather than holding a SQL thread for 3s
+        if access_tier == ACCESS_TIER_ANONYMOUS and sql:
+            database = query_database_name(path)
+            db_path = next((p for p in db_list if database_name(p) == database), None)
+            # Planning opens the database file, so it runs on a SQL thread
+            assessment = None
+            if db_path:
+                with timer.stage("query_cost"):
+                    assessment = await sql_executor.run(
+                        assess_query,
+                        db_path,
+                        sql,
+                        subdomain=subdomain,
+                        access_tier=access_tier,
+                    )
+            if assessment is not None and assessment.expensive:
+                logger.info(
+                    "Expensive query from anonymous caller",
+                    extra={
+                        "subdomain": subdomain,
+                        "path": path,
+                        "query_kind": assessment.kind,
+                        "scan_rows": assessment.scan_rows,
+                    },
+                )
+                if is_json:
+                    await send_402_response(send, "expensive_query")
+                    return
+                scope = dict(scope)
+                scope["query_string"] = tighten_time_limit(scope["query_string"])
+
+        # Answer repeated ?sql= queries from the result cache. This runs after
+        # the access checks above, and the key uses the capped query string
+        cache_key = None
+        if query_result_cache.enabled and is_cacheable_request(scope):
+            with timer.stage("cache"):
+                cache_key = make_cache_key(subdomain, scope, database_version(db_list))
+                cached_response = query_result_cache.get(cache_key)
+            if cached_response is not None:
+                await send_cached_query_response(scope, receive, send, cached_response)
+                logger.info(
+                    "Request completed",
+                    extra={
+                        "subdomain": subdomain,
+                        "path": path,
+                        "method": scope.get("method", "GET"),
+                        "query_cache": "hit",
+                        "timings": timer.as_dict(),
+                    },
+                )
+                return
+
+        # The site's Datasette instance is kept between requests and rebuilt
+        # when its data changes; building it is timed as metadata and
+        # datasette_init stages
+        instance = get_site_instance(subdomain, site, db_list)
+        datasette_instance, ds = instance.datasette, instance.app
 
         # Import NotFound to catch 404s before they hit Datasette's
         # exception handler (which calls rich.print_exception and fails)
         from datasette.utils.asgi import NotFound  # noqa: PLC0415
 
+        recorder = None
+        if cache_key is not None:
+            recorder = ResponseRecorder(send, query_result_cache.max_entry_bytes)
+
         try:
-            await ds(scope, receive, send)
+            # Queries run on the process-wide executor, queued fairly by site
+            # and access tier, instead of on this instance's own threads
+            with (
+                admission_controller.track(),
+                sql_executor.serve(datasette_instance, subdomain, access_tier),
+                timer.stage("datasette"),
+            ):
+                await ds(scope, receive, recorder or send)
+            if recorder is not None and (cacheable := recorder.response()):
+                query_result_cache.put(cache_key, cacheable)
             logger.info(
                 "Request completed",
                 extra={
                     "subdomain": subdomain,
                     "path": path,
                     "method": scope.get("method", "GET"),
+                    "timings": timer.as_dict(),
                 },
             )
         except NotFound:
@@ -387,3 +885,24 @@ async def datasette_by_subdomain_wrapper(scope, receive, send, app):
                 },
             )
             await send_404_response(send)
+
+
+# Current state of this worker's shared components, reported per worker
+for priority in PRIORITY_NAMES:
+    metrics.register_gauge(
+        "sql_executor_queued",
+        lambda priority=priority: sql_executor.stats()["queued_by_priority"][priority],
+        priority=priority,
+    )
+metrics.register_gauge("sql_executor_busy", lambda: sql_executor.stats()["busy"])
+metrics.register_gauge("admission_in_flight", lambda: admission_controller.in_flight)
+metrics.register_gauge(
+    "admission_shed_in_flight", lambda: admission_controller.shed_in_flight
+)
+metrics.register_gauge(
+    "admission_max_in_flight", lambda: admission_controller.max_in_flight
+)
+metrics.register_gauge("query_cache_bytes", lambda: query_result_cache.bytes)
+metrics.register_gauge(
+    "query_cache_entries", lambda: query_result_cache.stats()["entries"]
+)
@@ -0,0 +1,254 @@
+"""
+Streaming table exports for API key holders and internal services.
+
+Datasette's CSV streaming and downloads are disabled for every site, so
+researchers used to page through whole tables 100 rows at a time with
+``.json`` requests. The router instead answers
+
+    /-/export/<database>/<table>.ndjson
+    /-/export/<database>/<table>.csv
+
+for API key and internal service callers with the whole table, in a
+single streamed response:
+
+- rows are read in EXPORT_PAGE_SIZE pages with keyset pagination on the
+  table's primary key (or rowid), so every page is an index range scan
+  and memory stays bounded at one page
+- each page runs on the SQL executor at the caller's priority, and the
+  next page is only read once the previous one has been sent, so a slow
+  client slows the export down instead of buffering it
+- the X-Export-Key header names the key columns; to resume an
+  interrupted export, pass the last received row's key values as a JSON
+  array in ``?_after=``, e.g. ``?_after=["min-002"]``
+- ``?_limit=`` caps the number of rows returned
+
+At most EXPORT_MAX_CONCURRENT exports run at once per worker.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import os
+import time
+from typing import Optional
+from urllib.parse import parse_qs
+
+from django_plugins.metrics import metrics
+
+EXPORT_PREFIX = "/-/export/"
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "4"))
+# Per page; keyset pages are index range scans, so this is generous
+EXPORT_PAGE_TIME_LIMIT_MS = int(os.getenv("EXPORT_PAGE_TIME_LIMIT_MS", "5000"))
+
+CONTENT_TYPES = {
+    "ndjson": b"application/x-ndjson; charset=utf-8",
+    "csv": b"text/csv; charset=utf-8",
+}
+
+
+class ExportError(Exception):
+    """An export request that can't be served, with its HTTP status."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ExportRequest:
+    """A parsed export path and query string."""
+
+    __slots__ = ("database", "table", "format", "after", "limit")
+
+    def __init__(self, database, table, format, after=None, limit=None):
+        self.database = database
+        self.table = table
+        self.format = format
+        self.after: Optional[list] = after
+        self.limit: Optional[int] = limit
+
+
+def is_export_path(path: str) -> bool:
+    return path.startswith(EXPORT_PREFIX)
+
+
+def parse_export_request(path: str, query_string: bytes) -> ExportRequest:
+    """
+    Parse /-/export/<database>/<table>.<format>?_after=...&_limit=...
+
+    Raises:
+        ExportError: If the path or parameters are malformed
+    """
+    database, _, table_file = path[len(EXPORT_PREFIX) :].partition("/")
+    table, _, format = table_file.rpartition(".")
+    if not database or not table or format not in CONTENT_TYPES:
+        raise ExportError(
+            404, "Export paths look like /-/export/<database>/<table>.ndjson or .csv"
+        )
+
+    params = parse_qs(query_string.decode("utf-8", "replace"))
+    after = None
+    if "_after" in params:
+        try:
+            after = json.loads(params["_after"][0])
+        except ValueError:
+            after = None
+        if not isinstance(after, list) or not after:
+            raise ExportError(400, "_after must be a JSON array of key values")
+    limit = None
+    if "_limit" in params:
+        try:
+            limit = int(params["_limit"][0])
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            raise ExportError(400, "_limit must be a positive integer")
+    return ExportRequest(database, table, format, after, limit)
+
+
+def page_sql(table: str, keys: list[str], after: bool, page_size: int) -> str:
+    """The keyset query for one page, after the previous page's last key."""
+    from datasette.utils import escape_sqlite  # noqa: PLC0415
+
+    key_list = ", ".join(escape_sqlite(key) for key in keys)
+    columns = "rowid, *" if keys == ["rowid"] else "*"
+    where = ""
+    if after:
+        placeholders = ", ".join("?" for _ in keys)
+        where = f" where ({key_list}) > ({placeholders})"
+    return (
+        f"select {columns} from {escape_sqlite(table)}{where} "
+        f"order by {key_list} limit {page_size}"
+    )
+
+
+def encode_page(format: str, columns: list[str], rows, header: bool) -> bytes:
+    """Serialize one page of rows as NDJSON lines or CSV records."""
+    if format == "ndjson":
+        return b"".join(
+            json.dumps(dict(zip(columns, row, strict=True)), default=str).encode()
+            + b"\n"
+            for row in rows
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+class ExportLimiter:
+    """Counts running exports so a worker runs at most max_concurrent."""
+
+    def __init__(self, max_concurrent: int = EXPORT_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self.running = 0
+
+    def try_acquire(self) -> bool:
+        if self.running >= self.max_concurrent:
+            return False
+        self.running += 1
+        return True
+
+    def release(self) -> None:
+        self.running -= 1
+
+
+# Per worker process; exports run on the router's event loop
+export_limiter = ExportLimiter()
+
+
+async def resolve_table(datasette, request: ExportRequest) -> list[str]:
+    """
+    Check the table can be exported; returns its key columns.
+
+    Raises:
+        ExportError: If the database or table doesn't exist or is hidden
+    """
+    try:
+        database = datasette.get_database(request.database)
+    except KeyError:
+        raise ExportError(404, f"Database not found: {request.database}") from None
+    if not await database.table_exists(request.table) or (
+        request.table in await database.hidden_table_names()
+    ):
+        raise ExportError(404, f"Table not found: {request.table}")
+    keys = await database.primary_keys(request.table) or ["rowid"]
+    if request.after is not None and len(request.after) != len(keys):
+        raise ExportError(400, f"_after needs {len(keys)} values: {', '.join(keys)}")
+    return keys
+
+
+async def _wait_for_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream_export(
+    datasette, request: ExportRequest, keys: list[str], receive, send
+) -> int:
+    """
+    Stream a table export to an ASGI send; returns the number of rows sent.
+
+    Stops early, between pages, if the client disconnects.
+    """
+    database = datasette.get_database(request.database)
+    filename = f"{request.database}-{request.table}.{request.format}"
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", CONTENT_TYPES[request.format]),
+                (
+                    b"content-disposition",
+                    f'attachment; filename="{filename}"'.encode(),
+                ),
+                (b"x-export-key", ",".join(keys).encode()),
+                (b"cache-control", b"no-store"),
+            ],
+        }
+    )
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    after = request.after
+    sent = 0
+    started = time.monotonic()
+    try:
+        while not disconnected.done():
+            page_size = EXPORT_PAGE_SIZE
+            if request.limit is not None:
+                page_size = min(page_size, request.limit - sent)
+            results = await database.execute(
+                page_sql(request.table, keys, after is not None, page_size),
+                after or [],
+                custom_time_limit=EXPORT_PAGE_TIME_LIMIT_MS,
+            )
+            rows = results.rows
+            last_page = len(rows) < page_size or (
+                request.limit is not None and sent + len(rows) >= request.limit
+            )
+            chunk = encode_page(
+                request.format, list(results.columns), rows, header=sent == 0
+            )
+            # Awaiting send is the backpressure: it waits while the
+            # client's socket buffer is full
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": not last_page,
+                }
+            )
+            sent += len(rows)
+            if last_page:
+                break
+            after = [rows[-1][key] for key in keys]
+    finally:
+        disconnected.cancel()
+
+    metrics.inc("export_rows_total", sent, format=request.format)
+    metrics.observe("export_seconds", time.monotonic() - started)
+    return sent
@@ -0,0 +1,372 @@
+"""
+Prometheus-style metrics shared across gunicorn workers.
+
+Workers restart every ~200 requests, so in-process counters would vanish
+and be split across processes. Each worker instead keeps its metrics in
+memory and writes a snapshot to METRICS_DIR/worker-<pid>.json at most once
+per METRICS_FLUSH_SECONDS (and at exit). Whichever worker serves /metrics
+merges every snapshot:
+
+- counters and histograms are summed across all workers, including ones
+  that have exited; dead workers' snapshots are folded into archive.json
+  so the directory doesn't grow with every restart
+- gauges (current state, like pending Umami events) only come from
+  workers that are still alive
+
+Metrics are declared in METRICS; labels are passed as keyword arguments:
+
+    metrics.inc("rate_limit_hits_total")
+    metrics.observe("router_request_duration_seconds", 0.12, tier="human")
+    metrics.register_gauge("umami_events_pending", lambda: pending)
+    metrics.register_gauge("sql_executor_queued", queued, priority="api_key")
+"""
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable
+
+from django_plugins.request_timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "corkboard-metrics")
+)
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+
+# Histogram bucket upper bounds in seconds; the last bucket is +Inf
+DURATION_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+GAUGE = "gauge"
+
+METRICS = {
+    "router_requests_total": (
+        COUNTER,
+        "Site requests by subdomain, admission tier and status",
+    ),
+    "router_request_duration_seconds": (
+        HISTOGRAM,
+        "Site request latency by admission tier and status",
+    ),
+    "router_stage_duration_seconds": (
+        HISTOGRAM,
+        "Time spent in each router stage",
+    ),
+    "sql_seconds_total": (COUNTER, "SQL execution time by admission tier"),
+    "sql_wait_seconds_total": (
+        COUNTER,
+        "Time queries waited for an executor thread, by admission tier",
+    ),
+    "rate_limit_hits_total": (COUNTER, "Requests refused by the rate limiter"),
+    "api_key_cache_total": (COUNTER, "API key validations by cache result"),
+    "umami_events_total": (COUNTER, "Umami events sent, by result"),
+    "umami_events_pending": (GAUGE, "Umami events currently being sent"),
+    "sql_executor_queued": (
+        GAUGE,
+        "Queries waiting for an executor thread, by priority",
+    ),
+    "sql_executor_busy": (GAUGE, "Executor threads running a query"),
+    "admission_in_flight": (GAUGE, "Site requests in flight"),
+    "admission_shed_in_flight": (
+        GAUGE,
+        "In-flight requests at which low-priority requests are shed",
+    ),
+    "admission_max_in_flight": (
+        GAUGE,
+        "In-flight requests at which API key requests are shed",
+    ),
+    "admission_admitted_total": (
+        COUNTER,
+        "Site requests admitted, by admission class",
+    ),
+    "admission_shed_total": (
+        COUNTER,
+        "Site requests shed with a 503, by admission class and reason",
+    ),
+    "query_cache_lookups_total": (COUNTER, "Query result cache lookups, by result"),
+    "query_cache_evictions_total": (
+        COUNTER,
+        "Query results evicted from the cache to fit its byte budget",
+    ),
+    "query_cache_bytes": (GAUGE, "Bytes of query results in the cache"),
+    "query_cache_entries": (GAUGE, "Query results in the cache"),
+    "compression_bytes_in_total": (
+        COUNTER,
+        "Response bytes before router compression, by encoding",
+    ),
+    "compression_bytes_out_total": (
+        COUNTER,
+        "Response bytes after router compression, by encoding",
+    ),
+    "export_rows_total": (COUNTER, "Rows sent by table exports, by format"),
+    "export_seconds": (HISTOGRAM, "Time taken to stream a table export"),
+    "snapshot_bytes_total": (COUNTER, "Bytes of Parquet snapshots served"),
+}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsStore:
+    """One process's metrics, flushed to a file the other workers can read."""
+
+    def __init__(self, directory: str = METRICS_DIR):
+        self.directory = directory
+        self._gauges: dict[tuple, Callable] = {}
+        self._reset()
+
+    def _reset(self) -> None:
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self.counters: dict[tuple, float] = defaultdict(float)
+        # key -> [bucket counts..., +Inf count, sum]
+        self.histograms: dict[tuple, list] = {}
+        self._dirty = False
+        self._last_flush = 0.0
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        with self._lock:
+            self.counters[_key(name, labels)] += value
+            self._dirty = True
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            histogram = self.histograms.setdefault(
+                _key(name, labels), [0] * (len(DURATION_BUCKETS) + 2)
+            )
+            histogram[bisect_left(DURATION_BUCKETS, value)] += 1
+            histogram[-1] += value
+            self._dirty = True
+
+    def register_gauge(self, name: str, fn: Callable, **labels) -> None:
+        """Report fn()'s current value (a number) whenever metrics are flushed."""
+        self._gauges[_key(name, labels)] = fn
+
+    def snapshot(self) -> dict:
+        gauges = []
+        for (name, labels), fn in self._gauges.items():
+            try:
+                gauges.append([name, labels, fn()])
+            except Exception:
+                logger.exception("Gauge callback failed", extra={"metric": name})
+        with self._lock:
+            return {
+                "counters": [
+                    [name, labels, value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    [name, labels, values]
+                    for (name, labels), values in self.histograms.items()
+                ],
+                "gauges": gauges,
+            }
+
+    def path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"worker-{pid}.json")
+
+    def flush(self) -> None:
+        """Write this worker's snapshot atomically."""
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = self.snapshot()
+        tmp_path = f"{self.path(self.pid)}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path(self.pid))
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def maybe_flush(self) -> None:
+        """Flush if anything changed and the flush interval has passed."""
+        if self._dirty and time.monotonic() - self._last_flush >= METRICS_FLUSH_SECONDS:
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Failed to write metrics snapshot")
+
+    def collect(self) -> dict:
+        """Merge every worker's snapshot, archiving those of exited workers."""
+        self.flush()
+        merged = {"counters": defaultdict(float), "histograms": {}, "gauges": {}}
+        lock_path = os.path.join(self.directory, ".lock")
+        with open(lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(self.directory, "archive.json")
+            archive = _read_snapshot(archive_path) or {}
+            archive_changed = False
+            _merge(merged, archive, gauges=False)
+            for filename in sorted(os.listdir(self.directory)):
+                if not (filename.startswith("worker-") and filename.endswith(".json")):
+                    continue
+                pid = int(filename[len("worker-") : -len(".json")])
+                path = os.path.join(self.directory, filename)
+                snapshot = _read_snapshot(path)
+                if snapshot is None:
+                    continue
+                alive = pid == self.pid or _pid_alive(pid)
+                _merge(merged, snapshot, gauges=alive)
+                if not alive:
+                    archive = _combine(archive, snapshot)
+                    archive_changed = True
+                    os.remove(path)
+            if archive_changed:
+                tmp_path = f"{archive_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(archive, f)
+                os.replace(tmp_path, archive_path)
+        return merged
+
+
+def _read_snapshot(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(merged: dict, snapshot: dict, gauges: bool) -> None:
+    for name, labels, value in snapshot.get("counters", ()):
+        merged["counters"][(name, tuple(map(tuple, labels)))] += value
+    for name, labels, values in snapshot.get("histograms", ()):
+        key = (name, tuple(map(tuple, labels)))
+        existing = merged["histograms"].get(key)
+        merged["histograms"][key] = (
+            list(values)
+            if existing is None
+            else [a + b for a, b in zip(existing, values, strict=True)]
+        )
+    if gauges:
+        for name, labels, value in snapshot.get("gauges", ()):
+            key = (name, tuple(map(tuple, labels)))
+            merged["gauges"][key] = merged["gauges"].get(key, 0) + value
+
+
+def _combine(archive: dict, snapshot: dict) -> dict:
+    """Fold a dead worker's counters and histograms into the archive."""
+    merged = {"counters": defaultdict(float), "histograms": {}, "gauges": {}}
+    _merge(merged, archive, gauges=False)
+    _merge(merged, snapshot, gauges=False)
+    return {
+        "counters": [
+            [name, labels, value]
+            for (name, labels), value in merged["counters"].items()
+        ],
+        "histograms": [
+            [name, labels, values]
+            for (name, labels), values in merged["histograms"].items()
+        ],
+    }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus(merged: dict) -> str:
+    """Render merged metrics in the Prometheus text exposition format."""
+    samples = defaultdict(list)
+    for (name, labels), value in sorted(merged["counters"].items()):
+        samples[name].append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(merged["gauges"].items()):
+        samples[name].append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), values in sorted(merged["histograms"].items()):
+        cumulative = 0
+        for bound, count in zip([*DURATION_BUCKETS, "+Inf"], values[:-1], strict=True):
+            cumulative += count
+            samples[name].append(
+                f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} "
+                f"{cumulative}"
+            )
+        samples[name].append(f"{name}_sum{_format_labels(labels)} {values[-1]}")
+        samples[name].append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    lines = []
+    for name in sorted(samples):
+        kind, help_text = METRICS.get(name, (COUNTER, ""))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples[name])
+    return "\n".join(lines) + "\n"
+
+
+def record_request(timer: StageTimer) -> None:
+    """Record a finished site request from its stage timer."""
+    timings = timer.as_dict()
+    tier = timer.tier or "unknown"
+    status = str(timer.status or "error")
+    metrics.inc(
+        "router_requests_total", subdomain=timer.subdomain, tier=tier, status=status
+    )
+    metrics.observe(
+        "router_request_duration_seconds",
+        timings["total"] / 1000,
+        tier=tier,
+        status=status,
+    )
+    for stage, ms in timings.items():
+        if stage == "total":
+            continue
+        metrics.observe("router_stage_duration_seconds", ms / 1000, stage=stage)
+    if "sql" in timings:
+        metrics.inc("sql_seconds_total", timings["sql"] / 1000, tier=tier)
+        metrics.inc(
+            "sql_wait_seconds_total", timings.get("sql_wait", 0) / 1000, tier=tier
+        )
+    metrics.maybe_flush()
+
+
+def _flush_at_exit() -> None:
+    if metrics._dirty:
+        metrics.flush()
+
+
+# This worker's metrics; workers forked from a preloading master start fresh
+metrics = MetricsStore()
+os.register_at_fork(after_in_child=metrics._reset)
+atexit.register(_flush_at_exit)
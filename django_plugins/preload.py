@@ -0,0 +1,95 @@
+"""
+Shared state built once before gunicorn forks its workers.
+
+With ``gunicorn --preload`` the ASGI module is imported in the master, and
+with ASGI_PRELOAD=true config.asgi then calls ``preload()``. That builds
+the immutable state every worker needs, so workers inherit it
+copy-on-write instead of each building its own:
+
+- Datasette and its dependencies, imported
+- the Datasette plugins in plugins/, executed and registered once
+- the sites.db rows (see site_registry)
+- the compiled metadata.json template
+- the static asset table, with its compressed variants
+- the subdomain router and the compiled bot policy
+
+Finally gc.freeze() moves everything into the permanent generation, so
+garbage collection in the workers doesn't write to (and un-share) those
+pages.
+
+Fork-unsafe resources are never created here: the Redis client, httpx
+clients, SQLite connections and SQL executor threads are all created
+lazily in each worker. The ones that hold process state are reset after a
+fork.
+"""
+
+import gc
+import glob
+import importlib
+import logging
+import os
+import time
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+ASGI_PRELOAD = os.getenv("ASGI_PRELOAD", "false").lower() == "true"
+
+PLUGINS_DIR = "plugins"
+
+
+@lru_cache(maxsize=None)
+def load_datasette_plugins(plugins_dir: str = PLUGINS_DIR) -> tuple[str, ...]:
+    """
+    Register the plugins_dir plugins with Datasette once per process.
+
+    Datasette executes every plugins_dir module each time an instance is
+    constructed, then ignores all but the first copy. Instances built
+    after this call skip plugins_dir entirely.
+    """
+    from datasette.plugins import pm  # noqa: PLC0415
+    from datasette.utils import module_from_path  # noqa: PLC0415
+
+    names = []
+    for filepath in sorted(glob.glob(os.path.join(plugins_dir, "*.py"))):
+        name = os.path.basename(filepath)
+        module = module_from_path(filepath, name=name)
+        try:
+            pm.register(module)
+        except ValueError:
+            # Already registered by a Datasette instance built with plugins_dir
+            continue
+        names.append(name)
+    return tuple(names)
+
+
+def preload() -> dict:
+    """Build the shared state; returns how long each part took, in ms."""
+    # Imported here so a non-preloading worker's import order is unchanged
+    from django_plugins import datasette_by_subdomain  # noqa: PLC0415
+    from django_plugins.bot_policy import get_bot_policy  # noqa: PLC0415
+    from django_plugins.site_registry import site_registry  # noqa: PLC0415
+    from django_plugins.static_assets import get_static_asset_table  # noqa: PLC0415
+
+    steps = {
+        "datasette": lambda: importlib.import_module("datasette.app"),
+        "plugins": load_datasette_plugins,
+        "sites": site_registry.load_all,
+        "metadata_template": datasette_by_subdomain.get_metadata_template,
+        "static_assets": get_static_asset_table,
+        "bot_policy": get_bot_policy,
+    }
+    timings = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            # Workers build whatever failed lazily, as without preloading
+            logger.exception("Preload step failed", extra={"step": name})
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    gc.collect()
+    gc.freeze()
+    logger.info("Preloaded shared state", extra={"timings": timings})
+    return timings
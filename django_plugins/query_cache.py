@@ -0,0 +1,255 @@
+"""
+Result cache for custom ?sql= queries.
+
+Popular queries (the meeting drill-down links on every site, dashboard
+links, researchers re-running the same query) are answered by the subdomain
+router from a process-wide LRU cache, without building a Datasette instance
+or opening SQLite.
+
+Entries are keyed by site, path (database and output format), normalized
+SQL, the remaining query parameters (bound :params, _shape, _size, ...)
+and the version (size and mtime) of the site's database files. A redeploy
+changes the version, so stale entries are never served; they age out of
+the LRU. The cache has a byte budget rather than an entry count, because a
+single CSV or JSON result can be far larger than thousands of small ones.
+
+Unlike civic_analytics.SQLQueryCache, SQL is not lowercased: that would
+merge queries that differ inside string literals (meeting = 'Council' vs
+'council'). Only whitespace outside literals is collapsed.
+
+Lookups and evictions are counted in query_cache_lookups_total and
+query_cache_evictions_total; the router reports the cache's size as gauges.
+"""
+
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qsl
+
+from django_plugins.metrics import metrics
+
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# No single response may take more than this fraction of the budget
+MAX_ENTRY_FRACTION = 8
+
+# Pages that run ?sql= queries, matching Datasette's routes: the database
+# page (/meetings, /meetings.json) and /meetings/-/query(.json)
+_query_path_re = re.compile(r"^/(?P<database>[^/.]+)(?:/-/query)?(?:\.\w+)?$")
+
+# String literals, quoted identifiers and comments are kept verbatim (a line
+# comment keeps its newline); runs of whitespace elsewhere are collapsed
+_sql_token_re = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*\n?|/\*.*?(?:\*/|$)|\s+"
+    r"|[^'\"\s/-]+|[/-]|['\"]",
+    re.DOTALL,
+)
+
+# Functions whose result changes between runs against the same database
+_non_deterministic_re = re.compile(
+    r"\brandom(?:blob)?\s*\(|\bcurrent_(?:date|time|timestamp)\b|'now'",
+    re.IGNORECASE,
+)
+
+# Parameters that change the response but not the result being cached
+_uncacheable_params = {"_trace"}
+
+
+class CachedResponse(NamedTuple):
+    status: int
+    headers: list
+    body: bytes
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace outside string literals and strip the ends."""
+    return "".join(
+        " " if token.isspace() else token for token in _sql_token_re.findall(sql)
+    ).strip()
+
+
+def query_database_name(path: str) -> Optional[str]:
+    """Database a ?sql= page queries, or None if the path isn't one."""
+    match = _query_path_re.match(path)
+    return match.group("database") if match else None
+
+
+def is_cacheable_request(scope: dict) -> bool:
+    """
+    Check whether a request is a cacheable ?sql= query.
+
+    Only GETs of a database page with a deterministic SQL query qualify.
+    Requests from a signed-in Datasette actor are excluded, since the
+    rendered page can depend on who is asking.
+    """
+    if scope.get("method", "GET") != "GET":
+        return False
+    if query_database_name(scope.get("path", "")) is None:
+        return False
+    params = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    sql = params.get("sql")
+    if not sql or _non_deterministic_re.search(sql):
+        return False
+    if _uncacheable_params & params.keys():
+        return False
+    for name, value in scope.get("headers", []):
+        if name == b"cookie" and b"ds_actor=" in value:
+            return False
+    return True
+
+
+def database_version(db_list: list[str]) -> str:
+    """Version string for a site's database files; changes on redeploy."""
+    parts = []
+    for path in db_list:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        parts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+
+def make_cache_key(subdomain: str, scope: dict, version: str) -> str:
+    """Build the cache key for a cacheable request."""
+    params = parse_qsl(
+        scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True
+    )
+    normalized = sorted(
+        (name, normalize_sql(value) if name == "sql" else value)
+        for name, value in params
+    )
+    key_string = "\x00".join(
+        [subdomain, scope.get("path", ""), version, repr(normalized)]
+    )
+    return hashlib.sha256(key_string.encode()).hexdigest()
+
+
+class QueryResultCache:
+    """LRU cache of full query responses with a total byte budget."""
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // MAX_ENTRY_FRACTION
+        self._cache: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        response = self._cache.get(key)
+        if response is None:
+            self.misses += 1
+            metrics.inc("query_cache_lookups_total", result="miss")
+            return None
+        self._cache.move_to_end(key)
+        self.hits += 1
+        metrics.inc("query_cache_lookups_total", result="hit")
+        return response
+
+    def put(self, key: str, response: CachedResponse) -> bool:
+        """Store a response, evicting least recently used entries to fit."""
+        size = len(response.body) + sum(
+            len(name) + len(value) for name, value in response.headers
+        )
+        if size > self.max_entry_bytes:
+            return False
+        if key in self._cache:
+            self.bytes -= self._sizes.pop(key)
+            del self._cache[key]
+        while self._cache and self.bytes + size > self.max_bytes:
+            old_key, _ = self._cache.popitem(last=False)
+            self.bytes -= self._sizes.pop(old_key)
+            self.evictions += 1
+            metrics.inc("query_cache_evictions_total")
+        self._cache[key] = response
+        self._sizes[key] = size
+        self.bytes += size
+        return True
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ResponseRecorder:
+    """
+    ASGI send wrapper that forwards a response while keeping a copy.
+
+    Stops copying (but keeps forwarding) once the body outgrows max_bytes.
+    """
+
+    def __init__(self, send, max_bytes: int):
+        self.send = send
+        self.max_bytes = max_bytes
+        self.status = None
+        self.headers = []
+        self.chunks = []
+        self.size = 0
+        self.complete = False
+        self.overflowed = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.headers = list(message.get("headers", []))
+        elif message["type"] == "http.response.body" and not self.overflowed:
+            body = message.get("body", b"")
+            self.size += len(body)
+            if self.size > self.max_bytes:
+                self.overflowed = True
+                self.chunks = []
+            else:
+                self.chunks.append(body)
+            if not message.get("more_body", False):
+                self.complete = True
+        await self.send(message)
+
+    def response(self) -> Optional[CachedResponse]:
+        """The recorded response, if complete and safe to share."""
+        if not self.complete or self.overflowed or self.status != 200:
+            return None
+        if any(name.lower() == b"set-cookie" for name, _ in self.headers):
+            return None
+        return CachedResponse(self.status, self.headers, b"".join(self.chunks))
+
+
+def replay_app(response: CachedResponse):
+    """An ASGI app that sends a cached response."""
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status,
+                "headers": [*response.headers, (b"x-query-cache", b"hit")],
+            }
+        )
+        await send({"type": "http.response.body", "body": response.body})
+
+    return app
+
+
+# Process-wide cache shared by every request the worker handles
+query_result_cache = QueryResultCache()
@@ -0,0 +1,296 @@
+"""
+Pre-execution cost guard for custom ?sql= queries.
+
+Before an anonymous ?sql= query reaches Datasette, the router asks SQLite
+how it would run it (EXPLAIN QUERY PLAN, which only plans and reads no
+table data) and classifies the plan:
+
+- fts: answered from a full-text index (MATCH)
+- index: rows are found by index or rowid lookups
+- full_scan: at least one table is read from end to end
+- constant: no tables at all
+
+Plans name aliased tables by their alias, so aliases are mapped back to
+the tables they stand for; a scan of anything else that isn't a subquery
+or CTE is priced as a scan of every table the query reads. Full scans are
+priced by the estimated number of rows scanned, capped by the outermost
+constant LIMIT when rows are returned as they're scanned (no WHERE, join
+conditions, grouping, aggregates or sorting by temp b-tree). Above
+QUERY_COST_MAX_SCAN_ROWS the query is expensive: the router refuses it for
+anonymous JSON callers and runs it with a short _timelimit for anonymous
+HTML pages, instead of letting it hold one of Datasette's SQL threads for
+the full sql_time_limit_ms. Trusted callers and API keys are not checked.
+
+Assessments are cached per database file version and normalized SQL, so
+popular queries are only planned once per deploy. Planning opens the
+database file, so the router runs it on the SQL executor.
+"""
+
+import os
+import re
+import sqlite3
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qs, parse_qsl, urlencode
+
+from django_plugins.query_cache import normalize_sql
+
+QUERY_COST_MAX_SCAN_ROWS = int(os.getenv("QUERY_COST_MAX_SCAN_ROWS", "100000"))
+QUERY_COST_TIMELIMIT_MS = int(os.getenv("QUERY_COST_TIMELIMIT_MS", "500"))
+
+QUERY_KIND_FTS = "fts"
+QUERY_KIND_INDEX = "index"
+QUERY_KIND_FULL_SCAN = "full_scan"
+QUERY_KIND_CONSTANT = "constant"
+QUERY_KIND_INVALID = "invalid"
+
+_scan_re = re.compile(r"^SCAN (?P<table>.+?)(?P<rest> VIRTUAL TABLE .*| USING .*)?$")
+_search_re = re.compile(r"^SEARCH (?P<table>.+?)(?P<rest> USING .*)$")
+# Names EXPLAIN QUERY PLAN gives subqueries and CTEs it evaluates separately
+_derived_re = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (?P<name>.+)$")
+_identifier = r'"(?:[^"]|"")+"|\[[^\]]+\]|`[^`]+`|[\w$]+'
+# Keywords that can follow a table name in place of an alias
+_clause_keywords = (
+    "as|cross|except|from|full|group|having|indexed|inner|intersect|join|left"
+    "|limit|natural|not|on|order|outer|right|select|union|using|where|window"
+)
+# A table named after FROM, JOIN or a comma, with an optional alias
+_table_ref_re = re.compile(
+    rf"(?:\bfrom|\bjoin|,)\s+(?:(?:{_identifier})\s*\.\s*)?(?P<table>{_identifier})"
+    rf"(?:\s+(?:as\s+)?(?!(?:{_clause_keywords})\b)(?P<alias>{_identifier}))?",
+    re.IGNORECASE,
+)
+_virtual_index_re = re.compile(r"VIRTUAL TABLE INDEX (?P<num>\d+):(?P<idx>\S*)")
+_named_parameter_re = re.compile(r"(?<!:):(\w+)")
+# LIMIT n [OFFSET m] or LIMIT m, n closing the statement
+_outer_limit_re = re.compile(
+    r"\blimit\s+(\d+)\s*(?:(?:offset|,)\s*(\d+)\s*)?;?$", re.IGNORECASE
+)
+# Anything that makes SQLite read past the first rows before returning them
+_reads_all_rows_re = re.compile(
+    r"\b(?:where|on|using|join|group\s+by|having|count|sum|total|avg|min|max|group_concat)\b",
+    re.IGNORECASE,
+)
+
+
+class QueryAssessment(NamedTuple):
+    kind: str
+    scan_rows: int
+    scanned_tables: tuple
+
+    @property
+    def expensive(self) -> bool:
+        return self.scan_rows > QUERY_COST_MAX_SCAN_ROWS
+
+
+def get_sql_query(query_string: bytes) -> Optional[str]:
+    """The ?sql= parameter of a query string, if any."""
+    if not query_string:
+        return None
+    values = parse_qs(query_string.decode("utf-8", errors="ignore")).get("sql")
+    return values[0] if values else None
+
+
+def _estimate_rows(conn: sqlite3.Connection, table: str, virtual: bool) -> int:
+    """
+    Cheaply estimate a table's row count.
+
+    max(rowid) is a single b-tree descent. FTS tables are estimated from
+    their %_docsize shadow table, which has one row per document.
+    """
+    target = f"{table}_docsize" if virtual else table
+    escaped = target.replace('"', '""')
+    try:
+        row = conn.execute(f'select max(rowid) from "{escaped}"').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def limit_rows(sql: str, plan: list[str]) -> Optional[int]:
+    """
+    The most rows a scan can read, from the query's outermost LIMIT.
+
+    Only applies when every row scanned is returned: a WHERE clause, a
+    join condition, grouping, an aggregate or a sort means reading rows the
+    LIMIT never sees, so those queries return None and are priced as full scans.
+    """
+    match = _outer_limit_re.search(sql)
+    if (
+        match is None
+        or _reads_all_rows_re.search(sql)
+        or any("TEMP B-TREE" in detail for detail in plan)
+    ):
+        return None
+    return int(match.group(1)) + int(match.group(2) or 0)
+
+
+def _unquote(identifier: str) -> str:
+    if identifier[0] in '"`[':
+        identifier = identifier[1:-1]
+    return identifier.replace('""', '"').lower()
+
+
+def table_aliases(sql: str) -> dict[str, set[str]]:
+    """
+    Map the names a query's plan can print to the tables they may stand for.
+
+    EXPLAIN QUERY PLAN names a table by its alias when it has one, so
+    "select * from minutes m" plans as "SCAN m". Every table named after
+    FROM, JOIN or a comma maps to itself and its alias maps to it. This is
+    a lexical scan, not a parser: a name may map to more than one table,
+    and the caller should price it as all of them.
+
+    Returns:
+        Lowercased name -> set of lowercased table names
+    """
+    aliases: dict[str, set[str]] = {}
+    for match in _table_ref_re.finditer(sql):
+        table = _unquote(match.group("table"))
+        aliases.setdefault(table, set()).add(table)
+        if match.group("alias"):
+            aliases.setdefault(_unquote(match.group("alias")), set()).add(table)
+    return aliases
+
+
+def classify_plan(
+    plan: list[str],
+    tables: dict[str, bool],
+    aliases: Optional[dict[str, set[str]]] = None,
+    referenced: Optional[list[str]] = None,
+) -> tuple[str, list[str]]:
+    """
+    Classify EXPLAIN QUERY PLAN detail lines.
+
+    A SCAN whose target isn't a table, an alias of one, a subquery, a CTE
+    or a constant row is priced as a scan of every table the query reads.
+    Automatic indexes are built by scanning the whole table, so they count
+    as scans too.
+
+    Args:
+        plan: The detail column of each plan row
+        tables: Real table names in the database, mapped to whether they
+            are virtual tables
+        aliases: Output of table_aliases() for the query
+        referenced: Tables the query reads; defaults to every table
+
+    Returns:
+        (kind, scanned tables) tuple
+    """
+    aliases = aliases or {}
+    real = {name.lower(): name for name in tables}
+    derived = {
+        match.group("name").lower()
+        for match in map(_derived_re.match, plan)
+        if match is not None
+    }
+    scanned = []
+    unresolved = False
+    uses_fts = False
+    uses_index = False
+    for detail in plan:
+        match = _search_re.match(detail)
+        if match and "AUTOMATIC" not in match.group("rest"):
+            uses_index = True
+            continue
+        match = match or _scan_re.match(detail)
+        if not match:
+            # Temp b-trees, subquery and compound query headers
+            continue
+        target = match.group("table").lower()
+        names = aliases.get(target, set()) | {target}
+        virtual_match = _virtual_index_re.search(match.group("rest") or "")
+        if virtual_match and (
+            virtual_match.group("num") != "0" or virtual_match.group("idx")
+        ):
+            uses_fts = True
+        elif names & real.keys():
+            scanned.extend(real[name] for name in sorted(names & real.keys()))
+        elif not names & derived and target != "constant row":
+            unresolved = True
+    if unresolved:
+        scanned.extend(
+            table
+            for table in (list(tables) if referenced is None else referenced)
+            if table not in scanned
+        )
+
+    if scanned:
+        kind = QUERY_KIND_FULL_SCAN
+    elif uses_fts:
+        kind = QUERY_KIND_FTS
+    elif uses_index:
+        kind = QUERY_KIND_INDEX
+    else:
+        kind = QUERY_KIND_CONSTANT
+    return kind, scanned
+
+
+@lru_cache(maxsize=4096)
+def _assess(db_path: str, mtime_ns: int, size: int, sql: str) -> QueryAssessment:
+    """Plan and price a query; cached until the database file changes."""
+    params = {name: None for name in _named_parameter_re.findall(sql)}
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        tables = {
+            name: rootpage == 0
+            for name, rootpage in conn.execute(
+                "select name, rootpage from sqlite_master where type = 'table'"
+            )
+        }
+        read = set()
+
+        def authorize(action: int, table: Optional[str], *_args) -> int:
+            if action == sqlite3.SQLITE_READ:
+                read.add(table)
+            return sqlite3.SQLITE_OK
+
+        conn.set_authorizer(authorize)
+        try:
+            plan = [row[3] for row in conn.execute(f"explain query plan {sql}", params)]
+        except (sqlite3.Error, sqlite3.Warning):
+            # Let Datasette report the error
+            return QueryAssessment(QUERY_KIND_INVALID, 0, ())
+        finally:
+            conn.set_authorizer(None)
+        referenced = [table for table in tables if table in read]
+        kind, scanned = classify_plan(plan, tables, table_aliases(sql), referenced)
+        scan_rows = sum(_estimate_rows(conn, table, tables[table]) for table in scanned)
+        limit = limit_rows(sql, plan)
+        if limit is not None:
+            scan_rows = min(scan_rows, limit)
+    finally:
+        conn.close()
+    return QueryAssessment(kind, scan_rows, tuple(scanned))
+
+
+def assess_query(db_path: str, sql: str) -> QueryAssessment:
+    """
+    Classify and price a ?sql= query against a database file.
+
+    Args:
+        db_path: Path to the SQLite database
+        sql: Raw SQL from the query string
+
+    Returns:
+        QueryAssessment; invalid queries and missing databases are never
+        expensive, so Datasette still produces their error pages
+    """
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return QueryAssessment(QUERY_KIND_INVALID, 0, ())
+    return _assess(db_path, stat.st_mtime_ns, stat.st_size, normalize_sql(sql))
+
+
+def tighten_time_limit(query_string: bytes) -> bytes:
+    """Lower the query's _timelimit to at most QUERY_COST_TIMELIMIT_MS."""
+    time_limit = QUERY_COST_TIMELIMIT_MS
+    params = []
+    for name, value in parse_qsl(query_string.decode("utf-8"), keep_blank_values=True):
+        if name != "_timelimit":
+            params.append((name, value))
+        elif value.isdigit() and 0 < int(value) < time_limit:
+            time_limit = int(value)
+    params.append(("_timelimit", str(time_limit)))
+    return urlencode(params).encode("utf-8")
@@ -0,0 +1,277 @@
+"""
+Replay captured requests against the in-process ASGI application.
+
+``replay()`` drives an ASGI app (config.asgi.application, serving the
+local ../sites tree) with the records of a request capture, keeping
+``concurrency`` requests in flight, and ``summarize()`` reduces the
+results to:
+
+- throughput and status counts for the whole run
+- count, errors, rate limited (402) requests and p50/p95/p99 latency
+  per route class, the latencies leaving out the 402s
+- mean and p95 per router stage, read from each response's
+  Server-Timing header
+
+Requests are replayed with headers standing in for their captured tier:
+a browser User-Agent and a first-party Referer for human, an automated
+User-Agent for low, and, when a service secret is given, X-Service-Secret
+for api_key (captures have no keys to replay). Captures keep no client
+address, so each record is sent from its own address in 10.0.0.0/8
+rather than all sharing one rate limit bucket. ``compare()`` lines a summary up against a baseline
+saved by an earlier run.
+"""
+
+import asyncio
+import contextlib
+import ipaddress
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Optional
+
+from django.conf import settings
+
+from django_plugins.request_capture import route_class
+
+BROWSER_USER_AGENT = (
+    b"Mozilla/5.0 (X11; Linux x86_64; rv:130.0) Gecko/20100101 Firefox/130.0"
+)
+AUTOMATED_USER_AGENT = b"python-requests/2.32.3"
+
+PERCENTILES = (50, 95, 99)
+
+
+def load_records(path: str, limit: Optional[int] = None) -> list[dict]:
+    """Read capture records, skipping blank and malformed lines."""
+    records = []
+    with open(path) as fp:
+        for line in fp:
+            if limit is not None and len(records) >= limit:
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("path"):
+                records.append(record)
+    return records
+
+
+def replay_headers(record: dict, host: str, service_secret: Optional[str]) -> list:
+    """Request headers standing in for the record's captured tier."""
+    tier = record.get("tier")
+    user_agent = AUTOMATED_USER_AGENT if tier == "low" else BROWSER_USER_AGENT
+    headers = [
+        (b"host", host.encode()),
+        (b"user-agent", user_agent),
+        (b"accept-encoding", b"gzip"),
+    ]
+    if tier == "human":
+        # Matches is_first_party_request(), which expects http:// in DEBUG
+        scheme = "http" if settings.DEBUG else "https"
+        headers.append((b"referer", f"{scheme}://{host}/".encode()))
+    if tier == "api_key" and service_secret:
+        headers.append((b"x-service-secret", service_secret.encode()))
+    return headers
+
+
+def synthetic_client(index: int) -> str:
+    """A distinct 10.0.0.0/8 client address for the index-th record."""
+    return str(ipaddress.IPv4Address(0x0A000000 + index % 0x1000000))
+
+
+def build_scope(
+    record: dict,
+    host: Optional[str] = None,
+    service_secret: Optional[str] = None,
+    client: str = "127.0.0.1",
+) -> dict:
+    """The ASGI HTTP scope replaying a record, optionally on another host."""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": record.get("method", "GET"),
+        "scheme": "http",
+        "path": record["path"],
+        "raw_path": record["path"].encode(),
+        "query_string": record.get("query", "").encode(),
+        "headers": replay_headers(record, host or record["host"], service_secret),
+        "client": (client, 0),
+        "server": ("127.0.0.1", 8000),
+    }
+
+
+def parse_server_timing(value: str) -> dict[str, float]:
+    """Stage durations in ms from a Server-Timing header value."""
+    timings = {}
+    for metric in value.split(","):
+        name, _, params = metric.strip().partition(";")
+        for param in params.split(";"):
+            key, _, duration = param.strip().partition("=")
+            if key == "dur":
+                with contextlib.suppress(ValueError):
+                    timings[name] = float(duration)
+    return timings
+
+
+async def replay_one(app, record: dict, scope: dict) -> dict:
+    """Send one request through the app; returns its result."""
+    status = None
+    size = 0
+    timings = {}
+    finished = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Streaming responses watch for a disconnect until they finish
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, size, timings
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for name, value in message.get("headers", []):
+                if name.lower() == b"server-timing":
+                    timings = parse_server_timing(value.decode("latin-1"))
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    started = time.perf_counter()
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        status = None
+    finally:
+        finished.set()
+    return {
+        "route": record.get("route")
+        or route_class(scope["path"], scope["query_string"]),
+        "status": status,
+        "ms": (time.perf_counter() - started) * 1000,
+        "bytes": size,
+        "timings": timings,
+    }
+
+
+async def replay(
+    app,
+    records: list[dict],
+    concurrency: int = 8,
+    host: Optional[str] = None,
+    service_secret: Optional[str] = None,
+) -> tuple[list[dict], float]:
+    """Replay records with up to concurrency in flight; returns results and seconds."""
+    pending = enumerate(records)
+    results = []
+
+    async def worker():
+        for index, record in pending:
+            scope = build_scope(record, host, service_secret, synthetic_client(index))
+            results.append(await replay_one(app, record, scope))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return results, time.perf_counter() - started
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of unsorted values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def _latency_stats(values: list[float]) -> dict:
+    stats = {f"p{p}": round(percentile(values, p), 3) for p in PERCENTILES}
+    stats["mean"] = round(sum(values) / len(values), 3) if values else 0.0
+    return stats
+
+
+def summarize(results: list[dict], seconds: float) -> dict:
+    """Throughput, per-route latency and per-stage timings of a run."""
+    by_route = defaultdict(list)
+    counts = Counter()
+    errors = Counter()
+    rate_limited = Counter()
+    stages = defaultdict(list)
+    for result in results:
+        counts[result["route"]] += 1
+        if result["status"] == 402:
+            # Rejected before any real work; timing them would hide the
+            # latency of the requests that were served
+            rate_limited[result["route"]] += 1
+            continue
+        by_route[result["route"]].append(result["ms"])
+        if result["status"] is None or result["status"] >= 500:
+            errors[result["route"]] += 1
+        for stage, ms in result["timings"].items():
+            stages[stage].append(ms)
+
+    return {
+        "requests": len(results),
+        "seconds": round(seconds, 3),
+        "throughput": round(len(results) / seconds, 2) if seconds else 0.0,
+        "rate_limited": sum(rate_limited.values()),
+        "statuses": dict(
+            Counter(str(result["status"] or "error") for result in results)
+        ),
+        "routes": {
+            route: {
+                "count": counts[route],
+                "errors": errors[route],
+                "rate_limited": rate_limited[route],
+            }
+            | _latency_stats(by_route[route])
+            for route in sorted(counts)
+        },
+        "stages": {
+            stage: {
+                "mean": round(sum(values) / len(values), 3),
+                "p95": round(percentile(values, 95), 3),
+            }
+            for stage, values in sorted(stages.items())
+        },
+    }
+
+
+def _change(before: float, after: float) -> Optional[float]:
+    return round((after - before) / before * 100, 1) if before else None
+
+
+def compare(baseline: dict, current: dict) -> dict:
+    """
+    Percentage changes from a baseline summary to the current one.
+
+    Positive numbers mean the current run is higher: slower for route
+    latencies and stages, faster for throughput. Routes missing from
+    either run compare as None.
+    """
+    routes = {}
+    for route in sorted(set(baseline["routes"]) | set(current["routes"])):
+        before = baseline["routes"].get(route)
+        after = current["routes"].get(route)
+        if before is None or after is None:
+            routes[route] = None
+            continue
+        routes[route] = {
+            f"p{p}": _change(before[f"p{p}"], after[f"p{p}"]) for p in PERCENTILES
+        }
+    return {
+        "throughput": _change(baseline["throughput"], current["throughput"]),
+        "routes": routes,
+        "stages": {
+            stage: _change(baseline["stages"][stage]["mean"], stats["mean"])
+            for stage, stats in current["stages"].items()
+            if stage in baseline["stages"]
+        },
+    }
@@ -0,0 +1,134 @@
+"""
+Anonymized capture of site requests for replay benchmarks.
+
+With REQUEST_CAPTURE_PATH set, the router appends one JSON line per
+finished site request:
+
+    {"ts": ..., "host": "alameda.ca.civic.band", "method": "GET",
+     "path": "/meetings/minutes", "query": "_search=budget",
+     "route": "search", "tier": "human", "status": 200,
+     "duration_ms": 41.2, "timings": {"site_lookup": 0.4, ...}}
+
+Records are anonymized: no client address, no headers, and API keys are
+stripped from the query string. ``tier`` is the admission class, which is
+all the replay needs to reproduce the traffic mix. REQUEST_CAPTURE_SAMPLE
+captures a fraction of requests. A ``{pid}`` in the path gives each worker
+its own file.
+
+The replay_requests management command drives the in-process application
+with a capture (see replay).
+"""
+
+import json
+import os
+import random
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from django_plugins.api_key_auth import is_json_endpoint
+from django_plugins.export import is_export_path
+from django_plugins.query_cache import query_database_name
+from django_plugins.query_cost import get_sql_query
+from django_plugins.snapshots import is_snapshot_path
+from django_plugins.static_assets import is_static_path
+
+REQUEST_CAPTURE_PATH = os.getenv("REQUEST_CAPTURE_PATH", "")
+REQUEST_CAPTURE_SAMPLE = float(os.getenv("REQUEST_CAPTURE_SAMPLE", "1.0"))
+
+# Query parameters that carry credentials
+SECRET_PARAMS = frozenset({"api_key"})
+
+
+def route_class(path: str, query_string: bytes) -> str:
+    """
+    Group a request with others that cost about the same to serve.
+
+    One of static, export, snapshot, sql, search, index, special (other
+    /-/ pages), database, table or row, with ``.json`` appended for JSON
+    requests.
+    """
+    for kind, matches in (
+        ("static", is_static_path),
+        ("export", is_export_path),
+        ("snapshot", is_snapshot_path),
+    ):
+        if matches(path):
+            return kind
+    suffix = ".json" if is_json_endpoint(path) else ""
+    if query_database_name(path) and get_sql_query(query_string):
+        return "sql" + suffix
+    if b"_search" in query_string:
+        return "search" + suffix
+    segments = [segment for segment in path.split("/") if segment]
+    if not segments:
+        return "index"
+    if segments[0] == "-":
+        return "special" + suffix
+    kind = {1: "database", 2: "table"}.get(len(segments), "row")
+    return kind + suffix
+
+
+def anonymize_query(query_string: bytes) -> str:
+    """The query string without credentials."""
+    params = parse_qsl(query_string.decode("utf-8", "replace"), keep_blank_values=True)
+    return urlencode(
+        [(key, value) for key, value in params if key not in SECRET_PARAMS]
+    )
+
+
+def make_record(scope: dict, timer) -> dict:
+    """The capture record for a finished request."""
+    timings = timer.as_dict()
+    host = ""
+    for name, value in scope.get("headers", []):
+        if name == b"host":
+            host = value.decode("latin-1")
+            break
+    path = scope.get("path", "")
+    query_string = scope.get("query_string", b"")
+    return {
+        "ts": round(time.time(), 3),
+        "host": host,
+        "method": scope.get("method", "GET"),
+        "path": path,
+        "query": anonymize_query(query_string),
+        "route": route_class(path, query_string),
+        "tier": timer.tier,
+        "status": timer.status,
+        "duration_ms": timings.pop("total"),
+        "timings": timings,
+    }
+
+
+class RequestCapture:
+    """Appends request records to a JSONL file, opened on first use."""
+
+    def __init__(self, path: str = REQUEST_CAPTURE_PATH, sample: float = 1.0):
+        self.path = path
+        self.sample = sample
+        self._file = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and self.sample > 0
+
+    def record(self, scope: dict, timer) -> None:
+        if not self.enabled or (self.sample < 1 and random.random() >= self.sample):
+            return
+        if self._file is None:
+            path = self.path.replace("{pid}", str(os.getpid()))
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Line buffered: each record is one append, whole or not at all
+            self._file = open(path, "a", buffering=1)  # noqa: SIM115
+        self._file.write(json.dumps(make_record(scope, timer)) + "\n")
+
+    def _reset(self) -> None:
+        # A forked worker opens its own file handle (and {pid} path)
+        self._file = None
+
+
+# Per worker process; written from the event loop as requests finish
+request_capture = RequestCapture(REQUEST_CAPTURE_PATH, REQUEST_CAPTURE_SAMPLE)
+os.register_at_fork(after_in_child=request_capture._reset)
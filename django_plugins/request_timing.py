@@ -0,0 +1,134 @@
+"""
+Per-stage request timing for the subdomain router.
+
+The router creates a StageTimer per site request and makes it current
+through a ContextVar, so helpers it calls (the API key and rate limit
+checks, the SQL executor's threads) can record into it without extra
+arguments. Stages are timed with time.perf_counter:
+
+| Stage          | Where                                             |
+|----------------|---------------------------------------------------|
+| admission      | Bot policy and admission control                  |
+| site_lookup    | sites.db lookup                                   |
+| rate_limit     | Redis rate limit check                            |
+| api_key        | API key validation (Redis cache / civic.observer) |
+| query_cost     | EXPLAIN QUERY PLAN cost guard                     |
+| cache          | Query result cache lookup                         |
+| metadata       | metadata.json render and inspect data             |
+| datasette_init | Datasette construction                            |
+| datasette      | Datasette handling the request                    |
+| sql_wait       | Queries waiting for an executor thread            |
+| sql            | Query execution on executor threads               |
+| compress       | Response body compression                         |
+| export         | Streaming a table export                          |
+
+The timings are attached to the "Request completed" log record, sent as
+a Server-Timing header (internal callers only by default; see
+SERVER_TIMING), and recorded in the router_stage_duration_seconds metric
+(see metrics.record_request).
+"""
+
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# "internal" (X-Service-Secret callers), "all" or "off"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "internal")
+
+
+class StageTimer:
+    """Accumulated durations of a request's stages."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations: dict[str, float] = {}
+        self._open: dict[str, float] = {}
+        # Labels for metrics, filled in by the router as it learns them
+        self.subdomain: Optional[str] = None
+        self.tier: Optional[str] = None
+        self.status: Optional[int] = None
+        # Executor threads add to the same timer concurrently
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        self._open[name] = start
+        try:
+            yield
+        finally:
+            del self._open[name]
+            self.add(name, time.perf_counter() - start)
+
+    def as_dict(self) -> dict[str, float]:
+        """Stage durations in milliseconds, including stages still running."""
+        now = time.perf_counter()
+        with self._lock:
+            durations = dict(self.durations)
+        for name, start in list(self._open.items()):
+            durations[name] = durations.get(name, 0.0) + now - start
+        durations["total"] = now - self.started
+        return {name: round(seconds * 1000, 3) for name, seconds in durations.items()}
+
+    def header_value(self) -> bytes:
+        """The Server-Timing header value, e.g. b"site_lookup;dur=0.412"."""
+        return ", ".join(
+            f"{name};dur={ms}" for name, ms in self.as_dict().items()
+        ).encode()
+
+
+current_timer: ContextVar[Optional[StageTimer]] = ContextVar(
+    "current_timer", default=None
+)
+
+
+@contextmanager
+def timed_stage(name: str):
+    """Time a block as a stage of the current request, if there is one."""
+    timer = current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def timed(name: str):
+    """Decorator timing an async function as a stage of the current request."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with timed_stage(name):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_send(send, timer: StageTimer, server_timing: bool = False):
+    """Wrap an ASGI send to record the status and add a Server-Timing header."""
+
+    async def wrapped(message):
+        if message["type"] == "http.response.start":
+            timer.status = message["status"]
+        if message["type"] == "http.response.start" and server_timing:
+            message = {
+                **message,
+                "headers": [
+                    *message.get("headers", []),
+                    (b"server-timing", timer.header_value()),
+                ],
+            }
+        await send(message)
+
+    return wrapped
@@ -0,0 +1,169 @@
+"""
+Deploy-time inspect data for site databases.
+
+Deployed databases are read-only until the next deploy, so their table
+counts, hashes and FTS tables can be computed once (by the inspect_sites
+management command) and written next to the databases as
+inspect-data.json, in the same shape `datasette inspect` produces.
+
+The subdomain router loads that file and opens every database it covers in
+immutable mode, so Datasette uses the cached counts instead of running
+count(*) over the OCR tables. Each entry also records the file's size and
+mtime: an entry that no longer matches the file on disk (a redeploy that
+hasn't been re-inspected yet) is ignored and that database stays mutable.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+from functools import lru_cache
+
+INSPECT_FILENAME = "inspect-data.json"
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def inspect_data_path(subdomain: str) -> str:
+    """Path of the inspect data file for a site."""
+    return f"../sites/{subdomain}/{INSPECT_FILENAME}"
+
+
+def discover_sites() -> list[str]:
+    """List subdomains that have a deployed meetings.db in ../sites."""
+    return sorted(
+        os.path.basename(os.path.dirname(path))
+        for path in glob.glob("../sites/*/meetings.db")
+    )
+
+
+def database_name(path: str) -> str:
+    """Datasette database name for a database file (its stem)."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while block := fp.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _detect_fts(conn: sqlite3.Connection, table: str) -> str | None:
+    """Find the FTS virtual table indexing a table, like Datasette's detect_fts."""
+    row = conn.execute(
+        """
+        select name from sqlite_master
+        where rootpage = 0
+        and (
+            sql like '%VIRTUAL TABLE%USING FTS%content="' || :table || '"%'
+            or sql like '%VIRTUAL TABLE%USING FTS%content=[' || :table || ']%'
+            or (tbl_name = :table and sql like '%VIRTUAL TABLE%USING FTS%')
+        )
+        """,
+        {"table": table},
+    ).fetchone()
+    return row[0] if row else None
+
+
+def inspect_database(path: str) -> dict:
+    """
+    Compute inspect data for a single database file.
+
+    Args:
+        path: Path to the SQLite database
+
+    Returns:
+        Dict with hash, size, file, mtime_ns and per-table count/fts_table
+    """
+    stat = os.stat(path)
+    conn = sqlite3.connect(f"file:{path}?immutable=1", uri=True)
+    try:
+        table_names = [
+            row[0]
+            for row in conn.execute(
+                "select name from sqlite_master where type = 'table' order by name"
+            )
+        ]
+        tables = {}
+        for table in table_names:
+            escaped = table.replace('"', '""')
+            try:
+                count = conn.execute(f'select count(*) from "{escaped}"').fetchone()[0]
+            except sqlite3.OperationalError:
+                # Some virtual tables can't be counted
+                count = 0
+            tables[table] = {"count": count, "fts_table": _detect_fts(conn, table)}
+    finally:
+        conn.close()
+
+    return {
+        "hash": hash_file(path),
+        "size": stat.st_size,
+        "file": path,
+        "mtime_ns": stat.st_mtime_ns,
+        "tables": tables,
+    }
+
+
+def inspect_site(db_list: list[str]) -> dict:
+    """Compute inspect data for every existing database of a site."""
+    return {
+        database_name(path): inspect_database(path)
+        for path in db_list
+        if os.path.exists(path)
+    }
+
+
+def write_inspect_data(subdomain: str, data: dict) -> str:
+    """Atomically write a site's inspect data file and return its path."""
+    path = inspect_data_path(subdomain)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(data, fp, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+@lru_cache(maxsize=1024)
+def _read_inspect_file(path: str, mtime_ns: int) -> dict:
+    """Parse an inspect data file; cached until the file changes."""
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def load_inspect_data(subdomain: str, db_list: list[str]) -> dict:
+    """
+    Load the fresh inspect data entries for a site's databases.
+
+    Args:
+        subdomain: Site subdomain (e.g., "alameda.ca")
+        db_list: Database file paths being served
+
+    Returns:
+        Inspect data keyed by database name, containing only databases whose
+        recorded size and mtime still match the file on disk
+    """
+    path = inspect_data_path(subdomain)
+    try:
+        data = _read_inspect_file(path, os.stat(path).st_mtime_ns)
+    except (OSError, ValueError):
+        return {}
+
+    fresh = {}
+    for db_path in db_list:
+        name = database_name(db_path)
+        entry = data.get(name)
+        if not entry:
+            continue
+        try:
+            stat = os.stat(db_path)
+        except OSError:
+            continue
+        if entry.get("size") == stat.st_size and entry.get("mtime_ns") == (
+            stat.st_mtime_ns
+        ):
+            fresh[name] = entry
+    return fresh
@@ -0,0 +1,86 @@
+"""
+Per-site Datasette instances kept between requests.
+
+Building a site's serving state (metadata render, inspect data, Datasette
+construction, plugin setup, fresh SQLite connections) used to happen on
+every request. The router now keeps the most recently used
+SITE_INSTANCE_CACHE_SIZE instances per worker, keyed by subdomain and
+rebuilt whenever the site's version changes (its sites.db row, database
+files or inspect data).
+
+Cached instances are retained on the SQL executor, so executor threads
+keep their connections, and SQLite's page cache, warm between requests.
+An instance that is evicted or replaced is closed, with its databases
+and its internal database, once requests still using it have finished.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Callable, NamedTuple
+
+from django_plugins.sql_executor import sql_executor
+
+SITE_INSTANCE_CACHE_SIZE = int(os.getenv("SITE_INSTANCE_CACHE_SIZE", "32"))
+
+
+class SiteInstance(NamedTuple):
+    datasette: object
+    app: object
+    version: str
+
+
+class SiteInstanceCache:
+    """LRU of site Datasette instances, invalidated by version."""
+
+    def __init__(self, max_size: int = SITE_INSTANCE_CACHE_SIZE):
+        self.max_size = max_size
+        self._instances: OrderedDict[str, SiteInstance] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(
+        self, subdomain: str, version: str, build: Callable[[], SiteInstance]
+    ) -> SiteInstance:
+        """Return the cached instance for this version, or build a new one."""
+        instance = self._instances.get(subdomain)
+        if instance is not None and instance.version == version:
+            self._instances.move_to_end(subdomain)
+            self.hits += 1
+            return instance
+
+        self.misses += 1
+        instance = build()
+        if self.max_size <= 0:
+            return instance
+        self._discard(subdomain)
+        sql_executor.retain(instance.datasette)
+        self._instances[subdomain] = instance
+        while len(self._instances) > self.max_size:
+            self._discard(next(iter(self._instances)))
+        return instance
+
+    def _discard(self, subdomain: str) -> None:
+        instance = self._instances.pop(subdomain, None)
+        if instance is not None:
+            sql_executor.release(instance.datasette)
+            sql_executor.close_when_released(instance.datasette)
+
+    def clear(self) -> None:
+        for subdomain in list(self._instances):
+            self._discard(subdomain)
+
+    def __contains__(self, subdomain: str) -> bool:
+        return subdomain in self._instances
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._instances),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "sites": list(self._instances),
+        }
+
+
+# Per worker process; the router runs every request on one event loop
+site_instances = SiteInstanceCache()
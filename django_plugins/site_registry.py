@@ -0,0 +1,87 @@
+"""
+In-memory registry of sites.db rows for the subdomain router.
+
+The router used to open sites.db and look the site up on every request.
+Rows are now kept in memory and dropped whenever sites.db (or its WAL)
+changes on disk, so a deploy that updates the file is picked up on the
+next request.
+
+``load_all()`` reads every row at once. The preload step calls it in the
+gunicorn master so workers share the rows copy-on-write; otherwise rows
+are looked up and remembered one site at a time. No connection is kept
+open, so nothing fork-unsafe survives into workers.
+"""
+
+import os
+from typing import Optional
+
+import sqlite_utils
+from sqlite_utils.db import NotFoundError
+
+SITES_DB_PATH = "sites.db"
+
+
+def _file_version(path: str) -> tuple:
+    version = []
+    for file_path in (path, f"{path}-wal"):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            version.append(None)
+            continue
+        version.append((stat.st_size, stat.st_mtime_ns))
+    return tuple(version)
+
+
+class SiteRegistry:
+    """sites.db rows by subdomain, invalidated when the file changes."""
+
+    def __init__(self, path: str = SITES_DB_PATH):
+        self.path = path
+        self.clear()
+
+    def clear(self) -> None:
+        self._sites: dict[str, dict] = {}
+        self._complete = False
+        self._version: Optional[tuple] = None
+
+    def _check_version(self) -> None:
+        version = _file_version(self.path)
+        if version != self._version:
+            self._sites = {}
+            self._complete = False
+            self._version = version
+
+    def load_all(self) -> int:
+        """Read every site row; returns how many were loaded."""
+        self._check_version()
+        db = sqlite_utils.Database(self.path)
+        try:
+            self._sites = {row["subdomain"]: row for row in db["sites"].rows}
+        finally:
+            db.close()
+        self._complete = True
+        return len(self._sites)
+
+    def get(self, subdomain: str) -> Optional[dict]:
+        """The site's row, or None if there is no such site."""
+        self._check_version()
+        if subdomain in self._sites:
+            return self._sites[subdomain]
+        if self._complete:
+            return None
+
+        db = sqlite_utils.Database(self.path)
+        try:
+            site = db["sites"].get(subdomain)
+        except NotFoundError:
+            return None
+        finally:
+            db.close()
+        # Only found sites are remembered, so unknown hosts can't grow this
+        self._sites[subdomain] = site
+        return site
+
+
+# Per process; shared copy-on-write with workers when preloaded
+site_registry = SiteRegistry()
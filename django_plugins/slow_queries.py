@@ -0,0 +1,267 @@
+"""
+Slow query log for site databases.
+
+Datasette's sql_time_limit_ms interrupts slow queries without recording
+them, so nothing showed which sites needed which indexes. The router
+instruments each site's databases with ``slow_query_log.instrument()``.
+Every query that runs for at least SLOW_QUERY_MS, or is interrupted by the
+time limit, is recorded with:
+
+- the SQL text and a fingerprint with literals and parameters normalized
+  to ``?``, so the same query shape groups together
+- its execution time on the SQL executor thread (queue wait excluded)
+- rows returned, database, and the subdomain and access tier of the
+  request being served (see ``sql_executor.serve()``)
+
+Records wait in a bounded ring buffer per site (SLOW_QUERY_BUFFER_SIZE,
+oldest dropped first) and are written to the SQLite file at
+SLOW_QUERY_LOG_PATH every SLOW_QUERY_FLUSH_SECONDS by a background thread,
+and once more at exit, so a recycled worker doesn't lose its records.
+Every gunicorn worker appends to the same file; writes wait on each
+other's locks in that thread, never on the event loop. The admin page
+ranks fingerprints by total time across all of them.
+"""
+
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import UTC, datetime, timedelta
+from typing import NamedTuple, Optional
+
+import sqlite_utils
+
+from django_plugins.sql_executor import (
+    QueryClock,
+    SQLRequest,
+    current_query_clock,
+    current_sql_request,
+)
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv("SLOW_QUERY_BUFFER_SIZE", "200"))
+SLOW_QUERY_LOG_PATH = os.getenv("SLOW_QUERY_LOG_PATH", "slow_queries.db")
+SLOW_QUERY_FLUSH_SECONDS = int(os.getenv("SLOW_QUERY_FLUSH_SECONDS", "30"))
+SLOW_QUERY_RETENTION_DAYS = int(os.getenv("SLOW_QUERY_RETENTION_DAYS", "14"))
+
+_comment_re = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_string_re = re.compile(r"'(?:[^']|'')*'")
+_number_re = re.compile(r"\b\d+(?:\.\d+)?\b")
+_param_re = re.compile(r"[:@$]\w+|\?\d*")
+_value_list_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_whitespace_re = re.compile(r"\s+")
+
+
+def fingerprint(sql: str) -> str:
+    """Normalize SQL so queries differing only in values group together."""
+    sql = _comment_re.sub(" ", sql)
+    sql = _string_re.sub("?", sql)
+    sql = _number_re.sub("?", sql)
+    sql = _param_re.sub("?", sql)
+    sql = _value_list_re.sub("(?)", sql)
+    return _whitespace_re.sub(" ", sql).strip().lower()
+
+
+class SlowQuery(NamedTuple):
+    recorded_at: str
+    subdomain: str
+    database: str
+    access_tier: Optional[str]
+    fingerprint: str
+    sql: str
+    duration_ms: float
+    rows: Optional[int]
+    interrupted: bool
+
+
+class SlowQueryLog:
+    """Per-site ring buffers of slow queries, flushed to a SQLite file."""
+
+    def __init__(
+        self,
+        threshold_ms: int = SLOW_QUERY_MS,
+        buffer_size: int = SLOW_QUERY_BUFFER_SIZE,
+        path: str = SLOW_QUERY_LOG_PATH,
+        flush_seconds: float = SLOW_QUERY_FLUSH_SECONDS,
+    ):
+        self.threshold_ms = threshold_ms
+        self.buffer_size = buffer_size
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._reset()
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffers: dict[str, deque] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self.recorded = 0
+        self.dropped = Counter()
+
+    def _start_flusher(self) -> None:
+        # Called with self._lock held; threads don't survive a fork, so a
+        # forked worker starts its own on its first record
+        if self._flusher is None:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name="slow-query-log", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_periodically(self) -> None:
+        while not self._stopped.wait(self.flush_seconds):
+            self.safe_flush()
+
+    def record(self, query: SlowQuery) -> None:
+        with self._lock:
+            self._start_flusher()
+            buffer = self._buffers.setdefault(
+                query.subdomain, deque(maxlen=self.buffer_size)
+            )
+            if len(buffer) == self.buffer_size:
+                self.dropped[query.subdomain] += 1
+            buffer.append(query)
+            self.recorded += 1
+
+    def instrument(self, database) -> None:
+        """Record this Database instance's slow queries."""
+        from datasette.database import QueryInterrupted  # noqa: PLC0415
+
+        execute = database.execute
+
+        async def timed_execute(sql, *args, **kwargs):
+            clock = QueryClock()
+            token = current_query_clock.set(clock)
+            start = time.perf_counter()
+            rows = None
+            interrupted = False
+            try:
+                results = await execute(sql, *args, **kwargs)
+                rows = len(results.rows)
+            except QueryInterrupted:
+                interrupted = True
+                raise
+            finally:
+                current_query_clock.reset(token)
+                # Without the shared executor, fall back to the wall time
+                seconds = clock.seconds
+                if seconds is None:
+                    seconds = time.perf_counter() - start
+                if interrupted or seconds * 1000 >= self.threshold_ms:
+                    request = current_sql_request.get() or SQLRequest("")
+                    self.record(
+                        SlowQuery(
+                            datetime.now(UTC).isoformat(timespec="seconds"),
+                            request.subdomain,
+                            database.name,
+                            request.access_tier,
+                            fingerprint(sql),
+                            sql,
+                            round(seconds * 1000, 3),
+                            rows,
+                            interrupted,
+                        )
+                    )
+            return results
+
+        database.execute = timed_execute
+
+    def drain(self) -> list[SlowQuery]:
+        with self._lock:
+            queries = [query for buffer in self._buffers.values() for query in buffer]
+            self._buffers.clear()
+        return queries
+
+    def flush(self) -> int:
+        """Append buffered queries to the log file; returns how many."""
+        with self._flush_lock:
+            queries = self.drain()
+            if not queries:
+                return 0
+            db = sqlite_utils.Database(self.path)
+            try:
+                db.enable_wal()
+                table = db["slow_queries"]
+                table.insert_all(query._asdict() for query in queries)
+                table.create_index(["fingerprint"], if_not_exists=True)
+                table.create_index(["recorded_at"], if_not_exists=True)
+                cutoff = datetime.now(UTC) - timedelta(days=SLOW_QUERY_RETENTION_DAYS)
+                table.delete_where("recorded_at < ?", [cutoff.isoformat()])
+            finally:
+                db.close()
+            return len(queries)
+
+    def safe_flush(self) -> None:
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to write slow query log")
+
+    def close(self) -> None:
+        """Stop the background flushes and write what's left."""
+        self._stopped.set()
+        self.safe_flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            buffered = {sub: len(buffer) for sub, buffer in self._buffers.items()}
+        return {
+            "threshold_ms": self.threshold_ms,
+            "recorded": self.recorded,
+            "buffered": sum(buffered.values()),
+            "dropped": sum(self.dropped.values()),
+        }
+
+
+def top_fingerprints(
+    path: str = SLOW_QUERY_LOG_PATH,
+    days: int = 7,
+    subdomain: Optional[str] = None,
+    limit: int = 100,
+) -> list[dict]:
+    """Slow query fingerprints per site, ranked by total execution time."""
+    if not os.path.exists(path):
+        return []
+    since = (datetime.now(UTC) - timedelta(days=days)).isoformat()
+    where = "recorded_at >= :since"
+    if subdomain:
+        where += " and subdomain = :subdomain"
+    db = sqlite_utils.Database(path)
+    try:
+        if not db["slow_queries"].exists():
+            return []
+        return list(
+            db.query(
+                f"""
+                select
+                    fingerprint,
+                    subdomain,
+                    count(*) as calls,
+                    round(sum(duration_ms), 1) as total_ms,
+                    round(avg(duration_ms), 1) as avg_ms,
+                    round(max(duration_ms), 1) as max_ms,
+                    sum(interrupted) as interrupted,
+                    max(rows) as max_rows,
+                    max(sql) as example_sql
+                from slow_queries
+                where {where}
+                group by fingerprint, subdomain
+                order by total_ms desc
+                limit :limit
+                """,
+                {"since": since, "subdomain": subdomain, "limit": limit},
+            )
+        )
+    finally:
+        db.close()
+
+
+# Per worker process; every worker appends to the same log file
+slow_query_log = SlowQueryLog()
+os.register_at_fork(after_in_child=slow_query_log._reset)
+atexit.register(slow_query_log.close)
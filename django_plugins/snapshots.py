@@ -0,0 +1,403 @@
+"""
+Deploy-time Parquet snapshots of site tables for bulk downloads.
+
+Site databases only change on deploy, so researchers who want whole
+tables shouldn't need SQLite to produce them on every request. The
+snapshot_sites management command writes one Parquet file per table
+after a deploy:
+
+- ``agendas`` and ``minutes`` from meetings.db, and every table of the
+  finance databases (FTS and SQLite internal tables excepted)
+- rows are streamed from SQLite into SNAPSHOT_ROW_GROUP_SIZE row groups,
+  so memory stays bounded at one row group per table
+- column types come from the values SQLite actually holds, not the
+  declared types: integer, float, binary or string
+- files and a manifest.json with each file's rows, size and sha256 go in
+  ``../sites/<subdomain>/snapshots/``; like inspect data, each entry
+  records its source database's size and mtime, and is only served while
+  they still match
+
+The router serves the files at ``/-/snapshots/<database>/<table>.parquet``
+to API key holders and internal services, with ETag and single Range
+support, so bulk research access is static file serving. ``/-/snapshots/``
+lists the current snapshots.
+
+Writing snapshots needs the optional pyarrow package; serving them
+doesn't.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+from functools import lru_cache
+from typing import Optional
+
+from django_plugins.site_inspect import database_name, hash_file
+from django_plugins.static_assets import parse_range
+
+SNAPSHOT_PREFIX = "/-/snapshots/"
+SNAPSHOT_DIRNAME = "snapshots"
+MANIFEST_FILENAME = "manifest.json"
+CONTENT_TYPE = b"application/vnd.apache.parquet"
+
+SNAPSHOT_ROW_GROUP_SIZE = int(os.getenv("SNAPSHOT_ROW_GROUP_SIZE", "50000"))
+SNAPSHOT_COMPRESSION = os.getenv("SNAPSHOT_COMPRESSION", "zstd")
+
+# Tables snapshotted per database; databases not listed get every table
+SNAPSHOT_TABLES = {"meetings": ("agendas", "minutes")}
+
+# Bytes read from disk per body message when serving a snapshot
+SEND_CHUNK_SIZE = 256 * 1024
+
+
+def snapshot_dir(subdomain: str) -> str:
+    """Directory holding a site's snapshots and manifest."""
+    return f"../sites/{subdomain}/{SNAPSHOT_DIRNAME}"
+
+
+def snapshot_filename(database: str, table: str) -> str:
+    return f"{database}-{table}.parquet"
+
+
+def snapshot_tables(conn: sqlite3.Connection, database: str) -> list[str]:
+    """The tables of a database that get snapshots."""
+    names = [
+        row[0]
+        for row in conn.execute(
+            "select name from sqlite_master where type = 'table' "
+            "and sql not like 'CREATE VIRTUAL TABLE%' order by name"
+        )
+    ]
+    wanted = SNAPSHOT_TABLES.get(database)
+    if wanted is not None:
+        return [name for name in names if name in wanted]
+    # FTS shadow tables (<table>_fts_data, ...) belong to a virtual table
+    virtual = [
+        row[0]
+        for row in conn.execute(
+            "select name from sqlite_master where sql like 'CREATE VIRTUAL TABLE%'"
+        )
+    ]
+    return [
+        name
+        for name in names
+        if not name.startswith("sqlite_")
+        and not any(name.startswith(f"{fts}_") for fts in virtual)
+    ]
+
+
+def _quote(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def column_types(conn: sqlite3.Connection, table: str) -> dict[str, str]:
+    """
+    The Arrow type for each column, from the storage classes it holds.
+
+    One scan of the table collects the distinct typeof() of every column:
+    integers stay int64, integers mixed with reals become float64, blobs
+    stay binary and anything else (text, mixed, all null) is a string.
+    """
+    columns = [row[1] for row in conn.execute(f"pragma table_info({_quote(table)})")]
+    if not columns:
+        return {}
+    selects = ", ".join(
+        f"group_concat(distinct typeof({_quote(column)}))" for column in columns
+    )
+    row = conn.execute(f"select {selects} from {_quote(table)}").fetchone()
+    types = {}
+    for column, found in zip(columns, row, strict=True):
+        storage = set((found or "").split(",")) - {"", "null"}
+        if storage and storage <= {"integer"}:
+            types[column] = "int64"
+        elif storage and storage <= {"integer", "real"}:
+            types[column] = "float64"
+        elif storage == {"blob"}:
+            types[column] = "binary"
+        else:
+            types[column] = "string"
+    return types
+
+
+def _as_string(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value)
+
+
+def write_table_snapshot(
+    db_path: str, table: str, out_path: str, row_group_size: int
+) -> int:
+    """
+    Stream one table into a Parquet file; returns the number of rows.
+
+    The file is written next to out_path and moved into place once
+    complete, so readers never see a partial snapshot.
+    """
+    import pyarrow as pa  # noqa: PLC0415
+    import pyarrow.parquet as pq  # noqa: PLC0415
+
+    conn = sqlite3.connect(f"file:{db_path}?immutable=1", uri=True)
+    tmp_path = f"{out_path}.tmp"
+    rows_written = 0
+    try:
+        types = column_types(conn, table)
+        schema = pa.schema(
+            [(column, getattr(pa, type_name)()) for column, type_name in types.items()]
+        )
+        pks = [
+            row[1]
+            for row in sorted(
+                conn.execute(f"pragma table_info({_quote(table)})"),
+                key=lambda row: row[5],
+            )
+            if row[5]
+        ]
+        # Ordered, so an unchanged table produces an identical file
+        order = ", ".join(_quote(pk) for pk in pks) or "rowid"
+        cursor = conn.execute(f"select * from {_quote(table)} order by {order}")
+        with pq.ParquetWriter(
+            tmp_path, schema, compression=SNAPSHOT_COMPRESSION
+        ) as writer:
+            while rows := cursor.fetchmany(row_group_size):
+                arrays = []
+                for index, (column, type_name) in enumerate(types.items()):
+                    values = [row[index] for row in rows]
+                    if type_name == "string":
+                        values = [_as_string(value) for value in values]
+                    arrays.append(pa.array(values, type=schema.field(column).type))
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                rows_written += len(rows)
+        os.replace(tmp_path, out_path)
+    finally:
+        conn.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return rows_written
+
+
+def snapshot_site(
+    subdomain: str,
+    db_list: list[str],
+    row_group_size: int = SNAPSHOT_ROW_GROUP_SIZE,
+    force: bool = False,
+) -> dict:
+    """
+    Write a site's snapshots and manifest; returns the manifest.
+
+    Tables whose source database hasn't changed since the last manifest
+    are kept as they are, unless force is set. Snapshot files no longer
+    in the manifest are removed.
+    """
+    directory = snapshot_dir(subdomain)
+    os.makedirs(directory, exist_ok=True)
+    previous = {} if force else _read_manifest_dir(directory)
+    manifest = {}
+    for db_path in db_list:
+        if not os.path.exists(db_path):
+            continue
+        database = database_name(db_path)
+        stat = os.stat(db_path)
+        conn = sqlite3.connect(f"file:{db_path}?immutable=1", uri=True)
+        try:
+            tables = snapshot_tables(conn, database)
+        finally:
+            conn.close()
+        for table in tables:
+            filename = snapshot_filename(database, table)
+            out_path = os.path.join(directory, filename)
+            entry = previous.get(filename)
+            if (
+                entry is not None
+                and entry["source_size"] == stat.st_size
+                and entry["source_mtime_ns"] == stat.st_mtime_ns
+                and os.path.exists(out_path)
+            ):
+                manifest[filename] = entry
+                continue
+            rows = write_table_snapshot(db_path, table, out_path, row_group_size)
+            manifest[filename] = {
+                "database": database,
+                "table": table,
+                "rows": rows,
+                "size": os.path.getsize(out_path),
+                "sha256": hash_file(out_path),
+                "source": db_path,
+                "source_size": stat.st_size,
+                "source_mtime_ns": stat.st_mtime_ns,
+            }
+
+    manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+    with open(f"{manifest_path}.tmp", "w") as fp:
+        json.dump(manifest, fp, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+    for filename in os.listdir(directory):
+        if filename.endswith(".parquet") and filename not in manifest:
+            os.remove(os.path.join(directory, filename))
+    return manifest
+
+
+def _read_manifest_dir(directory: str) -> dict:
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    try:
+        return _read_manifest_file(path, os.stat(path).st_mtime_ns)
+    except (OSError, ValueError):
+        return {}
+
+
+@lru_cache(maxsize=1024)
+def _read_manifest_file(path: str, mtime_ns: int) -> dict:
+    """Parse a manifest; cached until the file changes."""
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def load_snapshots(subdomain: str) -> dict:
+    """
+    A site's current snapshots, keyed by filename.
+
+    Entries whose source database has changed since they were written (a
+    redeploy that hasn't been snapshotted yet) are left out.
+    """
+    current = {}
+    for filename, entry in _read_manifest_dir(snapshot_dir(subdomain)).items():
+        try:
+            stat = os.stat(entry["source"])
+        except OSError:
+            continue
+        if entry["source_size"] == stat.st_size and (
+            entry["source_mtime_ns"] == stat.st_mtime_ns
+        ):
+            current[filename] = entry
+    return current
+
+
+def is_snapshot_path(path: str) -> bool:
+    return path.startswith(SNAPSHOT_PREFIX)
+
+
+def parse_snapshot_path(path: str) -> Optional[str]:
+    """The snapshot filename for /-/snapshots/<database>/<table>.parquet."""
+    database, _, table_file = path[len(SNAPSHOT_PREFIX) :].partition("/")
+    table, _, extension = table_file.rpartition(".")
+    if not database or not table or "/" in table or extension != "parquet":
+        return None
+    return snapshot_filename(database, table)
+
+
+def snapshot_listing(entries: dict) -> bytes:
+    """The JSON body of /-/snapshots/."""
+    return json.dumps(
+        {
+            "snapshots": [
+                {
+                    "database": entry["database"],
+                    "table": entry["table"],
+                    "rows": entry["rows"],
+                    "size": entry["size"],
+                    "sha256": entry["sha256"],
+                    "url": f"{SNAPSHOT_PREFIX}{entry['database']}/"
+                    f"{entry['table']}.parquet",
+                }
+                for entry in entries.values()
+            ]
+        }
+    ).encode()
+
+
+def _get_header(headers: list, name: bytes) -> Optional[str]:
+    for header_name, header_value in headers:
+        if header_name.lower() == name:
+            return header_value.decode("latin-1")
+    return None
+
+
+def snapshot_response_headers(
+    entry: dict, subdomain: str, headers: list
+) -> tuple[int, list, Optional[tuple[int, int]]]:
+    """
+    Status, headers and byte range for a snapshot download.
+
+    Handles If-None-Match and a single Range (honoured only while If-Range,
+    if sent, matches the ETag).
+
+    Returns:
+        (status, headers, (start, end)) with an inclusive byte range, or
+        None for the range when no body is sent
+    """
+    size = entry["size"]
+    etag = f'"{entry["sha256"][:32]}"'
+    filename = f"{subdomain}-{snapshot_filename(entry['database'], entry['table'])}"
+    response_headers = [
+        (b"etag", etag.encode()),
+        (b"cache-control", b"private, no-cache"),
+        (b"accept-ranges", b"bytes"),
+    ]
+
+    if_none_match = _get_header(headers, b"if-none-match")
+    if if_none_match and etag in (
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    ):
+        return 304, response_headers, None
+
+    response_headers += [
+        (b"content-type", CONTENT_TYPE),
+        (b"content-disposition", f'attachment; filename="{filename}"'.encode()),
+    ]
+
+    range_header = _get_header(headers, b"range")
+    if_range = _get_header(headers, b"if-range")
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            pass  # Malformed or multi-range: serve the whole file instead
+        else:
+            if byte_range is None:
+                response_headers += [
+                    (b"content-range", f"bytes */{size}".encode()),
+                    (b"content-length", b"0"),
+                ]
+                return 416, response_headers, None
+            start, end = byte_range
+            response_headers += [
+                (b"content-range", f"bytes {start}-{end}/{size}".encode()),
+                (b"content-length", str(end - start + 1).encode()),
+            ]
+            return 206, response_headers, byte_range
+
+    response_headers.append((b"content-length", str(size).encode()))
+    return 200, response_headers, (0, size - 1)
+
+
+async def send_snapshot_file(path: str, byte_range: tuple[int, int], send) -> int:
+    """
+    Send an inclusive byte range of a file as body messages.
+
+    Reads happen off the event loop, one SEND_CHUNK_SIZE chunk at a time,
+    and the next chunk is only read once the previous send has completed.
+    Returns the number of bytes sent.
+    """
+    start, end = byte_range
+    remaining = end - start + 1
+    sent = 0
+    with open(path, "rb") as fp:
+        fp.seek(start)
+        while remaining > 0:
+            chunk = await asyncio.to_thread(fp.read, min(SEND_CHUNK_SIZE, remaining))
+            if not chunk:
+                break  # Truncated since the manifest was written
+            remaining -= len(chunk)
+            sent += len(chunk)
+            if remaining > 0:
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+            else:
+                await send({"type": "http.response.body", "body": chunk})
+                return sent
+    await send({"type": "http.response.body", "body": b""})
+    return sent
@@ -0,0 +1,352 @@
+"""
+Process-wide SQL executor shared by every site's Datasette instance.
+
+The subdomain router keeps a Datasette instance per site, and each one
+used to start its own pool of num_sql_threads threads. With many sites busy
+in one worker, SQLite concurrency was unbounded and a single popular city
+could take every CPU. Instead, every instance's ``executor`` is replaced by
+one FairSQLExecutor with a fixed thread budget (SQL_THREADS).
+
+Queued queries are scheduled by priority, then round-robin across
+subdomains, so one site's backlog cannot starve the others:
+
+| Priority    | Requests                                         |
+|-------------|--------------------------------------------------|
+| first_party | Page views, first-party AJAX, internal, research |
+| api_key     | Valid API key                                    |
+| anonymous   | Anonymous JSON and ?sql= queries                 |
+
+A site may also hold at most SQL_THREADS_PER_SITE threads at once.
+
+Datasette caches read connections in thread-locals keyed by Database
+instance. Since the threads outlive the instances, databases are
+registered while in use, by ``serve()`` for one request and by
+``retain()`` for as long as the router keeps the instance, and worker
+threads close connections for databases no longer registered. Instances
+the router drops are closed by ``close_when_released()`` once the last
+request serving them finishes.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple, Optional
+
+from django_plugins.api_key_auth import ACCESS_TIER_ANONYMOUS, ACCESS_TIER_API_KEY
+from django_plugins.request_timing import StageTimer, current_timer
+
+SQL_THREADS = int(os.getenv("SQL_THREADS", "16"))
+SQL_THREADS_PER_SITE = int(os.getenv("SQL_THREADS_PER_SITE", "5"))
+
+PRIORITY_NAMES = ("first_party", "api_key", "anonymous")
+_tier_priority = {ACCESS_TIER_API_KEY: 1, ACCESS_TIER_ANONYMOUS: 2}
+
+
+class SQLRequest(NamedTuple):
+    subdomain: str
+    access_tier: Optional[str] = None
+
+    @property
+    def priority(self) -> int:
+        # Trusted callers and untiered page views share the top priority
+        return _tier_priority.get(self.access_tier, 0)
+
+
+# Set by the router for the duration of a request; read when queries are
+# submitted, since asyncio's run_in_executor runs in the request's context
+current_sql_request: ContextVar[Optional[SQLRequest]] = ContextVar(
+    "current_sql_request", default=None
+)
+
+
+class QueryClock:
+    """Where one query's time went, filled in by the thread that ran it."""
+
+    __slots__ = ("seconds", "wait")
+
+    def __init__(self):
+        self.seconds: Optional[float] = None
+        self.wait: Optional[float] = None
+
+
+# Set around a single Database.execute call by callers that want its timing
+current_query_clock: ContextVar[Optional[QueryClock]] = ContextVar(
+    "current_query_clock", default=None
+)
+
+
+class _WorkItem(NamedTuple):
+    future: Future
+    fn: object
+    args: tuple
+    kwargs: dict
+    subdomain: str
+    priority: int
+    queued_at: float
+    timer: Optional[StageTimer]
+    clock: Optional[QueryClock]
+
+
+def _database_ids(datasette) -> list[str]:
+    return [
+        db._thread_local_id
+        for db in (*datasette.databases.values(), datasette.get_internal_database())
+    ]
+
+
+class FairSQLExecutor(Executor):
+    """Fixed-size thread pool with prioritized, per-subdomain fair queuing."""
+
+    def __init__(
+        self,
+        max_workers: int = SQL_THREADS,
+        max_per_site: int = SQL_THREADS_PER_SITE,
+    ):
+        self.max_workers = max_workers
+        self.max_per_site = max(1, min(max_per_site, max_workers))
+        self._reset()
+
+    def _reset(self) -> None:
+        # Threads don't survive a fork, so a forked child starts empty
+        self._condition = threading.Condition()
+        # One round-robin ring of subdomain -> queued items per priority
+        self._queues = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._running = Counter()
+        self._live_databases = Counter()
+        # Datasette instances to close once no request is serving them
+        self._closing = []
+        self._threads = []
+        self._idle = 0
+        self._shutdown = False
+        self.completed = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = 0.0
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        request = current_sql_request.get() or SQLRequest("")
+        future = Future()
+        item = _WorkItem(
+            future,
+            fn,
+            args,
+            kwargs,
+            request.subdomain,
+            request.priority,
+            time.monotonic(),
+            current_timer.get(),
+            current_query_clock.get(),
+        )
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new queries after shutdown")
+            ring = self._queues[item.priority]
+            ring.setdefault(item.subdomain, deque()).append(item)
+            self.max_queue_depth = max(self.max_queue_depth, self._queued())
+            if not self._idle and len(self._threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"sql-executor-{len(self._threads)}",
+                    daemon=True,
+                )
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                for ring in self._queues:
+                    for items in ring.values():
+                        for item in items:
+                            item.future.cancel()
+                    ring.clear()
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    @contextmanager
+    def serve(self, datasette, subdomain: str, access_tier: Optional[str] = None):
+        """
+        Run a Datasette instance's queries on this executor for one request.
+
+        Args:
+            datasette: The request's Datasette instance
+            subdomain: Site the queries are queued under
+            access_tier: The router's access tier, which sets the priority
+        """
+        self.retain(datasette)
+        token = current_sql_request.set(SQLRequest(subdomain, access_tier))
+        try:
+            yield self
+        finally:
+            current_sql_request.reset(token)
+            self.release(datasette)
+
+    async def run(
+        self, fn, /, *args, subdomain: str, access_tier: Optional[str] = None
+    ):
+        """
+        Run blocking SQLite work outside Datasette on this executor.
+
+        It's queued with the site's own queries, at the priority of the
+        request's access tier, instead of blocking the event loop.
+        """
+        token = current_sql_request.set(SQLRequest(subdomain, access_tier))
+        try:
+            future = self.submit(fn, *args)
+        finally:
+            current_sql_request.reset(token)
+        return await asyncio.wrap_future(future)
+
+    def retain(self, datasette) -> None:
+        """Run a Datasette instance's queries here and keep its connections."""
+        datasette.executor = self
+        with self._condition:
+            self._live_databases.update(_database_ids(datasette))
+
+    def release(self, datasette) -> None:
+        """Undo retain(); connections close once nothing retains them."""
+        with self._condition:
+            self._live_databases.subtract(_database_ids(datasette))
+            self._live_databases += Counter()  # Drop ids that reached 0
+            # Wake idle threads so they close the released connections
+            self._condition.notify_all()
+        self._close_released()
+
+    def close_when_released(self, datasette) -> None:
+        """Close a Datasette instance once no request is serving it."""
+        with self._condition:
+            self._closing.append(datasette)
+        self._close_released()
+
+    def _close_released(self) -> None:
+        with self._condition:
+            if not self._closing:
+                return
+            released = [
+                datasette
+                for datasette in self._closing
+                if self._live_databases.keys().isdisjoint(_database_ids(datasette))
+            ]
+            self._closing = [
+                datasette for datasette in self._closing if datasette not in released
+            ]
+        for datasette in released:
+            # close() would also shut down its executor, which is this one
+            datasette.executor = None
+            datasette.close()
+
+    def stats(self) -> dict:
+        with self._condition:
+            queued_by_priority = {
+                name: sum(len(items) for items in ring.values())
+                for name, ring in zip(PRIORITY_NAMES, self._queues, strict=True)
+            }
+            queued_by_site = Counter()
+            for ring in self._queues:
+                for subdomain, items in ring.items():
+                    queued_by_site[subdomain] += len(items)
+            return {
+                "threads": self.max_workers,
+                "max_per_site": self.max_per_site,
+                "busy": sum(self._running.values()),
+                "queued": sum(queued_by_priority.values()),
+                "queued_by_priority": queued_by_priority,
+                "queued_by_site": dict(queued_by_site.most_common(10)),
+                "running_by_site": dict(+self._running),
+                "max_queue_depth": self.max_queue_depth,
+                "completed": self.completed,
+                "wait_seconds": self.wait_seconds,
+            }
+
+    def _queued(self) -> int:
+        return sum(len(items) for ring in self._queues for items in ring.values())
+
+    def _next_item(self) -> Optional[_WorkItem]:
+        """Pop the next runnable item; the caller holds the condition."""
+        for ring in self._queues:
+            for subdomain in ring:
+                if self._running[subdomain] >= self.max_per_site:
+                    continue
+                items = ring[subdomain]
+                item = items.popleft()
+                if items:
+                    # Rotate: the site goes to the back of the ring
+                    ring.move_to_end(subdomain)
+                else:
+                    del ring[subdomain]
+                return item
+        return None
+
+    def _close_finished_connections(self, connections) -> None:
+        """Close this thread's connections to databases no longer in use."""
+        with self._condition:
+            stale = [
+                name for name in vars(connections) if name not in self._live_databases
+            ]
+        for name in stale:
+            getattr(connections, name).close()
+            delattr(connections, name)
+
+    def _worker(self):
+        from datasette.database import connections  # noqa: PLC0415
+
+        while True:
+            with self._condition:
+                item = self._next_item()
+                if item is None:
+                    if self._shutdown:
+                        return
+                    self._idle += 1
+                    self._condition.wait()
+                    self._idle -= 1
+                else:
+                    self._running[item.subdomain] += 1
+                    wait = time.monotonic() - item.queued_at
+                    self.wait_seconds += wait
+
+            if item is None:
+                # Woken by new work or by a request finishing
+                self._close_finished_connections(connections)
+                continue
+
+            if item.future.set_running_or_notify_cancel():
+                start = time.perf_counter()
+                result = error = None
+                try:
+                    result = item.fn(*item.args, **item.kwargs)
+                except BaseException as e:
+                    error = e
+                # Record before resolving, while the request is still waiting
+                seconds = time.perf_counter() - start
+                if item.timer is not None:
+                    item.timer.add("sql_wait", wait)
+                    item.timer.add("sql", seconds)
+                if item.clock is not None:
+                    item.clock.wait = wait
+                    item.clock.seconds = seconds
+                if error is None:
+                    item.future.set_result(result)
+                else:
+                    item.future.set_exception(error)
+                    del error
+
+            with self._condition:
+                self._running[item.subdomain] -= 1
+                self.completed += 1
+                # A slot for this site opened up; its queued items may run
+                self._condition.notify()
+            self._close_finished_connections(connections)
+
+
+# Shared by every Datasette instance the worker process creates
+sql_executor = FairSQLExecutor()
+os.register_at_fork(after_in_child=sql_executor._reset)
@@ -0,0 +1,120 @@
+"""
+Startup-time profile of the worker entry point.
+
+Gunicorn recycles workers every 200±50 requests, so worker startup sits
+on the request path far more often than a long-lived server's would.
+``profile_startup()`` starts a fresh interpreter with ``-X importtime``
+and times the phases a new worker goes through:
+
+1. ``import config.asgi``: settings, Django setup, djp plugins
+2. ``urlconf``: the URLconf and views, loaded on the first Django request
+3. ``datasette``: Datasette and the plugins/ modules, loaded on the first
+   site request
+
+The import log is kept so the slowest modules and packages can be
+reported. The startup_profile management command prints the breakdown
+and fails when startup exceeds a budget.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+from typing import NamedTuple
+
+ENTRY_POINT = "config.asgi"
+
+# Total startup budget in ms for the regression benchmark
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "2500"))
+
+# Run in the child interpreter; prints the phase timings as JSON
+_PROBE = """
+import importlib, json, os, sys, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+phases = {}
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+phases["import " + sys.argv[1]] = time.perf_counter() - start
+
+start = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+phases["urlconf"] = time.perf_counter() - start
+
+start = time.perf_counter()
+import datasette.app
+from django_plugins.preload import load_datasette_plugins
+load_datasette_plugins()
+phases["datasette"] = time.perf_counter() - start
+
+print(json.dumps({name: seconds * 1000 for name, seconds in phases.items()}))
+"""
+
+
+class ImportRecord(NamedTuple):
+    module: str
+    self_ms: float
+    cumulative_ms: float
+    depth: int
+
+
+class StartupProfile(NamedTuple):
+    phases: dict[str, float]
+    imports: list[ImportRecord]
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.phases.values())
+
+
+def parse_importtime(output: str) -> list[ImportRecord]:
+    """Parse ``-X importtime`` lines, ignoring anything else on stderr."""
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:") :].split("|")
+            self_ms = int(self_us) / 1000
+            cumulative_ms = int(cumulative_us) / 1000
+        except ValueError:
+            # The header line
+            continue
+        # One space, then two more per level of nesting
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        records.append(ImportRecord(name.strip(), self_ms, cumulative_ms, depth))
+    return records
+
+
+def package_totals(imports: list[ImportRecord]) -> Counter:
+    """Import time in ms by top-level package, counting each module once."""
+    totals = Counter()
+    for record in imports:
+        totals[record.module.split(".")[0]] += record.self_ms
+    return totals
+
+
+def slowest_imports(imports: list[ImportRecord], limit: int) -> list[ImportRecord]:
+    """The slowest imports made by each phase and the modules it imports."""
+    outer = [record for record in imports if record.depth <= 1]
+    return sorted(outer, key=lambda record: record.cumulative_ms, reverse=True)[:limit]
+
+
+def profile_startup(module: str = ENTRY_POINT, runs: int = 1) -> StartupProfile:
+    """Profile startup in fresh interpreters; returns the fastest of ``runs``."""
+    profiles = []
+    for _ in range(max(1, runs)):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _PROBE, module],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"Starting {module} failed:\n{result.stderr.strip()[-2000:]}"
+            )
+        phases = json.loads(result.stdout.strip().splitlines()[-1])
+        profiles.append(StartupProfile(phases, parse_importtime(result.stderr)))
+    return min(profiles, key=lambda profile: profile.total_ms)
@@ -0,0 +1,274 @@
+"""
+Fast-path serving of Datasette and plugin static assets.
+
+Requests for /-/static/* and /-/static-plugins/corkboard/* are answered by
+the subdomain router from a process-wide table built once per worker, so
+they skip the site lookup, auth checks and Datasette construction entirely.
+
+Every asset is held in memory with a content hash (used as the ETag) and
+precompressed gzip and, when the optional brotli package is installed,
+brotli variants. Cache-busted URLs (with a query string, like Datasette's
+app.css?<hash>) are marked immutable; everything else is revalidated with
+the ETag, in the spirit of WhiteNoise on the Django side.
+"""
+
+import gzip
+import hashlib
+import importlib.util
+import mimetypes
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+try:
+    import brotli
+
+    _brotli_available = True
+except ImportError:
+    _brotli_available = False
+
+# Mirrors the static_mounts the router passes to Datasette
+PLUGIN_STATIC_PREFIX = "/-/static-plugins/corkboard/"
+PLUGIN_STATIC_DIR = "plugins/static"
+DATASETTE_STATIC_PREFIX = "/-/static/"
+
+# Bodies smaller than this aren't worth a compressed variant
+MIN_COMPRESS_SIZE = 256
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/x-ndjson",
+    "image/svg+xml",
+)
+
+IMMUTABLE_CACHE_CONTROL = b"public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = b"public, max-age=3600"
+
+
+class StaticAsset:
+    """A static file held in memory with its precompressed variants."""
+
+    __slots__ = ("body", "content_type", "etag", "encodings")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'.encode()
+        self.encodings: dict[str, bytes] = {}
+
+        if len(body) >= MIN_COMPRESS_SIZE and content_type.startswith(
+            COMPRESSIBLE_TYPES
+        ):
+            if _brotli_available:
+                compressed = brotli.compress(body)
+                if len(compressed) < len(body):
+                    self.encodings["br"] = compressed
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.encodings["gzip"] = compressed
+
+
+def _datasette_static_dir() -> Optional[Path]:
+    """Locate Datasette's bundled static directory without importing it."""
+    spec = importlib.util.find_spec("datasette")
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    return Path(list(spec.submodule_search_locations)[0]) / "static"
+
+
+def _content_type(path: Path) -> str:
+    content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type == "application/javascript":
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+def _load_directory(prefix: str, directory: Optional[Path]) -> dict:
+    assets = {}
+    if directory is None or not directory.is_dir():
+        return assets
+    for file_path in sorted(directory.rglob("*")):
+        if file_path.is_file():
+            url_path = prefix + file_path.relative_to(directory).as_posix()
+            assets[url_path] = StaticAsset(
+                file_path.read_bytes(), _content_type(file_path)
+            )
+    return assets
+
+
+@lru_cache(maxsize=None)
+def get_static_asset_table() -> dict[str, StaticAsset]:
+    """
+    Build the process-wide asset table, keyed by URL path.
+
+    Built on first use (or ahead of time by calling this at startup) and
+    never invalidated: assets only change when a new image is deployed.
+    """
+    table = _load_directory(DATASETTE_STATIC_PREFIX, _datasette_static_dir())
+    table.update(_load_directory(PLUGIN_STATIC_PREFIX, Path(PLUGIN_STATIC_DIR)))
+    return table
+
+
+def is_static_path(path: str) -> bool:
+    """Check if the path is under one of the fast-path static mounts."""
+    return path.startswith((DATASETTE_STATIC_PREFIX, PLUGIN_STATIC_PREFIX))
+
+
+def _get_header(headers: list, name: bytes) -> Optional[str]:
+    for header_name, header_value in headers:
+        if header_name.lower() == name:
+            return header_value.decode("latin-1")
+    return None
+
+
+def choose_encoding(
+    accept_encoding: Optional[str], available, preference=("br", "gzip")
+) -> Optional[str]:
+    """
+    Pick the best precompressed variant the client accepts.
+
+    Args:
+        accept_encoding: Raw Accept-Encoding header value
+        available: Encodings that exist for the asset
+        preference: Encodings to consider, best first
+
+    Returns:
+        One of ``preference``, or None for the identity body
+    """
+    if not accept_encoding or not available:
+        return None
+    accepted = set()
+    for item in accept_encoding.split(","):
+        token, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if params in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    for encoding in preference:
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+def parse_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Parse a single-range "bytes=" Range header.
+
+    Args:
+        range_header: Raw Range header value
+        size: Length of the full body
+
+    Returns:
+        Inclusive (start, end) byte offsets, or None if unsatisfiable
+
+    Raises:
+        ValueError: If the header is malformed or asks for multiple ranges,
+            in which case the full body should be served
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        raise ValueError("Unsupported range")
+    start_text, _, end_text = spec.strip().partition("-")
+    if not start_text:
+        # Suffix range: the last N bytes
+        length = int(end_text)
+        if length <= 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def build_static_response(
+    asset: StaticAsset, method: str, headers: list, query_string: bytes
+) -> tuple[int, list, bytes]:
+    """
+    Build the status, headers and body for a static asset request.
+
+    Handles conditional requests (If-None-Match), single byte ranges on the
+    identity body and content negotiation of the precompressed variants.
+
+    Args:
+        asset: The asset being served
+        method: Request method (GET or HEAD)
+        headers: Request headers from the ASGI scope
+        query_string: Raw query string; present on cache-busted URLs
+
+    Returns:
+        (status, headers, body) tuple
+    """
+    cache_control = (
+        IMMUTABLE_CACHE_CONTROL if query_string else REVALIDATE_CACHE_CONTROL
+    )
+    response_headers = [
+        (b"etag", asset.etag),
+        (b"cache-control", cache_control),
+        (b"accept-ranges", b"bytes"),
+        (b"vary", b"Accept-Encoding"),
+    ]
+
+    if_none_match = _get_header(headers, b"if-none-match")
+    if if_none_match and asset.etag.decode() in (
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    ):
+        return 304, response_headers, b""
+
+    response_headers.append((b"content-type", asset.content_type.encode()))
+
+    range_header = _get_header(headers, b"range")
+    if_range = _get_header(headers, b"if-range")
+    if range_header and (if_range is None or if_range == asset.etag.decode()):
+        size = len(asset.body)
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            pass  # Malformed or multi-range: serve the full body instead
+        else:
+            if byte_range is None:
+                response_headers += [
+                    (b"content-range", f"bytes */{size}".encode()),
+                    (b"content-length", b"0"),
+                ]
+                return 416, response_headers, b""
+            start, end = byte_range
+            body = asset.body[start : end + 1]
+            response_headers += [
+                (b"content-range", f"bytes {start}-{end}/{size}".encode()),
+                (b"content-length", str(len(body)).encode()),
+            ]
+            return 206, response_headers, b"" if method == "HEAD" else body
+
+    encoding = choose_encoding(
+        _get_header(headers, b"accept-encoding"), asset.encodings
+    )
+    body = asset.encodings[encoding] if encoding else asset.body
+    if encoding:
+        response_headers.append((b"content-encoding", encoding.encode()))
+    response_headers.append((b"content-length", str(len(body)).encode()))
+    return 200, response_headers, b"" if method == "HEAD" else body
+
+
+def get_static_response(scope: dict) -> Optional[tuple[int, list, bytes]]:
+    """
+    Answer a request from the static asset table.
+
+    Returns None when the request should fall through to Datasette: other
+    methods, or paths not in the table (Datasette produces the 404).
+    """
+    if scope.get("method", "GET") not in ("GET", "HEAD"):
+        return None
+    asset = get_static_asset_table().get(os.path.normpath(scope.get("path", "")))
+    if asset is None:
+        return None
+    return build_static_response(
+        asset,
+        scope.get("method", "GET"),
+        scope.get("headers", []),
+        scope.get("query_string", b""),
+    )
@@ -0,0 +1,539 @@
+"""
+Reproducible synthetic site databases for performance tests and benchmarks.
+
+The test fixtures hold a handful of rows, which says nothing about how a
+city with decades of meetings and millions of OCR pages behaves. The
+generate_sites management command (and the ``synthetic_site`` test
+fixture) write sites shaped like deployed ones, at any scale:
+
+- ``../sites/<subdomain>/meetings.db`` with ``agendas`` and ``minutes``
+  pages across many meeting types and decades, weighted towards recent
+  years, with OCR-like text (page headers, agenda items, recognition
+  errors, broken hyphenation), ``page_image`` paths and FTS5 indexes
+- ``entities_json`` on most pages and ``votes_json`` on some minutes
+  pages, in the shapes the json_columns plugin renders, with council
+  rosters that change every election
+- optionally ``finance/election_finance.db`` with contributions and
+  expenditures
+- a matching row in ``sites.db``
+
+Everything derives from ``random.Random(f"{seed}:{subdomain}")``, so the
+same arguments always produce the same database files. Text is assembled
+from a per-site pool of noisy sentences rather than word by word, so a
+hundred thousand pages (about 300 MB) take around fifteen seconds.
+The command also writes each site's inspect data, so the router opens
+the databases in immutable mode like deployed ones.
+"""
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+from itertools import accumulate, islice
+from typing import Iterator, Optional
+
+import sqlite_utils
+
+from django_plugins.site_registry import SITES_DB_PATH
+
+# Meeting bodies and how often each one meets, relative to the others
+MEETING_TYPES = (
+    ("City Council", 12),
+    ("Planning Commission", 6),
+    ("Board of Zoning Adjustments", 3),
+    ("Parks and Recreation Commission", 2),
+    ("Transportation Commission", 2),
+    ("Library Board", 1),
+    ("Historical Preservation Board", 1),
+    ("Housing Authority", 1),
+    ("Public Utilities Board", 1),
+    ("Budget Committee", 1),
+)
+
+WORDS = (
+    "the of and to a in that for is on was be by with as motion council "
+    "city staff report public item approve budget hearing resolution "
+    "ordinance comment commission meeting members recommendation plan "
+    "project street development housing fund contract agreement amendment "
+    "zoning permit review discussion minutes consent calendar director "
+    "manager mayor vice chair seconded carried unanimously presentation "
+    "fiscal year capital improvement program water sewer traffic safety "
+    "police fire department services community residents property tax "
+    "revenue expenditure grant application district parcel environmental "
+    "impact study design construction bid award authorize execute "
+    "continued adjourned closed session roll call present absent "
+    "pursuant section code municipal general land use variance appeal "
+    "subdivision map landscape maintenance lighting assessment park "
+    "library transit bicycle pedestrian sidewalk repair affordable units "
+    "rental tenant protection program update quarterly annual audit"
+).split()
+
+# Zipf-like: earlier (commoner) words are picked far more often
+WORD_CUM_WEIGHTS = list(accumulate(1 / rank for rank in range(1, len(WORDS) + 1)))
+
+TOPICS = (
+    "Approval of Minutes",
+    "Consent Calendar",
+    "Public Comment on Non-Agenda Items",
+    "Annual Budget Adoption",
+    "Capital Improvement Program Update",
+    "Zoning Text Amendment",
+    "Conditional Use Permit",
+    "Street Resurfacing Contract Award",
+    "Affordable Housing Ordinance",
+    "Sewer Rate Increase Public Hearing",
+    "Park Master Plan",
+    "Traffic Calming Study",
+    "Police Department Quarterly Report",
+    "Closed Session Report",
+    "Tenant Protection Ordinance",
+    "Climate Action Plan",
+    "Library Expansion Design",
+    "Landscape and Lighting Assessment District",
+)
+
+FIRST_NAMES = (
+    "Maria James Linda Robert Patricia Michael Jennifer David Susan John "
+    "Karen Richard Nancy Joseph Lisa Thomas Betty Daniel Sandra Paul Angela "
+    "Kevin Rosa Brian Grace Luis Helen Steven Mei Carlos Aisha Omar Priya"
+).split()
+
+LAST_NAMES = (
+    "Garcia Smith Johnson Nguyen Williams Brown Lee Martinez Davis Lopez "
+    "Wilson Anderson Chen Taylor Thomas Moore Jackson Patel Harris Clark "
+    "Lewis Walker Young Allen King Wright Scott Torres Hill Green Adams Kim"
+).split()
+
+ORGANIZATIONS = (
+    "Chamber of Commerce",
+    "Unified School District",
+    "Water District",
+    "Transit Authority",
+    "Neighborhood Association",
+    "Housing Coalition",
+    "Downtown Business Association",
+    "County Board of Supervisors",
+    "Department of Transportation",
+    "Sierra Club",
+)
+
+STREETS = (
+    "Main Street",
+    "Oak Avenue",
+    "Park Boulevard",
+    "Central Avenue",
+    "Lincoln Way",
+    "Broadway",
+    "Shoreline Drive",
+    "Mission Street",
+    "Elm Street",
+    "Harbor Road",
+)
+
+CITY_NAMES = (
+    "Alder",
+    "Bayview",
+    "Cedar",
+    "Fairhaven",
+    "Granite",
+    "Lakeside",
+    "Millbrook",
+    "Pinecrest",
+    "Riverton",
+    "Westfield",
+)
+
+# Characters OCR tends to misread, and what it reads them as
+OCR_CONFUSIONS = (("rn", "m"), ("l", "1"), ("O", "0"), ("e", "c"), ("i", "l"))
+
+SENTENCE_POOL_SIZE = 2000
+COUNCIL_SIZE = 5
+TERM_YEARS = 4
+ENTITY_RATE = 0.8
+VOTE_RATE = 0.3
+INSERT_BATCH_SIZE = 5000
+
+PAGE_COLUMNS = (
+    "id",
+    "meeting",
+    "date",
+    "page",
+    "text",
+    "page_image",
+    "entities_json",
+    "votes_json",
+)
+
+FINANCE_TABLES = {
+    "monetary_contributions": (
+        "filer_name",
+        "report_date",
+        "contributor_name",
+        "contributor_city",
+        "contributor_zip",
+        "employer",
+        "occupation",
+        "amount",
+    ),
+    "expenditure_summaries": (
+        "filer_name",
+        "report_date",
+        "payee_name",
+        "description",
+        "amount",
+    ),
+}
+
+
+def site_dir(subdomain: str) -> str:
+    """Directory holding a site's databases."""
+    return f"../sites/{subdomain}"
+
+
+def _insert_rows(
+    conn: sqlite3.Connection, table: str, columns: tuple, rows: Iterator
+) -> int:
+    """Insert rows in batches; returns how many were inserted."""
+    sql = "insert into [{}] ({}) values ({})".format(
+        table, ", ".join(columns), ", ".join("?" for _ in columns)
+    )
+    count = 0
+    while batch := list(islice(rows, INSERT_BATCH_SIZE)):
+        conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def _open_for_bulk_load(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    # A half-written file is thrown away, so skip the journal entirely
+    conn.execute("pragma journal_mode = off")
+    conn.execute("pragma synchronous = off")
+    return conn
+
+
+class SyntheticSite:
+    """One synthetic site: its meetings, pages, finance rows and sites.db row."""
+
+    def __init__(
+        self,
+        subdomain: str,
+        pages: int,
+        seed: int = 0,
+        start_year: int = 1995,
+        end_year: int = 2024,
+        finance_rows: int = 0,
+    ):
+        if end_year < start_year:
+            raise ValueError("end_year is before start_year")
+        self.subdomain = subdomain
+        self.pages = pages
+        self.seed = seed
+        self.start_year = start_year
+        self.end_year = end_year
+        self.finance_rows = finance_rows
+        self.rng = random.Random(f"{seed}:{subdomain}")
+        self.city = self.rng.choice(CITY_NAMES)
+        self.name = f"{self.city} (synthetic)"
+        self.location = (
+            f"{self.rng.uniform(32.5, 42.0):.4f}",
+            f"{self.rng.uniform(-124.4, -114.1):.4f}",
+        )
+        self.rosters = self._rosters()
+        self.sentences = [self._sentence() for _ in range(SENTENCE_POOL_SIZE)]
+        self._years = list(range(start_year, end_year + 1))
+        # Recent years have more meetings online than early ones
+        self._year_weights = list(range(1, len(self._years) + 1))
+
+    def _person(self) -> str:
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def _rosters(self) -> list[list[str]]:
+        """Council members for each term, replacing a few every election."""
+        terms = (self.end_year - self.start_year) // TERM_YEARS + 1
+        rosters = [[self._person() for _ in range(COUNCIL_SIZE)]]
+        for _ in range(terms - 1):
+            roster = list(rosters[-1])
+            for seat in self.rng.sample(range(COUNCIL_SIZE), self.rng.randint(1, 3)):
+                roster[seat] = self._person()
+            rosters.append(roster)
+        return rosters
+
+    def roster(self, day: date) -> list[str]:
+        return self.rosters[(day.year - self.start_year) // TERM_YEARS]
+
+    def _ocr_noise(self, word: str) -> str:
+        roll = self.rng.random()
+        if roll < 0.02:
+            wrong, right = self.rng.choice(OCR_CONFUSIONS)
+            return word.replace(right, wrong, 1)
+        if roll < 0.03 and len(word) > 6:
+            cut = len(word) // 2
+            return f"{word[:cut]}-\n{word[cut:]}"
+        return word
+
+    def _sentence(self) -> str:
+        words = self.rng.choices(
+            WORDS, cum_weights=WORD_CUM_WEIGHTS, k=self.rng.randint(8, 24)
+        )
+        roll = self.rng.random()
+        if roll < 0.15:
+            words.insert(self.rng.randrange(len(words)), self.rng.choice(STREETS))
+        elif roll < 0.25:
+            words.insert(self.rng.randrange(len(words)), self._person())
+        text = " ".join(self._ocr_noise(word) for word in words)
+        return text[0].upper() + text[1:] + "."
+
+    def meetings(self, table: str) -> list[tuple[str, date, int]]:
+        """Meeting type, date and page count of each document, by date."""
+        types, weights = zip(*MEETING_TYPES, strict=True)
+        documents = []
+        remaining = self.pages_for(table)
+        while remaining > 0:
+            meeting = self.rng.choices(types, weights=weights)[0]
+            year = self.rng.choices(self._years, weights=self._year_weights)[0]
+            day = date(year, 1, 1) + timedelta(days=self.rng.randrange(365))
+            if table == "agendas" and self.rng.random() < 0.1:
+                # Agenda packets with staff reports attached run long
+                pages = self.rng.randint(40, 300)
+            else:
+                pages = self.rng.randint(2, 15)
+            pages = min(pages, remaining)
+            documents.append((meeting, day, pages))
+            remaining -= pages
+        documents.sort(key=lambda document: (document[1], document[0]))
+        return documents
+
+    def pages_for(self, table: str) -> int:
+        """Agendas get about three fifths of the site's pages."""
+        agendas = self.pages * 3 // 5
+        return agendas if table == "agendas" else self.pages - agendas
+
+    def page_text(self, meeting: str, day: date, page: int) -> str:
+        lines = [
+            f"CITY OF {self.city.upper()}",
+            f"{meeting.upper()} - {day:%B} {day.day}, {day.year}",
+            "",
+        ]
+        if self.rng.random() < 0.5:
+            for number in range(1, self.rng.randint(2, 5)):
+                topic = self.rng.choice(TOPICS)
+                lines.append(f"{number}. {topic} - {self.rng.choice(STREETS)}")
+            lines.append("")
+        sentences = self.rng.choices(self.sentences, k=self.rng.randint(8, 24))
+        for start in range(0, len(sentences), 4):
+            lines.append(" ".join(sentences[start : start + 4]))
+        lines.append(f"Page {page}")
+        return "\n".join(lines)
+
+    def entities(self, day: date) -> Optional[str]:
+        if self.rng.random() >= ENTITY_RATE:
+            return None
+
+        def mentions(names):
+            return [
+                {"text": name, "confidence": round(self.rng.uniform(0.5, 1.0), 2)}
+                for name in names
+            ]
+
+        roster = self.roster(day)
+        persons = self.rng.sample(roster, self.rng.randint(0, 3))
+        persons += [self._person() for _ in range(self.rng.randint(0, 2))]
+        return json.dumps(
+            {
+                "persons": mentions(persons),
+                "orgs": mentions(
+                    self.rng.sample(ORGANIZATIONS, self.rng.randint(0, 2))
+                ),
+                "locations": mentions(self.rng.sample(STREETS, self.rng.randint(0, 2))),
+            }
+        )
+
+    def votes(self, day: date) -> Optional[str]:
+        if self.rng.random() >= VOTE_RATE:
+            return None
+        roster = self.roster(day)
+        votes = []
+        for _ in range(self.rng.randint(1, 3)):
+            individual = [
+                {
+                    "name": name,
+                    "vote": self.rng.choices(
+                        ("aye", "nay", "abstain", "absent"), weights=(16, 3, 1, 1)
+                    )[0],
+                }
+                for name in roster
+            ]
+            tally = {
+                key: sum(vote["vote"] == value for vote in individual)
+                for key, value in (
+                    ("ayes", "aye"),
+                    ("nays", "nay"),
+                    ("abstain", "abstain"),
+                    ("absent", "absent"),
+                )
+            }
+            mover, seconder = self.rng.sample(roster, 2)
+            votes.append(
+                {
+                    "motion": f"Approve {self.rng.choice(TOPICS)}",
+                    "result": "passed" if tally["ayes"] > tally["nays"] else "failed",
+                    "tally": tally,
+                    "motion_by": mover,
+                    "seconded_by": seconder,
+                    "individual_votes": individual,
+                }
+            )
+        return json.dumps({"votes": votes})
+
+    def page_rows(self, table: str) -> Iterator[tuple]:
+        """Rows for the agendas or minutes table, in PAGE_COLUMNS order."""
+        for number, (meeting, day, pages) in enumerate(self.meetings(table)):
+            folder = meeting.replace(" ", "")
+            for page in range(1, pages + 1):
+                # Some bodies meet twice on a day, so the document number too
+                key = f"{self.subdomain}|{table}|{number}|{page}"
+                yield (
+                    hashlib.sha1(key.encode()).hexdigest()[:16],
+                    meeting,
+                    day.isoformat(),
+                    page,
+                    self.page_text(meeting, day, page),
+                    f"/_{table}/{folder}/{day}/{page}.png",
+                    self.entities(day),
+                    self.votes(day) if table == "minutes" else None,
+                )
+
+    def finance_rows_for(self, table: str) -> Iterator[tuple]:
+        count = (
+            self.finance_rows * 7 // 10
+            if table == "monetary_contributions"
+            else self.finance_rows - self.finance_rows * 7 // 10
+        )
+        committees = [f"Committee to Elect {name}" for name in self.rosters[-1]]
+        for _ in range(count):
+            year = self.rng.choices(self._years, weights=self._year_weights)[0]
+            reported = date(year, 1, 1) + timedelta(days=self.rng.randrange(365))
+            amount = round(self.rng.lognormvariate(5, 1.2), 2)
+            if table == "monetary_contributions":
+                yield (
+                    self.rng.choice(committees),
+                    reported.isoformat(),
+                    self._person(),
+                    self.city,
+                    f"9{self.rng.randrange(10000):04d}",
+                    self.rng.choice(ORGANIZATIONS),
+                    self.rng.choice(("Retired", "Attorney", "Engineer", "Teacher")),
+                    amount,
+                )
+            else:
+                yield (
+                    self.rng.choice(committees),
+                    reported.isoformat(),
+                    self.rng.choice(ORGANIZATIONS),
+                    self.rng.choice(("Mailers", "Consulting", "Yard signs", "Ads")),
+                    amount,
+                )
+
+    def write_meetings_db(self, path: str) -> int:
+        """Write meetings.db with FTS5 indexes; returns the page count."""
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = _open_for_bulk_load(tmp_path)
+        count = 0
+        try:
+            for table in ("agendas", "minutes"):
+                conn.execute(
+                    f"create table [{table}] (id text primary key, meeting text, "
+                    "date text, page integer, text text, page_image text, "
+                    "entities_json text, votes_json text)"
+                )
+                count += _insert_rows(conn, table, PAGE_COLUMNS, self.page_rows(table))
+                conn.execute(
+                    f"create virtual table [{table}_fts] "
+                    f"using FTS5 ([text], content=[{table}])"
+                )
+                conn.execute(
+                    f"insert into [{table}_fts]([{table}_fts]) values ('rebuild')"
+                )
+                conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        return count
+
+    def write_finance_db(self, path: str) -> int:
+        """Write election_finance.db; returns the row count."""
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = _open_for_bulk_load(tmp_path)
+        count = 0
+        try:
+            for table, columns in FINANCE_TABLES.items():
+                declared = ", ".join(
+                    f"{column} {'real' if column == 'amount' else 'text'}"
+                    for column in columns
+                )
+                conn.execute(f"create table [{table}] ({declared})")
+                count += _insert_rows(
+                    conn, table, columns, self.finance_rows_for(table)
+                )
+                conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        return count
+
+    def write(self) -> dict:
+        """Write the site's databases under ../sites; returns a summary."""
+        directory = site_dir(self.subdomain)
+        os.makedirs(directory, exist_ok=True)
+        meetings_db = f"{directory}/meetings.db"
+        summary = {
+            "subdomain": self.subdomain,
+            "pages": self.write_meetings_db(meetings_db),
+            "finance_rows": 0,
+            "size": os.path.getsize(meetings_db),
+        }
+        if self.finance_rows:
+            os.makedirs(f"{directory}/finance", exist_ok=True)
+            finance_db = f"{directory}/finance/election_finance.db"
+            summary["finance_rows"] = self.write_finance_db(finance_db)
+            summary["size"] += os.path.getsize(finance_db)
+        return summary
+
+    def site_row(self) -> dict:
+        """The site's sites.db row."""
+        last_updated = f"{self.end_year}-12-31"
+        return {
+            "subdomain": self.subdomain,
+            "name": self.name,
+            "state": "CA",
+            "kind": "city",
+            "scraper": "synthetic",
+            "pages": self.pages,
+            "start_year": self.start_year,
+            "extra": json.dumps({"synthetic": True, "seed": self.seed}),
+            "country": "USA",
+            "lat": self.location[0],
+            "lng": self.location[1],
+            "has_finance_data": int(bool(self.finance_rows)),
+            "status": "deployed",
+            "extraction_status": "completed",
+            "last_updated": last_updated,
+            "last_deployed": last_updated,
+            "last_extracted": last_updated,
+        }
+
+
+def write_site_rows(rows: list[dict], path: str = SITES_DB_PATH) -> None:
+    """Add or replace site rows in sites.db, leaving other sites alone."""
+    db = sqlite_utils.Database(path)
+    try:
+        db["sites"].upsert_all(rows, pk="subdomain", alter=True)
+    finally:
+        db.close()
@@ -0,0 +1,104 @@
+"""
+Warm-up of hot sites when a worker starts.
+
+Gunicorn recycles workers every 200±50 requests, so each new worker is
+cold and the first request to each popular site pays for building its
+Datasette instance and faulting its database pages into memory. During
+the ASGI lifespan startup, before the worker accepts traffic, the router
+warms the hottest sites within a time budget of WARMUP_SECONDS:
+
+1. Build and cache the site's Datasette instance (see site_instances)
+2. Run Datasette's startup hooks
+3. Read the first page of every visible table, on the worker's SQL
+   executor threads, so their connections and SQLite's page cache are warm
+
+Hot sites are WARMUP_SUBDOMAINS (comma-separated), followed by the sites
+with the most requests in the metrics every worker shares, up to
+WARMUP_SITES in total. Set WARMUP_SECONDS=0 to disable warm-up.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from typing import Awaitable, Callable
+
+from django_plugins.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+WARMUP_SECONDS = float(os.getenv("WARMUP_SECONDS", "10"))
+WARMUP_SITES = int(os.getenv("WARMUP_SITES", "8"))
+WARMUP_SUBDOMAINS = os.getenv("WARMUP_SUBDOMAINS", "")
+
+# Rows read from each table; Datasette's default_page_size plus one
+WARMUP_PAGE_ROWS = 101
+
+
+def hot_subdomains(limit: int = WARMUP_SITES) -> list[str]:
+    """Configured sites first, then the busiest sites by recorded requests."""
+    subdomains = [sub.strip() for sub in WARMUP_SUBDOMAINS.split(",") if sub.strip()]
+    try:
+        counters = metrics.collect()["counters"]
+    except OSError:
+        logger.exception("Could not read request metrics for warm-up")
+        counters = {}
+
+    requests = Counter()
+    for (name, labels), value in counters.items():
+        if name == "router_requests_total":
+            subdomain = dict(labels).get("subdomain")
+            if subdomain:
+                requests[subdomain] += value
+    for subdomain, _ in requests.most_common():
+        if subdomain not in subdomains:
+            subdomains.append(subdomain)
+    return subdomains[:limit]
+
+
+async def prime_datasette(datasette) -> None:
+    """Run startup hooks and read each visible table's first page."""
+    from datasette.utils import escape_sqlite  # noqa: PLC0415
+
+    await datasette.invoke_startup()
+    for database in datasette.databases.values():
+        hidden = set(await database.hidden_table_names())
+        for table in await database.table_names():
+            if table in hidden:
+                continue
+            await database.execute(
+                f"select * from {escape_sqlite(table)} limit {WARMUP_PAGE_ROWS}"
+            )
+
+
+async def warm_up(
+    warm_site: Callable[[str], Awaitable[None]],
+    subdomains: list[str],
+    budget: float = WARMUP_SECONDS,
+) -> list[str]:
+    """Warm sites in order until the time budget runs out; returns those warmed."""
+    start = time.monotonic()
+    warmed = []
+    for subdomain in subdomains:
+        remaining = budget - (time.monotonic() - start)
+        if remaining <= 0:
+            break
+        try:
+            await asyncio.wait_for(warm_site(subdomain), remaining)
+        except TimeoutError:
+            break
+        except Exception:
+            logger.exception("Warm-up failed", extra={"subdomain": subdomain})
+            continue
+        warmed.append(subdomain)
+
+    logger.info(
+        "Warm-up finished",
+        extra={
+            "warmed": warmed,
+            "skipped": [sub for sub in subdomains if sub not in warmed],
+            "duration_ms": round((time.monotonic() - start) * 1000, 1),
+        },
+    )
+    return warmed
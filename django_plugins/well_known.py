@@ -0,0 +1,122 @@
+"""
+Per-site well-known documents served directly by the subdomain router.
+
+robots.txt and opensearch.xml only depend on a site's name and which
+databases it has, so the router renders them once per site and answers
+crawler hits from the cache instead of building a Datasette instance.
+
+The Datasette plugins in plugins/robots.py and plugins/opensearch.py use the
+same renderers, so local `manage.py datasette` serves identical documents.
+"""
+
+from functools import lru_cache
+from typing import Optional
+
+# AI crawlers that are disallowed from every database on every site
+AI_USER_AGENTS = (
+    "Google-Extended",
+    "GPTBot",
+    "Applebot",
+    "Applebot-Extended",
+    "ChatGPT-User",
+    "CCBot",
+    "PerplexityBot",
+    "anthropic-ai",
+    "Claude-Web",
+    "ClaudeBot",
+    "Amazonbot",
+    "FacebookBot",
+    "Omgilibot",
+    "Omgili",
+    "Diffbot",
+    "Bytespider",
+    "ImagesiftBot",
+    "cohere-ai",
+    "SplitSignalBot",
+    "SemrushBot",
+    "SemrushBot-OCOB",
+    "SemrushBot-FT",
+    "SemrushBot-SWA",
+    "Meta-ExternalFetcher",
+    "OAI-SearchBot",
+    "YouBot",
+    "Meta-ExternalAgent",
+    "Ai2Bot",
+    "Ai2Bot-Dolma",
+)
+
+ROBOTS_TXT_PATH = "/robots.txt"
+OPENSEARCH_XML_PATH = "/opensearch.xml"
+WELL_KNOWN_PATHS = frozenset({ROBOTS_TXT_PATH, OPENSEARCH_XML_PATH})
+
+# Documents only change on deploy, so let browsers and the edge keep them a day
+WELL_KNOWN_CACHE_CONTROL = b"public, max-age=86400"
+
+
+def render_robots_txt(disallow: list[str]) -> str:
+    """Render robots.txt blocking AI crawlers from the given URL paths."""
+    lines = []
+    for user_agent in AI_USER_AGENTS:
+        lines += [f"User-agent: {user_agent}"]
+        lines += [f"Disallow: {item}" for item in disallow]
+        lines += ["\n"]
+    return "\n".join(lines)
+
+
+def render_opensearch_xml(subdomain: str, site_name: str) -> str:
+    """Render the OpenSearch description XML for a site."""
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<OpenSearchDescription xmlns="http://a9.com/-/spec/opensearch/1.1/">
+    <ShortName>{site_name}</ShortName>
+    <Description>Search meeting minutes and agendas from {site_name}</Description>
+    <Url type="text/html" template="https://{subdomain}.civic.band/meetings?_search={{searchTerms}}"/>
+    <Url type="application/json" template="https://{subdomain}.civic.band/meetings.json?_search={{searchTerms}}"/>
+    <Image height="16" width="16" type="image/x-icon">https://civic.band/favicon.ico</Image>
+    <InputEncoding>UTF-8</InputEncoding>
+    <OutputEncoding>UTF-8</OutputEncoding>
+    <Contact>hello@civic.band</Contact>
+    <LongName>{site_name} Civic Meeting Records</LongName>
+    <Tags>civic government meetings minutes agendas {subdomain}</Tags>
+    <Attribution>Data from {site_name} via CivicBand (https://civic.band)</Attribution>
+</OpenSearchDescription>"""
+
+
+def is_well_known_path(path: str) -> bool:
+    """Check if the request path is a document the router answers itself."""
+    return path in WELL_KNOWN_PATHS
+
+
+@lru_cache(maxsize=2048)
+def get_well_known_response(
+    path: str, subdomain: str, site_name: str, database_names: tuple[str, ...]
+) -> Optional[tuple[bytes, list]]:
+    """
+    Build (and cache) the body and headers for a well-known document.
+
+    The cache key includes everything the document depends on, so a site
+    rename or a newly deployed finance database produces a fresh entry.
+
+    Args:
+        path: Request path, one of WELL_KNOWN_PATHS
+        subdomain: Site subdomain (e.g., "alameda.ca")
+        site_name: Display name of the site
+        database_names: Names of the site's Datasette databases
+
+    Returns:
+        (body, headers) tuple, or None if the path is not a well-known document
+    """
+    if path == ROBOTS_TXT_PATH:
+        body = render_robots_txt([f"/{name}" for name in database_names])
+        content_type = b"text/plain; charset=utf-8"
+    elif path == OPENSEARCH_XML_PATH:
+        body = render_opensearch_xml(subdomain, site_name)
+        content_type = b"application/opensearchdescription+xml; charset=utf-8"
+    else:
+        return None
+
+    encoded = body.encode("utf-8")
+    return encoded, [
+        (b"content-type", content_type),
+        (b"content-length", str(len(encoded)).encode()),
+        (b"cache-control", WELL_KNOWN_CACHE_CONTROL),
+    ]
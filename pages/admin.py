@@ -1,16 +1,57 @@
 """Django admin configuration for pages app."""
 
 from django.contrib import admin
-from django.db.models import JSONField
+from django.core.cache import cache
+from django.db.models import F, JSONField, Q
+from django.shortcuts import render
+from django.urls import path
 from django_json_widget.widgets import JSONEditorWidget
 
-from .models import Site
+from .models import PIPELINE_STAGES, Site
+
+# The overview aggregates every site; a little staleness is fine
+OVERVIEW_CACHE_KEY = "pages:pipeline_overview"
+OVERVIEW_CACHE_SECONDS = 30
+
+
+class ProgressFilter(admin.SimpleListFilter):
+    """Filter sites by progress through their current stage."""
+
+    title = "progress"
+    parameter_name = "progress"
+
+    def lookups(self, _request, _model_admin):
+        return [
+            ("not_started", "Not started"),
+            ("in_progress", "In progress"),
+            ("complete", "Complete"),
+            ("failing", "Has failures"),
+        ]
+
+    def queryset(self, _request, queryset):
+        in_pipeline = Q(current_stage__in=PIPELINE_STAGES)
+        if self.value() == "not_started":
+            return queryset.filter(in_pipeline, progress_completed=0)
+        if self.value() == "in_progress":
+            return queryset.filter(
+                progress_completed__gt=0,
+                progress_completed__lt=F("progress_total"),
+            )
+        if self.value() == "complete":
+            return queryset.filter(
+                progress_total__gt=0, progress_completed__gte=F("progress_total")
+            )
+        if self.value() == "failing":
+            return queryset.filter(progress_failed__gt=0)
+        return queryset
 
 
 @admin.register(Site)
 class SiteAdmin(admin.ModelAdmin):
     """Admin interface for Site model."""
 
+    change_list_template = "admin/pages/site/change_list.html"
+
     formfield_overrides = {
         JSONField: {"widget": JSONEditorWidget},
     }
@@ -25,7 +66,14 @@ class SiteAdmin(admin.ModelAdmin):
         "updated_at",
         "get_progress",
     ]
-    list_filter = ["state", "country", "kind", "current_stage", "scraper"]
+    list_filter = [
+        "state",
+        "country",
+        "kind",
+        "current_stage",
+        ProgressFilter,
+        "scraper",
+    ]
     search_fields = ["subdomain", "name", "state"]
     readonly_fields = [
         "subdomain",
@@ -134,29 +182,48 @@ class SiteAdmin(admin.ModelAdmin):
         ),
     ]
 
+    def get_queryset(self, request):
+        # Progress is computed by the database so the changelist can sort
+        # and filter on it
+        return super().get_queryset(request).with_progress()
+
+    def get_urls(self):
+        return [
+            path(
+                "overview/",
+                self.admin_site.admin_view(self.overview_view),
+                name="pages_site_overview",
+            ),
+            *super().get_urls(),
+        ]
+
+    def overview_view(self, request):
+        """Pipeline totals per stage across all sites."""
+        overview = cache.get_or_set(
+            OVERVIEW_CACHE_KEY,
+            Site.objects.pipeline_overview,
+            OVERVIEW_CACHE_SECONDS,
+        )
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Pipeline overview",
+            "opts": self.model._meta,
+            "overview": overview,
+            "cache_seconds": OVERVIEW_CACHE_SECONDS,
+        }
+        return render(request, "admin/pages/site/overview.html", context)
+
     def get_progress(self, obj):
-        """Display overall progress across all stages."""
-        if obj.current_stage == "fetch":
-            total = obj.fetch_total
-            completed = obj.fetch_completed
-        elif obj.current_stage == "ocr":
-            total = obj.ocr_total
-            completed = obj.ocr_completed
-        elif obj.current_stage == "compilation":
-            total = obj.compilation_total
-            completed = obj.compilation_completed
-        elif obj.current_stage == "extraction":
-            total = obj.extraction_total
-            completed = obj.extraction_completed
-        elif obj.current_stage == "deploy":
-            total = obj.deploy_total
-            completed = obj.deploy_completed
-        else:
+        """Display progress through the current stage."""
+        if obj.current_stage not in PIPELINE_STAGES:
             return "N/A"
 
-        if total and total > 0:
-            percentage = (completed / total) * 100
+        total = obj.progress_total
+        completed = obj.progress_completed
+        if total > 0:
+            percentage = obj.progress_ratio * 100
             return f"{completed}/{total} ({percentage:.1f}%)"
         return "0/0"
 
     get_progress.short_description = "Current Progress"
+    get_progress.admin_order_field = "progress_ratio"
@@ -0,0 +1,128 @@
+"""Django management command to build the sharded global search index."""
+
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pages.models import Site
+from pages.search_index import (
+    BATCH_SIZE,
+    SHARD_BY_CHOICES,
+    build_shard,
+    index_dir,
+    list_shards,
+    read_index_meta,
+    shard_key,
+    shard_path,
+    write_index_meta,
+)
+
+
+class Command(BaseCommand):
+    """Incrementally build the global FTS index from every site's database."""
+
+    help = (
+        "Ingest each site's agendas and minutes into sharded FTS5 databases. "
+        "Sites whose meetings.db hasn't changed since the last run are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sites",
+            nargs="*",
+            help="Only ingest these site subdomains (default: every site).",
+        )
+        parser.add_argument(
+            "--shard-by",
+            dest="shard_by",
+            choices=SHARD_BY_CHOICES,
+            default="state",
+            help="Assign sites to shards by state or by subdomain hash.",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=16,
+            help="Number of shards when sharding by hash (default: 16).",
+        )
+        parser.add_argument(
+            "--index-dir",
+            dest="index_dir",
+            help="Directory for the shard databases (default: SEARCH_INDEX_DIR).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes, one shard each (default: 1).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            dest="batch_size",
+            type=int,
+            default=BATCH_SIZE,
+            help=f"Rows streamed per batch (default: {BATCH_SIZE}).",
+        )
+
+    def handle(self, **options):
+        directory = options.get("index_dir") or index_dir()
+        shard_by = options.get("shard_by") or "state"
+        shards = options.get("shards") or 16
+        workers = options.get("workers") or 1
+        batch_size = options.get("batch_size") or BATCH_SIZE
+        only = options.get("sites")
+
+        meta = read_index_meta(directory)
+        if meta and meta != {"shard_by": shard_by, "shards": shards}:
+            raise CommandError(
+                f"{directory} was built with --shard-by {meta['shard_by']} "
+                f"--shards {meta['shards']}; use a new --index-dir to reshard."
+            )
+
+        sites = Site.objects.order_by("subdomain")
+        if only:
+            sites = sites.filter(subdomain__in=only)
+        assignments = defaultdict(list)
+        for subdomain, state in sites.values_list("subdomain", "state"):
+            key = shard_key(subdomain, state, shard_by, shards)
+            assignments[shard_path(directory, key)].append(subdomain)
+
+        if not assignments:
+            raise CommandError("No sites to index")
+
+        os.makedirs(directory, exist_ok=True)
+        write_index_meta(directory, shard_by, shards)
+
+        # Pruning needs the full site list, so skip it when indexing a subset
+        prune = not only
+        if prune:
+            # Shards left with no sites still need their old sites pruned
+            for path in list_shards(directory):
+                assignments.setdefault(path, [])
+        jobs = [
+            (path, shard_sites, prune, batch_size)
+            for path, shard_sites in assignments.items()
+        ]
+
+        if workers == 1:
+            self.report(build_shard(*job) for job in jobs)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(build_shard, *job) for job in jobs]
+            self.report(future.result() for future in as_completed(futures))
+
+    def report(self, results):
+        for result in results:
+            line = (
+                f"{os.path.basename(result['shard'])}: "
+                f"{len(result['ingested'])} ingested, "
+                f"{len(result['skipped'])} unchanged"
+            )
+            if result["pruned"]:
+                line += f", {len(result['pruned'])} pruned"
+            if result["missing"]:
+                line += f", {len(result['missing'])} missing meetings.db"
+            self.stdout.write(line)
@@ -0,0 +1,344 @@
+"""Django management command to report on and maintain site FTS indexes."""
+
+import contextlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_plugins.datasette_by_subdomain import get_site_databases
+from django_plugins.site_inspect import (
+    discover_sites,
+    inspect_data_path,
+    inspect_site,
+    write_inspect_data,
+)
+
+# Rowid of the FTS5 structure record in the %_data shadow table
+FTS5_STRUCTURE_ROWID = 10
+
+# Marker SQLite 3.44+ writes after the cookie in the FTS5 structure record
+FTS5_STRUCTURE_V2 = b"\xff\x00\x00\x01"
+
+DEFAULT_PROBE = "budget"
+
+
+def _quote(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _read_varint(data: bytes, offset: int) -> tuple[int, int]:
+    """Decode an SQLite varint, returning (value, next offset)."""
+    value = 0
+    for i in range(8):
+        byte = data[offset + i]
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, offset + i + 1
+    return (value << 8) | data[offset + 8], offset + 9
+
+
+def find_fts_tables(conn: sqlite3.Connection) -> list[dict]:
+    """
+    List the FTS virtual tables in a database.
+
+    Returns:
+        Dicts with name, module ("fts4" or "fts5") and content table, for
+        external-content indexes
+    """
+    tables = []
+    rows = conn.execute(
+        "select name, sql from sqlite_master "
+        "where rootpage = 0 and sql like '%VIRTUAL TABLE%USING FTS%' order by name"
+    )
+    for name, sql in rows:
+        lowered = sql.lower()
+        module = "fts5" if "using fts5" in lowered else "fts4"
+        content = None
+        for option in sql[sql.index("(") + 1 : sql.rindex(")")].split(","):
+            key, _, value = option.strip().partition("=")
+            if key.strip().lower() == "content":
+                content = value.strip().strip("'\"[]") or None
+        tables.append({"name": name, "module": module, "content": content})
+    return tables
+
+
+def fts5_structure(conn: sqlite3.Connection, fts_table: str) -> tuple[int, int]:
+    """
+    Read the level and segment counts from an FTS5 structure record.
+
+    Returns:
+        (levels, segments) tuple
+    """
+    row = conn.execute(
+        f"select block from {_quote(fts_table + '_data')} where id = ?",
+        [FTS5_STRUCTURE_ROWID],
+    ).fetchone()
+    if row is None or not row[0]:
+        return 0, 0
+    data = row[0]
+    offset = 4  # Skip the configuration cookie
+    if data[offset : offset + 4] == FTS5_STRUCTURE_V2:
+        offset += 4
+    levels, offset = _read_varint(data, offset)
+    segments, _ = _read_varint(data, offset)
+    return levels, segments
+
+
+def _count(conn: sqlite3.Connection, table: str) -> int | None:
+    try:
+        return conn.execute(f"select count(*) from {_quote(table)}").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def fts_table_stats(conn: sqlite3.Connection, fts: dict) -> dict:
+    """
+    Collect segment, size and sync stats for one FTS table.
+
+    An index is considered optimized when all its data is in a single
+    segment. For external-content indexes, in_sync compares the content
+    table's row count with the number of documents in the index.
+    """
+    name = fts["name"]
+    if fts["module"] == "fts5":
+        levels, segments = fts5_structure(conn, name)
+        size_sql = (
+            f"select coalesce(sum(length(block)), 0) from {_quote(name + '_data')}"
+        )
+    else:
+        levels = conn.execute(
+            f"select count(distinct level) from {_quote(name + '_segdir')}"
+        ).fetchone()[0]
+        segments = _count(conn, name + "_segdir")
+        size_sql = (
+            f"select coalesce(sum(length(block)), 0) from {_quote(name + '_segments')}"
+        )
+
+    documents = _count(conn, name + "_docsize")
+    content_rows = _count(conn, fts["content"]) if fts["content"] else None
+    in_sync = None
+    if documents is not None and content_rows is not None:
+        in_sync = documents == content_rows
+
+    return {
+        "name": name,
+        "module": fts["module"],
+        "content": fts["content"],
+        "levels": levels,
+        "segments": segments,
+        "optimized": segments is not None and segments <= 1,
+        "size_bytes": conn.execute(size_sql).fetchone()[0],
+        "documents": documents,
+        "content_rows": content_rows,
+        "in_sync": in_sync,
+    }
+
+
+def probe_latency_ms(conn: sqlite3.Connection, fts: dict, probe: str) -> float:
+    """Time a ranked ?_search=-style query against an FTS table."""
+    name = _quote(fts["name"])
+    order = " order by rank" if fts["module"] == "fts5" else ""
+    sql = f"select rowid from {name} where {name} match ?{order} limit 100"
+    start = time.perf_counter()
+    # An unparseable probe still reports the time taken
+    with contextlib.suppress(sqlite3.OperationalError):
+        conn.execute(sql, [probe]).fetchall()
+    return (time.perf_counter() - start) * 1000
+
+
+def maintain_database(path: str, merge: int | None = None) -> None:
+    """
+    Optimize (or merge) every FTS index and ANALYZE, via a copy and swap.
+
+    The database is copied with the backup API, maintained, then moved over
+    the original with os.replace, so readers see either the old or the new
+    file and never a half-optimized one.
+
+    Args:
+        path: Path to the SQLite database
+        merge: Pages of incremental merge work per FTS table instead of a
+            full optimize
+    """
+    tmp_path = f"{path}.fts-maintenance.tmp"
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target)
+        for fts in find_fts_tables(target):
+            name = _quote(fts["name"])
+            if merge is None:
+                target.execute(f"insert into {name}({name}) values ('optimize')")
+            elif fts["module"] == "fts5":
+                target.execute(
+                    f"insert into {name}({name}, rank) values ('merge', ?)", [merge]
+                )
+            else:
+                target.execute(
+                    f"insert into {name}({name}) values (?)", [f"merge={merge},8"]
+                )
+        target.commit()
+        target.execute("ANALYZE")
+        target.commit()
+    except Exception:
+        target.close()
+        os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(tmp_path, path)
+
+
+def check_site(
+    subdomain: str,
+    probe: str = DEFAULT_PROBE,
+    optimize: bool = False,
+    merge: int | None = None,
+) -> dict:
+    """
+    Report on (and optionally maintain) the FTS indexes of one site.
+
+    Runs in a worker process, so it only takes and returns plain data.
+    """
+    path = f"../sites/{subdomain}/meetings.db"
+    result = {"subdomain": subdomain, "path": path}
+    try:
+        if optimize or merge is not None:
+            maintain_database(path, merge=merge)
+            result["maintained"] = "optimize" if merge is None else f"merge={merge}"
+            # The swap changed the file, so refresh inspect data if the site has it
+            if os.path.exists(inspect_data_path(subdomain)):
+                write_inspect_data(
+                    subdomain, inspect_site(get_site_databases(subdomain))
+                )
+
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            tables = []
+            for fts in find_fts_tables(conn):
+                stats = fts_table_stats(conn, fts)
+                stats["probe_ms"] = round(probe_latency_ms(conn, fts, probe), 3)
+                tables.append(stats)
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        result["error"] = str(e)
+        return result
+
+    result["size_bytes"] = os.path.getsize(path)
+    result["fts_tables"] = tables
+    result["segments"] = sum(table["segments"] or 0 for table in tables)
+    result["probe_ms"] = round(sum(table["probe_ms"] for table in tables), 3)
+    return result
+
+
+class Command(BaseCommand):
+    """Report FTS segment, size and sync stats across sites, optionally optimizing."""
+
+    help = (
+        "Walk ../sites/*/meetings.db and report FTS index health and search "
+        "latency, slowest sites first. With --optimize or --merge, maintain "
+        "each index on a copy of the database and swap it into place."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sites",
+            nargs="*",
+            help="Site subdomains to check (default: every site in ../sites).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes (default: 1).",
+        )
+        parser.add_argument(
+            "--probe",
+            default=DEFAULT_PROBE,
+            help=f"Search term used to time each index (default: {DEFAULT_PROBE}).",
+        )
+        parser.add_argument(
+            "--optimize",
+            action="store_true",
+            help="Run FTS optimize and ANALYZE before reporting.",
+        )
+        parser.add_argument(
+            "--merge",
+            type=int,
+            help="Run an incremental FTS merge of this many pages instead of optimize.",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=20,
+            help="Number of slowest sites to print (default: 20).",
+        )
+        parser.add_argument(
+            "--json",
+            dest="json_path",
+            help="Write the full machine-readable report to this path ('-' for stdout).",
+        )
+
+    def handle(self, **options):
+        sites = options.get("sites") or discover_sites()
+        workers = options.get("workers") or 1
+        kwargs = {
+            "probe": options.get("probe") or DEFAULT_PROBE,
+            "optimize": options.get("optimize", False),
+            "merge": options.get("merge"),
+        }
+
+        if not sites:
+            raise CommandError("No sites found in ../sites")
+        if kwargs["merge"] is not None and kwargs["merge"] <= 0:
+            raise CommandError("--merge must be a positive number of pages")
+
+        if workers == 1:
+            results = [check_site(site, **kwargs) for site in sites]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(check_site, site, **kwargs) for site in sites
+                ]
+                results = [future.result() for future in as_completed(futures)]
+
+        results.sort(key=lambda result: result.get("probe_ms", -1), reverse=True)
+        report = {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "probe": kwargs["probe"],
+            "sites": results,
+        }
+
+        json_path = options.get("json_path")
+        if json_path == "-":
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if json_path:
+            with open(json_path, "w") as fp:
+                json.dump(report, fp, indent=2)
+
+        self.print_summary(results, options.get("top") or 20)
+
+    def print_summary(self, results, top):
+        for result in results[:top]:
+            if "error" in result:
+                self.stdout.write(f"{result['subdomain']}: error: {result['error']}")
+                continue
+            out_of_sync = [
+                table["name"]
+                for table in result["fts_tables"]
+                if table["in_sync"] is False
+            ]
+            line = (
+                f"{result['subdomain']}: {result['probe_ms']:.1f}ms, "
+                f"{result['segments']} segments"
+            )
+            if out_of_sync:
+                line += f", out of sync: {', '.join(out_of_sync)}"
+            self.stdout.write(line)
@@ -0,0 +1,134 @@
+"""Django management command to generate synthetic sites for benchmarks."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_plugins.datasette_by_subdomain import get_site_databases
+from django_plugins.site_inspect import inspect_site, write_inspect_data
+from django_plugins.synthetic_sites import SyntheticSite, site_dir, write_site_rows
+
+
+def generate_site(subdomain, pages, seed, start_year, end_year, finance_rows):
+    """Write one synthetic site; returns its summary and sites.db row."""
+    site = SyntheticSite(subdomain, pages, seed, start_year, end_year, finance_rows)
+    summary = site.write()
+    write_inspect_data(subdomain, inspect_site(get_site_databases(subdomain)))
+    return summary, site.site_row()
+
+
+class Command(BaseCommand):
+    """Write reproducible synthetic site databases at a configurable scale."""
+
+    help = (
+        "Generate synthetic sites in ../sites, with OCR-like pages, FTS5 "
+        "indexes, entities and votes, optional finance databases and "
+        "matching sites.db rows, for performance tests and benchmarks. The "
+        "same arguments always produce the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sites",
+            type=int,
+            default=1,
+            help="Number of sites to generate (default: 1).",
+        )
+        parser.add_argument(
+            "--pages",
+            type=int,
+            default=100_000,
+            help="Agenda and minutes pages per site (default: 100000).",
+        )
+        parser.add_argument(
+            "--start-year",
+            type=int,
+            default=1995,
+            help="Year of the earliest meetings (default: 1995).",
+        )
+        parser.add_argument(
+            "--end-year",
+            type=int,
+            default=2024,
+            help="Year of the latest meetings (default: 2024).",
+        )
+        parser.add_argument(
+            "--finance-rows",
+            type=int,
+            default=0,
+            help="Rows of election finance data per site (default: none).",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed for the generated data (default: 0).",
+        )
+        parser.add_argument(
+            "--prefix",
+            default="synthetic",
+            help="Subdomains are <prefix><n>.ca (default: synthetic).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes (default: 1).",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Replace sites that already exist in ../sites.",
+        )
+
+    def handle(self, **options):
+        if options["sites"] < 1 or options["pages"] < 1:
+            raise CommandError("--sites and --pages must be at least 1")
+        if options["end_year"] < options["start_year"]:
+            raise CommandError("--end-year is before --start-year")
+
+        subdomains = [
+            f"{options['prefix']}{n}.ca" for n in range(1, options["sites"] + 1)
+        ]
+        existing = [
+            subdomain
+            for subdomain in subdomains
+            if os.path.exists(f"{site_dir(subdomain)}/meetings.db")
+        ]
+        if existing and not options["force"]:
+            raise CommandError(
+                f"Sites already exist in ../sites: {', '.join(existing)} "
+                "(use --force to replace them)"
+            )
+
+        args = (
+            options["pages"],
+            options["seed"],
+            options["start_year"],
+            options["end_year"],
+            options["finance_rows"],
+        )
+        workers = options.get("workers") or 1
+        if workers == 1:
+            results = [generate_site(subdomain, *args) for subdomain in subdomains]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(generate_site, subdomain, *args)
+                    for subdomain in subdomains
+                ]
+                results = [future.result() for future in as_completed(futures)]
+
+        # Written once, from this process: workers never share sites.db
+        write_site_rows([row for _, row in results])
+        for summary, _ in sorted(results, key=lambda result: result[0]["subdomain"]):
+            finance = (
+                f", {summary['finance_rows']} finance rows"
+                if summary["finance_rows"]
+                else ""
+            )
+            self.stdout.write(
+                f"{summary['subdomain']}: {summary['pages']} pages{finance}, "
+                f"{summary['size'] / 1024 / 1024:.1f} MB"
+            )
@@ -0,0 +1,67 @@
+"""Django management command to write deploy-time inspect data for sites."""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_plugins.datasette_by_subdomain import get_site_databases
+from django_plugins.site_inspect import (
+    discover_sites,
+    inspect_site,
+    write_inspect_data,
+)
+
+
+def inspect_and_write(subdomain):
+    """Inspect one site's databases and write its inspect-data.json."""
+    data = inspect_site(get_site_databases(subdomain))
+    if not data:
+        return subdomain, None, 0
+    path = write_inspect_data(subdomain, data)
+    table_count = sum(len(entry["tables"]) for entry in data.values())
+    return subdomain, path, table_count
+
+
+class Command(BaseCommand):
+    """Precompute table counts, hashes and FTS info for deployed site databases."""
+
+    help = (
+        "Write inspect-data.json for each site so the router can open its "
+        "databases in immutable mode. Run after every deploy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sites",
+            nargs="*",
+            help="Site subdomains to inspect (default: every site in ../sites).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes (default: 1).",
+        )
+
+    def handle(self, **options):
+        sites = options.get("sites") or discover_sites()
+        workers = options.get("workers") or 1
+
+        if not sites:
+            raise CommandError("No sites found in ../sites")
+
+        if workers == 1:
+            results = (inspect_and_write(site) for site in sites)
+            self.report(results)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(inspect_and_write, site) for site in sites]
+            self.report(future.result() for future in as_completed(futures))
+
+    def report(self, results):
+        for subdomain, path, table_count in results:
+            if path is None:
+                self.stdout.write(f"{subdomain}: no databases found, skipped")
+            else:
+                self.stdout.write(f"{subdomain}: {table_count} tables -> {path}")
@@ -0,0 +1,143 @@
+"""Django management command to replay a request capture as a benchmark."""
+
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from django_plugins import datasette_by_subdomain
+from django_plugins.replay import compare, load_records, replay, summarize
+from django_plugins.site_inspect import discover_sites
+
+
+class Command(BaseCommand):
+    """Replay captured requests through the in-process application."""
+
+    help = (
+        "Replay a REQUEST_CAPTURE_PATH capture through config.asgi.application "
+        "against the local ../sites tree, and report throughput, latency "
+        "percentiles by route class and per-stage timings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("capture", help="Request capture JSONL file.")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help="Requests in flight at once (default: 8).",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            help="Replay at most this many records.",
+        )
+        parser.add_argument(
+            "--site",
+            help="Replay every request against this local site.",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write the run's summary as JSON, for a later --baseline.",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Summary JSON of an earlier run to compare against.",
+        )
+
+    def handle(self, **options):
+        try:
+            records = load_records(options["capture"], options.get("limit"))
+        except OSError as error:
+            raise CommandError(f"Can't read capture: {error}") from None
+        if not records:
+            raise CommandError(f"No requests in {options['capture']}")
+        baseline = None
+        if options.get("baseline"):
+            with open(options["baseline"]) as fp:
+                baseline = json.load(fp)
+
+        sites = discover_sites()
+        site = options.get("site")
+        if site and site not in sites:
+            raise CommandError(f"Site not found in ../sites: {site}")
+        host = None
+        if site:
+            host = f"{site}.{datasette_by_subdomain.ROOT_DOMAINS.split(',')[0]}"
+
+        # Every response reports its stage timings to the replay
+        datasette_by_subdomain.SERVER_TIMING = "all"
+        from config.asgi import application  # noqa: PLC0415
+
+        results, seconds = asyncio.run(
+            replay(
+                application,
+                records,
+                options["concurrency"],
+                host,
+                settings.CIVIC_OBSERVER_SECRET,
+            )
+        )
+        summary = summarize(results, seconds)
+        self.report(summary)
+        if baseline is not None:
+            self.report_comparison(compare(baseline, summary))
+        if options.get("output"):
+            with open(options["output"], "w") as fp:
+                json.dump(summary, fp, indent=2)
+            self.stdout.write(f"Summary written to {options['output']}")
+
+    def report(self, summary):
+        self.stdout.write(
+            f"{summary['requests']} requests in {summary['seconds']:.1f}s: "
+            f"{summary['throughput']:.1f} req/s"
+        )
+        statuses = ", ".join(
+            f"{status}: {count}"
+            for status, count in sorted(summary["statuses"].items())
+        )
+        self.stdout.write(f"Statuses: {statuses}")
+        if summary["rate_limited"]:
+            self.stdout.write(
+                f"{summary['rate_limited']} rate limited (402), left out of "
+                "the latencies below"
+            )
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'Route':<16}{'Count':>8}{'Errors':>8}{'402s':>8}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        )
+        for route, stats in summary["routes"].items():
+            self.stdout.write(
+                f"{route:<16}{stats['count']:>8}{stats['errors']:>8}"
+                f"{stats['rate_limited']:>8}"
+                f"{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}"
+            )
+        if summary["stages"]:
+            self.stdout.write("")
+            self.stdout.write(f"{'Stage':<16}{'Mean ms':>10}{'p95 ms':>10}")
+            for stage, stats in summary["stages"].items():
+                self.stdout.write(
+                    f"{stage:<16}{stats['mean']:>10.2f}{stats['p95']:>10.2f}"
+                )
+
+    def report_comparison(self, comparison):
+        def change(value):
+            return "n/a" if value is None else f"{value:+.1f}%"
+
+        self.stdout.write("")
+        self.stdout.write(
+            f"Against baseline: throughput {change(comparison['throughput'])}"
+        )
+        self.stdout.write(f"{'Route':<16}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for route, changes in comparison["routes"].items():
+            if changes is None:
+                self.stdout.write(f"{route:<16}{'only in one run':>30}")
+                continue
+            self.stdout.write(
+                f"{route:<16}{change(changes['p50']):>10}"
+                f"{change(changes['p95']):>10}{change(changes['p99']):>10}"
+            )
+        for stage, value in comparison["stages"].items():
+            self.stdout.write(f"  {stage}: {change(value)} mean")
@@ -0,0 +1,189 @@
+"""Django management command to serve local sites through the production router."""
+
+import asyncio
+import cProfile
+import os
+import re
+import time
+
+import uvicorn
+from django.core.management.base import BaseCommand, CommandError
+
+from django_plugins import datasette_by_subdomain
+from django_plugins.site_inspect import discover_sites
+from django_plugins.static_assets import is_static_path
+
+# Browsers and curl resolve every *.localhost name to the loopback address
+LOCAL_DOMAIN = "localhost"
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+def _with_host(scope: dict, host: str) -> dict:
+    headers = [(name, value) for name, value in scope["headers"] if name != b"host"]
+    return {**scope, "headers": [(b"host", host.encode()), *headers]}
+
+
+class HostOverride:
+    """ASGI middleware answering every request as the given site."""
+
+    def __init__(self, app, subdomain: str):
+        self.app = app
+        self.host = f"{subdomain}.{LOCAL_DOMAIN}"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope = _with_host(scope, self.host)
+        await self.app(scope, receive, send)
+
+
+class RequestProfiler:
+    """
+    ASGI middleware writing a profile of each request to output_dir.
+
+    cProfile writes .prof files (for snakeviz or pstats); pyinstrument
+    writes .html call trees. Profiled requests run one at a time so their
+    profiles don't mix. cProfile only sees the event loop thread: queries
+    on the SQL executor's threads show up as time spent waiting.
+    """
+
+    def __init__(self, app, profiler: str, output_dir: str, report=print):
+        self.app = app
+        self.profiler = profiler
+        self.output_dir = output_dir
+        self.report = report
+        self._lock = asyncio.Lock()
+
+    def output_path(self, scope: dict) -> str:
+        host = dict(scope["headers"]).get(b"host", b"").decode("latin-1")
+        subdomain = host.split(":")[0].removesuffix(f".{LOCAL_DOMAIN}")
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", scope.get("path", "")).strip("-")
+        extension = "prof" if self.profiler == "cprofile" else "html"
+        name = f"{time.strftime('%H%M%S')}-{time.monotonic_ns() % 10**6:06d}"
+        name += f"-{subdomain or 'django'}-{slug[:60] or 'index'}.{extension}"
+        return os.path.join(self.output_dir, name)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or is_static_path(scope.get("path", "")):
+            await self.app(scope, receive, send)
+            return
+
+        path = self.output_path(scope)
+        async with self._lock:
+            started = time.perf_counter()
+            if self.profiler == "cprofile":
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    await self.app(scope, receive, send)
+                finally:
+                    profile.disable()
+                    profile.dump_stats(path)
+            else:
+                from pyinstrument import Profiler  # noqa: PLC0415
+
+                profiler = Profiler(async_mode="enabled")
+                profiler.start()
+                try:
+                    await self.app(scope, receive, send)
+                finally:
+                    profiler.stop()
+                    with open(path, "w") as fp:
+                        fp.write(profiler.output_html())
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.report(f"{scope['method']} {scope['path']} {elapsed_ms:.0f}ms -> {path}")
+
+
+class Command(BaseCommand):
+    """Serve every site in ../sites through the production ASGI stack."""
+
+    help = (
+        "Serve the local ../sites tree through config.asgi.application and "
+        "the subdomain router, at http://<subdomain>.localhost:<port>/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=8000,
+            help="Port to listen on (default: 8000).",
+        )
+        parser.add_argument(
+            "--bind",
+            default="127.0.0.1",
+            help="Address to listen on (default: 127.0.0.1).",
+        )
+        parser.add_argument(
+            "--site",
+            help=(
+                "Answer every request as this site, whatever the Host header "
+                "(e.g., for http://127.0.0.1:8000/ or a tunnel)."
+            ),
+        )
+        parser.add_argument(
+            "--profile",
+            choices=PROFILERS,
+            help="Write a profile of every request (pyinstrument must be installed).",
+        )
+        parser.add_argument(
+            "--profile-dir",
+            default="profiles",
+            help="Directory for request profiles (default: profiles).",
+        )
+
+    def handle(self, **options):
+        sites = discover_sites()
+        if not sites:
+            raise CommandError("No sites found in ../sites")
+        site = options.get("site")
+        if site and site not in sites:
+            raise CommandError(f"Site not found in ../sites: {site}")
+
+        profiler = options.get("profile")
+        if profiler == "pyinstrument":
+            try:
+                import pyinstrument  # noqa: F401, PLC0415
+            except ImportError:
+                raise CommandError(
+                    "--profile pyinstrument needs the pyinstrument package"
+                ) from None
+
+        # <subdomain>.localhost is routed like <subdomain>.civic.band
+        domains = datasette_by_subdomain.ROOT_DOMAINS.split(",")
+        if LOCAL_DOMAIN not in domains:
+            datasette_by_subdomain.ROOT_DOMAINS = ",".join([*domains, LOCAL_DOMAIN])
+
+        from config.asgi import application  # noqa: PLC0415
+
+        app = application
+        if site:
+            app = HostOverride(app, site)
+        if profiler:
+            os.makedirs(options["profile_dir"], exist_ok=True)
+            app = RequestProfiler(
+                app, profiler, options["profile_dir"], self.stdout.write
+            )
+
+        port = options["port"]
+        self.stdout.write(f"Serving {len(sites)} sites from ../sites")
+        if site:
+            self.stdout.write(f"Every request is answered as {site}")
+        for subdomain in sites[:5]:
+            self.stdout.write(f"  http://{subdomain}.{LOCAL_DOMAIN}:{port}/")
+        if len(sites) > 5:
+            self.stdout.write(f"  ... and {len(sites) - 5} more")
+        if profiler:
+            self.stdout.write(
+                f"Writing {profiler} profiles to {options['profile_dir']}"
+            )
+        self.stdout.write("Press Ctrl+C to stop.")
+
+        # lifespan="on" runs the router's warm-up, as in production
+        uvicorn.run(
+            app,
+            host=options["bind"],
+            port=port,
+            log_level="info",
+            lifespan="on",
+        )
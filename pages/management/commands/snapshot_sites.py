@@ -0,0 +1,87 @@
+"""Django management command to write Parquet snapshots of site tables."""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_plugins.datasette_by_subdomain import get_site_databases
+from django_plugins.site_inspect import discover_sites
+from django_plugins.snapshots import SNAPSHOT_ROW_GROUP_SIZE, snapshot_site
+
+
+def snapshot_and_report(subdomain, row_group_size, force):
+    """Snapshot one site; returns its subdomain and manifest."""
+    manifest = snapshot_site(
+        subdomain, get_site_databases(subdomain), row_group_size, force
+    )
+    return subdomain, manifest
+
+
+class Command(BaseCommand):
+    """Write Parquet snapshots of each site's tables for bulk downloads."""
+
+    help = (
+        "Write Parquet snapshots of agendas, minutes and finance tables for "
+        "each site, served at /-/snapshots/. Run after every deploy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sites",
+            nargs="*",
+            help="Site subdomains to snapshot (default: every site in ../sites).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes (default: 1).",
+        )
+        parser.add_argument(
+            "--row-group-size",
+            type=int,
+            default=SNAPSHOT_ROW_GROUP_SIZE,
+            help=f"Rows per Parquet row group (default: {SNAPSHOT_ROW_GROUP_SIZE}).",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rewrite snapshots even if their database hasn't changed.",
+        )
+
+    def handle(self, **options):
+        try:
+            import pyarrow  # noqa: F401, PLC0415
+        except ImportError:
+            raise CommandError(
+                "Snapshots need the pyarrow package: pip install pyarrow"
+            ) from None
+
+        sites = options.get("sites") or discover_sites()
+        workers = options.get("workers") or 1
+        args = (options["row_group_size"], options["force"])
+
+        if not sites:
+            raise CommandError("No sites found in ../sites")
+
+        if workers == 1:
+            self.report(snapshot_and_report(site, *args) for site in sites)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(snapshot_and_report, site, *args) for site in sites
+            ]
+            self.report(future.result() for future in as_completed(futures))
+
+    def report(self, results):
+        for subdomain, manifest in results:
+            if not manifest:
+                self.stdout.write(f"{subdomain}: no tables found, skipped")
+                continue
+            rows = sum(entry["rows"] for entry in manifest.values())
+            size = sum(entry["size"] for entry in manifest.values())
+            self.stdout.write(
+                f"{subdomain}: {len(manifest)} snapshots, {rows} rows, "
+                f"{size / 1024 / 1024:.1f} MB"
+            )
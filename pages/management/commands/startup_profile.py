@@ -0,0 +1,73 @@
+"""Django management command to report where worker startup time goes."""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_plugins.startup_profile import (
+    ENTRY_POINT,
+    package_totals,
+    profile_startup,
+    slowest_imports,
+)
+
+
+class Command(BaseCommand):
+    """Print an import-time and startup breakdown for the worker entry point."""
+
+    help = (
+        "Start the ASGI entry point in a fresh interpreter and report how "
+        "long each startup phase, package and import takes. With "
+        "--budget-ms, fail if startup takes longer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--module",
+            default=ENTRY_POINT,
+            help=f"Entry point module to import (default: {ENTRY_POINT}).",
+        )
+        parser.add_argument(
+            "--runs",
+            type=int,
+            default=3,
+            help="Profile this many times and report the fastest (default: 3).",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=15,
+            help="Packages and imports to list (default: 15).",
+        )
+        parser.add_argument(
+            "--budget-ms",
+            type=float,
+            default=None,
+            help="Fail if total startup time exceeds this many milliseconds.",
+        )
+
+    def handle(self, **options):
+        limit = options["limit"]
+        try:
+            profile = profile_startup(options["module"], runs=options["runs"])
+        except RuntimeError as error:
+            raise CommandError(str(error)) from error
+
+        self.stdout.write("Startup phases")
+        for name, ms in profile.phases.items():
+            self.stdout.write(f"  {name:<40} {ms:>9.1f} ms")
+        self.stdout.write(f"  {'total':<40} {profile.total_ms:>9.1f} ms")
+
+        self.stdout.write("\nImport time by package")
+        for package, ms in package_totals(profile.imports).most_common(limit):
+            self.stdout.write(f"  {package:<40} {ms:>9.1f} ms")
+
+        self.stdout.write("\nSlowest imports (cumulative)")
+        for record in slowest_imports(profile.imports, limit):
+            name = "  " * record.depth + record.module
+            self.stdout.write(f"  {name:<40} {record.cumulative_ms:>9.1f} ms")
+
+        budget = options["budget_ms"]
+        if budget is not None and profile.total_ms > budget:
+            raise CommandError(
+                f"Startup took {profile.total_ms:.1f} ms, over the "
+                f"{budget:.0f} ms budget"
+            )
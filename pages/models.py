@@ -1,7 +1,87 @@
 from django.db import models
-
-
-class SiteManager(models.Manager):
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    IntegerField,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast
+
+# Pipeline stages in order; each has <stage>_total/_completed/_failed counters
+PIPELINE_STAGES = ("fetch", "ocr", "compilation", "extraction", "deploy")
+
+
+def _current_stage_counter(counter: str) -> Case:
+    """The current stage's <stage>_<counter> column, or 0 outside the pipeline."""
+    return Case(
+        *(
+            When(current_stage=stage, then=F(f"{stage}_{counter}"))
+            for stage in PIPELINE_STAGES
+        ),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+class SiteQuerySet(models.QuerySet):
+    def with_progress(self):
+        """Annotate each site's progress through its current stage."""
+        return self.annotate(
+            progress_total=_current_stage_counter("total"),
+            progress_completed=_current_stage_counter("completed"),
+            progress_failed=_current_stage_counter("failed"),
+        ).annotate(
+            progress_ratio=Case(
+                When(
+                    progress_total__gt=0,
+                    then=Cast("progress_completed", FloatField())
+                    / Cast("progress_total", FloatField()),
+                ),
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+
+    def pipeline_overview(self) -> dict:
+        """Per-stage site counts and counter totals, in a single query."""
+        aggregates = {"sites": Count("pk")}
+        for stage in PIPELINE_STAGES:
+            aggregates[f"{stage}_sites"] = Count("pk", filter=Q(current_stage=stage))
+            aggregates[f"{stage}_failing_sites"] = Count(
+                "pk", filter=Q(current_stage=stage, **{f"{stage}_failed__gt": 0})
+            )
+            for counter in ("total", "completed", "failed"):
+                aggregates[f"{stage}_{counter}"] = Sum(f"{stage}_{counter}", default=0)
+        totals = self.aggregate(**aggregates)
+
+        stages = []
+        for stage in PIPELINE_STAGES:
+            total = totals[f"{stage}_total"]
+            stages.append(
+                {
+                    "stage": stage,
+                    "sites": totals[f"{stage}_sites"],
+                    "failing_sites": totals[f"{stage}_failing_sites"],
+                    "total": total,
+                    "completed": totals[f"{stage}_completed"],
+                    "failed": totals[f"{stage}_failed"],
+                    "ratio": totals[f"{stage}_completed"] / total if total else None,
+                }
+            )
+        in_pipeline = sum(stage["sites"] for stage in stages)
+        return {
+            "sites": totals["sites"],
+            "idle_sites": totals["sites"] - in_pipeline,
+            "stages": stages,
+        }
+
+
+class SiteManager(models.Manager.from_queryset(SiteQuerySet)):
     """Custom manager for Site model."""
 
     pass
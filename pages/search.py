@@ -0,0 +1,280 @@
+"""
+Federated full-text search across site databases.
+
+A search fans out one FTS5 query per site (against the agendas_fts and
+minutes_fts indexes in meetings.db) onto a bounded, process-wide thread
+pool; SQLite releases the GIL while it runs queries, so threads scale
+across cores without the cost of process pools. Each site gets its own
+time budget, enforced with an SQLite progress handler, and the whole search
+has an overall budget after which sites still queued are skipped.
+
+Results are ranked by bm25 (lower is better) and merged into a global
+top-k with a bounded heap as each site finishes, so memory stays O(k)
+however many sites are searched. ``stream_events()`` hands the events to
+async code (the ASGI response) one at a time as they're produced.
+"""
+
+import asyncio
+import contextlib
+import heapq
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from functools import lru_cache
+
+from django.conf import settings
+
+SEARCH_TABLES = ("agendas", "minutes")
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# How many SQLite VM instructions run between deadline checks
+PROGRESS_HANDLER_INTERVAL = 1000
+
+_escape_fts_re = re.compile(r'\s+|(".*?")')
+
+
+def escape_fts_query(query: str) -> str:
+    """
+    Quote every term of a user query so FTS5 syntax can't break it.
+
+    Mirrors Datasette's escape_fts: quoted phrases are kept, an unbalanced
+    quote is closed, and bare words are wrapped in double quotes.
+    """
+    if query.count('"') % 2:
+        query += '"'
+    bits = _escape_fts_re.split(query)
+    bits = [bit for bit in bits if bit and bit != '""']
+    return " ".join(
+        bit if bit.startswith('"') and bit.endswith('"') else f'"{bit}"' for bit in bits
+    )
+
+
+@lru_cache(maxsize=None)
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide search thread pool, creating it on first use."""
+    return ThreadPoolExecutor(
+        max_workers=settings.FEDERATED_SEARCH_WORKERS,
+        thread_name_prefix="federated-search",
+    )
+
+
+def search_site(subdomain: str, fts_query: str, limit: int, budget_ms: int) -> dict:
+    """
+    Run an FTS query against one site's meetings database.
+
+    Args:
+        subdomain: Site subdomain (e.g., "alameda.ca")
+        fts_query: Escaped FTS5 query
+        limit: Maximum results per table
+        budget_ms: Time budget for this site in milliseconds
+
+    Returns:
+        Dict with subdomain, results (each with a bm25 score), elapsed_ms,
+        timed_out and, if the database couldn't be searched, error
+    """
+    start = time.monotonic()
+    deadline = start + budget_ms / 1000
+    result = {"subdomain": subdomain, "results": [], "timed_out": False}
+
+    try:
+        conn = sqlite3.connect(
+            f"file:../sites/{subdomain}/meetings.db?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+    except sqlite3.Error as e:
+        result["error"] = str(e)
+        result["elapsed_ms"] = round((time.monotonic() - start) * 1000, 3)
+        return result
+
+    # Returning true from the handler interrupts the running query
+    conn.set_progress_handler(
+        lambda: time.monotonic() > deadline, PROGRESS_HANDLER_INTERVAL
+    )
+    try:
+        for table in SEARCH_TABLES:
+            fts = f"{table}_fts"
+            try:
+                rows = conn.execute(
+                    f"""
+                    select {table}.id, {table}.meeting, {table}.date, {table}.page,
+                        snippet({fts}, -1, '<mark>', '</mark>', '…', 16),
+                        bm25({fts}) as score
+                    from {fts}
+                    join {table} on {table}.rowid = {fts}.rowid
+                    where {fts} match ?
+                    order by score
+                    limit ?
+                    """,
+                    [fts_query, limit],
+                ).fetchall()
+            except sqlite3.OperationalError as e:
+                if time.monotonic() > deadline:
+                    result["timed_out"] = True
+                    break
+                if "no such table" in str(e):
+                    continue
+                result["error"] = str(e)
+                break
+            result["results"].extend(
+                {
+                    "subdomain": subdomain,
+                    "table": table,
+                    "id": row[0],
+                    "meeting": row[1],
+                    "date": row[2],
+                    "page": row[3],
+                    "snippet": row[4],
+                    "score": row[5],
+                }
+                for row in rows
+            )
+    finally:
+        conn.close()
+
+    result["elapsed_ms"] = round((time.monotonic() - start) * 1000, 3)
+    return result
+
+
+class TopK:
+    """Keep the k best (lowest bm25) results seen so far."""
+
+    def __init__(self, k: int):
+        self.k = k
+        self._heap = []
+        self._counter = 0
+
+    def add(self, item: dict) -> None:
+        # Max-heap on score via negation; the counter breaks ties stably
+        entry = (-item["score"], -self._counter, item)
+        self._counter += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def results(self) -> list[dict]:
+        return [entry[2] for entry in sorted(self._heap, reverse=True)]
+
+
+def federated_search(
+    subdomains: list[str],
+    query: str,
+    limit: int = DEFAULT_LIMIT,
+    site_budget_ms: int | None = None,
+    total_budget_ms: int | None = None,
+):
+    """
+    Search many sites in parallel, yielding events as results arrive.
+
+    Yields one {"type": "site", ...} event per finished site, with that
+    site's own results, and finally a {"type": "results", ...} event with
+    the merged global top-k. Closing the generator early (a client
+    disconnect) cancels the sites that haven't started yet.
+
+    Args:
+        subdomains: Sites to search
+        query: Raw user query, escaped before use
+        limit: Size of the global top-k (and of each site's result list)
+        site_budget_ms: Per-site time budget (default from settings)
+        total_budget_ms: Budget for the whole search (default from settings)
+    """
+    if site_budget_ms is None:
+        site_budget_ms = settings.FEDERATED_SEARCH_SITE_BUDGET_MS
+    if total_budget_ms is None:
+        total_budget_ms = settings.FEDERATED_SEARCH_TOTAL_BUDGET_MS
+
+    start = time.monotonic()
+    fts_query = escape_fts_query(query)
+    top_k = TopK(limit)
+    timed_out = []
+    skipped = []
+    errors = {}
+
+    executor = get_executor()
+    futures = {
+        executor.submit(search_site, subdomain, fts_query, limit, site_budget_ms): (
+            subdomain
+        )
+        for subdomain in subdomains
+    }
+    try:
+        for future in as_completed(futures, timeout=total_budget_ms / 1000):
+            site_result = future.result()
+            if site_result["timed_out"]:
+                timed_out.append(site_result["subdomain"])
+            if "error" in site_result:
+                errors[site_result["subdomain"]] = site_result["error"]
+            for item in site_result["results"]:
+                top_k.add(item)
+            yield {"type": "site", **site_result}
+    except FuturesTimeoutError:
+        pass
+    finally:
+        for future, subdomain in futures.items():
+            if future.cancel():
+                skipped.append(subdomain)
+
+    yield {
+        "type": "results",
+        "query": query,
+        "results": top_k.results(),
+        "sites_searched": len(futures) - len(skipped),
+        "sites_timed_out": sorted(timed_out),
+        "sites_skipped": sorted(skipped),
+        "errors": errors,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 3),
+    }
+
+
+class _Failure:
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+async def stream_events(events):
+    """
+    Yield the events of a blocking generator to async code as they arrive.
+
+    The generator runs on a thread of the default executor, handing each
+    event over through a queue, so waiting on the fan-out never blocks the
+    event loop and the first site's event is sent before the last finishes.
+    When the consumer stops early (a client disconnect cancels the
+    response), the thread closes the generator after its current event,
+    cancelling the sites that haven't started.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # The loop may be gone by the time a cancelled stream's thread ends
+        with contextlib.suppress(RuntimeError):
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def produce():
+        try:
+            for event in events:
+                if stop.is_set():
+                    break
+                put(event)
+        except Exception as e:
+            put(_Failure(e))
+        finally:
+            events.close()
+            put(done)
+
+    loop.run_in_executor(None, produce)
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
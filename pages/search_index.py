@@ -0,0 +1,319 @@
+"""
+Sharded global search index built offline from site databases.
+
+The build_search_index command copies every site's agendas and minutes
+pages into a handful of shard databases, each with one external-content
+FTS5 index over all of its sites' pages. Sites are assigned to shards by
+state or by a stable hash of the subdomain.
+
+Each shard records the version (size and mtime) of every site database it
+has ingested, so rebuilding only re-ingests sites redeployed since the last
+run. A site is re-ingested by deleting its rows, which triggers remove from
+the FTS index, and streaming its pages back in batches, so memory use
+doesn't depend on the size of the site.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import zlib
+from concurrent.futures import as_completed
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from pages.search import SEARCH_TABLES, TopK, escape_fts_query, get_executor
+
+SHARD_BY_CHOICES = ("state", "hash")
+
+INDEX_META_FILENAME = "index.json"
+
+BATCH_SIZE = 1000
+
+SCHEMA = """
+create table if not exists documents (
+    id integer primary key,
+    subdomain text not null,
+    source_table text not null,
+    doc_id text,
+    meeting text,
+    date text,
+    page integer,
+    text text
+);
+create index if not exists documents_subdomain on documents(subdomain);
+create virtual table if not exists documents_fts using fts5(
+    text, content=documents, content_rowid=id
+);
+create trigger if not exists documents_ai after insert on documents begin
+    insert into documents_fts(rowid, text) values (new.id, new.text);
+end;
+create trigger if not exists documents_ad after delete on documents begin
+    insert into documents_fts(documents_fts, rowid, text)
+    values ('delete', old.id, old.text);
+end;
+create table if not exists ingested (
+    subdomain text primary key,
+    version text not null,
+    rows integer not null,
+    ingested_at text not null
+);
+"""
+
+
+def index_dir() -> str:
+    """Directory holding the shard databases."""
+    return settings.SEARCH_INDEX_DIR
+
+
+def shard_key(subdomain: str, state: str | None, shard_by: str, shards: int) -> str:
+    """
+    Choose the shard a site belongs to.
+
+    Hash sharding uses crc32 rather than hash() so the assignment is the same
+    in every process and every run.
+    """
+    if shard_by == "state":
+        return (state or "unknown").strip().lower() or "unknown"
+    return f"{zlib.crc32(subdomain.encode()) % shards:03d}"
+
+
+def shard_path(directory: str, key: str) -> str:
+    return os.path.join(directory, f"shard-{key}.db")
+
+
+def list_shards(directory: str | None = None) -> list[str]:
+    """Paths of the shard databases in the index directory."""
+    directory = directory or index_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.startswith("shard-") and name.endswith(".db")
+    )
+
+
+def read_index_meta(directory: str) -> dict | None:
+    try:
+        with open(os.path.join(directory, INDEX_META_FILENAME)) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def write_index_meta(directory: str, shard_by: str, shards: int) -> None:
+    with open(os.path.join(directory, INDEX_META_FILENAME), "w") as fp:
+        json.dump({"shard_by": shard_by, "shards": shards}, fp)
+
+
+def site_version(db_path: str) -> str:
+    """Version of a deployed site database; changes on every redeploy."""
+    stat = os.stat(db_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def ingest_site(
+    conn: sqlite3.Connection,
+    subdomain: str,
+    db_path: str,
+    version: str,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Replace a site's documents in a shard, streaming them from its database.
+
+    Runs in a single transaction, so searches against the shard see either
+    the old or the new copy of the site.
+
+    Returns:
+        Number of pages ingested
+    """
+    rows_ingested = 0
+    with conn:
+        conn.execute("delete from documents where subdomain = ?", [subdomain])
+        source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            existing = {
+                row[0]
+                for row in source.execute(
+                    "select name from sqlite_master where type = 'table'"
+                )
+            }
+            for table in SEARCH_TABLES:
+                if table not in existing:
+                    continue
+                cursor = source.execute(
+                    f"select id, meeting, date, page, text from {table}"
+                )
+                while batch := cursor.fetchmany(batch_size):
+                    conn.executemany(
+                        "insert into documents "
+                        "(subdomain, source_table, doc_id, meeting, date, page, text) "
+                        "values (?, ?, ?, ?, ?, ?, ?)",
+                        [(subdomain, table, *row) for row in batch],
+                    )
+                    rows_ingested += len(batch)
+        finally:
+            source.close()
+        conn.execute(
+            "insert or replace into ingested values (?, ?, ?, ?)",
+            [
+                subdomain,
+                version,
+                rows_ingested,
+                datetime.now(timezone.utc).isoformat(),
+            ],
+        )
+    return rows_ingested
+
+
+def build_shard(
+    path: str, sites: list[str], prune: bool = True, batch_size: int = BATCH_SIZE
+) -> dict:
+    """
+    Bring one shard up to date with its sites' deployed databases.
+
+    Runs in a worker process; each shard has exactly one writer.
+
+    Args:
+        path: Shard database path
+        sites: Subdomains assigned to this shard
+        prune: Remove sites that are no longer assigned to this shard
+        batch_size: Rows fetched and inserted per batch
+
+    Returns:
+        Dict with the shard path and lists of ingested, skipped, pruned
+        and missing sites
+    """
+    result = {"shard": path, "ingested": [], "skipped": [], "pruned": [], "missing": []}
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("pragma journal_mode = wal")
+        conn.executescript(SCHEMA)
+        versions = dict(conn.execute("select subdomain, version from ingested"))
+
+        for subdomain in sites:
+            db_path = f"../sites/{subdomain}/meetings.db"
+            try:
+                version = site_version(db_path)
+            except OSError:
+                result["missing"].append(subdomain)
+                continue
+            if versions.get(subdomain) == version:
+                result["skipped"].append(subdomain)
+                continue
+            ingest_site(conn, subdomain, db_path, version, batch_size)
+            result["ingested"].append(subdomain)
+
+        if prune:
+            for subdomain in sorted(set(versions) - set(sites)):
+                with conn:
+                    conn.execute(
+                        "delete from documents where subdomain = ?", [subdomain]
+                    )
+                    conn.execute(
+                        "delete from ingested where subdomain = ?", [subdomain]
+                    )
+                result["pruned"].append(subdomain)
+    finally:
+        conn.close()
+    return result
+
+
+def search_shard(
+    path: str, fts_query: str, subdomains: list[str], limit: int, budget_ms: int
+) -> dict:
+    """
+    Search one shard, restricted to the given sites.
+
+    Returns results in the same shape as pages.search.search_site, keyed by
+    shard instead of subdomain.
+    """
+    start = time.monotonic()
+    deadline = start + budget_ms / 1000
+    result = {"shard": os.path.basename(path), "results": [], "timed_out": False}
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+    try:
+        rows = conn.execute(
+            """
+            select documents.subdomain, documents.source_table, documents.doc_id,
+                documents.meeting, documents.date, documents.page,
+                snippet(documents_fts, -1, '<mark>', '</mark>', '…', 16),
+                bm25(documents_fts) as score
+            from documents_fts
+            join documents on documents.id = documents_fts.rowid
+            where documents_fts match ?
+            and documents.subdomain in (select value from json_each(?))
+            order by score
+            limit ?
+            """,
+            [fts_query, json.dumps(subdomains), limit],
+        ).fetchall()
+    except sqlite3.OperationalError as e:
+        if time.monotonic() > deadline:
+            result["timed_out"] = True
+        else:
+            result["error"] = str(e)
+        rows = []
+    finally:
+        conn.close()
+
+    result["results"] = [
+        {
+            "subdomain": row[0],
+            "table": row[1],
+            "id": row[2],
+            "meeting": row[3],
+            "date": row[4],
+            "page": row[5],
+            "snippet": row[6],
+            "score": row[7],
+        }
+        for row in rows
+    ]
+    result["elapsed_ms"] = round((time.monotonic() - start) * 1000, 3)
+    return result
+
+
+def index_search(subdomains: list[str], query: str, limit: int, budget_ms=None):
+    """
+    Search the global index, yielding events like pages.search.federated_search.
+
+    Yields one {"type": "shard", ...} event per shard and a final
+    {"type": "results", ...} event with the merged top-k.
+    """
+    if budget_ms is None:
+        budget_ms = settings.FEDERATED_SEARCH_TOTAL_BUDGET_MS
+    start = time.monotonic()
+    fts_query = escape_fts_query(query)
+    top_k = TopK(limit)
+    errors = {}
+    timed_out = []
+
+    executor = get_executor()
+    futures = [
+        executor.submit(search_shard, path, fts_query, subdomains, limit, budget_ms)
+        for path in list_shards()
+    ]
+    for future in as_completed(futures):
+        shard_result = future.result()
+        if shard_result["timed_out"]:
+            timed_out.append(shard_result["shard"])
+        if "error" in shard_result:
+            errors[shard_result["shard"]] = shard_result["error"]
+        for item in shard_result["results"]:
+            top_k.add(item)
+        yield {"type": "shard", **shard_result}
+
+    yield {
+        "type": "results",
+        "query": query,
+        "results": top_k.results(),
+        "shards_searched": len(futures),
+        "shards_timed_out": sorted(timed_out),
+        "errors": errors,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 3),
+    }
@@ -1,10 +1,16 @@
+import json
+
+from asgiref.sync import sync_to_async
 from django.db.models import Sum
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
+from django_plugins.api_key_auth import check_rate_limit
 from pages.models import Site
+from pages.search import DEFAULT_LIMIT, MAX_LIMIT, federated_search, stream_events
+from pages.search_index import index_search, list_shards
 from pages.utils import apply_site_filters
 
 
@@ -151,3 +157,55 @@ def recent_deploys_view(request):
     ]
 
     return JsonResponse(data, safe=False)
+
+
+def get_client_ip(request) -> str:
+    """The client's IP address, preferring X-Forwarded-For as the router does."""
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "unknown")
+
+
+async def federated_search_view(request):
+    """API endpoint searching meeting minutes and agendas across sites.
+
+    Query params:
+        search: Full-text query (required).
+        limit: Number of results in the merged top-k (default 20, max 100).
+        q, state, kind, has_finance: Restrict which sites are searched,
+            as on the home page.
+        source: "index" to answer from the prebuilt global search index
+            instead of searching each site's database.
+
+    Streams newline-delimited JSON: one "site" (or "shard") event as each
+    one's results arrive, then a final "results" event with the global top-k.
+    Each search fans out across every site, so clients share the site
+    rate limit.
+    """
+    query = request.GET.get("search", "").strip()
+    if not query:
+        return JsonResponse({"error": "Missing 'search' parameter"}, status=400)
+
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        return JsonResponse({"error": "Invalid 'limit' parameter"}, status=400)
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    if await check_rate_limit(get_client_ip(request)):
+        return JsonResponse({"error": "Rate limit exceeded"}, status=429)
+
+    sites = apply_site_filters(request)[0]
+    subdomains = await sync_to_async(list)(sites.values_list("subdomain", flat=True))
+
+    if request.GET.get("source") == "index":
+        if not list_shards():
+            return JsonResponse({"error": "Search index not built"}, status=503)
+        events = index_search(subdomains, query, limit)
+    else:
+        events = federated_search(subdomains, query, limit=limit)
+    return StreamingHttpResponse(
+        (json.dumps(event) + "\n" async for event in stream_events(events)),
+        content_type="application/x-ndjson",
+    )
@@ -24,6 +24,8 @@ from urllib.parse import parse_qs
 import httpx
 from datasette import hookimpl
 
+from django_plugins.metrics import metrics
+
 logger = logging.getLogger(__name__)
 
 # Configuration from environment
@@ -93,6 +95,10 @@ _sql_query_cache = SQLQueryCache(max_size=1000, ttl_seconds=3600)
 class UmamiEventTracker:
     """Sends events to Umami Analytics API."""
 
+    # Events being sent across all trackers in this worker. They are sent
+    # inline while the request waits, so this is the worker's backlog.
+    pending = 0
+
     def __init__(self, url: str, website_id: str):
         self.url = url.rstrip("/")
         self.website_id = website_id
@@ -126,6 +132,7 @@ class UmamiEventTracker:
         if not UMAMI_ENABLED:
             return
 
+        UmamiEventTracker.pending += 1
         try:
             # Use provided language or default
             lang = language or "en-US"
@@ -182,12 +189,17 @@ class UmamiEventTracker:
 
                 if response.status_code == 200:
                     logger.debug(f"Event tracked: {event_name}")
+                    metrics.inc("umami_events_total", result="sent")
                 else:
                     logger.warning(f"Event tracking failed: {response.status_code}")
+                    metrics.inc("umami_events_total", result="failed")
 
         except Exception as e:
             logger.error(f"Failed to track event: {e}")
+            metrics.inc("umami_events_total", result="error")
             # Don't raise - tracking failures shouldn't break the app
+        finally:
+            UmamiEventTracker.pending -= 1
 
     def _clean_event_data(self, data: Dict) -> Dict:
         """Clean event data to meet Umami constraints."""
@@ -308,6 +320,9 @@ def get_accept_language(headers: Dict[str, str]) -> str:
     return primary if primary else "en-US"
 
 
+metrics.register_gauge("umami_events_pending", lambda: UmamiEventTracker.pending)
+
+
 @hookimpl
 def asgi_wrapper(datasette):
     """Wrap ASGI application to track analytics events."""
@@ -0,0 +1,277 @@
+"""
+FTS5 snippets for page cards on search results.
+
+A ``?_search=`` table page of agendas or minutes used to render the whole
+OCR text of every page card, up to 100 of them, only for search_highlight
+to mark the matches. This plugin gives the table templates a
+``search_snippets(display_rows)`` function instead: one query asks the
+table's FTS5 index for a ``snippet()`` of each displayed row's text, and
+the card shows that short, highlighted excerpt. The full text stays on
+the row page.
+
+Since the cards no longer show it, the full text isn't read either: an
+ASGI wrapper adds ``_nocol=text`` to those search pages, so the table
+query leaves the column out, and takes it back out of the page's links
+and Link headers so exports and pagination still get every column. Cards
+with no snippet (the search timed out, or a row has no FTS entry) fetch
+their text separately.
+"""
+
+import re
+from typing import Optional
+from urllib.parse import parse_qsl
+
+import markupsafe
+from datasette import hookimpl
+from datasette.utils import escape_fts, escape_sqlite
+
+SNIPPET_TABLES = ("agendas", "minutes")
+SNIPPET_COLUMN = "text"
+# Tokens per snippet; FTS5 allows at most 64
+SNIPPET_TOKENS = 40
+
+# Control characters can't appear in OCR text, so they mark the matches
+# until the snippet has been escaped
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+# HTML table pages of the tables that get snippets
+_card_path_re = re.compile(
+    rf"^/(?P<database>[^/.]+)/(?P<table>{'|'.join(SNIPPET_TABLES)})$"
+)
+# The parameter without_card_text adds, as rendered in URLs and forms
+_added_param_re = re.compile(
+    rf"(\?|&amp;|&)_nocol={SNIPPET_COLUMN}(?![\w%.+~-])(&amp;|&)?".encode()
+)
+_added_input = f'<input type="hidden" name="_nocol" value="{SNIPPET_COLUMN}">'.encode()
+
+
+def snippet_markup(snippet: str) -> markupsafe.Markup:
+    """Escape a snippet's text, turning the match markers into <mark>."""
+    return markupsafe.Markup(
+        str(markupsafe.escape(snippet))
+        .replace(_MATCH_START, "<mark>")
+        .replace(_MATCH_END, "</mark>")
+    )
+
+
+async def snippet_fts_table(datasette, database, table) -> Optional[tuple]:
+    """
+    The table's FTS5 index, if snippets can be taken from it.
+
+    Returns:
+        (fts_table, fts_columns, table_config), or None when the table has
+        no FTS5 index on its text column
+    """
+    db = datasette.get_database(database)
+    table_config = await datasette.table_config(database, table)
+    fts_table = table_config.get("fts_table") or await db.fts_table(table)
+    if not fts_table:
+        return None
+    fts_columns = await db.table_columns(fts_table)
+    if SNIPPET_COLUMN not in fts_columns:
+        return None
+    return fts_table, fts_columns, table_config
+
+
+async def fetch_snippets(datasette, database, table, request, ids) -> dict:
+    """
+    Snippets of the matching text for the given row ids.
+
+    Returns:
+        Dict of row id to snippet Markup; empty when the table has no FTS5
+        index on its text column, or the search isn't a valid FTS query
+    """
+    search = request.args.get("_search")
+    if not search or not ids:
+        return {}
+    fts = await snippet_fts_table(datasette, database, table)
+    if fts is None:
+        return {}
+    fts_table, fts_columns, table_config = fts
+    db = datasette.get_database(database)
+
+    raw = table_config.get("searchmode") == "raw"
+    if request.args.get("_searchmode") in ("raw", "escaped"):
+        raw = request.args.get("_searchmode") == "raw"
+    fts_pk = table_config.get("fts_pk", "rowid")
+
+    params = {
+        "search": search if raw else escape_fts(search),
+        "start": _MATCH_START,
+        "end": _MATCH_END,
+    }
+    params.update({f"id{index}": row_id for index, row_id in enumerate(ids)})
+    fts = escape_sqlite(fts_table)
+    sql = f"""
+        select t.id, snippet({fts}, {fts_columns.index(SNIPPET_COLUMN)},
+            :start, :end, '…', {SNIPPET_TOKENS})
+        from {fts} join {escape_sqlite(table)} t
+            on t.{escape_sqlite(fts_pk)} = {fts}.rowid
+        where {fts} match :search
+        and t.id in ({", ".join(f":id{index}" for index in range(len(ids)))})
+    """
+    try:
+        results = await db.execute(sql, params)
+    except Exception:
+        return {}
+    return {str(row[0]): snippet_markup(row[1]) for row in results.rows if row[1]}
+
+
+async def fetch_card_texts(datasette, database, table, ids) -> dict:
+    """
+    Full text of the given row ids, for cards without a snippet.
+
+    Returns:
+        Dict of row id to text
+    """
+    if not ids:
+        return {}
+    db = datasette.get_database(database)
+    params = {f"id{index}": row_id for index, row_id in enumerate(ids)}
+    sql = f"""
+        select id, {escape_sqlite(SNIPPET_COLUMN)} from {escape_sqlite(table)}
+        where id in ({", ".join(f":id{index}" for index in range(len(ids)))})
+    """
+    results = await db.execute(sql, params)
+    return {str(row[0]): row[1] or "" for row in results.rows}
+
+
+@hookimpl
+def extra_template_vars(database, table, view_name, request, datasette):
+    if (
+        view_name != "table"
+        or table not in SNIPPET_TABLES
+        or request is None
+        or not request.args.get("_search")
+    ):
+        return {}
+
+    async def search_snippets(display_rows):
+        ids = [
+            cell["raw"]
+            for row in display_rows
+            for cell in row
+            if cell["column"] == "id"
+        ]
+        return await fetch_snippets(datasette, database, table, request, ids)
+
+    async def search_card_texts(display_rows, snippets):
+        # Only rows whose text was left out of the page's query
+        ids = [
+            cell["raw"]
+            for row in display_rows
+            if not any(cell["column"] == SNIPPET_COLUMN for cell in row)
+            for cell in row
+            if cell["column"] == "id" and str(cell["raw"]) not in snippets
+        ]
+        return await fetch_card_texts(datasette, database, table, ids)
+
+    return {
+        "search_snippets": search_snippets,
+        "search_card_texts": search_card_texts,
+    }
+
+
+async def without_card_text(datasette, scope: dict) -> dict:
+    """
+    Leave the text column out of a search result page's table query.
+
+    Pages that sort by text, choose their own columns or can't get
+    snippets (the cards fall back to the full text) are left alone.
+    """
+    match = _card_path_re.match(scope.get("path", ""))
+    if match is None:
+        return scope
+    query_string = scope.get("query_string", b"")
+    params = dict(
+        parse_qsl(query_string.decode("utf-8", errors="ignore"), keep_blank_values=True)
+    )
+    if (
+        not params.get("_search")
+        or "_col" in params
+        or "_nocol" in params
+        or SNIPPET_COLUMN in (params.get("_sort"), params.get("_sort_desc"))
+    ):
+        return scope
+    database, table = match.group("database"), match.group("table")
+    try:
+        fts = await snippet_fts_table(datasette, database, table)
+        columns = await datasette.get_database(database).table_columns(table)
+    except KeyError:
+        # Unknown database: Datasette answers with its 404
+        return scope
+    if fts is None or SNIPPET_COLUMN not in columns:
+        return scope
+    separator = b"&" if query_string else b""
+    return {
+        **scope,
+        "query_string": query_string + separator + f"_nocol={SNIPPET_COLUMN}".encode(),
+    }
+
+
+def without_added_param(content: bytes) -> bytes:
+    """Remove the parameter without_card_text adds from a page or header."""
+    content = content.replace(_added_input, b"")
+    return _added_param_re.sub(
+        lambda match: match.group(1) if match.group(2) else b"", content
+    )
+
+
+def _original_header(key: bytes, value: bytes, content: bytes) -> bytes:
+    if key.lower() == b"content-length":
+        return str(len(content)).encode()
+    if key.lower() == b"link":
+        return without_added_param(value)
+    return value
+
+
+def original_links(send):
+    """
+    Wrap send to take the added parameter back out of the response.
+
+    Datasette builds the page's links (JSON, CSV, facets, the next page)
+    from the request it was given, so without this they'd all carry
+    ``_nocol=text``. The body is buffered so Content-Length stays right.
+    """
+    start = None
+    body = []
+
+    async def wrapped_send(message):
+        nonlocal start
+        if message["type"] == "http.response.start":
+            start = message
+            return
+        if message["type"] != "http.response.body" or start is None:
+            await send(message)
+            return
+        body.append(message.get("body", b""))
+        if message.get("more_body"):
+            return
+        content = without_added_param(b"".join(body))
+        headers = [
+            (key, _original_header(key, value, content))
+            for key, value in start.get("headers", [])
+        ]
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": content})
+
+    return wrapped_send
+
+
+@hookimpl
+def asgi_wrapper(datasette):
+    """Skip reading the full text on search result pages that show snippets."""
+
+    def wrap(app):
+        async def wrapper(scope, receive, send):
+            if scope["type"] == "http":
+                original = scope
+                scope = await without_card_text(datasette, scope)
+                if scope is not original:
+                    send = original_links(send)
+            await app(scope, receive, send)
+
+        return wrapper
+
+    return wrap
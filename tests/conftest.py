@@ -278,3 +278,68 @@ def django_db_setup(django_db_setup, django_db_blocker):
     # Cleanup
     with django_db_blocker.unblock(), connections["default"].cursor() as cursor:
         cursor.execute("DELETE FROM sites WHERE subdomain = 'test.ca'")
+
+
+@pytest.fixture(autouse=True)
+def clear_router_caches():
+    """Look up sites and build their Datasette instances afresh in every test."""
+    from django_plugins.datasette_by_subdomain import (  # noqa: PLC0415
+        get_metadata_template,
+    )
+    from django_plugins.site_instances import site_instances  # noqa: PLC0415
+    from django_plugins.site_registry import site_registry  # noqa: PLC0415
+
+    def clear():
+        site_instances.clear()
+        site_registry.clear()
+        get_metadata_template.cache_clear()
+
+    clear()
+    yield
+    # Datasette's pytest plugin closes every instance a test built, and
+    # closing shuts down its executor: detach cached instances from the
+    # shared sql_executor first so later tests can still run queries
+    for instance in site_instances._instances.values():
+        instance.datasette.executor = None
+    clear()
+
+
+@pytest.fixture(autouse=True)
+def isolate_datasette_plugins():
+    """Unregister plugins/ modules a test loaded into Datasette's plugin manager."""
+    from datasette.plugins import pm  # noqa: PLC0415
+
+    from django_plugins.preload import load_datasette_plugins  # noqa: PLC0415
+
+    before = {name for name, _ in pm.list_name_plugin()}
+    yield
+    for name, plugin in pm.list_name_plugin():
+        if name not in before:
+            pm.unregister(plugin, name=name)
+    load_datasette_plugins.cache_clear()
+
+
+@pytest.fixture
+def synthetic_site(tmp_path, monkeypatch):
+    """
+    Generate synthetic sites in ../sites, with their sites.db rows.
+
+    Returns a factory taking the subdomain, page count and any other
+    SyntheticSite arguments; the working directory is left next to ../sites.
+    """
+    from django_plugins.synthetic_sites import (  # noqa: PLC0415
+        SyntheticSite,
+        write_site_rows,
+    )
+
+    app_dir = tmp_path / "app"
+    app_dir.mkdir()
+    monkeypatch.chdir(app_dir)
+
+    def generate(subdomain="synthetic1.ca", pages=200, **kwargs):
+        site = SyntheticSite(subdomain, pages, **kwargs)
+        site.write()
+        write_site_rows([site.site_row()])
+        return site
+
+    return generate
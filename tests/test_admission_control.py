@@ -0,0 +1,233 @@
+"""
+Tests for load-shedding admission control.
+
+Tests cover:
+- Classifying requests as human, API key or low priority
+- Shedding thresholds for in-flight requests and latency
+- Latency decay once load drops
+- Admission metrics
+- Router answering shed requests with 503 and Retry-After, and classing
+  only validated API keys as api_key
+"""
+
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import admission_control, datasette_by_subdomain
+from django_plugins.admission_control import (
+    PRIORITY_API_KEY,
+    PRIORITY_HUMAN,
+    PRIORITY_LOW,
+    AdmissionController,
+    classify_request,
+)
+from django_plugins.metrics import MetricsStore
+
+BROWSER = (b"user-agent", b"Mozilla/5.0 (Macintosh) Firefox/130.0")
+
+
+def classify(path="/meetings", headers=(BROWSER,), api_key_validated=False):
+    return classify_request(
+        list(headers), path, "testcity", api_key_validated=api_key_validated
+    )
+
+
+class TestClassifyRequest:
+    """Test assigning admission classes."""
+
+    def test_browser_html_is_human(self):
+        assert classify() == PRIORITY_HUMAN
+
+    def test_anonymous_json_is_low(self):
+        assert classify("/meetings/agendas.json") == PRIORITY_LOW
+
+    @pytest.mark.parametrize(
+        "user_agent",
+        [b"python-requests/2.31", b"curl/8.4.0", b"Mozilla/5.0 (compatible; GPTBot)"],
+    )
+    def test_automated_html_is_low(self, user_agent):
+        assert classify(headers=[(b"user-agent", user_agent)]) == PRIORITY_LOW
+
+    def test_missing_user_agent_is_low(self):
+        assert classify(headers=[]) == PRIORITY_LOW
+
+    def test_validated_api_key(self):
+        headers = [BROWSER, (b"x-api-key", b"cb_live_test")]
+        assert (
+            classify("/meetings.json", headers, api_key_validated=True)
+            == PRIORITY_API_KEY
+        )
+
+    def test_unvalidated_api_key_is_anonymous(self):
+        headers = [BROWSER, (b"x-api-key", b"made_up")]
+        assert classify("/meetings.json", headers) == PRIORITY_LOW
+
+    def test_research_tool_is_human(self):
+        headers = [(b"user-agent", b"Zotero/6.0")]
+        assert classify("/meetings.json", headers) == PRIORITY_HUMAN
+
+
+class TestAdmissionController:
+    """Test shedding decisions."""
+
+    def test_admits_everything_when_idle(self):
+        controller = AdmissionController()
+
+        assert controller.admit(PRIORITY_LOW) is None
+        assert controller.stats()["admitted"] == {PRIORITY_LOW: 1}
+
+    def test_sheds_low_priority_over_in_flight_threshold(self):
+        controller = AdmissionController(shed_in_flight=1, max_in_flight=2)
+
+        with controller.track():
+            assert controller.admit(PRIORITY_LOW) == "in_flight"
+            assert controller.admit(PRIORITY_API_KEY) is None
+            with controller.track():
+                assert controller.admit(PRIORITY_API_KEY) == "in_flight"
+                assert controller.admit(PRIORITY_HUMAN) is None
+
+        assert controller.stats()["shed"] == {
+            "low:in_flight": 1,
+            "api_key:in_flight": 1,
+        }
+
+    def test_sheds_low_priority_on_latency(self):
+        controller = AdmissionController(shed_latency_ms=100)
+        controller._latency_ms = 500
+        controller._latency_at = admission_control.time.monotonic()
+
+        assert controller.admit(PRIORITY_LOW) == "latency"
+        assert controller.admit(PRIORITY_API_KEY) is None
+
+    def test_counts_decisions_in_metrics(self, tmp_path):
+        store = MetricsStore(str(tmp_path))
+        controller = AdmissionController(shed_in_flight=0)
+
+        with patch.object(admission_control, "metrics", store):
+            controller.admit(PRIORITY_HUMAN)
+            controller.admit(PRIORITY_LOW)
+
+        assert store.counters[("admission_admitted_total", (("priority", "human"),))]
+        assert store.counters[
+            ("admission_shed_total", (("priority", "low"), ("reason", "in_flight")))
+        ]
+
+    def test_latency_decays(self):
+        controller = AdmissionController()
+        controller._latency_ms = 1000
+        controller._latency_at = 0
+
+        half_life = admission_control.LATENCY_HALF_LIFE_SECONDS
+        assert controller.latency_ms(now=half_life) == pytest.approx(500)
+
+    def test_track_records_latency(self):
+        controller = AdmissionController()
+
+        with (
+            patch.object(
+                admission_control.time, "monotonic", side_effect=[10.0, 11.0, 11.0]
+            ),
+            controller.track(),
+        ):
+            pass
+
+        assert controller.in_flight == 0
+        assert controller.peak_in_flight == 1
+        assert controller._latency_ms == pytest.approx(200)
+
+
+@pytest.mark.asyncio
+class TestRouterAdmission:
+    """Test the router shedding requests."""
+
+    async def call_router(self, controller, path, headers, api_key_validated=False):
+        with (
+            patch.object(
+                datasette_by_subdomain,
+                "is_validated_api_key",
+                AsyncMock(return_value=api_key_validated),
+            ),
+            patch.object(
+                datasette_by_subdomain,
+                "validate_api_key",
+                AsyncMock(return_value={"valid": api_key_validated}),
+            ),
+            patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+            patch("datasette.app.Datasette") as mock_datasette,
+            patch("django_plugins.datasette_by_subdomain.Environment") as mock_env,
+            patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
+            patch.object(datasette_by_subdomain, "admission_controller", controller),
+            patch(
+                "django_plugins.datasette_by_subdomain.check_rate_limit",
+                AsyncMock(return_value=False),
+            ),
+        ):
+            mock_sqlite.return_value.__getitem__.return_value.get.return_value = {
+                "name": "Test City",
+                "state": "CA",
+                "subdomain": "testcity",
+                "last_updated": "2024-01-01",
+            }
+            mock_env.return_value.get_template.return_value.render.return_value = "{}"
+            datasette_app = AsyncMock()
+            mock_datasette.return_value.app.return_value = datasette_app
+            send = AsyncMock()
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": path,
+                "query_string": b"",
+                "headers": [(b"host", b"testcity.civic.band"), *headers],
+            }
+            await datasette_by_subdomain.wrap(AsyncMock())(scope, AsyncMock(), send)
+            return send, datasette_app
+
+    async def test_sheds_anonymous_json_when_saturated(self):
+        controller = AdmissionController(shed_in_flight=0, retry_after=7)
+
+        send, datasette_app = await self.call_router(
+            controller, "/meetings/agendas.json", [BROWSER]
+        )
+
+        start = send.call_args_list[0][0][0]
+        assert start["status"] == 503
+        assert (b"retry-after", b"7") in start["headers"]
+        datasette_app.assert_not_called()
+
+    async def test_html_keeps_flowing_when_saturated(self):
+        controller = AdmissionController(shed_in_flight=0, max_in_flight=0)
+
+        _, datasette_app = await self.call_router(controller, "/meetings", [BROWSER])
+
+        datasette_app.assert_called_once()
+        assert controller.stats()["admitted"] == {PRIORITY_HUMAN: 1}
+
+    async def test_unvalidated_api_key_shed_as_anonymous(self):
+        controller = AdmissionController(shed_in_flight=0)
+
+        send, _ = await self.call_router(
+            controller, "/meetings/agendas.json", [BROWSER, (b"x-api-key", b"made_up")]
+        )
+
+        assert send.call_args_list[0][0][0]["status"] == 503
+        assert controller.stats()["shed"] == {"low:in_flight": 1}
+
+    async def test_validated_api_key_admitted(self):
+        controller = AdmissionController(shed_in_flight=0)
+
+        _, datasette_app = await self.call_router(
+            controller,
+            "/meetings/agendas.json",
+            [BROWSER, (b"x-api-key", b"cb_live_test")],
+            api_key_validated=True,
+        )
+
+        datasette_app.assert_called_once()
+        assert controller.stats()["admitted"] == {PRIORITY_API_KEY: 1}
@@ -278,6 +278,23 @@ class TestValidateApiKey:
         assert b"valid" in cached
         assert b"false" in cached.lower()
 
+    async def test_is_validated_api_key_reads_cache_only(self, settings, fake_redis):
+        from django_plugins.api_key_auth import (
+            is_validated_api_key,
+            set_redis_client,
+            validate_api_key,
+        )
+
+        set_redis_client(fake_redis)
+        settings.DEBUG = True
+
+        # Not validated yet, then validated as valid and as invalid
+        assert await is_validated_api_key("dev_test_key") is False
+        await validate_api_key("dev_test_key", "alameda.ca")
+        await validate_api_key("invalid_key", "alameda.ca")
+        assert await is_validated_api_key("dev_test_key") is True
+        assert await is_validated_api_key("invalid_key") is False
+
 
 class TestIsResearchToolRequest:
     """Test research tool detection via User-Agent header."""
@@ -0,0 +1,212 @@
+"""
+Tests for the compiled bot policy.
+
+Tests cover:
+- Loading Anubis-style rules, imports and unsupported rules
+- First-match rule order across combined matchers
+- User-Agent, path, header and CIDR conditions
+- The repo's botPolicy.yaml
+- Denied bots feeding admission control and the rate limiter
+"""
+
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain
+from django_plugins.admission_control import PRIORITY_LOW, classify_request
+from django_plugins.bot_policy import BotVerdict, load_bot_policy
+
+POLICY = """
+bots:
+  - name: deny-scraper
+    user_agent_regex: (?i:scrapy)
+    action: DENY
+  - name: allow-archiver
+    user_agent_regex: archive\\.org_bot
+    action: ALLOW
+  - name: bad-network
+    remote_addresses: ["203.0.113.0/24", "2001:db8::/32"]
+    action: DENY
+  - name: trusted-host
+    remote_addresses: ["203.0.113.7/32"]
+    action: ALLOW
+  - name: api-scraper
+    user_agent_regex: python-requests
+    path_regex: \\.json$
+    action: DENY
+  - name: header-rule
+    headers_regex:
+      X-Scraper: "yes"
+    action: DENY
+  - name: cel
+    expression: userAgent.contains("x")
+    action: DENY
+  - name: broken
+    user_agent_regex: "("
+    action: DENY
+  - import: (data)/bots/ai-robots-txt.yaml
+  - import: (data)/bots/unknown.yaml
+  - import: extra.yaml
+  - name: generic-browser
+    user_agent_regex: Mozilla|Opera
+    action: CHALLENGE
+"""
+
+EXTRA = """
+- name: extra-rule
+  user_agent_regex: ExtraBot
+  action: DENY
+"""
+
+
+@pytest.fixture
+def policy(tmp_path):
+    (tmp_path / "botPolicy.yaml").write_text(POLICY)
+    (tmp_path / "extra.yaml").write_text(EXTRA)
+    return load_bot_policy(str(tmp_path / "botPolicy.yaml"))
+
+
+def classify(policy, user_agent=None, path="/meetings", client_ip="198.51.100.1"):
+    headers = [(b"user-agent", user_agent.encode())] if user_agent else []
+    return policy.classify(headers, path, client_ip)
+
+
+class TestLoadBotPolicy:
+    """Test compiling rule files."""
+
+    def test_skips_unsupported_rules(self, policy):
+        assert [name for name, _ in policy.skipped] == [
+            "(data)/bots/unknown.yaml",
+            "cel",
+            "broken",
+        ]
+
+    def test_missing_file_matches_nothing(self, tmp_path):
+        policy = load_bot_policy(str(tmp_path / "missing.yaml"))
+
+        assert classify(policy, "GPTBot") == BotVerdict()
+
+    def test_repo_policy(self):
+        policy = load_bot_policy("botPolicy.yaml")
+
+        assert classify(policy, "Mozilla/5.0 (compatible; GPTBot/1.0)").denied
+        assert classify(policy, "Mozilla/5.0 Firefox/130.0").action == "CHALLENGE"
+        assert classify(policy, "curl/8", path="/robots.txt").action == "ALLOW"
+
+
+class TestClassify:
+    """Test matching requests against rules."""
+
+    def test_user_agent_rule(self, policy):
+        assert classify(policy, "Scrapy/2.11") == BotVerdict("DENY", "deny-scraper")
+
+    def test_rule_order_within_combined_regex(self, policy):
+        # Matches both deny-scraper and generic-browser; the earlier rule wins
+        verdict = classify(policy, "Mozilla/5.0 Scrapy/2.11")
+        assert verdict.rule == "deny-scraper"
+
+    def test_cidr_rules(self, policy):
+        assert classify(policy, client_ip="203.0.113.9").rule == "bad-network"
+        assert classify(policy, client_ip="2001:db8::1").rule == "bad-network"
+        # The /32 comes after the /24 it is inside, so the /24 still wins
+        assert classify(policy, client_ip="203.0.113.7").rule == "bad-network"
+
+    def test_invalid_client_ip(self, policy):
+        assert classify(policy, client_ip="unknown") == BotVerdict()
+
+    def test_combined_conditions(self, policy):
+        assert classify(policy, "python-requests/2.31", "/meetings.json").denied
+        assert not classify(policy, "python-requests/2.31", "/meetings").denied
+
+    def test_header_rule(self, policy):
+        headers = [(b"x-scraper", b"yes")]
+        assert policy.classify(headers, "/", "").rule == "header-rule"
+
+    def test_builtin_and_file_imports(self, policy):
+        assert classify(policy, "GPTBot/1.0").rule == "ai-robots-txt"
+        assert classify(policy, "ExtraBot/1.0").rule == "extra-rule"
+
+    def test_no_match(self, policy):
+        assert classify(policy, "curl/8") == BotVerdict()
+
+    def test_inline_global_flags(self, tmp_path):
+        path = tmp_path / "botPolicy.yaml"
+        path.write_text(
+            """
+bots:
+  - name: scrapy
+    user_agent_regex: Scrapy
+    action: DENY
+  - name: gptbot
+    user_agent_regex: (?i)gptbot
+    action: DENY
+  - name: curl
+    user_agent_regex: curl
+    action: CHALLENGE
+"""
+        )
+        policy = load_bot_policy(str(path))
+
+        assert classify(policy, "Mozilla/5.0 (compatible; GPTBot/1.0)").rule == "gptbot"
+        assert classify(policy, "Scrapy/2.11 gptbot").rule == "scrapy"
+        assert classify(policy, "curl/8 gptbot").rule == "gptbot"
+        assert classify(policy, "curl/8").rule == "curl"
+        assert policy.skipped == ()
+
+
+def test_denied_bot_is_low_priority():
+    headers = [(b"user-agent", b"Mozilla/5.0 Firefox/130.0")]
+
+    priority = classify_request(
+        headers, "/meetings", "testcity", BotVerdict("DENY", "rule")
+    )
+
+    assert priority == PRIORITY_LOW
+
+
+@pytest.mark.asyncio
+async def test_router_rate_limits_denied_bot_html(policy):
+    """Bots the policy denies are rate limited on HTML pages too."""
+    with (
+        patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+        patch("datasette.app.Datasette") as mock_datasette,
+        patch("django_plugins.datasette_by_subdomain.Environment") as mock_env,
+        patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
+        patch.object(datasette_by_subdomain, "get_bot_policy", return_value=policy),
+        patch(
+            "django_plugins.datasette_by_subdomain.check_rate_limit",
+            AsyncMock(return_value=True),
+        ) as mock_rate_limit,
+    ):
+        mock_sqlite.return_value.__getitem__.return_value.get.return_value = {
+            "name": "Test City",
+            "state": "CA",
+            "subdomain": "testcity",
+            "last_updated": "2024-01-01",
+        }
+        mock_env.return_value.get_template.return_value.render.return_value = "{}"
+        send = AsyncMock()
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/meetings",
+            "query_string": b"",
+            "headers": [
+                (b"host", b"testcity.civic.band"),
+                (b"user-agent", b"Scrapy/2.11"),
+            ],
+            "client": ("198.51.100.1", 1234),
+        }
+
+        await datasette_by_subdomain.wrap(AsyncMock())(scope, AsyncMock(), send)
+
+        mock_rate_limit.assert_awaited_once_with("198.51.100.1")
+        assert send.call_args_list[0][0][0]["status"] == 402
+        mock_datasette.return_value.app.assert_not_called()
@@ -0,0 +1,174 @@
+"""
+Tests for streaming response compression.
+
+Tests cover:
+- Which responses are compressible
+- Whole-body and streamed compression, with their headers
+- Passing through small, encoded and non-text responses
+- The router compressing Datasette responses
+"""
+
+import gzip
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import compression, datasette_by_subdomain
+from django_plugins.compression import compress_send, is_compressible
+
+HTML = [(b"content-type", b"text/html; charset=utf-8")]
+PAGE = b"<tr><td>Meeting called to order at 7:00 PM</td></tr>\n" * 200
+GZIP = [(b"accept-encoding", b"gzip, deflate")]
+
+
+async def run(messages, request_headers=GZIP, method="GET"):
+    """Send messages through compress_send; returns what reached the client."""
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    wrapped = compress_send(send, request_headers, method)
+    for message in messages:
+        await wrapped(message)
+    return sent
+
+
+def response(headers, *chunks, status=200):
+    messages = [{"type": "http.response.start", "status": status, "headers": headers}]
+    for index, chunk in enumerate(chunks):
+        messages.append(
+            {
+                "type": "http.response.body",
+                "body": chunk,
+                "more_body": index < len(chunks) - 1,
+            }
+        )
+    return messages
+
+
+def test_is_compressible():
+    assert is_compressible(200, HTML)
+    assert is_compressible(404, [(b"content-type", b"application/json")])
+    assert not is_compressible(304, HTML)
+    assert not is_compressible(206, HTML)
+    assert not is_compressible(200, [(b"content-type", b"application/octet-stream")])
+    assert not is_compressible(200, [*HTML, (b"content-encoding", b"gzip")])
+    assert not is_compressible(200, [*HTML, (b"cache-control", b"no-transform")])
+    assert not is_compressible(200, [*HTML, (b"content-length", b"12")])
+
+
+@pytest.mark.asyncio
+class TestCompressSend:
+    """Test compressing responses as they are sent."""
+
+    async def test_whole_body_gets_exact_length(self):
+        headers = [*HTML, (b"content-length", str(len(PAGE)).encode())]
+        start, body = await run(response(headers, PAGE))
+
+        response_headers = dict(start["headers"])
+        assert response_headers[b"content-encoding"] == b"gzip"
+        assert response_headers[b"vary"] == b"Accept-Encoding"
+        assert int(response_headers[b"content-length"]) == len(body["body"])
+        assert gzip.decompress(body["body"]) == PAGE
+        assert len(body["body"]) * 5 < len(PAGE)
+
+    async def test_streamed_body_is_compressed_per_chunk(self):
+        sent = await run(response(HTML, PAGE, PAGE, b""))
+
+        start, *bodies = sent
+        assert b"content-length" not in dict(start["headers"])
+        assert [body["more_body"] for body in bodies] == [True, True, False]
+        # Every chunk is flushed, so the client can decode it on arrival
+        assert bodies[0]["body"] and bodies[1]["body"]
+        assert gzip.decompress(b"".join(body["body"] for body in bodies)) == (
+            PAGE + PAGE
+        )
+
+    async def test_strong_etag_is_weakened(self):
+        start, _ = await run(response([*HTML, (b"etag", b'"abc"')], PAGE))
+
+        assert dict(start["headers"])[b"etag"] == b'W/"abc"'
+
+    async def test_vary_is_merged(self):
+        start, _ = await run(response([*HTML, (b"vary", b"Cookie")], PAGE))
+
+        assert dict(start["headers"])[b"vary"] == b"Cookie, Accept-Encoding"
+
+    async def test_small_body_passes_through(self):
+        start, body = await run(response(HTML, b"<p>hi</p>"))
+
+        assert b"content-encoding" not in dict(start["headers"])
+        assert body["body"] == b"<p>hi</p>"
+
+    async def test_client_without_encodings_gets_vary(self):
+        start, body = await run(response(HTML, PAGE), request_headers=[])
+
+        assert dict(start["headers"])[b"vary"] == b"Accept-Encoding"
+        assert b"content-encoding" not in dict(start["headers"])
+        assert body["body"] == PAGE
+
+    async def test_binary_response_passes_through(self):
+        messages = response([(b"content-type", b"application/x-sqlite3")], PAGE)
+
+        assert await run(messages) == messages
+
+    async def test_head_request_passes_through(self):
+        messages = response(HTML, PAGE)
+
+        assert await run(messages, method="HEAD") == messages
+
+    async def test_records_bytes_saved(self):
+        with patch.object(compression, "metrics") as mock_metrics:
+            await run(response(HTML, PAGE))
+
+        mock_metrics.inc.assert_any_call(
+            "compression_bytes_in_total", len(PAGE), encoding="gzip"
+        )
+
+
+@pytest.mark.asyncio
+async def test_router_compresses_datasette_response():
+    site = {
+        "name": "Test City",
+        "state": "CA",
+        "subdomain": "testcity",
+        "last_updated": "2024-01-01",
+    }
+
+    async def datasette_app(_scope, _receive, send):
+        for message in response(HTML, PAGE):
+            await send(message)
+
+    send = AsyncMock()
+    with (
+        patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+        patch("datasette.app.Datasette") as mock_datasette,
+        patch("django_plugins.datasette_by_subdomain.Environment") as mock_env,
+        patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
+    ):
+        mock_sqlite.return_value.__getitem__.return_value.get.return_value = site
+        mock_env.return_value.get_template.return_value.render.return_value = "{}"
+        mock_datasette.return_value.app.return_value = datasette_app
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/meetings/minutes",
+            "query_string": b"",
+            "headers": [
+                (b"host", b"testcity.civic.band"),
+                (b"user-agent", b"Mozilla/5.0 Firefox/130.0"),
+                *GZIP,
+            ],
+        }
+        await datasette_by_subdomain.wrap(AsyncMock())(scope, AsyncMock(), send)
+
+    start, body = (call.args[0] for call in send.call_args_list)
+    assert dict(start["headers"])[b"content-encoding"] == b"gzip"
+    assert gzip.decompress(body["body"]) == PAGE
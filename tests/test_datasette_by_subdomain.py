@@ -25,9 +25,7 @@ from django_plugins import datasette_by_subdomain
 @pytest.mark.asyncio
 async def test_asgi_wrapper_localhost():
     """Test that localhost requests route to the original app with early return."""
-    with patch(
-        "django_plugins.datasette_by_subdomain.sqlite_utils.Database"
-    ) as mock_sqlite:
+    with patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite:
         # Setup mocks
         mock_app = AsyncMock()
         # Add required fields to the scope
@@ -60,9 +58,7 @@ async def test_asgi_wrapper_fully_mocked():
     # than what we're patching. Let's fix this based on the implementation.
 
     with (
-        patch(
-            "django_plugins.datasette_by_subdomain.sqlite_utils"
-        ) as mock_sqlite_utils,
+        patch("django_plugins.site_registry.sqlite_utils") as mock_sqlite_utils,
         patch("datasette.app.Datasette") as mock_datasette,
         patch("django_plugins.datasette_by_subdomain.Environment") as mock_environment,
         patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
@@ -119,7 +115,13 @@ async def test_asgi_wrapper_fully_mocked():
         mock_datasette.assert_called_once()
 
         # Verify datasette app was called with the correct scope
-        mock_ds_app.assert_called_once_with(mock_scope, mock_receive, mock_send)
+        mock_ds_app.assert_called_once()
+        ds_scope, ds_receive, ds_send = mock_ds_app.call_args[0]
+        assert (ds_scope, ds_receive) == (mock_scope, mock_receive)
+
+        # The instrumented send forwards to the original one
+        await ds_send({"type": "http.response.body", "body": b""})
+        mock_send.assert_awaited_once_with({"type": "http.response.body", "body": b""})
 
         # Verify original app was not called
         mock_app.assert_not_called()
@@ -130,9 +132,7 @@ async def test_asgi_wrapper_fully_mocked():
 async def test_metadata_template_rendering():
     """Integration test that uses the real metadata.json template."""
     with (
-        patch(
-            "django_plugins.datasette_by_subdomain.sqlite_utils.Database"
-        ) as mock_sqlite,
+        patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
         patch("datasette.app.Datasette") as mock_datasette,
         patch(
             "django_plugins.datasette_by_subdomain.Environment", autospec=True
@@ -235,9 +235,7 @@ class TestQueryLengthProtection:
 @pytest.mark.asyncio
 async def test_bot_protection_blocks_long_queries():
     """Test that long text queries return 402."""
-    with patch(
-        "django_plugins.datasette_by_subdomain.sqlite_utils.Database"
-    ) as mock_sqlite:
+    with patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite:
         mock_app = AsyncMock()
         long_text = "a" * 600
         mock_scope = {
@@ -283,9 +281,7 @@ async def test_bot_protection_blocks_long_queries():
 @pytest.mark.asyncio
 async def test_asgi_wrapper_missing_subdomain():
     """Test handling when subdomain doesn't exist - should redirect to civic.band."""
-    with patch(
-        "django_plugins.datasette_by_subdomain.sqlite_utils.Database"
-    ) as mock_sqlite:
+    with patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite:
         # Setup mocks
         mock_app = AsyncMock()
         mock_scope = {
@@ -339,9 +335,7 @@ async def test_asgi_wrapper_missing_subdomain():
 @pytest.mark.asyncio
 async def test_asgi_wrapper_missing_subdomain_returns_none():
     """Test handling when subdomain lookup returns None (not exception)."""
-    with patch(
-        "django_plugins.datasette_by_subdomain.sqlite_utils.Database"
-    ) as mock_sqlite:
+    with patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite:
         # Setup mocks
         mock_app = AsyncMock()
         mock_scope = {
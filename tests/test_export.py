@@ -0,0 +1,299 @@
+"""
+Tests for streaming table exports.
+
+Tests cover:
+- Parsing export paths, cursors and limits
+- Keyset page queries
+- Streaming NDJSON and CSV in pages, resuming and stopping early
+- The router's access control for exports
+- Export metrics on /metrics
+"""
+
+import asyncio
+import csv
+import io
+import json
+import sqlite3
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from datasette.app import Datasette
+from django.test import RequestFactory
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from config.views import metrics_view
+from django_plugins import datasette_by_subdomain, export
+from django_plugins.export import (
+    ExportError,
+    ExportRequest,
+    page_sql,
+    parse_export_request,
+    resolve_table,
+    stream_export,
+)
+from django_plugins.metrics import metrics
+
+SITE = {
+    "name": "Test City",
+    "state": "CA",
+    "subdomain": "testcity",
+    "last_updated": "2024-01-01",
+}
+
+
+class TestParseExportRequest:
+    """Test parsing export paths and parameters."""
+
+    def test_parses_path_and_params(self):
+        request = parse_export_request(
+            "/-/export/meetings/minutes.ndjson", b'_after=["min-002"]&_limit=50'
+        )
+
+        assert (request.database, request.table, request.format) == (
+            "meetings",
+            "minutes",
+            "ndjson",
+        )
+        assert request.after == ["min-002"]
+        assert request.limit == 50
+
+    @pytest.mark.parametrize(
+        ("path", "query_string", "status"),
+        [
+            ("/-/export/meetings/minutes.xml", b"", 404),
+            ("/-/export/meetings", b"", 404),
+            ("/-/export/meetings/minutes.csv", b"_after=min-002", 400),
+            ("/-/export/meetings/minutes.csv", b"_after=[]", 400),
+            ("/-/export/meetings/minutes.csv", b"_limit=0", 400),
+        ],
+    )
+    def test_rejects_malformed(self, path, query_string, status):
+        with pytest.raises(ExportError) as excinfo:
+            parse_export_request(path, query_string)
+
+        assert excinfo.value.status == status
+
+
+def test_page_sql():
+    assert page_sql("minutes", ["id"], False, 100) == (
+        "select * from minutes order by id limit 100"
+    )
+    assert page_sql("minutes", ["rowid"], True, 100) == (
+        "select rowid, * from minutes where (rowid) > (?) order by rowid limit 100"
+    )
+
+
+async def connected():
+    """An ASGI receive for a client that stays connected."""
+    await asyncio.Event().wait()
+
+
+async def collect(datasette, request):
+    """Stream an export; returns the body messages sent."""
+    send = AsyncMock()
+    keys = await resolve_table(datasette, request)
+    await stream_export(datasette, request, keys, connected, send)
+    return [call.args[0] for call in send.call_args_list[1:]]
+
+
+@pytest.mark.asyncio
+class TestStreamExport:
+    """Test streaming exports from a real Datasette instance."""
+
+    @pytest.fixture(autouse=True)
+    def small_pages(self):
+        with patch.object(export, "EXPORT_PAGE_SIZE", 2):
+            yield
+
+    @pytest.fixture
+    def datasette_instance(self, temp_db):
+        return Datasette([str(temp_db)])
+
+    async def test_ndjson_in_pages(self, datasette_instance, temp_db):
+        bodies = await collect(
+            datasette_instance, ExportRequest(temp_db.stem, "agendas", "ndjson")
+        )
+
+        assert [body["more_body"] for body in bodies] == [True, False]
+        rows = [
+            json.loads(line)
+            for line in b"".join(body["body"] for body in bodies).splitlines()
+        ]
+        assert [row["id"] for row in rows] == ["agenda1", "agenda2", "agenda3"]
+
+    async def test_csv_header_once(self, datasette_instance, temp_db):
+        bodies = await collect(
+            datasette_instance, ExportRequest(temp_db.stem, "agendas", "csv")
+        )
+
+        rows = list(
+            csv.reader(io.StringIO(b"".join(b["body"] for b in bodies).decode()))
+        )
+        assert rows[0][:2] == ["id", "meeting"]
+        assert [row[0] for row in rows[1:]] == ["agenda1", "agenda2", "agenda3"]
+
+    async def test_resumes_after_cursor_with_limit(self, datasette_instance, temp_db):
+        bodies = await collect(
+            datasette_instance,
+            ExportRequest(temp_db.stem, "agendas", "ndjson", ["agenda1"], limit=1),
+        )
+
+        assert len(bodies) == 1
+        assert json.loads(bodies[0]["body"])["id"] == "agenda2"
+
+    async def test_rowid_table(self, tmp_path):
+        db_path = tmp_path / "finance.db"
+        conn = sqlite3.connect(db_path)
+        conn.execute("create table donations (donor text, amount integer)")
+        conn.executemany(
+            "insert into donations values (?, ?)", [("a", 1), ("b", 2), ("c", 3)]
+        )
+        conn.commit()
+        conn.close()
+        datasette = Datasette([str(db_path)])
+
+        bodies = await collect(
+            datasette, ExportRequest("finance", "donations", "ndjson")
+        )
+
+        lines = b"".join(body["body"] for body in bodies).splitlines()
+        assert [json.loads(line) for line in lines][-1] == {
+            "rowid": 3,
+            "donor": "c",
+            "amount": 3,
+        }
+
+    async def test_missing_table(self, datasette_instance, temp_db):
+        with pytest.raises(ExportError, match="Table not found"):
+            await resolve_table(
+                datasette_instance, ExportRequest(temp_db.stem, "nope", "csv")
+            )
+
+    async def test_stops_when_client_disconnects(self, datasette_instance, temp_db):
+        send = AsyncMock()
+        receive = AsyncMock(return_value={"type": "http.disconnect"})
+        request = ExportRequest(temp_db.stem, "agendas", "ndjson")
+
+        sent = await stream_export(datasette_instance, request, ["id"], receive, send)
+
+        assert sent == 2
+
+
+@pytest.mark.asyncio
+class TestRouter:
+    """Test the router's access control for exports."""
+
+    async def export(self, temp_db, internal=False, headers=(), api_key_valid=False):
+        send = AsyncMock()
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": f"/-/export/{temp_db.stem}/minutes.ndjson",
+            "query_string": b"",
+            "headers": [(b"host", b"testcity.civic.band"), *headers],
+        }
+        with (
+            patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+            patch.object(
+                datasette_by_subdomain,
+                "get_site_databases",
+                return_value=[str(temp_db)],
+            ),
+            patch.object(
+                datasette_by_subdomain,
+                "check_rate_limit",
+                AsyncMock(return_value=False),
+            ),
+            patch.object(
+                datasette_by_subdomain,
+                "is_internal_service_request",
+                MagicMock(return_value=internal),
+            ),
+            patch.object(
+                datasette_by_subdomain,
+                "is_validated_api_key",
+                AsyncMock(return_value=api_key_valid),
+            ),
+            patch.object(
+                datasette_by_subdomain,
+                "validate_api_key",
+                AsyncMock(return_value={"valid": api_key_valid}),
+            ),
+        ):
+            mock_sqlite.return_value.__getitem__.return_value.get.return_value = SITE
+            await datasette_by_subdomain.wrap(AsyncMock())(scope, connected, send)
+        return [call.args[0] for call in send.call_args_list]
+
+    async def test_anonymous_gets_401(self, temp_db):
+        messages = await self.export(temp_db)
+
+        assert messages[0]["status"] == 401
+
+    async def test_first_party_referer_without_key_gets_401(self, temp_db):
+        messages = await self.export(
+            temp_db, headers=[(b"referer", b"https://testcity.civic.band/")]
+        )
+
+        assert messages[0]["status"] == 401
+
+    @pytest.mark.parametrize(
+        "trusted_header",
+        [
+            (b"referer", b"https://testcity.civic.band/"),
+            (b"user-agent", b"Zotero/7.0"),
+        ],
+    )
+    async def test_api_key_from_trusted_source_gets_export(
+        self, temp_db, trusted_header
+    ):
+        messages = await self.export(
+            temp_db,
+            headers=[trusted_header, (b"x-api-key", b"org-key")],
+            api_key_valid=True,
+        )
+
+        assert messages[0]["status"] == 200
+
+    async def test_invalid_api_key_from_trusted_source_gets_401(self, temp_db):
+        messages = await self.export(
+            temp_db,
+            headers=[
+                (b"referer", b"https://testcity.civic.band/"),
+                (b"x-api-key", b"bad-key"),
+            ],
+        )
+
+        assert messages[0]["status"] == 401
+
+    async def test_internal_service_gets_export(self, temp_db):
+        messages = await self.export(temp_db, internal=True)
+
+        assert messages[0]["status"] == 200
+        assert dict(messages[0]["headers"])[b"x-export-key"] == b"id"
+        lines = b"".join(message["body"] for message in messages[1:]).splitlines()
+        assert len(lines) == 2
+
+    async def test_metrics_after_export(self, temp_db, settings, tmp_path):
+        settings.CIVIC_OBSERVER_SECRET = "real-secret-value"
+        await self.export(
+            temp_db, internal=True, headers=[(b"accept-encoding", b"gzip")]
+        )
+
+        with patch.object(metrics, "directory", str(tmp_path)):
+            response = metrics_view(
+                RequestFactory().get(
+                    "/metrics", HTTP_X_SERVICE_SECRET="real-secret-value"
+                )
+            )
+
+        text = response.content.decode()
+        assert "# TYPE export_seconds histogram" in text
+        assert "# TYPE export_rows_total counter" in text
+        assert "# TYPE compression_bytes_in_total counter" in text
+        assert "# TYPE compression_bytes_out_total counter" in text
+        assert "# HELP export_seconds Time taken to stream a table export" in text
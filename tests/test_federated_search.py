@@ -0,0 +1,289 @@
+"""
+Tests for federated search across site databases.
+
+Tests cover:
+- FTS query escaping
+- Top-k merging by bm25 score
+- Per-site search, time budgets and missing databases
+- Handing blocking events to async code as they arrive
+- The /api/search/ streaming endpoint, site filters and rate limit
+"""
+
+import json
+import sqlite3
+import threading
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, Client
+
+from pages import search
+from pages.models import Site
+
+
+def create_site_db(site_dir, rows):
+    """Create a meetings.db with FTS5-indexed agendas and minutes tables."""
+    site_dir.mkdir(parents=True)
+    conn = sqlite3.connect(site_dir / "meetings.db")
+    for table in search.SEARCH_TABLES:
+        conn.execute(
+            f"CREATE TABLE {table} (id TEXT PRIMARY KEY, meeting TEXT, date TEXT, "
+            "page INTEGER, text TEXT)"
+        )
+        conn.execute(
+            f"CREATE VIRTUAL TABLE {table}_fts USING FTS5 (text, content=[{table}])"
+        )
+    for table, row_id, text in rows:
+        conn.execute(
+            f"INSERT INTO {table} VALUES (?, 'City Council', '2024-01-15', 1, ?)",
+            [row_id, text],
+        )
+    for table in search.SEARCH_TABLES:
+        conn.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def sites_dir(tmp_path, monkeypatch):
+    """Two sites under ../sites relative to a temp working directory."""
+    app_dir = tmp_path / "app"
+    app_dir.mkdir()
+    create_site_db(
+        tmp_path / "sites" / "alameda.ca",
+        [
+            ("agendas", "a1", "budget budget budget hearing"),
+            ("minutes", "m1", "the budget was approved"),
+        ],
+    )
+    create_site_db(
+        tmp_path / "sites" / "austin.tx",
+        [("minutes", "m1", "zoning and budget discussion")],
+    )
+    monkeypatch.chdir(app_dir)
+    return tmp_path / "sites"
+
+
+class TestEscapeFtsQuery:
+    """Test quoting user queries for FTS5."""
+
+    def test_quotes_bare_words(self):
+        assert search.escape_fts_query("city budget") == '"city" "budget"'
+
+    def test_keeps_phrases(self):
+        assert search.escape_fts_query('"city council" vote') == '"city council" "vote"'
+
+    def test_closes_unbalanced_quote(self):
+        assert search.escape_fts_query('"city council') == '"city council"'
+
+    def test_neutralizes_operators(self):
+        assert search.escape_fts_query("budget OR NOT x*") == (
+            '"budget" "OR" "NOT" "x*"'
+        )
+
+
+class TestTopK:
+    """Test merging results into a global top-k."""
+
+    def test_keeps_lowest_scores_in_order(self):
+        top_k = search.TopK(2)
+        for score in (-1.0, -5.0, -3.0, 0.0):
+            top_k.add({"score": score})
+
+        assert [item["score"] for item in top_k.results()] == [-5.0, -3.0]
+
+    def test_ties_keep_arrival_order(self):
+        top_k = search.TopK(3)
+        for name in ("first", "second"):
+            top_k.add({"score": -1.0, "name": name})
+
+        assert [item["name"] for item in top_k.results()] == ["first", "second"]
+
+
+@pytest.mark.usefixtures("sites_dir")
+class TestSearchSite:
+    """Test searching a single site."""
+
+    def test_returns_ranked_results(self):
+        result = search.search_site("alameda.ca", '"budget"', 10, 1000)
+
+        assert result["timed_out"] is False
+        assert {item["table"] for item in result["results"]} == {"agendas", "minutes"}
+        assert all(item["subdomain"] == "alameda.ca" for item in result["results"])
+        assert "<mark>budget</mark>" in result["results"][0]["snippet"]
+
+    def test_missing_database_reports_error(self):
+        result = search.search_site("nowhere.ca", '"budget"', 10, 1000)
+
+        assert result["results"] == []
+        assert "error" in result
+
+    def test_time_budget_interrupts_query(self):
+        with patch.object(search, "PROGRESS_HANDLER_INTERVAL", 1):
+            result = search.search_site("alameda.ca", '"budget"', 10, 0)
+
+        assert result["timed_out"] is True
+        assert result["results"] == []
+
+
+@pytest.mark.usefixtures("sites_dir")
+class TestFederatedSearch:
+    """Test fanning out a search across sites."""
+
+    def test_streams_site_events_then_results(self):
+        events = list(search.federated_search(["alameda.ca", "austin.tx"], "budget"))
+
+        assert [event["type"] for event in events] == ["site", "site", "results"]
+        final = events[-1]
+        assert final["sites_searched"] == 2
+        assert len(final["results"]) == 3
+        scores = [item["score"] for item in final["results"]]
+        assert scores == sorted(scores)
+
+    def test_limit_applies_to_merged_results(self):
+        events = list(
+            search.federated_search(["alameda.ca", "austin.tx"], "budget", limit=1)
+        )
+
+        assert len(events[-1]["results"]) == 1
+        assert events[-1]["results"][0]["id"] == "a1"
+
+
+class TestStreamEvents:
+    """Test handing a blocking generator's events to async code."""
+
+    @pytest.mark.asyncio
+    async def test_yields_events_before_generator_finishes(self):
+        release = threading.Event()
+
+        def events():
+            yield 1
+            release.wait(5)
+            yield 2
+
+        stream = search.stream_events(events())
+        assert await anext(stream) == 1
+        release.set()
+        assert [event async for event in stream] == [2]
+
+    @pytest.mark.asyncio
+    async def test_raises_generator_errors(self):
+        def events():
+            yield 1
+            raise ValueError("broken")
+
+        stream = search.stream_events(events())
+        assert await anext(stream) == 1
+        with pytest.raises(ValueError, match="broken"):
+            await anext(stream)
+
+    @pytest.mark.asyncio
+    async def test_closes_generator_when_consumer_stops(self):
+        closed = threading.Event()
+
+        def events():
+            try:
+                while True:
+                    yield 1
+            finally:
+                closed.set()
+
+        stream = search.stream_events(events())
+        assert await anext(stream) == 1
+        await stream.aclose()
+
+        assert closed.wait(5)
+
+
+def read_events(response):
+    """Decode the NDJSON events of a streamed /api/search/ response."""
+
+    async def read():
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    return [json.loads(line) for line in async_to_sync(read)().splitlines()]
+
+
+@pytest.fixture
+def sites():
+    Site.objects.create(subdomain="alameda.ca", name="Alameda", state="CA")
+    Site.objects.create(subdomain="austin.tx", name="Austin", state="TX")
+
+
+@pytest.fixture
+def rate_limit():
+    with patch(
+        "pages.views.check_rate_limit", AsyncMock(return_value=False)
+    ) as check_rate_limit:
+        yield check_rate_limit
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("sites_dir", "sites", "rate_limit")
+class TestFederatedSearchView:
+    """Test /api/search/ endpoint."""
+
+    def get_events(self, url):
+        response = Client().get(url)
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/x-ndjson"
+        return read_events(response)
+
+    def test_missing_search_returns_400(self):
+        response = Client().get("/api/search/")
+        assert response.status_code == 400
+
+    def test_invalid_limit_returns_400(self):
+        response = Client().get("/api/search/?search=budget&limit=lots")
+        assert response.status_code == 400
+
+    def test_searches_all_sites(self):
+        events = self.get_events("/api/search/?search=budget")
+
+        assert {item["subdomain"] for item in events[-1]["results"]} == {
+            "alameda.ca",
+            "austin.tx",
+        }
+
+    def test_state_filter_limits_sites(self):
+        events = self.get_events("/api/search/?search=budget&state=TX")
+
+        assert events[-1]["sites_searched"] == 1
+        assert {item["subdomain"] for item in events[-1]["results"]} == {"austin.tx"}
+
+    def test_rate_limited_client_gets_429(self, rate_limit):
+        rate_limit.return_value = True
+
+        response = Client().get(
+            "/api/search/?search=budget", HTTP_X_FORWARDED_FOR="203.0.113.9, 10.0.0.1"
+        )
+
+        assert response.status_code == 429
+        rate_limit.assert_awaited_once_with("203.0.113.9")
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("sites_dir", "sites", "rate_limit")
+async def test_view_streams_first_site_before_fan_out_finishes():
+    release = threading.Event()
+    search_site = search.search_site
+
+    def slow_austin(subdomain, *args):
+        if subdomain == "austin.tx":
+            release.wait(5)
+        return search_site(subdomain, *args)
+
+    with patch.object(search, "search_site", slow_austin):
+        response = await AsyncClient().get("/api/search/?search=budget")
+        stream = aiter(response.streaming_content)
+        first = json.loads(await anext(stream))
+        # austin.tx is still searching when the first site's event is sent
+        assert first["type"] == "site"
+        assert first["subdomain"] != "austin.tx"
+        release.set()
+        rest = [json.loads(line) async for line in stream]
+
+    assert "austin.tx" in {event.get("subdomain") for event in rest}
+    assert rest[-1]["type"] == "results"
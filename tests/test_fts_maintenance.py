@@ -0,0 +1,197 @@
+"""
+Tests for the fts_maintenance management command.
+
+Tests cover:
+- FTS table discovery for FTS4 and FTS5 indexes
+- Segment counts from the FTS5 structure record
+- Detecting external-content indexes that are out of sync
+- Optimizing on a copy and swapping it into place
+- The machine-readable report
+"""
+
+import json
+import sqlite3
+import sys
+from io import StringIO
+from unittest.mock import MagicMock
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import site_inspect
+from pages.management.commands import fts_maintenance
+
+
+@pytest.fixture
+def site_db(tmp_path, monkeypatch):
+    """Create ../sites/testcity/meetings.db with FTS5 and FTS4 indexes."""
+    app_dir = tmp_path / "app"
+    site_dir = tmp_path / "sites" / "testcity"
+    app_dir.mkdir()
+    site_dir.mkdir(parents=True)
+    db_path = site_dir / "meetings.db"
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE agendas (id INTEGER PRIMARY KEY, text TEXT)")
+    conn.execute("CREATE TABLE minutes (id INTEGER PRIMARY KEY, text TEXT)")
+    conn.execute(
+        "CREATE VIRTUAL TABLE agendas_fts USING FTS5 (text, content=[agendas])"
+    )
+    conn.execute(
+        "CREATE VIRTUAL TABLE minutes_fts USING FTS4 (text, content=[minutes])"
+    )
+    # One transaction per row leaves one segment per row
+    for i in range(4):
+        text = f"budget hearing item {i}"
+        conn.execute("INSERT INTO agendas (id, text) VALUES (?, ?)", [i, text])
+        conn.execute("INSERT INTO agendas_fts (rowid, text) VALUES (?, ?)", [i, text])
+        conn.execute("INSERT INTO minutes (id, text) VALUES (?, ?)", [i, text])
+        conn.execute("INSERT INTO minutes_fts (docid, text) VALUES (?, ?)", [i, text])
+        conn.commit()
+    conn.close()
+
+    monkeypatch.chdir(app_dir)
+    return db_path
+
+
+def fts_stats(db_path, name):
+    conn = sqlite3.connect(db_path)
+    try:
+        fts = next(
+            fts for fts in fts_maintenance.find_fts_tables(conn) if fts["name"] == name
+        )
+        return fts_maintenance.fts_table_stats(conn, fts)
+    finally:
+        conn.close()
+
+
+class TestFtsStats:
+    """Test reading FTS index stats."""
+
+    def test_finds_fts_tables(self, site_db):
+        conn = sqlite3.connect(site_db)
+        tables = fts_maintenance.find_fts_tables(conn)
+        conn.close()
+
+        assert tables == [
+            {"name": "agendas_fts", "module": "fts5", "content": "agendas"},
+            {"name": "minutes_fts", "module": "fts4", "content": "minutes"},
+        ]
+
+    def test_fts5_segments(self, site_db):
+        stats = fts_stats(site_db, "agendas_fts")
+
+        assert stats["segments"] == 4
+        assert stats["optimized"] is False
+        assert stats["size_bytes"] > 0
+
+    def test_fts4_segments(self, site_db):
+        stats = fts_stats(site_db, "minutes_fts")
+
+        assert stats["segments"] == 4
+        assert stats["optimized"] is False
+
+    def test_in_sync(self, site_db):
+        assert fts_stats(site_db, "agendas_fts")["in_sync"] is True
+
+    def test_out_of_sync(self, site_db):
+        conn = sqlite3.connect(site_db)
+        conn.execute("INSERT INTO agendas (id, text) VALUES (99, 'not indexed')")
+        conn.commit()
+        conn.close()
+
+        stats = fts_stats(site_db, "agendas_fts")
+
+        assert stats["in_sync"] is False
+        assert stats["content_rows"] == 5
+        assert stats["documents"] == 4
+
+    def test_read_varint(self):
+        assert fts_maintenance._read_varint(b"\x05", 0) == (5, 1)
+        assert fts_maintenance._read_varint(b"\x81\x00", 0) == (128, 2)
+
+
+class TestMaintainDatabase:
+    """Test optimizing a database via copy and swap."""
+
+    def test_optimize_merges_segments(self, site_db):
+        fts_maintenance.maintain_database(str(site_db))
+
+        assert fts_stats(site_db, "agendas_fts")["segments"] == 1
+        assert fts_stats(site_db, "minutes_fts")["segments"] == 1
+        assert not site_db.with_name("meetings.db.fts-maintenance.tmp").exists()
+
+    def test_optimize_runs_analyze(self, site_db):
+        fts_maintenance.maintain_database(str(site_db))
+
+        conn = sqlite3.connect(site_db)
+        tables = conn.execute(
+            "select name from sqlite_master where name = 'sqlite_stat1'"
+        ).fetchall()
+        conn.close()
+        assert tables == [("sqlite_stat1",)]
+
+    def test_search_results_unchanged(self, site_db):
+        fts_maintenance.maintain_database(str(site_db), merge=16)
+
+        conn = sqlite3.connect(site_db)
+        rows = conn.execute(
+            "select rowid from agendas_fts where agendas_fts match 'budget'"
+        ).fetchall()
+        conn.close()
+        assert len(rows) == 4
+
+    @pytest.mark.usefixtures("site_db")
+    def test_refreshes_existing_inspect_data(self):
+        db_list = ["../sites/testcity/meetings.db"]
+        site_inspect.write_inspect_data("testcity", site_inspect.inspect_site(db_list))
+
+        fts_maintenance.check_site("testcity", optimize=True)
+
+        assert "meetings" in site_inspect.load_inspect_data("testcity", db_list)
+
+
+@pytest.mark.usefixtures("site_db")
+class TestFtsMaintenanceCommand:
+    """Test the fts_maintenance management command."""
+
+    def test_json_report(self, tmp_path):
+        report_path = tmp_path / "report.json"
+
+        call_command("fts_maintenance", json_path=str(report_path), stdout=StringIO())
+
+        report = json.loads(report_path.read_text())
+        assert report["probe"] == "budget"
+        site = report["sites"][0]
+        assert site["subdomain"] == "testcity"
+        assert site["segments"] == 8
+        assert {table["name"] for table in site["fts_tables"]} == {
+            "agendas_fts",
+            "minutes_fts",
+        }
+        assert site["probe_ms"] >= 0
+
+    def test_summary_output(self):
+        out = StringIO()
+
+        call_command("fts_maintenance", "testcity", optimize=True, stdout=out)
+
+        assert "testcity:" in out.getvalue()
+        assert "2 segments" in out.getvalue()
+
+    def test_missing_site_reports_error(self):
+        out = StringIO()
+
+        call_command("fts_maintenance", "nowhere", stdout=out)
+
+        assert "nowhere: error" in out.getvalue()
+
+    def test_rejects_non_positive_merge(self):
+        with pytest.raises(CommandError, match="--merge"):
+            call_command("fts_maintenance", merge=0)
@@ -0,0 +1,213 @@
+"""
+Tests for the Prometheus-style metrics.
+
+Tests cover:
+- Counters, histograms and gauges in one worker's store
+- Merging snapshots across workers and archiving exited workers
+- The text exposition format
+- Every recorded metric being declared, and the router's gauges
+- Recording finished router requests
+- The internal-only /metrics view
+"""
+
+import re
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+from django.http import Http404
+from django.test import RequestFactory
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from config.views import metrics_view
+from django_plugins import datasette_by_subdomain  # noqa: F401 (registers gauges)
+from django_plugins import metrics as metrics_module
+from django_plugins.metrics import (
+    METRICS,
+    MetricsStore,
+    record_request,
+    render_prometheus,
+)
+from django_plugins.request_timing import StageTimer
+
+
+def make_store(directory, pid):
+    store = MetricsStore(str(directory))
+    store.pid = pid
+    return store
+
+
+class TestMetricsStore:
+    """Test one worker's store."""
+
+    def test_counters_and_histograms(self, tmp_path):
+        store = make_store(tmp_path, 1)
+        store.inc("rate_limit_hits_total")
+        store.inc("rate_limit_hits_total", 2)
+        store.observe("router_request_duration_seconds", 0.003, tier="human")
+
+        snapshot = store.snapshot()
+
+        assert snapshot["counters"] == [["rate_limit_hits_total", (), 3]]
+        [[name, labels, values]] = snapshot["histograms"]
+        assert labels == (("tier", "human"),)
+        assert sum(values[:-1]) == 1
+        assert values[-1] == 0.003
+
+    def test_failing_gauge_is_skipped(self, tmp_path):
+        store = make_store(tmp_path, 1)
+        store.register_gauge("admission_in_flight", lambda: 1 / 0)
+
+        assert store.snapshot()["gauges"] == []
+
+    def test_labeled_gauges(self, tmp_path):
+        store = make_store(tmp_path, 1)
+        store.register_gauge("sql_executor_queued", lambda: 2, priority="api_key")
+        store.register_gauge("sql_executor_queued", lambda: 5, priority="anonymous")
+
+        text = render_prometheus(store.collect())
+
+        assert 'sql_executor_queued{priority="api_key"} 2' in text
+        assert 'sql_executor_queued{priority="anonymous"} 5' in text
+        assert text.count("# TYPE sql_executor_queued gauge") == 1
+
+    def test_maybe_flush_only_when_dirty(self, tmp_path):
+        store = make_store(tmp_path, 1)
+        store.maybe_flush()
+        assert not (tmp_path / "worker-1.json").exists()
+
+        store.inc("rate_limit_hits_total")
+        store.maybe_flush()
+        assert (tmp_path / "worker-1.json").exists()
+
+
+class TestCollect:
+    """Test merging every worker's snapshot."""
+
+    def test_sums_across_workers(self, tmp_path):
+        other = make_store(tmp_path, 2)
+        other.inc("api_key_cache_total", result="hit")
+        other.register_gauge("admission_in_flight", lambda: 3)
+        other.flush()
+        store = make_store(tmp_path, 1)
+        store.inc("api_key_cache_total", result="hit")
+        store.register_gauge("admission_in_flight", lambda: 1)
+
+        with patch.object(metrics_module, "_pid_alive", return_value=True):
+            merged = store.collect()
+
+        assert merged["counters"][("api_key_cache_total", (("result", "hit"),))] == 2
+        assert merged["gauges"][("admission_in_flight", ())] == 4
+
+    def test_exited_workers_are_archived(self, tmp_path):
+        dead = make_store(tmp_path, 2)
+        dead.inc("rate_limit_hits_total", 5)
+        dead.register_gauge("admission_in_flight", lambda: 7)
+        dead.flush()
+        store = make_store(tmp_path, 1)
+
+        with patch.object(metrics_module, "_pid_alive", return_value=False):
+            first = store.collect()
+            second = store.collect()
+
+        assert not (tmp_path / "worker-2.json").exists()
+        for merged in (first, second):
+            assert merged["counters"][("rate_limit_hits_total", ())] == 5
+            assert ("admission_in_flight", ()) not in merged["gauges"]
+
+
+def test_render_prometheus(tmp_path):
+    store = make_store(tmp_path, 1)
+    store.inc("router_requests_total", subdomain="alameda", tier="human", status=200)
+    store.observe("router_stage_duration_seconds", 0.02, stage="sql")
+
+    text = render_prometheus(store.collect())
+
+    assert "# TYPE router_requests_total counter" in text
+    assert (
+        'router_requests_total{status="200",subdomain="alameda",tier="human"} 1.0'
+        in text
+    )
+    assert 'router_stage_duration_seconds_bucket{stage="sql",le="0.01"} 0' in text
+    assert 'router_stage_duration_seconds_bucket{stage="sql",le="+Inf"} 1' in text
+    assert 'router_stage_duration_seconds_count{stage="sql"} 1' in text
+
+
+def test_recorded_metrics_are_declared():
+    repo = Path(__file__).resolve().parent.parent
+    pattern = re.compile(r'metrics\.(?:inc|observe|register_gauge)\(\s*"(\w+)"')
+    recorded = {
+        name
+        for directory in ("django_plugins", "plugins", "pages", "config")
+        for path in (repo / directory).rglob("*.py")
+        for name in pattern.findall(path.read_text())
+    }
+
+    assert recorded
+    assert recorded - set(METRICS) == set()
+    assert all(help_text for _, help_text in METRICS.values())
+
+
+def test_router_gauges():
+    gauges = {
+        (name, tuple(labels)): value
+        for name, labels, value in metrics_module.metrics.snapshot()["gauges"]
+    }
+
+    for priority in ("first_party", "api_key", "anonymous"):
+        assert gauges[("sql_executor_queued", (("priority", priority),))] == 0
+    assert ("sql_executor_busy", ()) in gauges
+    assert ("query_cache_bytes", ()) in gauges
+
+
+def test_record_request(tmp_path):
+    store = make_store(tmp_path, 1)
+    timer = StageTimer()
+    timer.subdomain = "alameda"
+    timer.tier = "low"
+    timer.status = 503
+    timer.add("sql", 0.01)
+    timer.add("sql_wait", 0.002)
+
+    with patch.object(metrics_module, "metrics", store):
+        record_request(timer)
+
+    assert (
+        store.counters[
+            (
+                "router_requests_total",
+                (("status", "503"), ("subdomain", "alameda"), ("tier", "low")),
+            )
+        ]
+        == 1
+    )
+    assert store.counters[("sql_wait_seconds_total", (("tier", "low"),))] == 0.002
+
+
+class TestMetricsView:
+    """Test the /metrics endpoint."""
+
+    def test_not_found_for_public_requests(self, settings):
+        settings.DEBUG = False
+        settings.CIVIC_OBSERVER_SECRET = "real-secret-value"
+
+        with pytest.raises(Http404):
+            metrics_view(RequestFactory().get("/metrics"))
+
+    def test_internal_services_get_metrics(self, settings, tmp_path):
+        settings.DEBUG = False
+        settings.CIVIC_OBSERVER_SECRET = "real-secret-value"
+        request = RequestFactory().get(
+            "/metrics", HTTP_X_SERVICE_SECRET="real-secret-value"
+        )
+
+        with patch.object(metrics_module.metrics, "directory", str(tmp_path)):
+            response = metrics_view(request)
+
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
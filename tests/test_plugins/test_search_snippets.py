@@ -0,0 +1,189 @@
+"""
+Tests for search_snippets.py plugin.
+
+Tests cover:
+- Escaping snippets and marking their matches
+- Which pages get snippets
+- Search result cards showing snippets instead of the full text
+- Leaving the full text out of search result table queries, but not
+  out of the page's links
+"""
+
+import sqlite3
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from datasette.app import Datasette
+from datasette.plugins import pm
+
+from plugins import search_snippets
+from plugins.search_snippets import extra_template_vars, snippet_markup
+
+FILLER = "The council reviewed routine correspondence and reports. " * 40
+
+
+@pytest.fixture
+def datasette_with_fts(tmp_path):
+    """A meetings database with searchable minutes, and the plugin loaded."""
+    db_path = tmp_path / "meetings.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE minutes (id TEXT PRIMARY KEY, meeting TEXT, date TEXT, "
+        "page INTEGER, text TEXT, page_image TEXT, entities_json TEXT, "
+        "votes_json TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO minutes VALUES (?, 'City Council', '2024-01-15', ?, ?, "
+        "'/img.png', NULL, NULL)",
+        [
+            ("min-001", 1, FILLER + "The <b>budget</b> was approved. " + FILLER),
+            ("min-002", 2, FILLER),
+        ],
+    )
+    conn.execute(
+        "CREATE VIRTUAL TABLE minutes_fts USING FTS5 (text, content=[minutes])"
+    )
+    conn.execute("INSERT INTO minutes_fts(minutes_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.close()
+
+    pm.register(search_snippets, name="search_snippets")
+    # datasette-search-all's menu links fail on FTS tables under this
+    # Datasette alpha; they're not what's being tested
+    search_all = pm.unregister(name="search_all")
+    templates_dir = Path(__file__).parent.parent.parent / "templates" / "datasette"
+    yield Datasette([str(db_path)], template_dir=str(templates_dir))
+    if search_all is not None:
+        pm.register(search_all, name="search_all")
+
+
+def test_snippet_markup_escapes_text():
+    assert snippet_markup("a <b>\x02budget\x03</b> vote") == (
+        "a &lt;b&gt;<mark>budget</mark>&lt;/b&gt; vote"
+    )
+
+
+@pytest.mark.parametrize(
+    ("view_name", "table", "args"),
+    [
+        ("row", "minutes", {"_search": "budget"}),
+        ("table", "votes", {"_search": "budget"}),
+        ("table", "minutes", {}),
+    ],
+)
+def test_only_search_result_tables_get_snippets(view_name, table, args):
+    request = MagicMock()
+    request.args = args
+
+    assert extra_template_vars("meetings", table, view_name, request, None) == {}
+
+
+@pytest.mark.parametrize(
+    ("content", "expected"),
+    [
+        (b"/m.json?_search=a&amp;_nocol=text", b"/m.json?_search=a"),
+        (
+            b"/m.json?_search=a&amp;_nocol=text&amp;_shape=array",
+            b"/m.json?_search=a&amp;_shape=array",
+        ),
+        (b"<m?_nocol=text&_next=2>", b"<m?_next=2>"),
+        (b'"m?_nocol=text"', b'"m"'),
+        (b'<input type="hidden" name="_nocol" value="text">', b""),
+        (b"m?_nocol=textual", b"m?_nocol=textual"),
+    ],
+)
+def test_without_added_param(content, expected):
+    assert search_snippets.without_added_param(content) == expected
+
+
+@pytest.mark.asyncio
+class TestSearchResultCards:
+    """Test rendering search results with snippets."""
+
+    async def test_search_shows_snippet(self, datasette_with_fts):
+        response = await datasette_with_fts.client.get(
+            "/meetings/minutes?_search=budget"
+        )
+
+        html = response.text
+        assert response.status_code == 200
+        assert html.count('<article class="page-card"') == 1
+        assert "&lt;b&gt;<mark>budget</mark>&lt;/b&gt; was approved" in html
+        assert 'class="card-text-full"' in html
+        assert html.count("routine correspondence") < 10
+        assert "card-text-content" not in html
+
+    async def test_search_without_snippet_shows_full_text(self, datasette_with_fts):
+        with patch.object(
+            search_snippets, "fetch_snippets", AsyncMock(return_value={})
+        ):
+            response = await datasette_with_fts.client.get(
+                "/meetings/minutes?_search=budget"
+            )
+
+        html = response.text
+        assert "card-snippet" not in html
+        assert "The &lt;b&gt;budget&lt;/b&gt; was approved" in html
+        assert html.count("routine correspondence") >= 40
+
+    async def test_search_page_links_keep_every_column(self, datasette_with_fts):
+        response = await datasette_with_fts.client.get(
+            "/meetings/minutes?_search=budget&_size=1"
+        )
+
+        assert response.status_code == 200
+        assert "minutes.json?_search=budget&amp;_size=1" in response.text
+        assert "minutes.csv?_search=budget" in response.text
+        assert "_shape=array" in response.text
+        assert "_nocol" not in response.text
+        assert "_nocol" not in response.headers["link"]
+
+    async def test_browsing_shows_full_text(self, datasette_with_fts):
+        response = await datasette_with_fts.client.get("/meetings/minutes")
+
+        html = response.text
+        assert "card-snippet" not in html
+        assert html.count("routine correspondence") >= 40
+
+
+@pytest.mark.asyncio
+class TestWithoutCardText:
+    """Test leaving the text column out of search result pages."""
+
+    def scope(self, path="/meetings/minutes", query_string=b"_search=budget"):
+        return {"type": "http", "path": path, "query_string": query_string}
+
+    async def test_search_page_skips_text(self, datasette_with_fts):
+        scope = await search_snippets.without_card_text(
+            datasette_with_fts, self.scope()
+        )
+
+        assert scope["query_string"] == b"_search=budget&_nocol=text"
+
+    @pytest.mark.parametrize(
+        ("path", "query_string"),
+        [
+            ("/meetings/minutes", b""),
+            ("/meetings/minutes.json", b"_search=budget"),
+            ("/meetings/minutes", b"_search=budget&_col=meeting"),
+            ("/meetings/minutes", b"_search=budget&_sort=text"),
+            ("/meetings/votes", b"_search=budget"),
+            ("/nope/minutes", b"_search=budget"),
+        ],
+    )
+    async def test_other_pages_unchanged(self, datasette_with_fts, path, query_string):
+        scope = self.scope(path, query_string)
+
+        assert (
+            await search_snippets.without_card_text(datasette_with_fts, scope) is scope
+        )
+
+    async def test_table_without_fts_unchanged(self, datasette_with_fts):
+        db = datasette_with_fts.get_database("meetings")
+        await db.execute_write("drop table minutes_fts")
+        scope = self.scope()
+
+        assert (
+            await search_snippets.without_card_text(datasette_with_fts, scope) is scope
+        )
@@ -0,0 +1,122 @@
+"""
+Tests for preloaded shared state and fork safety.
+
+Tests cover:
+- The in-memory site registry and its invalidation when sites.db changes
+- Registering the Datasette plugins once per process
+- The preload steps and gc.freeze()
+- Resetting the SQL executor in a forked child
+"""
+
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+import sqlite_utils
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import preload
+from django_plugins.site_registry import SiteRegistry
+from django_plugins.sql_executor import FairSQLExecutor
+
+
+@pytest.fixture
+def sites_db(tmp_path):
+    path = tmp_path / "sites.db"
+    db = sqlite_utils.Database(path)
+    db["sites"].insert_all(
+        [
+            {"subdomain": "alameda.ca", "name": "Alameda"},
+            {"subdomain": "oakland.ca", "name": "Oakland"},
+        ],
+        pk="subdomain",
+    )
+    db.close()
+    return path
+
+
+class TestSiteRegistry:
+    """Test the in-memory site registry."""
+
+    def test_get_remembers_found_sites(self, sites_db):
+        registry = SiteRegistry(str(sites_db))
+
+        assert registry.get("alameda.ca")["name"] == "Alameda"
+        assert registry.get("missing") is None
+        assert list(registry._sites) == ["alameda.ca"]
+
+    def test_load_all(self, sites_db):
+        registry = SiteRegistry(str(sites_db))
+
+        assert registry.load_all() == 2
+        with patch("django_plugins.site_registry.sqlite_utils.Database") as mock_db:
+            assert registry.get("oakland.ca")["name"] == "Oakland"
+            assert registry.get("missing") is None
+        mock_db.assert_not_called()
+
+    def test_reloads_when_file_changes(self, sites_db):
+        registry = SiteRegistry(str(sites_db))
+        registry.load_all()
+
+        db = sqlite_utils.Database(sites_db)
+        db["sites"].update("alameda.ca", {"name": "City of Alameda"})
+        db["sites"].insert({"subdomain": "berkeley.ca", "name": "Berkeley"})
+        db.close()
+
+        assert registry.get("alameda.ca")["name"] == "City of Alameda"
+        assert registry.get("berkeley.ca")["name"] == "Berkeley"
+
+
+def test_load_datasette_plugins_registers_once():
+    from datasette.plugins import pm  # noqa: PLC0415
+
+    names = preload.load_datasette_plugins()
+
+    assert "page_image.py" in names
+    assert pm.get_plugin("page_image.py") is not None
+    with patch("datasette.utils.module_from_path") as mock_load:
+        assert preload.load_datasette_plugins() == names
+    mock_load.assert_not_called()
+
+
+def test_preload_runs_every_step_and_freezes():
+    with (
+        patch.object(preload, "load_datasette_plugins") as mock_plugins,
+        patch("django_plugins.site_registry.site_registry.load_all") as mock_sites,
+        patch(
+            "django_plugins.static_assets.get_static_asset_table",
+            side_effect=OSError("missing"),
+        ),
+        patch("django_plugins.preload.gc.freeze") as mock_freeze,
+    ):
+        timings = preload.preload()
+
+    mock_plugins.assert_called_once()
+    mock_sites.assert_called_once()
+    mock_freeze.assert_called_once()
+    # A failing step is logged and skipped
+    assert set(timings) == {
+        "datasette",
+        "plugins",
+        "sites",
+        "metadata_template",
+        "static_assets",
+        "bot_policy",
+    }
+
+
+def test_executor_reset_forgets_threads():
+    executor = FairSQLExecutor(max_workers=2)
+    assert executor.submit(lambda: 42).result(timeout=5) == 42
+    assert executor._threads
+
+    executor._reset()
+
+    assert executor._threads == []
+    assert executor.completed == 0
+    assert executor.submit(lambda: 43).result(timeout=5) == 43
+    executor.shutdown()
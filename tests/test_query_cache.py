@@ -0,0 +1,305 @@
+"""
+Tests for the ?sql= query result cache.
+
+Tests cover:
+- SQL normalization that preserves string literals
+- Which requests are cacheable
+- Cache keys, byte-budget LRU eviction and stats
+- Recording responses as they are sent
+- Router serving repeated queries without building Datasette
+"""
+
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain, query_cache
+from django_plugins.metrics import MetricsStore
+
+SQL_QUERY = b"sql=select+*+from+agendas+where+meeting+%3D+%27City+Council%27"
+
+
+def make_scope(path="/meetings", query_string=SQL_QUERY, method="GET", headers=None):
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": headers or [(b"host", b"testcity.civic.band")],
+    }
+
+
+def make_response(body=b"x" * 10, headers=None):
+    return query_cache.CachedResponse(200, headers or [], body)
+
+
+class TestNormalizeSql:
+    """Test SQL normalization."""
+
+    def test_collapses_whitespace(self):
+        assert (
+            query_cache.normalize_sql("select  *\r\n from\tagendas ")
+            == "select * from agendas"
+        )
+
+    def test_preserves_literals(self):
+        assert (
+            query_cache.normalize_sql("select * from t where m = 'City   Council'")
+            == "select * from t where m = 'City   Council'"
+        )
+
+    def test_does_not_lowercase(self):
+        assert query_cache.normalize_sql("where m = 'Council'") != (
+            query_cache.normalize_sql("where m = 'council'")
+        )
+
+    def test_escaped_quotes(self):
+        assert (
+            query_cache.normalize_sql("select 'it''s  here',   1")
+            == "select 'it''s  here', 1"
+        )
+
+
+class TestIsCacheableRequest:
+    """Test which requests may be cached."""
+
+    def test_database_sql_query(self):
+        assert query_cache.is_cacheable_request(make_scope())
+
+    def test_json_format(self):
+        assert query_cache.is_cacheable_request(make_scope(path="/meetings.json"))
+
+    def test_table_page_not_cached(self):
+        assert not query_cache.is_cacheable_request(
+            make_scope(path="/meetings/agendas", query_string=b"_search=budget")
+        )
+
+    def test_post_not_cached(self):
+        assert not query_cache.is_cacheable_request(make_scope(method="POST"))
+
+    @pytest.mark.parametrize(
+        "sql",
+        [
+            b"select+random()",
+            b"select+*+from+agendas+where+date+%3E%3D+current_date",
+            b"select+date(%27now%27)",
+        ],
+    )
+    def test_non_deterministic_not_cached(self, sql):
+        assert not query_cache.is_cacheable_request(
+            make_scope(query_string=b"sql=" + sql)
+        )
+
+    def test_trace_not_cached(self):
+        assert not query_cache.is_cacheable_request(
+            make_scope(query_string=SQL_QUERY + b"&_trace=1")
+        )
+
+    def test_signed_in_actor_not_cached(self):
+        assert not query_cache.is_cacheable_request(
+            make_scope(headers=[(b"cookie", b"ds_actor=abc")])
+        )
+
+
+class TestMakeCacheKey:
+    """Test cache key construction."""
+
+    def test_whitespace_variants_share_key(self):
+        spaced = make_scope(query_string=SQL_QUERY.replace(b"+*+", b"+++*+"))
+        assert query_cache.make_cache_key("a", spaced, "v1") == (
+            query_cache.make_cache_key("a", make_scope(), "v1")
+        )
+
+    def test_parameter_order_ignored(self):
+        first = make_scope(query_string=b"sql=select+:x&x=1&_size=10")
+        second = make_scope(query_string=b"_size=10&x=1&sql=select+:x")
+        assert query_cache.make_cache_key("a", first, "v1") == (
+            query_cache.make_cache_key("a", second, "v1")
+        )
+
+    def test_bound_parameters_distinguish(self):
+        first = make_scope(query_string=b"sql=select+:x&x=1")
+        second = make_scope(query_string=b"sql=select+:x&x=2")
+        assert query_cache.make_cache_key("a", first, "v1") != (
+            query_cache.make_cache_key("a", second, "v1")
+        )
+
+    def test_version_distinguishes(self):
+        assert query_cache.make_cache_key("a", make_scope(), "v1") != (
+            query_cache.make_cache_key("a", make_scope(), "v2")
+        )
+
+    def test_format_distinguishes(self):
+        assert query_cache.make_cache_key("a", make_scope(), "v1") != (
+            query_cache.make_cache_key("a", make_scope(path="/meetings.json"), "v1")
+        )
+
+
+class TestQueryResultCache:
+    """Test the byte-budget LRU cache."""
+
+    def test_hit_and_miss_stats(self):
+        cache = query_cache.QueryResultCache(max_bytes=1000)
+        cache.put("a", make_response())
+
+        assert cache.get("a") == make_response()
+        assert cache.get("b") is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+    def test_evicts_least_recently_used(self):
+        cache = query_cache.QueryResultCache(max_bytes=800)
+        for key in ("a", "b", "c"):
+            cache.put(key, make_response(b"x" * 100))
+        cache.get("a")
+
+        for key in ("d", "e", "f", "g", "h", "i"):
+            cache.put(key, make_response(b"x" * 100))
+
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.bytes <= cache.max_bytes
+        assert cache.stats()["evictions"] == 1
+
+    def test_counts_in_metrics(self, tmp_path):
+        store = MetricsStore(str(tmp_path))
+        cache = query_cache.QueryResultCache(max_bytes=800)
+
+        with patch.object(query_cache, "metrics", store):
+            for key in ("a", "b", "c", "d", "e", "f", "g", "h", "i"):
+                cache.put(key, make_response(b"x" * 100))
+            cache.get("i")
+            cache.get("a")
+
+        assert store.counters[("query_cache_lookups_total", (("result", "hit"),))] == 1
+        assert store.counters[("query_cache_lookups_total", (("result", "miss"),))] == 1
+        assert store.counters[("query_cache_evictions_total", ())] == cache.evictions
+        assert cache.evictions
+
+    def test_rejects_oversized_entries(self):
+        cache = query_cache.QueryResultCache(max_bytes=800)
+
+        assert cache.put("a", make_response(b"x" * 101)) is False
+        assert cache.stats()["entries"] == 0
+
+    def test_replacing_entry_updates_bytes(self):
+        cache = query_cache.QueryResultCache(max_bytes=1000)
+        cache.put("a", make_response(b"x" * 50))
+        cache.put("a", make_response(b"x" * 20))
+
+        assert cache.bytes == 20
+
+    def test_disabled_with_zero_budget(self):
+        assert not query_cache.QueryResultCache(max_bytes=0).enabled
+
+
+@pytest.mark.asyncio
+class TestResponseRecorder:
+    """Test recording responses while sending them."""
+
+    async def send_response(self, recorder, headers=(), chunks=(b"ok",), status=200):
+        await recorder(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        for i, chunk in enumerate(chunks):
+            await recorder(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": i < len(chunks) - 1,
+                }
+            )
+
+    async def test_records_streamed_body(self):
+        send = AsyncMock()
+        recorder = query_cache.ResponseRecorder(send, 100)
+
+        await self.send_response(recorder, chunks=(b"a", b"b", b"c"))
+
+        assert recorder.response().body == b"abc"
+        assert send.call_count == 4
+
+    async def test_set_cookie_not_recorded(self):
+        recorder = query_cache.ResponseRecorder(AsyncMock(), 100)
+
+        await self.send_response(recorder, headers=[(b"set-cookie", b"x=1")])
+
+        assert recorder.response() is None
+
+    async def test_error_not_recorded(self):
+        recorder = query_cache.ResponseRecorder(AsyncMock(), 100)
+
+        await self.send_response(recorder, status=400)
+
+        assert recorder.response() is None
+
+    async def test_overflow_still_forwards(self):
+        send = AsyncMock()
+        recorder = query_cache.ResponseRecorder(send, 3)
+
+        await self.send_response(recorder, chunks=(b"ab", b"cd"))
+
+        assert recorder.response() is None
+        assert send.call_args_list[-1][0][0]["body"] == b"cd"
+
+
+@pytest.mark.asyncio
+async def test_router_serves_repeated_query_from_cache():
+    """A repeated ?sql= query is answered without constructing Datasette."""
+
+    async def datasette_app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/html")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"<table></table>"})
+
+    with (
+        patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+        patch("datasette.app.Datasette") as mock_datasette,
+        patch("django_plugins.datasette_by_subdomain.Environment") as mock_env,
+        patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
+        patch.object(
+            datasette_by_subdomain,
+            "query_result_cache",
+            query_cache.QueryResultCache(max_bytes=10000),
+        ) as cache,
+        patch("plugins.civic_analytics.UMAMI_ENABLED", False),
+    ):
+        mock_sqlite.return_value.__getitem__.return_value.get.return_value = {
+            "name": "Test City",
+            "state": "CA",
+            "subdomain": "testcity",
+            "last_updated": "2024-01-01",
+        }
+        mock_env.return_value.get_template.return_value.render.return_value = "{}"
+        mock_datasette.return_value.app.return_value = datasette_app
+
+        wrapper = datasette_by_subdomain.wrap(AsyncMock())
+        first_send = AsyncMock()
+        await wrapper(make_scope(), AsyncMock(), first_send)
+        second_send = AsyncMock()
+        await wrapper(make_scope(), AsyncMock(), second_send)
+
+        assert mock_datasette.call_count == 1
+        assert cache.stats()["hits"] == 1
+        start = second_send.call_args_list[0][0][0]
+        assert start["status"] == 200
+        assert (b"x-query-cache", b"hit") in start["headers"]
+        assert second_send.call_args_list[1][0][0]["body"] == b"<table></table>"
+
+        # A redeploy changes the database version and misses the cache
+        with patch.object(
+            datasette_by_subdomain, "database_version", return_value="redeployed"
+        ):
+            await wrapper(make_scope(), AsyncMock(), AsyncMock())
+        assert mock_datasette.call_count == 2
@@ -0,0 +1,389 @@
+"""
+Tests for the ?sql= query cost guard.
+
+Tests cover:
+- Classifying EXPLAIN QUERY PLAN output, including aliased tables
+- Estimating scanned rows against a real database, capped by LIMIT
+- Lowering _timelimit for expensive HTML queries
+- Router refusing expensive anonymous JSON queries, planned on a SQL thread
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain, query_cache, query_cost
+
+TABLES = {"agendas": False, "agendas_fts": True}
+
+
+@pytest.fixture
+def meetings_db(tmp_path):
+    """A meetings.db with 50 agendas rows and an FTS index."""
+    path = tmp_path / "meetings.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE agendas (id TEXT PRIMARY KEY, meeting TEXT, text TEXT)")
+    conn.execute("CREATE VIRTUAL TABLE agendas_fts USING FTS5 (text, content=agendas)")
+    conn.executemany(
+        "INSERT INTO agendas VALUES (?, 'City Council', 'budget hearing')",
+        [(f"a{i}",) for i in range(50)],
+    )
+    conn.execute("INSERT INTO agendas_fts(agendas_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+class TestClassifyPlan:
+    """Test classifying query plans."""
+
+    def test_full_scan(self):
+        assert query_cost.classify_plan(["SCAN agendas"], TABLES) == (
+            "full_scan",
+            ["agendas"],
+        )
+
+    def test_index_lookup(self):
+        plan = ["SEARCH agendas USING INDEX sqlite_autoindex_agendas_1 (id=?)"]
+        assert query_cost.classify_plan(plan, TABLES) == ("index", [])
+
+    def test_fts_match(self):
+        plan = ["SCAN agendas_fts VIRTUAL TABLE INDEX 0:M1"]
+        assert query_cost.classify_plan(plan, TABLES) == ("fts", [])
+
+    def test_unfiltered_fts_table_is_a_scan(self):
+        plan = ["SCAN agendas_fts VIRTUAL TABLE INDEX 0:"]
+        assert query_cost.classify_plan(plan, TABLES)[0] == "full_scan"
+
+    def test_constant(self):
+        assert query_cost.classify_plan(["SCAN CONSTANT ROW"], TABLES) == (
+            "constant",
+            [],
+        )
+
+    def test_aliased_scan(self):
+        aliases = query_cost.table_aliases('select * from agendas as "the a"')
+        assert query_cost.classify_plan(["SCAN the a"], TABLES, aliases) == (
+            "full_scan",
+            ["agendas"],
+        )
+
+    def test_automatic_index_is_a_scan(self):
+        plan = ["SCAN a", "SEARCH b USING AUTOMATIC COVERING INDEX (text=?)"]
+        aliases = query_cost.table_aliases(
+            "select * from agendas a join agendas b on b.text = a.text"
+        )
+        assert query_cost.classify_plan(plan, TABLES, aliases) == (
+            "full_scan",
+            ["agendas", "agendas"],
+        )
+
+    def test_unresolved_scan_prices_referenced_tables(self):
+        assert query_cost.classify_plan(["SCAN x"], TABLES, {}, ["agendas"]) == (
+            "full_scan",
+            ["agendas"],
+        )
+
+    def test_cte_alias_is_not_a_table(self):
+        plan = ["MATERIALIZE x", "SCAN agendas", "SCAN x", "SCAN y"]
+        aliases = query_cost.table_aliases(
+            "with x as (select * from agendas) select * from x, x as y"
+        )
+        assert query_cost.classify_plan(plan, TABLES, aliases) == (
+            "full_scan",
+            ["agendas"],
+        )
+
+
+class TestTableAliases:
+    """Test mapping plan names back to tables."""
+
+    @pytest.mark.parametrize(
+        ("sql", "aliases"),
+        [
+            ("select * from agendas", {"agendas": {"agendas"}}),
+            (
+                "select * from main.Agendas AS a where a.id = 1",
+                {"agendas": {"agendas"}, "a": {"agendas"}},
+            ),
+            (
+                'select * from [agendas] x join "minutes" on x.id = minutes.id',
+                {"agendas": {"agendas"}, "x": {"agendas"}, "minutes": {"minutes"}},
+            ),
+            (
+                "select * from agendas a, minutes m",
+                {
+                    "agendas": {"agendas"},
+                    "a": {"agendas"},
+                    "minutes": {"minutes"},
+                    "m": {"minutes"},
+                },
+            ),
+        ],
+    )
+    def test_table_aliases(self, sql, aliases):
+        assert query_cost.table_aliases(sql) == aliases
+
+
+class TestAssessQuery:
+    """Test planning and pricing queries against a database."""
+
+    def test_full_scan_over_threshold(self, meetings_db):
+        with patch.object(query_cost, "QUERY_COST_MAX_SCAN_ROWS", 10):
+            assessment = query_cost.assess_query(
+                meetings_db, "select * from agendas where text like '%budget%'"
+            )
+
+            assert assessment.kind == "full_scan"
+            assert assessment.scan_rows == 50
+            assert assessment.expensive
+
+    @pytest.mark.parametrize(
+        ("sql", "scan_rows"),
+        [
+            ("select * from agendas limit 5", 5),
+            ("select * from agendas limit 5 offset 3", 8),
+            ("select * from agendas limit 3, 5;", 8),
+            ("select * from agendas limit 500", 50),
+        ],
+    )
+    def test_limited_scan_is_capped(self, meetings_db, sql, scan_rows):
+        with patch.object(query_cost, "QUERY_COST_MAX_SCAN_ROWS", 10):
+            assessment = query_cost.assess_query(meetings_db, sql)
+
+            assert assessment.kind == "full_scan"
+            assert assessment.scan_rows == scan_rows
+
+    @pytest.mark.parametrize(
+        "sql",
+        [
+            "select * from agendas where text like '%budget%' limit 5",
+            "select * from agendas order by meeting limit 5",
+            "select count(*) from agendas limit 5",
+            "select meeting from agendas group by meeting limit 5",
+            "select * from (select * from agendas limit 5)",
+            "select * from agendas limit :size",
+            "select * from agendas a join agendas b on b.id = a.id limit 5",
+            "select * from agendas join agendas b using (id) limit 5",
+        ],
+    )
+    def test_limit_not_capping_rows_read(self, meetings_db, sql):
+        assessment = query_cost.assess_query(meetings_db, sql)
+
+        assert assessment.scan_rows == 50
+
+    @pytest.mark.parametrize(
+        "sql",
+        [
+            "select * from agendas a where a.text like '%budget%'",
+            "select * from agendas AS a where a.text like '%budget%'",
+            'select * from "agendas" "the a" where "the a".text like \'%budget%\'',
+            "select * from AGENDAS where text like '%budget%'",
+        ],
+    )
+    def test_aliased_full_scan(self, meetings_db, sql):
+        with patch.object(query_cost, "QUERY_COST_MAX_SCAN_ROWS", 10):
+            assessment = query_cost.assess_query(meetings_db, sql)
+
+            assert assessment.kind == "full_scan"
+            assert assessment.scan_rows == 50
+            assert assessment.expensive
+
+    def test_aliased_join(self, meetings_db):
+        assessment = query_cost.assess_query(
+            meetings_db,
+            "select * from agendas a join agendas b on b.text = a.text limit 10",
+        )
+
+        assert assessment.kind == "full_scan"
+        assert assessment.scan_rows == 100
+
+    def test_fts_query_is_cheap(self, meetings_db):
+        with patch.object(query_cost, "QUERY_COST_MAX_SCAN_ROWS", 10):
+            assessment = query_cost.assess_query(
+                meetings_db,
+                "select rowid from agendas_fts where agendas_fts match :q",
+            )
+
+            assert assessment.kind == "fts"
+            assert not assessment.expensive
+
+    def test_primary_key_lookup_is_cheap(self, meetings_db):
+        assessment = query_cost.assess_query(
+            meetings_db, "select * from agendas where id = :id"
+        )
+
+        assert assessment.kind == "index"
+
+    def test_invalid_sql_is_left_to_datasette(self, meetings_db):
+        assessment = query_cost.assess_query(meetings_db, "select * from nope")
+
+        assert assessment.kind == "invalid"
+        assert not assessment.expensive
+
+    def test_missing_database(self, tmp_path):
+        assessment = query_cost.assess_query(str(tmp_path / "x.db"), "select 1")
+
+        assert assessment.kind == "invalid"
+
+
+class TestTightenTimeLimit:
+    """Test lowering _timelimit."""
+
+    def test_adds_time_limit(self):
+        assert query_cost.tighten_time_limit(b"sql=select+1") == (
+            b"sql=select+1&_timelimit=500"
+        )
+
+    def test_keeps_lower_time_limit(self):
+        assert query_cost.tighten_time_limit(b"sql=select+1&_timelimit=100") == (
+            b"sql=select+1&_timelimit=100"
+        )
+
+    def test_lowers_higher_time_limit(self):
+        assert query_cost.tighten_time_limit(b"_timelimit=5000&sql=x") == (
+            b"sql=x&_timelimit=500"
+        )
+
+
+def test_normalize_sql_keeps_line_comments():
+    """Collapsing a comment's newline would comment out the rest of the query."""
+    assert query_cache.normalize_sql("-- hi\nselect   1") == "-- hi\nselect 1"
+    assert query_cache.normalize_sql("-- hi\nselect 1") != (
+        query_cache.normalize_sql("-- hi select 1")
+    )
+
+
+@pytest.fixture
+def router(tmp_path, monkeypatch, meetings_db):
+    """Run the router against a real site database with Datasette mocked."""
+    app_dir = tmp_path / "app"
+    app_dir.mkdir()
+    site_dir = tmp_path / "sites" / "testcity"
+    site_dir.mkdir(parents=True)
+    (tmp_path / "meetings.db").rename(site_dir / "meetings.db")
+    monkeypatch.chdir(app_dir)
+
+    datasette_app = AsyncMock()
+    with (
+        patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+        patch("datasette.app.Datasette") as mock_datasette,
+        patch("django_plugins.datasette_by_subdomain.Environment") as mock_env,
+        patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
+        patch.object(
+            datasette_by_subdomain,
+            "query_result_cache",
+            query_cache.QueryResultCache(max_bytes=0),
+        ),
+        patch.object(query_cost, "QUERY_COST_MAX_SCAN_ROWS", 10),
+        patch("plugins.civic_analytics.UMAMI_ENABLED", False),
+        patch(
+            "django_plugins.datasette_by_subdomain.check_rate_limit",
+            AsyncMock(return_value=False),
+        ),
+    ):
+        mock_sqlite.return_value.__getitem__.return_value.get.return_value = {
+            "name": "Test City",
+            "state": "CA",
+            "subdomain": "testcity",
+            "last_updated": "2024-01-01",
+        }
+        mock_env.return_value.get_template.return_value.render.return_value = "{}"
+        mock_datasette.return_value.app.return_value = datasette_app
+        yield datasette_by_subdomain.wrap(AsyncMock()), datasette_app
+
+
+def make_scope(path, query_string, headers=()):
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": query_string,
+        "headers": [(b"host", b"testcity.civic.band"), *headers],
+    }
+
+
+FULL_SCAN = b"sql=select+*+from+agendas+where+text+like+%27%25budget%25%27"
+
+
+@pytest.mark.asyncio
+class TestRouterCostGuard:
+    """Test the router applying the cost guard by access tier."""
+
+    async def test_anonymous_json_full_scan_refused(self, router):
+        wrapper, datasette_app = router
+        send = AsyncMock()
+
+        await wrapper(make_scope("/meetings.json", FULL_SCAN), AsyncMock(), send)
+
+        assert send.call_args_list[0][0][0]["status"] == 402
+        body = json.loads(send.call_args_list[1][0][0]["body"])
+        assert body["error"] == "expensive_query"
+        datasette_app.assert_not_called()
+
+    async def test_anonymous_html_full_scan_time_limited(self, router):
+        wrapper, datasette_app = router
+
+        await wrapper(make_scope("/meetings", FULL_SCAN), AsyncMock(), AsyncMock())
+
+        scope = datasette_app.call_args[0][0]
+        assert scope["query_string"].endswith(b"&_timelimit=500")
+
+    async def test_plans_on_sql_executor(self, router):
+        wrapper, _ = router
+        threads = []
+        assess_query = query_cost.assess_query
+
+        def record_thread(*args):
+            threads.append(threading.current_thread().name)
+            return assess_query(*args)
+
+        with patch.object(datasette_by_subdomain, "assess_query", record_thread):
+            await wrapper(make_scope("/meetings", FULL_SCAN), AsyncMock(), AsyncMock())
+
+        assert len(threads) == 1
+        assert threads[0].startswith("sql-executor-")
+
+    async def test_anonymous_fts_query_allowed(self, router):
+        wrapper, datasette_app = router
+        query_string = (
+            b"sql=select+rowid+from+agendas_fts+where+agendas_fts+match+%27budget%27"
+        )
+
+        await wrapper(
+            make_scope("/meetings/-/query.json", query_string), AsyncMock(), AsyncMock()
+        )
+
+        scope = datasette_app.call_args[0][0]
+        assert b"_timelimit" not in scope["query_string"]
+
+    async def test_api_key_not_checked(self, router):
+        wrapper, datasette_app = router
+        with (
+            patch(
+                "django_plugins.datasette_by_subdomain.is_validated_api_key",
+                AsyncMock(return_value=True),
+            ),
+            patch(
+                "django_plugins.datasette_by_subdomain.validate_api_key",
+                AsyncMock(return_value={"valid": True}),
+            ),
+        ):
+            await wrapper(
+                make_scope(
+                    "/meetings.json", FULL_SCAN, [(b"x-api-key", b"cb_live_test")]
+                ),
+                AsyncMock(),
+                AsyncMock(),
+            )
+
+        datasette_app.assert_called_once()
@@ -0,0 +1,226 @@
+"""
+Tests for replaying request captures.
+
+Tests cover:
+- Loading captures and building replay scopes
+- Parsing Server-Timing headers
+- Replaying with concurrency, including streamed responses
+- Summaries, percentiles and comparisons
+- The replay_requests management command
+"""
+
+import asyncio
+import json
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from django_plugins import datasette_by_subdomain, replay
+from django_plugins.api_key_auth import is_first_party_request
+from django_plugins.replay import (
+    build_scope,
+    compare,
+    load_records,
+    parse_server_timing,
+    percentile,
+    summarize,
+)
+
+RECORDS = [
+    {
+        "host": "testcity.civic.band",
+        "path": "/meetings/minutes",
+        "query": "_search=budget",
+        "route": "search",
+        "tier": "human",
+    },
+    {
+        "host": "testcity.civic.band",
+        "path": "/meetings/minutes.json",
+        "query": "",
+        "tier": "low",
+    },
+    {
+        "host": "testcity.civic.band",
+        "path": "/-/export/meetings/minutes.csv",
+        "query": "",
+        "tier": "api_key",
+    },
+]
+
+
+async def fake_app(scope, receive, send):
+    """Answers every request, streaming exports until the client is done."""
+    await receive()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"server-timing", b"site_lookup;dur=0.5, total;dur=2.0")],
+        }
+    )
+    if scope["path"].startswith("/-/export/"):
+        await send({"type": "http.response.body", "body": b"a", "more_body": True})
+        await asyncio.sleep(0)
+    await send({"type": "http.response.body", "body": b"done"})
+
+
+def test_load_records_skips_bad_lines(tmp_path):
+    path = tmp_path / "capture.jsonl"
+    path.write_text(
+        "\n".join([json.dumps(RECORDS[0]), "not json", "", json.dumps(RECORDS[1])])
+    )
+
+    assert load_records(str(path)) == RECORDS[:2]
+    assert load_records(str(path), limit=1) == RECORDS[:1]
+
+
+def test_build_scope_stands_in_for_tier():
+    scope = build_scope(RECORDS[2], host="other.civic.band", service_secret="s3")
+
+    headers = dict(scope["headers"])
+    assert headers[b"host"] == b"other.civic.band"
+    assert headers[b"x-service-secret"] == b"s3"
+    assert dict(build_scope(RECORDS[1])["headers"])[b"user-agent"] == (
+        replay.AUTOMATED_USER_AGENT
+    )
+
+
+@pytest.mark.parametrize("debug", [False, True])
+def test_human_records_are_first_party(settings, debug):
+    settings.DEBUG = debug
+    settings.CIVIC_BAND_DOMAIN = "civic.band"
+
+    assert is_first_party_request(build_scope(RECORDS[0])["headers"], "testcity")
+    assert not is_first_party_request(build_scope(RECORDS[1])["headers"], "testcity")
+
+
+def test_parse_server_timing():
+    assert parse_server_timing("sql;dur=1.5, cache;desc=miss;dur=0.2, x") == {
+        "sql": 1.5,
+        "cache": 0.2,
+    }
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 95) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_replay_runs_every_record():
+    results, seconds = await replay.replay(fake_app, RECORDS * 4, concurrency=3)
+
+    assert len(results) == 12
+    assert seconds > 0
+    assert {result["route"] for result in results} == {"search", "table.json", "export"}
+    export = next(result for result in results if result["route"] == "export")
+    assert export["bytes"] == 5
+    assert export["timings"] == {"site_lookup": 0.5, "total": 2.0}
+
+
+@pytest.mark.asyncio
+async def test_replay_spreads_client_addresses():
+    clients = []
+
+    async def app(scope, receive, send):
+        clients.append(scope["client"][0])
+        await fake_app(scope, receive, send)
+
+    await replay.replay(app, RECORDS * 2, concurrency=2)
+
+    assert len(set(clients)) == 6
+    assert all(client.startswith("10.") for client in clients)
+
+
+@pytest.mark.asyncio
+async def test_replay_counts_app_errors():
+    async def broken_app(_scope, _receive, _send):
+        raise RuntimeError("boom")
+
+    results, seconds = await replay.replay(broken_app, RECORDS[:1])
+
+    assert summarize(results, seconds)["routes"]["search"]["errors"] == 1
+
+
+def test_summarize_and_compare():
+    results = [
+        {"route": "table", "status": 200, "ms": ms, "bytes": 1, "timings": {"sql": 1}}
+        for ms in (10.0, 20.0)
+    ]
+    baseline = summarize(results, 1.0)
+    current = summarize([{**result, "ms": result["ms"] / 2} for result in results], 0.5)
+
+    assert baseline["routes"]["table"]["p50"] == 10.0
+    assert baseline["throughput"] == 2.0
+    comparison = compare(baseline, current)
+    assert comparison["throughput"] == 100.0
+    assert comparison["routes"]["table"]["p50"] == -50.0
+    assert comparison["stages"]["sql"] == 0.0
+
+
+def test_summarize_counts_rate_limited_apart():
+    results = [
+        {"route": "table.json", "status": status, "ms": ms, "bytes": 1, "timings": {}}
+        for status, ms in ((200, 40.0), (402, 1.0), (402, 1.0))
+    ]
+
+    summary = summarize(results, 1.0)
+
+    assert summary["rate_limited"] == 2
+    assert summary["statuses"] == {"200": 1, "402": 2}
+    route = summary["routes"]["table.json"]
+    assert (route["count"], route["errors"], route["rate_limited"]) == (3, 0, 2)
+    assert route["p50"] == 40.0
+
+
+class TestReplayRequestsCommand:
+    """Test the replay_requests command."""
+
+    @pytest.fixture
+    def capture(self, tmp_path):
+        path = tmp_path / "capture.jsonl"
+        path.write_text("\n".join(json.dumps(record) for record in RECORDS))
+        return path
+
+    @pytest.fixture(autouse=True)
+    def application(self):
+        asgi = MagicMock()
+        asgi.application = fake_app
+        with (
+            patch.dict(sys.modules, {"config.asgi": asgi}),
+            patch.object(datasette_by_subdomain, "SERVER_TIMING", "internal"),
+        ):
+            yield
+
+    def test_reports_and_writes_summary(self, capture, tmp_path, capsys):
+        output = tmp_path / "run.json"
+
+        call_command("replay_requests", str(capture), "--output", str(output))
+
+        out = capsys.readouterr().out
+        assert "3 requests" in out
+        assert "search" in out
+        assert datasette_by_subdomain.SERVER_TIMING == "all"
+        assert json.loads(output.read_text())["requests"] == 3
+
+    def test_compares_with_baseline(self, capture, tmp_path, capsys):
+        baseline = tmp_path / "before.json"
+        call_command("replay_requests", str(capture), "--output", str(baseline))
+
+        call_command("replay_requests", str(capture), "--baseline", str(baseline))
+
+        assert "Against baseline" in capsys.readouterr().out
+
+    def test_empty_capture(self, tmp_path):
+        path = tmp_path / "empty.jsonl"
+        path.write_text("")
+
+        with pytest.raises(CommandError, match="No requests"):
+            call_command("replay_requests", str(path))
@@ -0,0 +1,152 @@
+"""
+Tests for request capture.
+
+Tests cover:
+- Classifying routes
+- Stripping credentials from captured query strings
+- Writing and sampling capture records
+- The router capturing finished site requests
+"""
+
+import json
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain
+from django_plugins.request_capture import (
+    RequestCapture,
+    anonymize_query,
+    route_class,
+)
+from django_plugins.request_timing import StageTimer
+
+
+@pytest.mark.parametrize(
+    ("path", "query_string", "route"),
+    [
+        ("/", b"", "index"),
+        ("/meetings", b"", "database"),
+        ("/meetings/minutes", b"", "table"),
+        ("/meetings/minutes.json", b"_size=10", "table.json"),
+        ("/meetings/minutes/min-001", b"", "row"),
+        ("/meetings/minutes", b"_search=budget", "search"),
+        ("/meetings", b"sql=select+1", "sql"),
+        ("/meetings.json", b"sql=select+1", "sql.json"),
+        ("/-/export/meetings/minutes.csv", b"", "export"),
+        ("/-/snapshots/", b"", "snapshot"),
+        ("/-/static/app.css", b"", "static"),
+        ("/-/versions.json", b"", "special.json"),
+    ],
+)
+def test_route_class(path, query_string, route):
+    assert route_class(path, query_string) == route
+
+
+def test_anonymize_query_strips_api_key():
+    assert anonymize_query(b"_search=budget&api_key=secret&_size=") == (
+        "_search=budget&_size="
+    )
+
+
+def make_timer(status=200, tier="human"):
+    timer = StageTimer()
+    timer.status = status
+    timer.tier = tier
+    timer.add("site_lookup", 0.001)
+    return timer
+
+
+SCOPE = {
+    "type": "http",
+    "method": "GET",
+    "path": "/meetings/minutes",
+    "query_string": b"_search=budget&api_key=secret",
+    "headers": [(b"host", b"testcity.civic.band"), (b"x-api-key", b"secret")],
+    "client": ("203.0.113.9", 1234),
+}
+
+
+class TestRequestCapture:
+    """Test writing capture records."""
+
+    def test_writes_anonymized_record(self, tmp_path):
+        capture = RequestCapture(str(tmp_path / "capture.jsonl"))
+
+        capture.record(SCOPE, make_timer())
+        capture.record(SCOPE, make_timer(status=404))
+
+        lines = (tmp_path / "capture.jsonl").read_text().splitlines()
+        record = json.loads(lines[0])
+        assert len(lines) == 2
+        assert record["host"] == "testcity.civic.band"
+        assert record["query"] == "_search=budget"
+        assert record["route"] == "search"
+        assert (record["tier"], record["status"]) == ("human", 200)
+        assert record["timings"]["site_lookup"] == 1.0
+        assert "secret" not in lines[0]
+        assert "203.0.113.9" not in lines[0]
+
+    def test_pid_in_path(self, tmp_path):
+        capture = RequestCapture(str(tmp_path / "captures" / "requests-{pid}.jsonl"))
+
+        capture.record(SCOPE, make_timer())
+
+        (path,) = (tmp_path / "captures").iterdir()
+        assert path.name.startswith("requests-") and "{pid}" not in path.name
+
+    def test_disabled_without_path(self):
+        capture = RequestCapture("")
+
+        capture.record(SCOPE, make_timer())
+
+        assert capture._file is None
+
+    def test_sampling(self, tmp_path):
+        capture = RequestCapture(str(tmp_path / "capture.jsonl"), sample=0.5)
+
+        with patch("django_plugins.request_capture.random.random", return_value=0.7):
+            capture.record(SCOPE, make_timer())
+
+        assert not (tmp_path / "capture.jsonl").exists()
+
+
+@pytest.mark.asyncio
+async def test_router_captures_site_requests():
+    site = {
+        "name": "Test City",
+        "state": "CA",
+        "subdomain": "testcity",
+        "last_updated": "2024-01-01",
+    }
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/meetings/minutes",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"testcity.civic.band"),
+            (b"user-agent", b"Mozilla/5.0 Firefox/130.0"),
+        ],
+    }
+    with (
+        patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+        patch("datasette.app.Datasette") as mock_datasette,
+        patch("django_plugins.datasette_by_subdomain.Environment") as mock_env,
+        patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
+        patch.object(datasette_by_subdomain, "request_capture") as mock_capture,
+    ):
+        mock_sqlite.return_value.__getitem__.return_value.get.return_value = site
+        mock_env.return_value.get_template.return_value.render.return_value = "{}"
+        mock_datasette.return_value.app.return_value = AsyncMock()
+        await datasette_by_subdomain.wrap(AsyncMock())(scope, AsyncMock(), AsyncMock())
+
+    captured_scope, timer = mock_capture.record.call_args.args
+    assert captured_scope["path"] == "/meetings/minutes"
+    assert timer.subdomain == "testcity"
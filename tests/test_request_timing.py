@@ -0,0 +1,167 @@
+"""
+Tests for per-stage request timing.
+
+Tests cover:
+- Stage durations, open stages and the Server-Timing header value
+- Helpers recording into the current request's timer
+- SQL executor threads recording query and queue time
+- Router sending Server-Timing and logging timings
+"""
+
+import logging
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain
+from django_plugins.request_timing import (
+    StageTimer,
+    current_timer,
+    instrument_send,
+    timed,
+)
+from django_plugins.sql_executor import FairSQLExecutor
+
+
+class TestStageTimer:
+    """Test recording stages."""
+
+    def test_stages_accumulate(self):
+        timer = StageTimer()
+        timer.add("sql", 0.002)
+        timer.add("sql", 0.003)
+
+        timings = timer.as_dict()
+
+        assert timings["sql"] == 5.0
+        assert timings["total"] >= 0
+
+    def test_open_stage_reported_so_far(self):
+        timer = StageTimer()
+
+        with timer.stage("datasette"):
+            assert "datasette" in timer.as_dict()
+
+        assert "datasette" in timer.durations
+
+    def test_header_value(self):
+        timer = StageTimer()
+        timer.add("site_lookup", 0.0005)
+
+        assert timer.header_value().startswith(b"site_lookup;dur=0.5, total;dur=")
+
+
+@pytest.mark.asyncio
+class TestTimedHelpers:
+    """Test helpers recording into the current timer."""
+
+    async def test_records_into_current_timer(self):
+        @timed("api_key")
+        async def validate():
+            return "ok"
+
+        timer = StageTimer()
+        token = current_timer.set(timer)
+        try:
+            assert await validate() == "ok"
+        finally:
+            current_timer.reset(token)
+
+        assert "api_key" in timer.durations
+
+    async def test_no_timer_is_a_no_op(self):
+        @timed("api_key")
+        async def validate():
+            return "ok"
+
+        assert await validate() == "ok"
+
+    async def test_instrument_send(self):
+        timer = StageTimer()
+        send = AsyncMock()
+
+        await instrument_send(send, timer, server_timing=True)(
+            {"type": "http.response.start", "status": 200, "headers": []}
+        )
+
+        headers = send.call_args[0][0]["headers"]
+        assert headers[0][0] == b"server-timing"
+        assert timer.status == 200
+
+
+def test_executor_records_sql_stages():
+    executor = FairSQLExecutor(max_workers=1)
+    timer = StageTimer()
+    token = current_timer.set(timer)
+    try:
+        executor.submit(lambda: None).result(5)
+    finally:
+        current_timer.reset(token)
+        executor.shutdown()
+
+    assert {"sql", "sql_wait"} <= timer.durations.keys()
+
+
+@pytest.mark.asyncio
+class TestRouterTiming:
+    """Test the router's Server-Timing header and log record."""
+
+    async def call_router(self, server_timing):
+        with (
+            patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+            patch("datasette.app.Datasette") as mock_datasette,
+            patch("django_plugins.datasette_by_subdomain.Environment") as mock_env,
+            patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
+            patch.object(datasette_by_subdomain, "SERVER_TIMING", server_timing),
+        ):
+            mock_sqlite.return_value.__getitem__.return_value.get.return_value = {
+                "name": "Test City",
+                "state": "CA",
+                "subdomain": "testcity",
+                "last_updated": "2024-01-01",
+            }
+            mock_env.return_value.get_template.return_value.render.return_value = "{}"
+
+            async def datasette_app(scope, receive, send):
+                await send({"type": "http.response.start", "status": 200})
+                await send({"type": "http.response.body", "body": b"ok"})
+
+            mock_datasette.return_value.app.return_value = datasette_app
+            send = AsyncMock()
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": "/meetings",
+                "query_string": b"",
+                "headers": [
+                    (b"host", b"testcity.civic.band"),
+                    (b"user-agent", b"Mozilla/5.0 Firefox/130.0"),
+                ],
+            }
+            await datasette_by_subdomain.wrap(AsyncMock())(scope, AsyncMock(), send)
+            return dict(send.call_args_list[0][0][0].get("headers", []))
+
+    async def test_header_sent_when_enabled(self):
+        headers = await self.call_router("all")
+
+        value = headers[b"server-timing"].decode()
+        for stage in ("admission", "site_lookup", "metadata", "datasette_init"):
+            assert f"{stage};dur=" in value
+
+    async def test_header_internal_only_by_default(self):
+        headers = await self.call_router("internal")
+
+        assert b"server-timing" not in headers
+
+    async def test_timings_logged(self, caplog):
+        with caplog.at_level(logging.INFO, logger=datasette_by_subdomain.__name__):
+            await self.call_router("off")
+
+        record = next(r for r in caplog.records if r.message == "Request completed")
+        assert {"site_lookup", "datasette", "total"} <= record.timings.keys()
@@ -0,0 +1,183 @@
+"""
+Tests for the sharded global search index.
+
+Tests cover:
+- Assigning sites to shards by state or hash
+- Incremental builds that only re-ingest changed sites
+- Pruning sites that moved shards
+- Searching the index through /api/search/?source=index
+"""
+
+import os
+import sqlite3
+from io import StringIO
+from unittest.mock import AsyncMock
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import Client, override_settings
+
+from pages import search_index
+from pages.models import Site
+from tests.test_federated_search import create_site_db, read_events
+
+
+@pytest.fixture
+def index_env(tmp_path, monkeypatch):
+    """Two deployed sites and an empty index directory."""
+    app_dir = tmp_path / "app"
+    app_dir.mkdir()
+    create_site_db(
+        tmp_path / "sites" / "alameda.ca",
+        [
+            ("agendas", "a1", "budget budget budget hearing"),
+            ("minutes", "m1", "the budget was approved"),
+        ],
+    )
+    create_site_db(
+        tmp_path / "sites" / "austin.tx",
+        [("minutes", "m1", "zoning and budget discussion")],
+    )
+    monkeypatch.chdir(app_dir)
+    monkeypatch.setattr("pages.views.check_rate_limit", AsyncMock(return_value=False))
+    # Only index the sites created here, not the shared test fixtures
+    Site.objects.all().delete()
+    Site.objects.create(subdomain="alameda.ca", name="Alameda", state="CA")
+    Site.objects.create(subdomain="austin.tx", name="Austin", state="TX")
+
+    index_dir = tmp_path / "index"
+    with override_settings(SEARCH_INDEX_DIR=str(index_dir)):
+        yield tmp_path
+
+
+def build(**options):
+    out = StringIO()
+    call_command("build_search_index", stdout=out, **options)
+    return out.getvalue()
+
+
+def shard_subdomains(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("select subdomain, rows from ingested"))
+    finally:
+        conn.close()
+
+
+class TestShardKey:
+    """Test assigning sites to shards."""
+
+    def test_state(self):
+        assert search_index.shard_key("alameda.ca", "CA", "state", 16) == "ca"
+
+    def test_missing_state(self):
+        assert search_index.shard_key("x", None, "state", 16) == "unknown"
+
+    def test_hash_is_stable(self):
+        assert search_index.shard_key("alameda.ca", "CA", "hash", 16) == (
+            search_index.shard_key("alameda.ca", "TX", "hash", 16)
+        )
+        assert 0 <= int(search_index.shard_key("alameda.ca", None, "hash", 4)) < 4
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("index_env")
+class TestBuildSearchIndex:
+    """Test the build_search_index management command."""
+
+    def test_builds_state_shards(self):
+        build()
+
+        shards = search_index.list_shards()
+        assert [os.path.basename(path) for path in shards] == [
+            "shard-ca.db",
+            "shard-tx.db",
+        ]
+        assert shard_subdomains(shards[0]) == {"alameda.ca": 2}
+
+    def test_rebuild_skips_unchanged_sites(self):
+        build()
+        output = build()
+
+        assert "0 ingested, 1 unchanged" in output
+
+    def test_redeploy_reingests_only_that_site(self, index_env):
+        build()
+        conn = sqlite3.connect(index_env / "sites" / "austin.tx" / "meetings.db")
+        conn.execute(
+            "INSERT INTO agendas VALUES ('a2', 'Council', '2024-02-01', 1, 'parks')"
+        )
+        conn.commit()
+        conn.close()
+
+        output = build()
+
+        assert "shard-ca.db: 0 ingested, 1 unchanged" in output
+        assert "shard-tx.db: 1 ingested, 0 unchanged" in output
+        tx_shard = search_index.shard_path(search_index.index_dir(), "tx")
+        assert shard_subdomains(tx_shard) == {"austin.tx": 2}
+
+    def test_site_moving_shards_is_pruned(self):
+        build()
+        Site.objects.filter(subdomain="austin.tx").update(state="CA")
+
+        build()
+
+        tx_shard = search_index.shard_path(search_index.index_dir(), "tx")
+        assert shard_subdomains(tx_shard) == {}
+        conn = sqlite3.connect(tx_shard)
+        assert conn.execute("select count(*) from documents_fts").fetchone()[0] == 0
+        conn.close()
+
+    def test_hash_sharding(self):
+        build(shard_by="hash", shards=2)
+
+        assert all(
+            os.path.basename(path) in ("shard-000.db", "shard-001.db")
+            for path in search_index.list_shards()
+        )
+
+    def test_resharding_requires_new_directory(self):
+        build()
+
+        with pytest.raises(CommandError, match="reshard"):
+            build(shard_by="hash")
+
+    def test_small_batches(self):
+        build(batch_size=1)
+
+        ca_shard = search_index.shard_path(search_index.index_dir(), "ca")
+        assert shard_subdomains(ca_shard) == {"alameda.ca": 2}
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("index_env")
+class TestIndexSearch:
+    """Test answering searches from the global index."""
+
+    def get_events(self, url):
+        response = Client().get(url)
+        assert response.status_code == 200
+        return read_events(response)
+
+    def test_index_not_built_returns_503(self):
+        response = Client().get("/api/search/?search=budget&source=index")
+        assert response.status_code == 503
+
+    def test_searches_all_shards(self):
+        build()
+
+        events = self.get_events("/api/search/?search=budget&source=index")
+
+        assert [event["type"] for event in events] == ["shard", "shard", "results"]
+        results = events[-1]["results"]
+        assert len(results) == 3
+        assert results[0]["id"] == "a1"
+
+    def test_site_filters_apply(self):
+        build()
+
+        events = self.get_events("/api/search/?search=budget&source=index&state=TX")
+
+        assert {item["subdomain"] for item in events[-1]["results"]} == {"austin.tx"}
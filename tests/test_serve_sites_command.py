@@ -0,0 +1,119 @@
+"""
+Tests for the serve_sites management command.
+
+Tests cover:
+- Validating the sites tree and options
+- Serving config.asgi.application with *.localhost routing
+- Overriding the Host header
+- Writing per-request profiles
+"""
+
+import pstats
+import sqlite3
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from django_plugins import datasette_by_subdomain
+from pages.management.commands.serve_sites import HostOverride, RequestProfiler
+
+
+@pytest.fixture
+def sites_tree(tmp_path, monkeypatch):
+    """Create ../sites/testcity/meetings.db relative to a temp working dir."""
+    app_dir = tmp_path / "app"
+    site_dir = tmp_path / "sites" / "testcity"
+    app_dir.mkdir()
+    site_dir.mkdir(parents=True)
+    sqlite3.connect(site_dir / "meetings.db").close()
+    monkeypatch.chdir(app_dir)
+    return site_dir
+
+
+@pytest.fixture
+def serve():
+    """Run the command without starting a server; returns uvicorn.run's mock."""
+    asgi = MagicMock()
+    with (
+        patch("uvicorn.run") as mock_run,
+        patch.dict(sys.modules, {"config.asgi": asgi}),
+        patch.object(datasette_by_subdomain, "ROOT_DOMAINS", "civic.band"),
+    ):
+        mock_run.application = asgi.application
+        yield mock_run
+
+
+@pytest.mark.usefixtures("sites_tree")
+class TestServeSitesCommand:
+    """Test the serve_sites command."""
+
+    def test_serves_production_application(self, serve):
+        call_command("serve_sites", "--port", "9000")
+
+        app = serve.call_args.args[0]
+        assert app is serve.application
+        assert serve.call_args.kwargs["port"] == 9000
+        assert serve.call_args.kwargs["lifespan"] == "on"
+        assert datasette_by_subdomain.ROOT_DOMAINS == "civic.band,localhost"
+
+    def test_site_overrides_host(self, serve):
+        call_command("serve_sites", "--site", "testcity")
+
+        app = serve.call_args.args[0]
+        assert isinstance(app, HostOverride)
+        assert app.host == "testcity.localhost"
+
+    def test_unknown_site(self, serve):
+        with pytest.raises(CommandError, match="Site not found"):
+            call_command("serve_sites", "--site", "nowhere")
+
+        serve.assert_not_called()
+
+    def test_profile_wraps_application(self, serve, tmp_path):
+        call_command(
+            "serve_sites", "--profile", "cprofile", "--profile-dir", str(tmp_path)
+        )
+
+        assert isinstance(serve.call_args.args[0], RequestProfiler)
+
+
+def test_requires_sites(serve, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    with pytest.raises(CommandError, match="No sites found"):
+        call_command("serve_sites")
+
+
+@pytest.mark.asyncio
+async def test_host_override_replaces_host():
+    app = AsyncMock()
+    scope = {"type": "http", "headers": [(b"host", b"127.0.0.1:8000")]}
+
+    await HostOverride(app, "alameda.ca")(scope, None, None)
+
+    assert app.call_args.args[0]["headers"] == [(b"host", b"alameda.ca.localhost")]
+
+
+@pytest.mark.asyncio
+async def test_request_profiler_writes_cprofile(tmp_path):
+    async def app(_scope, _receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    report = MagicMock()
+    profiler = RequestProfiler(app, "cprofile", str(tmp_path), report)
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/meetings/minutes",
+        "headers": [(b"host", b"alameda.ca.localhost:8000")],
+    }
+
+    await profiler(scope, AsyncMock(), AsyncMock())
+
+    (path,) = tmp_path.iterdir()
+    assert path.name.endswith("-alameda.ca-meetings-minutes.prof")
+    assert pstats.Stats(str(path)).total_calls > 0
+    assert str(path) in report.call_args.args[0]
@@ -0,0 +1,111 @@
+"""
+Tests for the Site admin's pipeline progress.
+
+Tests cover:
+- Progress annotations computed by the database
+- Per-stage pipeline totals
+- Sorting and filtering the changelist by progress
+- The pipeline overview page
+"""
+
+import pytest
+from django.core.cache import cache
+
+from pages.admin import OVERVIEW_CACHE_KEY
+from pages.models import Site
+
+
+@pytest.fixture
+def pipeline_sites():
+    Site.objects.all().delete()
+    Site.objects.create(
+        subdomain="done.ca", current_stage="ocr", ocr_total=10, ocr_completed=10
+    )
+    Site.objects.create(
+        subdomain="half.ca",
+        current_stage="ocr",
+        ocr_total=10,
+        ocr_completed=5,
+        ocr_failed=2,
+    )
+    Site.objects.create(
+        subdomain="fresh.ca", current_stage="deploy", deploy_total=4, fetch_total=99
+    )
+    Site.objects.create(subdomain="idle.ca")
+    cache.delete(OVERVIEW_CACHE_KEY)
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("pipeline_sites")
+class TestSiteQuerySet:
+    """Test progress computed in the database."""
+
+    def test_with_progress(self):
+        sites = {site.subdomain: site for site in Site.objects.with_progress()}
+
+        assert sites["half.ca"].progress_total == 10
+        assert sites["half.ca"].progress_completed == 5
+        assert sites["half.ca"].progress_failed == 2
+        assert sites["half.ca"].progress_ratio == 0.5
+        # Counters of stages other than the current one are ignored
+        assert sites["fresh.ca"].progress_total == 4
+        assert sites["idle.ca"].progress_ratio == 0.0
+
+    def test_pipeline_overview(self, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            overview = Site.objects.pipeline_overview()
+
+        assert overview["sites"] == 4
+        assert overview["idle_sites"] == 1
+        ocr = next(stage for stage in overview["stages"] if stage["stage"] == "ocr")
+        assert ocr == {
+            "stage": "ocr",
+            "sites": 2,
+            "failing_sites": 1,
+            "total": 20,
+            "completed": 15,
+            "failed": 2,
+            "ratio": 0.75,
+        }
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("pipeline_sites")
+class TestSiteAdmin:
+    """Test the changelist and overview page."""
+
+    def test_changelist_shows_progress(self, admin_client):
+        response = admin_client.get("/admin/pages/site/")
+
+        assert response.status_code == 200
+        assert b"5/10 (50.0%)" in response.content
+        assert b"Pipeline overview" in response.content
+
+    def test_changelist_sorts_by_progress(self, admin_client):
+        # get_progress is the eighth list_display column
+        response = admin_client.get("/admin/pages/site/?o=8")
+
+        sites = [site.subdomain for site in response.context["cl"].result_list]
+        assert sites.index("half.ca") < sites.index("done.ca")
+
+    @pytest.mark.parametrize(
+        ("progress", "expected"),
+        [
+            ("not_started", {"fresh.ca"}),
+            ("in_progress", {"half.ca"}),
+            ("complete", {"done.ca"}),
+            ("failing", {"half.ca"}),
+        ],
+    )
+    def test_changelist_filters_by_progress(self, admin_client, progress, expected):
+        response = admin_client.get(f"/admin/pages/site/?progress={progress}")
+
+        sites = {site.subdomain for site in response.context["cl"].result_list}
+        assert sites == expected
+
+    def test_overview_page(self, admin_client):
+        response = admin_client.get("/admin/pages/site/overview/")
+
+        assert response.status_code == 200
+        assert response.context["overview"]["sites"] == 4
+        assert cache.get(OVERVIEW_CACHE_KEY) == response.context["overview"]
@@ -0,0 +1,161 @@
+"""
+Tests for deploy-time inspect data and immutable database opening.
+
+Tests cover:
+- Inspecting a site database (counts, hash, FTS tables)
+- Loading only fresh inspect data entries
+- The inspect_sites management command
+- Router opening inspected databases in immutable mode
+"""
+
+import json
+import os
+import sqlite3
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from django.core.management import call_command
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain, site_inspect
+
+
+@pytest.fixture
+def sites_tree(tmp_path, monkeypatch):
+    """Create ../sites/testcity/meetings.db relative to a temp working dir."""
+    app_dir = tmp_path / "app"
+    site_dir = tmp_path / "sites" / "testcity"
+    app_dir.mkdir()
+    site_dir.mkdir(parents=True)
+
+    conn = sqlite3.connect(site_dir / "meetings.db")
+    conn.execute(
+        "CREATE TABLE agendas (id TEXT PRIMARY KEY, meeting TEXT, date TEXT, "
+        "page INTEGER, text TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO agendas VALUES (?, 'City Council', '2024-01-15', ?, ?)",
+        [(f"a{i}", i, f"page {i} budget") for i in range(5)],
+    )
+    conn.execute(
+        "CREATE VIRTUAL TABLE agendas_fts USING FTS5 (text, content=[agendas])"
+    )
+    conn.execute("INSERT INTO agendas_fts(agendas_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.chdir(app_dir)
+    return site_dir
+
+
+@pytest.mark.usefixtures("sites_tree")
+class TestInspectDatabase:
+    """Test computing inspect data for a database."""
+
+    def test_counts_and_fts(self):
+        data = site_inspect.inspect_database("../sites/testcity/meetings.db")
+
+        assert data["tables"]["agendas"]["count"] == 5
+        assert data["tables"]["agendas"]["fts_table"] == "agendas_fts"
+        assert data["size"] == os.path.getsize("../sites/testcity/meetings.db")
+        assert len(data["hash"]) == 64
+
+    def test_inspect_site_keys_by_database_name(self):
+        data = site_inspect.inspect_site(
+            ["../sites/testcity/meetings.db", "../sites/testcity/finance/items.db"]
+        )
+
+        assert list(data) == ["meetings"]
+
+
+@pytest.mark.usefixtures("sites_tree")
+class TestLoadInspectData:
+    """Test loading inspect data in the router."""
+
+    def test_missing_file_returns_empty(self):
+        assert (
+            site_inspect.load_inspect_data(
+                "testcity", ["../sites/testcity/meetings.db"]
+            )
+            == {}
+        )
+
+    def test_fresh_entries_loaded(self):
+        db_list = ["../sites/testcity/meetings.db"]
+        site_inspect.write_inspect_data("testcity", site_inspect.inspect_site(db_list))
+
+        data = site_inspect.load_inspect_data("testcity", db_list)
+
+        assert data["meetings"]["tables"]["agendas"]["count"] == 5
+
+    def test_stale_entries_ignored(self):
+        db_list = ["../sites/testcity/meetings.db"]
+        data = site_inspect.inspect_site(db_list)
+        data["meetings"]["size"] += 1
+        site_inspect.write_inspect_data("testcity", data)
+
+        assert site_inspect.load_inspect_data("testcity", db_list) == {}
+
+
+class TestInspectSitesCommand:
+    """Test the inspect_sites management command."""
+
+    def test_writes_inspect_file(self, sites_tree):
+        call_command("inspect_sites", "testcity")
+
+        with open(sites_tree / site_inspect.INSPECT_FILENAME) as fp:
+            data = json.load(fp)
+        assert data["meetings"]["tables"]["agendas"]["count"] == 5
+
+    def test_discovers_sites(self, sites_tree):
+        call_command("inspect_sites")
+
+        assert (sites_tree / site_inspect.INSPECT_FILENAME).exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("inspected", [True, False])
+async def test_router_opens_inspected_databases_immutable(sites_tree, inspected):
+    """Inspected databases are passed to Datasette as immutables."""
+    db_list = ["../sites/testcity/meetings.db"]
+    if inspected:
+        site_inspect.write_inspect_data("testcity", site_inspect.inspect_site(db_list))
+
+    with (
+        patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+        patch("datasette.app.Datasette") as mock_datasette,
+        patch("django_plugins.datasette_by_subdomain.Environment") as mock_env,
+        patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
+    ):
+        mock_sqlite.return_value.__getitem__.return_value.get.return_value = {
+            "name": "Test City",
+            "state": "CA",
+            "subdomain": "testcity",
+            "last_updated": "2024-01-01",
+        }
+        mock_env.return_value.get_template.return_value.render.return_value = "{}"
+        mock_datasette.return_value.app.return_value = AsyncMock()
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/meetings",
+            "headers": [(b"host", b"testcity.civic.band")],
+        }
+        wrapper = datasette_by_subdomain.wrap(AsyncMock())
+        await wrapper(scope, AsyncMock(), AsyncMock())
+
+        args, kwargs = mock_datasette.call_args
+        if inspected:
+            assert args[0] == []
+            assert kwargs["immutables"] == db_list
+            assert "meetings" in kwargs["inspect_data"]
+        else:
+            assert args[0] == db_list
+            assert kwargs["immutables"] == []
+            assert kwargs["inspect_data"] is None
@@ -0,0 +1,212 @@
+"""
+Tests for the slow query log.
+
+Tests cover:
+- SQL fingerprints
+- Recording slow and interrupted queries from instrumented databases
+- Bounded per-site buffers
+- Flushing to SQLite and ranking fingerprints
+- The admin page
+"""
+
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from datasette.database import QueryInterrupted
+
+from django_plugins import slow_queries
+from django_plugins.slow_queries import SlowQueryLog, fingerprint, top_fingerprints
+from django_plugins.sql_executor import (
+    FairSQLExecutor,
+    SQLRequest,
+    current_query_clock,
+    current_sql_request,
+)
+
+
+class FakeDatabase:
+    name = "meetings"
+
+    def __init__(self, rows=(), error=None):
+        self.rows = list(rows)
+        self.error = error
+
+    async def execute(self, _sql, _params=None):
+        if self.error:
+            raise self.error
+        return SimpleNamespace(rows=self.rows)
+
+
+def test_fingerprint():
+    assert (
+        fingerprint(
+            "SELECT * FROM minutes -- comment\nWHERE date = '2024-01-01' AND page > 10"
+        )
+        == "select * from minutes where date = ? and page > ?"
+    )
+    assert fingerprint("select * from t1 where id in (1, 2, 3)") == (
+        "select * from t1 where id in (?)"
+    )
+    assert fingerprint("select :p0, ?") == "select ?, ?"
+
+
+@pytest.mark.asyncio
+class TestInstrument:
+    """Test recording queries from instrumented databases."""
+
+    async def test_records_slow_query(self, tmp_path):
+        log = SlowQueryLog(threshold_ms=0, path=str(tmp_path / "slow.db"))
+        database = FakeDatabase(rows=[(1,), (2,)])
+        log.instrument(database)
+
+        token = current_sql_request.set(SQLRequest("alameda", "anonymous"))
+        try:
+            await database.execute("select 1")
+        finally:
+            current_sql_request.reset(token)
+
+        [query] = log.drain()
+        assert query.subdomain == "alameda"
+        assert query.access_tier == "anonymous"
+        assert query.rows == 2
+        assert not query.interrupted
+
+    async def test_skips_fast_query(self, tmp_path):
+        log = SlowQueryLog(threshold_ms=10_000, path=str(tmp_path / "slow.db"))
+        database = FakeDatabase()
+        log.instrument(database)
+
+        await database.execute("select 1")
+
+        assert log.drain() == []
+
+    async def test_records_interrupted_query(self, tmp_path):
+        log = SlowQueryLog(threshold_ms=10_000, path=str(tmp_path / "slow.db"))
+        database = FakeDatabase(error=QueryInterrupted(None, "select 1", None))
+        log.instrument(database)
+
+        with pytest.raises(QueryInterrupted):
+            await database.execute("select 1")
+
+        [query] = log.drain()
+        assert query.interrupted
+        assert query.rows is None
+
+    async def test_uses_executor_time(self, tmp_path):
+        log = SlowQueryLog(threshold_ms=0, path=str(tmp_path / "slow.db"))
+        executor = FairSQLExecutor(max_workers=1)
+
+        clocks = []
+
+        class ExecutorDatabase(FakeDatabase):
+            async def execute(self, _sql, _params=None):
+                clocks.append(current_query_clock.get())
+                executor.submit(lambda: None).result(5)
+                return SimpleNamespace(rows=[])
+
+        database = ExecutorDatabase()
+        log.instrument(database)
+        try:
+            await database.execute("select 1")
+        finally:
+            executor.shutdown()
+
+        [query] = log.drain()
+        assert clocks[0].wait is not None
+        assert query.duration_ms == round(clocks[0].seconds * 1000, 3)
+
+
+def test_buffer_is_bounded_per_site(tmp_path):
+    log = SlowQueryLog(buffer_size=2, path=str(tmp_path / "slow.db"))
+    for subdomain in ("alameda", "alameda", "alameda", "oakland"):
+        log.record(make_query(subdomain))
+
+    assert log.stats()["buffered"] == 3
+    assert log.dropped == {"alameda": 1}
+
+
+def make_query(subdomain, sql="select 1", duration_ms=300.0):
+    return slow_queries.SlowQuery(
+        "2099-01-01T00:00:00+00:00",
+        subdomain,
+        "meetings",
+        None,
+        fingerprint(sql),
+        sql,
+        duration_ms,
+        1,
+        False,
+    )
+
+
+def test_flush_and_rank(tmp_path):
+    path = str(tmp_path / "slow.db")
+    log = SlowQueryLog(path=path)
+    log.record(make_query("alameda", "select 1", 300))
+    log.record(make_query("alameda", "select 2", 400))
+    log.record(make_query("oakland", "select * from minutes", 500))
+
+    assert log.flush() == 3
+    assert log.flush() == 0
+
+    ranked = top_fingerprints(path)
+    assert [(row["subdomain"], row["calls"]) for row in ranked] == [
+        ("alameda", 2),
+        ("oakland", 1),
+    ]
+    assert ranked[0]["total_ms"] == 700
+    assert top_fingerprints(path, subdomain="oakland")[0]["subdomain"] == "oakland"
+
+
+def test_flushes_in_background(tmp_path):
+    path = str(tmp_path / "slow.db")
+    log = SlowQueryLog(path=path, flush_seconds=0.01)
+    log.record(make_query("alameda"))
+
+    deadline = time.monotonic() + 5
+    while not top_fingerprints(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    log.close()
+
+    assert top_fingerprints(path)[0]["calls"] == 1
+
+
+def test_close_writes_buffered_queries(tmp_path):
+    path = str(tmp_path / "slow.db")
+    log = SlowQueryLog(path=path, flush_seconds=3600)
+    log.record(make_query("alameda"))
+
+    log.close()
+
+    assert top_fingerprints(path)[0]["calls"] == 1
+
+
+def test_top_fingerprints_without_log(tmp_path):
+    assert top_fingerprints(str(tmp_path / "missing.db")) == []
+
+
+@pytest.mark.django_db
+def test_admin_page(admin_client, tmp_path):
+    log = SlowQueryLog(path=str(tmp_path / "slow.db"))
+    log.record(make_query("alameda", "select * from minutes where id = 5"))
+
+    with (
+        patch("config.views.slow_query_log", log),
+        patch(
+            "config.views.top_fingerprints",
+            lambda **kwargs: top_fingerprints(log.path, **kwargs),
+        ),
+    ):
+        response = admin_client.get("/admin/slow-queries/?days=3")
+
+    assert response.status_code == 200
+    assert b"select * from minutes where id = ?" in response.content
+
+
+@pytest.mark.django_db
+def test_admin_page_requires_staff(client):
+    response = client.get("/admin/slow-queries/")
+
+    assert response.status_code == 302
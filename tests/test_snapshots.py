@@ -0,0 +1,336 @@
+"""
+Tests for deploy-time Parquet snapshots.
+
+Tests cover:
+- Choosing tables and column types
+- Writing snapshots and manifests (when pyarrow is installed)
+- Loading only current manifest entries
+- Download headers: ETag, Range, If-Range
+- Sending a file range in chunks
+- The router's listing, downloads and access control
+"""
+
+import json
+import os
+import sqlite3
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain, snapshots
+
+SITE = {
+    "name": "Test City",
+    "state": "CA",
+    "subdomain": "testcity",
+    "last_updated": "2024-01-01",
+}
+
+BODY = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def sites_tree(tmp_path, monkeypatch):
+    """Create ../sites/testcity with meetings and finance databases."""
+    app_dir = tmp_path / "app"
+    site_dir = tmp_path / "sites" / "testcity"
+    app_dir.mkdir()
+    (site_dir / "finance").mkdir(parents=True)
+
+    conn = sqlite3.connect(site_dir / "meetings.db")
+    conn.execute(
+        "CREATE TABLE agendas (id TEXT PRIMARY KEY, meeting TEXT, page INTEGER)"
+    )
+    conn.execute("CREATE TABLE minutes (id TEXT PRIMARY KEY, page INTEGER)")
+    conn.execute("CREATE TABLE notes (id TEXT)")
+    conn.executemany(
+        "INSERT INTO agendas VALUES (?, 'City Council', ?)",
+        [(f"a{i}", i) for i in range(5)],
+    )
+    conn.execute("INSERT INTO minutes VALUES ('m1', 1)")
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(site_dir / "finance" / "election_finance.db")
+    conn.execute("CREATE TABLE donations (donor TEXT, amount)")
+    conn.executemany(
+        "INSERT INTO donations VALUES (?, ?)", [("a", 1), ("b", 2.5), ("c", None)]
+    )
+    conn.execute("CREATE VIRTUAL TABLE donations_fts USING FTS5 (donor)")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.chdir(app_dir)
+    return site_dir
+
+
+def db_list():
+    return [
+        "../sites/testcity/meetings.db",
+        "../sites/testcity/finance/election_finance.db",
+    ]
+
+
+def write_fake_snapshot(site_dir, body=BODY):
+    """Write a snapshot file and manifest by hand, without pyarrow."""
+    directory = site_dir / snapshots.SNAPSHOT_DIRNAME
+    directory.mkdir(exist_ok=True)
+    (directory / "meetings-agendas.parquet").write_bytes(body)
+    stat = os.stat(site_dir / "meetings.db")
+    manifest = {
+        "meetings-agendas.parquet": {
+            "database": "meetings",
+            "table": "agendas",
+            "rows": 5,
+            "size": len(body),
+            "sha256": "ab" * 32,
+            "source": "../sites/testcity/meetings.db",
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+        }
+    }
+    (directory / snapshots.MANIFEST_FILENAME).write_text(json.dumps(manifest))
+    return manifest["meetings-agendas.parquet"]
+
+
+def test_snapshot_tables(sites_tree):
+    conn = sqlite3.connect(sites_tree / "meetings.db")
+    assert snapshots.snapshot_tables(conn, "meetings") == ["agendas", "minutes"]
+    conn = sqlite3.connect(sites_tree / "finance" / "election_finance.db")
+    assert snapshots.snapshot_tables(conn, "election_finance") == ["donations"]
+
+
+def test_column_types(sites_tree):
+    conn = sqlite3.connect(sites_tree / "finance" / "election_finance.db")
+    assert snapshots.column_types(conn, "donations") == {
+        "donor": "string",
+        "amount": "float64",
+    }
+    conn = sqlite3.connect(sites_tree / "meetings.db")
+    assert snapshots.column_types(conn, "agendas")["page"] == "int64"
+
+
+class TestWriteSnapshots:
+    """Test writing snapshots with pyarrow."""
+
+    @pytest.fixture(autouse=True)
+    def parquet(self):
+        return pytest.importorskip("pyarrow.parquet")
+
+    def test_writes_row_groups_and_manifest(self, sites_tree, parquet):
+        manifest = snapshots.snapshot_site("testcity", db_list(), row_group_size=2)
+
+        assert sorted(manifest) == [
+            "election_finance-donations.parquet",
+            "meetings-agendas.parquet",
+            "meetings-minutes.parquet",
+        ]
+        path = sites_tree / "snapshots" / "meetings-agendas.parquet"
+        parquet_file = parquet.ParquetFile(path)
+        assert parquet_file.metadata.num_row_groups == 3
+        assert parquet_file.read().column("id").to_pylist() == [
+            f"a{i}" for i in range(5)
+        ]
+        assert manifest["meetings-agendas.parquet"]["rows"] == 5
+        assert manifest["meetings-agendas.parquet"]["size"] == os.path.getsize(path)
+
+    def test_unchanged_sites_are_reused(self, sites_tree):
+        first = snapshots.snapshot_site("testcity", db_list())
+        path = sites_tree / "snapshots" / "meetings-agendas.parquet"
+        mtime = os.stat(path).st_mtime_ns
+
+        second = snapshots.snapshot_site("testcity", db_list())
+
+        assert second == first
+        assert os.stat(path).st_mtime_ns == mtime
+
+    def test_removes_stale_files(self, sites_tree):
+        stale = sites_tree / "snapshots" / "meetings-old.parquet"
+        stale.parent.mkdir()
+        stale.write_bytes(b"old")
+
+        snapshots.snapshot_site("testcity", db_list())
+
+        assert not stale.exists()
+
+    def test_command(self, sites_tree):
+        call_command("snapshot_sites", "testcity")
+
+        assert (sites_tree / "snapshots" / snapshots.MANIFEST_FILENAME).exists()
+
+
+def test_command_without_pyarrow(sites_tree):
+    with (
+        patch.dict(sys.modules, {"pyarrow": None}),
+        pytest.raises(CommandError, match="pyarrow"),
+    ):
+        call_command("snapshot_sites", "testcity")
+
+
+class TestLoadSnapshots:
+    """Test loading the current manifest entries."""
+
+    def test_loads_current_entries(self, sites_tree):
+        entry = write_fake_snapshot(sites_tree)
+
+        assert snapshots.load_snapshots("testcity") == {
+            "meetings-agendas.parquet": entry
+        }
+
+    def test_ignores_entries_for_redeployed_databases(self, sites_tree):
+        write_fake_snapshot(sites_tree)
+        with open(sites_tree / "meetings.db", "ab") as fp:
+            fp.write(b"\0" * 4096)
+
+        assert snapshots.load_snapshots("testcity") == {}
+
+
+def test_parse_snapshot_path():
+    assert (
+        snapshots.parse_snapshot_path("/-/snapshots/meetings/agendas.parquet")
+        == "meetings-agendas.parquet"
+    )
+    assert snapshots.parse_snapshot_path("/-/snapshots/meetings/agendas.csv") is None
+    assert snapshots.parse_snapshot_path("/-/snapshots/meetings") is None
+
+
+class TestSnapshotResponseHeaders:
+    """Test conditional and range requests for snapshot downloads."""
+
+    ENTRY = {
+        "database": "meetings",
+        "table": "agendas",
+        "size": 1000,
+        "sha256": "ab" * 32,
+    }
+    ETAG = '"' + "ab" * 16 + '"'
+
+    def respond(self, *headers):
+        return snapshots.snapshot_response_headers(
+            self.ENTRY, "testcity", [(name, value.encode()) for name, value in headers]
+        )
+
+    def test_full_file(self):
+        status, headers, byte_range = self.respond()
+
+        assert status == 200
+        assert byte_range == (0, 999)
+        assert dict(headers)[b"content-length"] == b"1000"
+        assert dict(headers)[b"content-disposition"] == (
+            b'attachment; filename="testcity-meetings-agendas.parquet"'
+        )
+
+    def test_range(self):
+        status, headers, byte_range = self.respond((b"range", "bytes=100-199"))
+
+        assert status == 206
+        assert byte_range == (100, 199)
+        assert dict(headers)[b"content-range"] == b"bytes 100-199/1000"
+
+    def test_unsatisfiable_range(self):
+        status, _, byte_range = self.respond((b"range", "bytes=5000-"))
+
+        assert (status, byte_range) == (416, None)
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        status, _, _ = self.respond((b"range", "bytes=0-9"), (b"if-range", '"old"'))
+
+        assert status == 200
+
+    def test_if_none_match(self):
+        status, _, byte_range = self.respond((b"if-none-match", self.ETAG))
+
+        assert (status, byte_range) == (304, None)
+
+
+@pytest.mark.asyncio
+async def test_send_snapshot_file_in_chunks(tmp_path):
+    path = tmp_path / "snapshot.parquet"
+    path.write_bytes(BODY)
+    send = AsyncMock()
+
+    with patch.object(snapshots, "SEND_CHUNK_SIZE", 1024):
+        sent = await snapshots.send_snapshot_file(str(path), (10, 3009), send)
+
+    messages = [call.args[0] for call in send.call_args_list]
+    assert sent == 3000
+    assert [len(message["body"]) for message in messages] == [1024, 1024, 952]
+    assert [message.get("more_body", False) for message in messages] == [
+        True,
+        True,
+        False,
+    ]
+    assert b"".join(message["body"] for message in messages) == BODY[10:3010]
+
+
+@pytest.mark.asyncio
+class TestRouter:
+    """Test the router serving snapshots."""
+
+    async def get(self, path, internal=True, headers=()):
+        send = AsyncMock()
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"host", b"testcity.civic.band"), *headers],
+        }
+        with (
+            patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+            patch.object(
+                datasette_by_subdomain,
+                "check_rate_limit",
+                AsyncMock(return_value=False),
+            ),
+            patch.object(
+                datasette_by_subdomain,
+                "is_internal_service_request",
+                MagicMock(return_value=internal),
+            ),
+        ):
+            mock_sqlite.return_value.__getitem__.return_value.get.return_value = SITE
+            await datasette_by_subdomain.wrap(AsyncMock())(scope, AsyncMock(), send)
+        return [call.args[0] for call in send.call_args_list]
+
+    async def test_anonymous_gets_401(self, sites_tree):
+        write_fake_snapshot(sites_tree)
+
+        messages = await self.get("/-/snapshots/meetings/agendas.parquet", False)
+
+        assert messages[0]["status"] == 401
+
+    async def test_download_range(self, sites_tree):
+        write_fake_snapshot(sites_tree)
+
+        messages = await self.get(
+            "/-/snapshots/meetings/agendas.parquet",
+            headers=[(b"range", b"bytes=0-99")],
+        )
+
+        assert messages[0]["status"] == 206
+        assert b"".join(message["body"] for message in messages[1:]) == BODY[:100]
+
+    async def test_listing(self, sites_tree):
+        write_fake_snapshot(sites_tree)
+
+        messages = await self.get("/-/snapshots/")
+
+        listing = json.loads(messages[1]["body"])
+        assert listing["snapshots"][0]["url"] == (
+            "/-/snapshots/meetings/agendas.parquet"
+        )
+
+    @pytest.mark.usefixtures("sites_tree")
+    async def test_missing_snapshot(self):
+        messages = await self.get("/-/snapshots/meetings/minutes.parquet")
+
+        assert messages[0]["status"] == 404
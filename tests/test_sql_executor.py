@@ -0,0 +1,187 @@
+"""
+Tests for the process-wide SQL executor.
+
+Tests cover:
+- Round-robin scheduling across subdomains
+- Priority by access tier
+- Per-site thread limits
+- Queue metrics
+- Running Datasette queries and closing their connections afterwards
+- Closing dropped Datasette instances once no request serves them
+"""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+from datasette.app import Datasette
+
+from django_plugins.api_key_auth import ACCESS_TIER_ANONYMOUS, ACCESS_TIER_API_KEY
+from django_plugins.sql_executor import FairSQLExecutor, SQLRequest, current_sql_request
+
+
+@pytest.fixture
+def executor():
+    executor = FairSQLExecutor(max_workers=1, max_per_site=1)
+    yield executor
+    executor.shutdown(cancel_futures=True)
+
+
+def submit(executor, fn, subdomain, access_tier=None):
+    token = current_sql_request.set(SQLRequest(subdomain, access_tier))
+    try:
+        return executor.submit(fn)
+    finally:
+        current_sql_request.reset(token)
+
+
+def block(executor):
+    """Occupy the executor's only thread until the returned event is set."""
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    future = submit(executor, blocker, "blocker")
+    started.wait(5)
+    return release, future
+
+
+def queue_jobs(executor, jobs):
+    """Queue (name, subdomain, tier) jobs behind a blocker; return run order."""
+    order = []
+    release, _ = block(executor)
+    futures = [
+        submit(executor, lambda name=name: order.append(name), subdomain, tier)
+        for name, subdomain, tier in jobs
+    ]
+    release.set()
+    for future in futures:
+        future.result(5)
+    return order
+
+
+class TestScheduling:
+    """Test the order queued queries run in."""
+
+    def test_round_robin_across_sites(self, executor):
+        order = queue_jobs(
+            executor,
+            [
+                ("a1", "a", None),
+                ("a2", "a", None),
+                ("a3", "a", None),
+                ("b1", "b", None),
+                ("c1", "c", None),
+            ],
+        )
+
+        assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+    def test_priority_by_tier(self, executor):
+        order = queue_jobs(
+            executor,
+            [
+                ("anonymous", "a", ACCESS_TIER_ANONYMOUS),
+                ("api_key", "b", ACCESS_TIER_API_KEY),
+                ("first_party", "c", None),
+            ],
+        )
+
+        assert order == ["first_party", "api_key", "anonymous"]
+
+    def test_per_site_limit(self):
+        executor = FairSQLExecutor(max_workers=3, max_per_site=1)
+        lock = threading.Lock()
+        running = {"a": 0, "max": 0}
+
+        def job():
+            with lock:
+                running["a"] += 1
+                running["max"] = max(running["max"], running["a"])
+            time.sleep(0.01)
+            with lock:
+                running["a"] -= 1
+
+        try:
+            futures = [submit(executor, job, "a") for _ in range(4)]
+            for future in futures:
+                future.result(5)
+        finally:
+            executor.shutdown()
+
+        assert running["max"] == 1
+
+    def test_exceptions_propagate(self, executor):
+        future = submit(executor, lambda: 1 / 0, "a")
+
+        with pytest.raises(ZeroDivisionError):
+            future.result(5)
+
+
+def test_stats(executor):
+    release, blocker = block(executor)
+    submit(executor, lambda: None, "a", ACCESS_TIER_ANONYMOUS)
+    submit(executor, lambda: None, "a", ACCESS_TIER_ANONYMOUS)
+    submit(executor, lambda: None, "b", ACCESS_TIER_API_KEY)
+
+    stats = executor.stats()
+    release.set()
+    blocker.result(5)
+
+    assert stats["busy"] == 1
+    assert stats["queued"] == 3
+    assert stats["queued_by_priority"] == {
+        "first_party": 0,
+        "api_key": 1,
+        "anonymous": 2,
+    }
+    assert stats["queued_by_site"] == {"a": 2, "b": 1}
+    assert stats["running_by_site"] == {"blocker": 1}
+
+
+@pytest.mark.asyncio
+async def test_serves_datasette_queries(tmp_path, executor):
+    """Datasette queries run on the executor; connections close afterwards."""
+    from datasette.database import connections  # noqa: PLC0415
+
+    path = tmp_path / "meetings.db"
+    sqlite3.connect(path).close()
+    datasette = Datasette([str(path)], settings={"num_sql_threads": 1})
+
+    db = datasette.get_database("meetings")
+    with executor.serve(datasette, "testcity"):
+        result = await db.execute("select 1 as one")
+        thread_name = await db.execute_fn(lambda _conn: threading.current_thread().name)
+    assert result.first()["one"] == 1
+    assert thread_name.startswith("sql-executor-")
+
+    def open_connections():
+        return list(vars(connections))
+
+    # The thread closes finished connections after its next job at the latest
+    submit(executor, open_connections, "other").result(5)
+    assert submit(executor, open_connections, "other").result(5) == []
+
+
+@pytest.mark.asyncio
+async def test_closes_instance_once_released(tmp_path, executor):
+    path = tmp_path / "meetings.db"
+    sqlite3.connect(path).close()
+    datasette = Datasette([str(path)])
+    db = datasette.get_database("meetings")
+
+    with executor.serve(datasette, "testcity"):
+        executor.close_when_released(datasette)
+        # Still serving a request: closing now would break its queries
+        assert (await db.execute("select 1 as one")).first()["one"] == 1
+        assert not datasette.get_internal_database()._closed
+
+    assert datasette.get_internal_database()._closed
+    assert db._closed
+    assert datasette.executor is None
+    # Closing the instance left the shared executor running
+    assert submit(executor, lambda: 1, "other").result(5) == 1
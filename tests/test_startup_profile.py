@@ -0,0 +1,102 @@
+"""
+Tests for the worker startup profile.
+
+Tests cover:
+- Parsing -X importtime output
+- Totals by package and the slowest imports
+- The startup_profile management command and its budget
+- The startup time regression benchmark
+"""
+
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from django_plugins.startup_profile import (
+    STARTUP_BUDGET_MS,
+    ImportRecord,
+    StartupProfile,
+    package_totals,
+    parse_importtime,
+    profile_startup,
+    slowest_imports,
+)
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       200 |        200 |     django.utils
+import time:      1000 |       1200 |   django.core.asgi
+/app/config/settings.py:46: UserWarning: Set the SECRET_KEY env variable
+import time:      3000 |       3000 |   sentry_sdk
+import time:       500 |       4700 | config.asgi
+"""
+
+
+def test_parse_importtime():
+    records = parse_importtime(IMPORTTIME)
+
+    assert records == [
+        ImportRecord("django.utils", 0.2, 0.2, 2),
+        ImportRecord("django.core.asgi", 1.0, 1.2, 1),
+        ImportRecord("sentry_sdk", 3.0, 3.0, 1),
+        ImportRecord("config.asgi", 0.5, 4.7, 0),
+    ]
+
+
+def test_package_totals_and_slowest_imports():
+    records = parse_importtime(IMPORTTIME)
+
+    assert package_totals(records).most_common() == [
+        ("sentry_sdk", 3.0),
+        ("django", 1.2),
+        ("config", 0.5),
+    ]
+    assert [record.module for record in slowest_imports(records, 2)] == [
+        "config.asgi",
+        "sentry_sdk",
+    ]
+
+
+class TestCommand:
+    """Test the startup_profile management command."""
+
+    PROFILE = StartupProfile(
+        {"import config.asgi": 300.0, "urlconf": 50.0, "datasette": 150.0},
+        parse_importtime(IMPORTTIME),
+    )
+
+    def test_reports_breakdown(self):
+        out = StringIO()
+        with patch(
+            "pages.management.commands.startup_profile.profile_startup",
+            return_value=self.PROFILE,
+        ) as mock_profile:
+            call_command("startup_profile", "--runs", "2", stdout=out)
+
+        mock_profile.assert_called_once_with("config.asgi", runs=2)
+        output = out.getvalue()
+        assert "import config.asgi" in output
+        assert "500.0 ms" in output
+        assert "sentry_sdk" in output
+
+    def test_fails_over_budget(self):
+        with (
+            patch(
+                "pages.management.commands.startup_profile.profile_startup",
+                return_value=self.PROFILE,
+            ),
+            pytest.raises(CommandError, match="over the 400 ms budget"),
+        ):
+            call_command("startup_profile", "--budget-ms", "400", stdout=StringIO())
+
+
+@pytest.mark.integration
+def test_startup_within_budget():
+    """Regression benchmark; set STARTUP_BUDGET_MS to tune for slow machines."""
+    profile = profile_startup(runs=2)
+
+    assert set(profile.phases) == {"import config.asgi", "urlconf", "datasette"}
+    assert profile.total_ms <= STARTUP_BUDGET_MS, profile.phases
@@ -0,0 +1,224 @@
+"""
+Tests for fast-path static asset serving.
+
+Tests cover:
+- Asset table contents for Datasette and corkboard plugin mounts
+- Content negotiation of precompressed variants
+- Conditional and Range requests
+- Router serving assets before the site lookup
+"""
+
+import gzip
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain, static_assets
+
+PAGE_CARD_CSS = "/-/static-plugins/corkboard/page-card.css"
+
+
+def make_scope(path, headers=None, method="GET", query_string=b""):
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": headers or [],
+    }
+
+
+class TestAssetTable:
+    """Test the process-wide asset table."""
+
+    def test_includes_datasette_static(self):
+        table = static_assets.get_static_asset_table()
+        assert "/-/static/app.css" in table
+
+    def test_includes_corkboard_plugin_static(self):
+        table = static_assets.get_static_asset_table()
+        asset = table[PAGE_CARD_CSS]
+        assert asset.content_type == "text/css; charset=utf-8"
+
+    def test_gzip_variant_roundtrips(self):
+        asset = static_assets.get_static_asset_table()["/-/static/app.css"]
+        assert gzip.decompress(asset.encodings["gzip"]) == asset.body
+
+    def test_etag_is_content_hash(self):
+        body = b"body { color: red; }"
+        assert (
+            static_assets.StaticAsset(body, "text/css").etag
+            == static_assets.StaticAsset(body, "text/css").etag
+        )
+        assert (
+            static_assets.StaticAsset(body, "text/css").etag
+            != static_assets.StaticAsset(body + b" ", "text/css").etag
+        )
+
+    def test_small_bodies_not_compressed(self):
+        assert static_assets.StaticAsset(b"a{}", "text/css").encodings == {}
+
+
+class TestChooseEncoding:
+    """Test Accept-Encoding negotiation."""
+
+    def test_prefers_brotli(self):
+        assert (
+            static_assets.choose_encoding("gzip, br", {"br": b"", "gzip": b""}) == "br"
+        )
+
+    def test_falls_back_to_gzip(self):
+        assert static_assets.choose_encoding("gzip, br", {"gzip": b""}) == "gzip"
+
+    def test_respects_q_zero(self):
+        assert static_assets.choose_encoding("gzip;q=0", {"gzip": b""}) is None
+
+    def test_no_header(self):
+        assert static_assets.choose_encoding(None, {"gzip": b""}) is None
+
+
+class TestParseRange:
+    """Test Range header parsing."""
+
+    def test_explicit_range(self):
+        assert static_assets.parse_range("bytes=0-9", 100) == (0, 9)
+
+    def test_open_ended_range(self):
+        assert static_assets.parse_range("bytes=90-", 100) == (90, 99)
+
+    def test_suffix_range(self):
+        assert static_assets.parse_range("bytes=-10", 100) == (90, 99)
+
+    def test_end_clamped(self):
+        assert static_assets.parse_range("bytes=50-500", 100) == (50, 99)
+
+    def test_unsatisfiable(self):
+        assert static_assets.parse_range("bytes=200-300", 100) is None
+
+    def test_multiple_ranges_rejected(self):
+        with pytest.raises(ValueError):
+            static_assets.parse_range("bytes=0-1,5-6", 100)
+
+
+class TestGetStaticResponse:
+    """Test building responses for asset requests."""
+
+    def test_identity_response(self):
+        status, headers, body = static_assets.get_static_response(
+            make_scope(PAGE_CARD_CSS)
+        )
+        headers_dict = dict(headers)
+
+        assert status == 200
+        assert b"content-encoding" not in headers_dict
+        assert headers_dict[b"content-length"] == str(len(body)).encode()
+        assert headers_dict[b"cache-control"] == static_assets.REVALIDATE_CACHE_CONTROL
+
+    def test_gzip_response(self):
+        status, headers, body = static_assets.get_static_response(
+            make_scope("/-/static/app.css", [(b"accept-encoding", b"gzip")])
+        )
+
+        assert status == 200
+        assert dict(headers)[b"content-encoding"] == b"gzip"
+        asset = static_assets.get_static_asset_table()["/-/static/app.css"]
+        assert gzip.decompress(body) == asset.body
+
+    def test_versioned_url_is_immutable(self):
+        _, headers, _ = static_assets.get_static_response(
+            make_scope("/-/static/app.css", query_string=b"d4e5f6")
+        )
+        assert dict(headers)[b"cache-control"] == static_assets.IMMUTABLE_CACHE_CONTROL
+
+    def test_if_none_match_returns_304(self):
+        asset = static_assets.get_static_asset_table()[PAGE_CARD_CSS]
+        status, _, body = static_assets.get_static_response(
+            make_scope(PAGE_CARD_CSS, [(b"if-none-match", asset.etag)])
+        )
+
+        assert status == 304
+        assert body == b""
+
+    def test_range_request(self):
+        asset = static_assets.get_static_asset_table()[PAGE_CARD_CSS]
+        status, headers, body = static_assets.get_static_response(
+            make_scope(PAGE_CARD_CSS, [(b"range", b"bytes=0-9")])
+        )
+
+        assert status == 206
+        assert body == asset.body[:10]
+        assert dict(headers)[b"content-range"] == (
+            f"bytes 0-9/{len(asset.body)}".encode()
+        )
+
+    def test_unsatisfiable_range(self):
+        status, _, _ = static_assets.get_static_response(
+            make_scope(PAGE_CARD_CSS, [(b"range", b"bytes=999999-")])
+        )
+        assert status == 416
+
+    def test_stale_if_range_serves_full_body(self):
+        asset = static_assets.get_static_asset_table()[PAGE_CARD_CSS]
+        status, _, body = static_assets.get_static_response(
+            make_scope(
+                PAGE_CARD_CSS,
+                [(b"range", b"bytes=0-9"), (b"if-range", b'"stale"')],
+            )
+        )
+
+        assert status == 200
+        assert body == asset.body
+
+    def test_head_has_no_body(self):
+        status, headers, body = static_assets.get_static_response(
+            make_scope(PAGE_CARD_CSS, method="HEAD")
+        )
+
+        assert status == 200
+        assert body == b""
+        assert int(dict(headers)[b"content-length"]) > 0
+
+    def test_unknown_asset_falls_through(self):
+        assert (
+            static_assets.get_static_response(make_scope("/-/static/nope.js")) is None
+        )
+
+    def test_path_traversal_falls_through(self):
+        assert (
+            static_assets.get_static_response(
+                make_scope("/-/static/../../../etc/passwd")
+            )
+            is None
+        )
+
+    def test_post_falls_through(self):
+        assert (
+            static_assets.get_static_response(make_scope(PAGE_CARD_CSS, method="POST"))
+            is None
+        )
+
+
+@pytest.mark.asyncio
+async def test_router_serves_static_before_site_lookup():
+    """Static assets are served without touching sites.db or Datasette."""
+    with (
+        patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+        patch("datasette.app.Datasette") as mock_datasette,
+    ):
+        mock_app = AsyncMock()
+        mock_send = AsyncMock()
+        scope = make_scope(PAGE_CARD_CSS, [(b"host", b"testcity.civic.band")])
+
+        wrapper = datasette_by_subdomain.wrap(mock_app)
+        await wrapper(scope, AsyncMock(), mock_send)
+
+        mock_sqlite.assert_not_called()
+        mock_datasette.assert_not_called()
+        mock_app.assert_not_called()
+        assert mock_send.call_args_list[0][0][0]["status"] == 200
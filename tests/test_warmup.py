@@ -0,0 +1,221 @@
+"""
+Tests for cached site instances and worker warm-up.
+
+Tests cover:
+- The per-site instance LRU, its executor retention and closing evicted
+  instances
+- Picking hot sites from configuration and shared metrics
+- Warming sites within a time budget
+- Priming a real Datasette instance
+- The router's lifespan handling and instance reuse
+"""
+
+import asyncio
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from datasette.app import Datasette
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain, warmup
+from django_plugins.site_instances import SiteInstance, SiteInstanceCache
+from django_plugins.sql_executor import FairSQLExecutor
+from django_plugins.warmup import hot_subdomains, prime_datasette, warm_up
+
+SITE = {
+    "name": "Test City",
+    "state": "CA",
+    "subdomain": "testcity",
+    "last_updated": "2024-01-01",
+}
+
+
+def make_instance(version="v1"):
+    return SiteInstance(MagicMock(), MagicMock(), version)
+
+
+class TestSiteInstanceCache:
+    """Test the per-site LRU."""
+
+    def test_reuses_instance_until_version_changes(self):
+        cache = SiteInstanceCache(max_size=2)
+        with patch("django_plugins.site_instances.sql_executor") as executor:
+            first = cache.get_or_build("alameda", "v1", make_instance)
+            assert cache.get_or_build("alameda", "v1", make_instance) is first
+
+            second = cache.get_or_build("alameda", "v2", make_instance)
+
+        assert second is not first
+        executor.release.assert_called_once_with(first.datasette)
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_evicts_least_recently_used(self):
+        cache = SiteInstanceCache(max_size=2)
+        with patch("django_plugins.site_instances.sql_executor") as executor:
+            alameda = cache.get_or_build("alameda", "v1", make_instance)
+            cache.get_or_build("oakland", "v1", make_instance)
+            cache.get_or_build("alameda", "v1", make_instance)
+            cache.get_or_build("berkeley", "v1", make_instance)
+
+        assert "alameda" in cache
+        assert "oakland" not in cache
+        assert executor.retain.call_count == 3
+        assert alameda.datasette not in [
+            call.args[0] for call in executor.release.call_args_list
+        ]
+
+    def test_closes_evicted_instances(self):
+        cache = SiteInstanceCache(max_size=1)
+        executor = FairSQLExecutor(max_workers=1)
+
+        def build():
+            return SiteInstance(Datasette([]), MagicMock(), "v1")
+
+        with patch("django_plugins.site_instances.sql_executor", executor):
+            alameda = cache.get_or_build("alameda", "v1", build)
+            oakland = cache.get_or_build("oakland", "v1", build)
+
+        assert alameda.datasette.get_internal_database()._closed
+        assert not oakland.datasette.get_internal_database()._closed
+        assert oakland.datasette.executor is executor
+        assert not executor._shutdown
+        cache.clear()
+        executor.shutdown()
+
+    def test_disabled_cache_builds_every_time(self):
+        cache = SiteInstanceCache(max_size=0)
+
+        first = cache.get_or_build("alameda", "v1", make_instance)
+
+        assert cache.get_or_build("alameda", "v1", make_instance) is not first
+
+
+def test_hot_subdomains():
+    counters = {
+        ("router_requests_total", (("status", "200"), ("subdomain", "oakland"))): 5,
+        ("router_requests_total", (("status", "404"), ("subdomain", "oakland"))): 5,
+        ("router_requests_total", (("status", "200"), ("subdomain", "alameda"))): 20,
+        ("router_requests_total", (("status", "200"), ("subdomain", "berkeley"))): 1,
+        ("rate_limit_hits_total", ()): 100,
+    }
+    with (
+        patch.object(warmup, "WARMUP_SUBDOMAINS", "pinned, oakland"),
+        patch.object(warmup.metrics, "collect", return_value={"counters": counters}),
+    ):
+        assert hot_subdomains(limit=3) == ["pinned", "oakland", "alameda"]
+
+
+@pytest.mark.asyncio
+class TestWarmUp:
+    """Test warming sites within the budget."""
+
+    async def test_skips_failures(self):
+        async def warm_site(subdomain):
+            if subdomain == "broken":
+                raise ValueError(subdomain)
+
+        warmed = await warm_up(warm_site, ["broken", "alameda"], budget=5)
+
+        assert warmed == ["alameda"]
+
+    async def test_stops_at_budget(self):
+        async def warm_site(subdomain):
+            if subdomain == "slow":
+                await asyncio.sleep(10)
+
+        warmed = await warm_up(warm_site, ["alameda", "slow", "oakland"], budget=0.1)
+
+        assert warmed == ["alameda"]
+
+    async def test_prime_datasette(self, temp_db):
+        datasette = Datasette([str(temp_db)])
+        tables = []
+        database = next(iter(datasette.databases.values()))
+        execute = database.execute
+
+        async def record(sql, *args, **kwargs):
+            tables.append(sql)
+            return await execute(sql, *args, **kwargs)
+
+        database.execute = record
+
+        await prime_datasette(datasette)
+
+        assert datasette._startup_invoked
+        assert any("from agendas limit" in sql for sql in tables)
+        assert any("from minutes limit" in sql for sql in tables)
+
+
+@pytest.mark.asyncio
+class TestRouter:
+    """Test the router's lifespan handling and instance reuse."""
+
+    async def test_lifespan_warms_before_startup_completes(self):
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        send = AsyncMock()
+
+        with (
+            patch.object(datasette_by_subdomain, "WARMUP_SECONDS", 5),
+            patch.object(
+                datasette_by_subdomain, "hot_subdomains", return_value=["alameda"]
+            ),
+            patch.object(datasette_by_subdomain, "warm_up", AsyncMock()) as mock_warm,
+        ):
+            await datasette_by_subdomain.wrap(AsyncMock())(
+                {"type": "lifespan"}, AsyncMock(side_effect=messages), send
+            )
+
+        mock_warm.assert_awaited_once_with(
+            datasette_by_subdomain.warm_site, ["alameda"], 5
+        )
+        assert [call.args[0]["type"] for call in send.call_args_list] == [
+            "lifespan.startup.complete",
+            "lifespan.shutdown.complete",
+        ]
+
+    async def test_warm_site_caches_instance(self, temp_db):
+        with (
+            patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+            patch.object(
+                datasette_by_subdomain,
+                "get_site_databases",
+                return_value=[str(temp_db)],
+            ),
+        ):
+            mock_sqlite.return_value.__getitem__.return_value.get.return_value = SITE
+            await datasette_by_subdomain.warm_site("testcity")
+
+        assert "testcity" in datasette_by_subdomain.site_instances
+
+    async def test_reuses_site_instance_between_requests(self):
+        with (
+            patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+            patch("datasette.app.Datasette") as mock_datasette,
+            patch("django_plugins.datasette_by_subdomain.Environment") as mock_env,
+            patch("django_plugins.datasette_by_subdomain.FileSystemLoader"),
+        ):
+            mock_sqlite.return_value.__getitem__.return_value.get.return_value = SITE
+            mock_env.return_value.get_template.return_value.render.return_value = "{}"
+            mock_datasette.return_value.app.return_value = AsyncMock()
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": "/meetings",
+                "query_string": b"",
+                "headers": [
+                    (b"host", b"testcity.civic.band"),
+                    (b"user-agent", b"Mozilla/5.0 Firefox/130.0"),
+                ],
+            }
+            for _ in range(2):
+                await datasette_by_subdomain.wrap(AsyncMock())(
+                    scope, AsyncMock(), AsyncMock()
+                )
+
+        mock_datasette.assert_called_once()
+        assert mock_datasette.return_value.app.return_value.await_count == 2
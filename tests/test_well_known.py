@@ -0,0 +1,151 @@
+"""
+Tests for well-known documents served by the subdomain router.
+
+Tests cover:
+- robots.txt and opensearch.xml rendering
+- Per-site response caching
+- Router answering well-known paths without building Datasette
+"""
+
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+mock_djp = MagicMock()
+mock_djp.hookimpl = MagicMock()
+mock_djp.urlpatterns = MagicMock(return_value=[])
+sys.modules["djp"] = mock_djp
+
+from django_plugins import datasette_by_subdomain, well_known
+
+
+class TestRenderers:
+    """Test document rendering."""
+
+    def test_robots_txt_blocks_ai_user_agents(self):
+        content = well_known.render_robots_txt(["/meetings"])
+
+        assert "User-agent: GPTBot" in content
+        assert "User-agent: ClaudeBot" in content
+        assert "Disallow: /meetings" in content
+
+    def test_robots_txt_disallows_every_database(self):
+        content = well_known.render_robots_txt(["/meetings", "/election_finance"])
+
+        assert content.count("Disallow: /meetings") == len(well_known.AI_USER_AGENTS)
+        assert content.count("Disallow: /election_finance") == len(
+            well_known.AI_USER_AGENTS
+        )
+
+    def test_opensearch_xml_uses_site(self):
+        xml = well_known.render_opensearch_xml("alameda.ca", "Alameda")
+
+        assert "<ShortName>Alameda</ShortName>" in xml
+        assert "https://alameda.ca.civic.band/meetings?_search={searchTerms}" in xml
+
+
+class TestGetWellKnownResponse:
+    """Test cached response building."""
+
+    def setup_method(self):
+        well_known.get_well_known_response.cache_clear()
+
+    def test_robots_response(self):
+        body, headers = well_known.get_well_known_response(
+            "/robots.txt", "alameda.ca", "Alameda", ("meetings",)
+        )
+
+        headers_dict = dict(headers)
+        assert b"Disallow: /meetings" in body
+        assert headers_dict[b"content-type"].startswith(b"text/plain")
+        assert headers_dict[b"content-length"] == str(len(body)).encode()
+        assert headers_dict[b"cache-control"] == well_known.WELL_KNOWN_CACHE_CONTROL
+
+    def test_opensearch_response(self):
+        body, headers = well_known.get_well_known_response(
+            "/opensearch.xml", "alameda.ca", "Alameda", ("meetings",)
+        )
+
+        assert b"<ShortName>Alameda</ShortName>" in body
+        assert dict(headers)[b"content-type"].startswith(
+            b"application/opensearchdescription+xml"
+        )
+
+    def test_unknown_path_returns_none(self):
+        assert (
+            well_known.get_well_known_response(
+                "/meetings", "alameda.ca", "Alameda", ("meetings",)
+            )
+            is None
+        )
+
+    def test_responses_are_cached(self):
+        well_known.get_well_known_response(
+            "/robots.txt", "alameda.ca", "Alameda", ("meetings",)
+        )
+        well_known.get_well_known_response(
+            "/robots.txt", "alameda.ca", "Alameda", ("meetings",)
+        )
+
+        info = well_known.get_well_known_response.cache_info()
+        assert info.hits == 1
+        assert info.misses == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "path,expected",
+    [
+        ("/robots.txt", b"User-agent: GPTBot"),
+        ("/opensearch.xml", b"<ShortName>Test City</ShortName>"),
+    ],
+)
+async def test_router_serves_well_known_without_datasette(path, expected):
+    """Well-known paths are answered before Datasette is constructed."""
+    with (
+        patch("django_plugins.site_registry.sqlite_utils.Database") as mock_sqlite,
+        patch("datasette.app.Datasette") as mock_datasette,
+        patch(
+            "django_plugins.datasette_by_subdomain.os.path.exists", return_value=True
+        ),
+    ):
+        mock_db_instance = MagicMock()
+        mock_db_instance.__getitem__.return_value.get.return_value = {
+            "name": "Test City",
+            "state": "CA",
+            "subdomain": "testcity",
+            "last_updated": "2024-01-01",
+        }
+        mock_sqlite.return_value = mock_db_instance
+
+        mock_app = AsyncMock()
+        mock_send = AsyncMock()
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "headers": [(b"host", b"testcity.civic.band")],
+        }
+
+        wrapper = datasette_by_subdomain.wrap(mock_app)
+        await wrapper(scope, AsyncMock(), mock_send)
+
+        mock_datasette.assert_not_called()
+        mock_app.assert_not_called()
+
+        start_message = mock_send.call_args_list[0][0][0]
+        body_message = mock_send.call_args_list[1][0][0]
+        assert start_message["status"] == 200
+        assert expected in body_message["body"]
+
+
+def test_robots_txt_lists_finance_databases():
+    """robots.txt disallows every database deployed for the site."""
+    db_list = [
+        "../sites/alameda.ca/meetings.db",
+        "../sites/alameda.ca/finance/election_finance.db",
+    ]
+    names = datasette_by_subdomain.get_database_names(db_list)
+
+    assert names == ("meetings", "election_finance")